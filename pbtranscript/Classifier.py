@@ -6,19 +6,19 @@ import math
 import re
 import logging
 import multiprocessing
-from collections import defaultdict, namedtuple
+from collections import defaultdict, namedtuple, deque
 
 from pbcore.util.Process import backticks
-from pbcore.io import FastaWriter
+from pbcore.io import FastaReader, FastaWriter
 
 from pbtranscript.PBTranscriptException import PBTranscriptException
-from pbtranscript.io import DOMReader
+from pbtranscript.io import DOMReader, DOMRecord
 from pbtranscript.io.ContigSetReaderWrapper import ContigSetReaderWrapper
 from pbtranscript.io import ReadAnnotation
 from pbtranscript.io.PbiBamIO import CCSInput
 from pbtranscript.io.Summary import ClassifySummary
 from pbtranscript.Utils import (revcmp, realpath, as_contigset,
-    generateChunkedFN, cat_files, real_upath, ln)
+    generateChunkedFN, cat_files, real_upath, ln, fork_pool, fork_state)
 
 
 PBMATRIXFN = "PBMATRIX.txt"
@@ -31,6 +31,14 @@ FLCHIMERADOMFN = "hmmer.fl.chimera.dom"
 NFLCHIMERADOMFN = "hmmer.nfl.chimera.dom"
 CLASSIFYSUMMARY = "classify_summary.txt"
 
+# Engines to search primers in reads, phmmer or the native banded
+# local aligner in c_PrimerSearch.
+PRIMER_SEARCH_ENGINES = ("phmmer", "native")
+
+# Number of reads in a batch classified by a worker process of the
+# streaming classifier (see Classifier.runStreamingClassifier).
+STREAM_BATCH_SIZE = 500
+
 
 # ChimeraDetectionOptions:
 # Minimum length to output a (trimmed) sequence.
@@ -102,7 +110,7 @@ class Classifier(object):
                  opts=ChimeraDetectionOptions(50, 10, 100, 50, 100, False),
                  out_nfl_fn=None, out_flnc_fn=None,
                  ignore_polyA=False, reuse_dom=False,
-                 ignore_empty_output=False):
+                 ignore_empty_output=False, primer_search="phmmer"):
         self.reads_fn = realpath(reads_fn)
         self.out_dir = realpath(out_dir)
         self.cpus = cpus
@@ -111,6 +119,11 @@ class Classifier(object):
         self.ignore_polyA = ignore_polyA
         self.reuse_dom = reuse_dom
         self.ignore_empty_output = ignore_empty_output
+        if primer_search not in PRIMER_SEARCH_ENGINES:
+            raise ClassifierException(
+                "Primer search engine must be one of {e}, not {s}.".
+                format(e=", ".join(PRIMER_SEARCH_ENGINES), s=primer_search))
+        self.primer_search = primer_search
         self._numReads = None
 
         # The input primer file: primers.fasta
@@ -368,20 +381,30 @@ class Classifier(object):
 
     def _startPhmmers(self, chunked_reads_fns, chunked_dom_fns,
                       out_dom_fn, primer_fn, pbmatrix_fn):
-        """Run phmmers on chunked reads files in 'chunked_reads_fns' and
-        generate chunked dom files as listed in 'chunked_dom_fns', finally
-        concatenate dom files to 'out_dom_fn'."""
-        logging.info("Start to launch phmmer on chunked reads.")
+        """Run phmmers (or the native primer search engine, depending on
+        self.primer_search) on chunked reads files in 'chunked_reads_fns'
+        and generate chunked dom files as listed in 'chunked_dom_fns',
+        finally concatenate dom files to 'out_dom_fn'."""
+        logging.info("Start to launch {e} on chunked reads.".
+                     format(e=self.primer_search))
+        search_func = self._phmmer if self.primer_search == "phmmer" \
+            else self._nativePrimerSearch
         jobs = []
         for reads_fn, domFN in zip(chunked_reads_fns, chunked_dom_fns):
             p = multiprocessing.Process(
-                target=self._phmmer,
+                target=search_func,
                 args=(reads_fn, domFN, primer_fn, pbmatrix_fn))
             jobs.append((p, domFN))
             p.start()
 
-        for p, domFN in jobs:
+        for p, dummy_domFN in jobs:
             p.join()
+
+        for p, domFN in jobs:
+            if p.exitcode != 0:
+                raise ClassifierException(
+                    "{e} on {f} exited with code {c}.".
+                    format(e=self.primer_search, f=domFN, c=p.exitcode))
             cmd = "cat {0} >> {1}".format(real_upath(domFN),
                                           real_upath(out_dom_fn))
             _output, errCode, errMsg = backticks(cmd)
@@ -406,6 +429,55 @@ class Classifier(object):
             raise ClassifierException(
                 "Error calling phmmer: {e}.".format(e=str(errMsg)))
 
+    def _nativePrimerSearch(self, reads_fn, domFN, primer_fn, dummy_pbmatrix_fn):
+        """Search primers in primer_fn against reads in reads_fn using
+        the native primer search engine, write hits to a DOM file in the
+        same format as phmmer --domtblout."""
+        searcher = self._primerSearcher(primer_fn)
+        logging.debug("Searching primers in {r} natively.".format(r=reads_fn))
+        # Chunked reads files (e.g., *.fasta_split.0) have no FASTA suffix.
+        with FastaReader(reads_fn) as reader, \
+                open(domFN, 'w') as writer:
+            writer.write("# Program: pbtranscript native primer search\n")
+            for r in reader:
+                for dom in self._nativePrimerHits(searcher, r.name, r.sequence):
+                    writer.write(dom.toString() + "\n")
+
+    @staticmethod
+    def _primerSearcher(primer_fn):
+        """Return a native PrimerSearcher of primers in primer_fn."""
+        from pbtranscript.c_PrimerSearch import PrimerSearcher
+        with ContigSetReaderWrapper(primer_fn) as reader:
+            primers = [(r.name, r.sequence) for r in reader]
+        return PrimerSearcher(primers)
+
+    @staticmethod
+    def _nativePrimerHits(searcher, sid, seq):
+        """Search primers in seq using a native PrimerSearcher, return
+        a list of DOMRecords of hits, as if they were read from a DOM file
+        created by phmmer."""
+        return [DOMRecord(pid=searcher.names[pi], sid=sid, score=score,
+                          pStart=pStart, pEnd=pEnd,
+                          pLen=len(searcher.sequences[pi]),
+                          sStart=sStart, sEnd=sEnd, sLen=len(seq))
+                for pi, score, pStart, pEnd, sStart, sEnd in searcher.search(seq)]
+
+    @staticmethod
+    def _addFrontBackHit(bestOf, r):
+        """Save a primer hit r in the front or back window of a read to
+        bestOf {primer_name:DOMRecord}, if r is the best hit of its primer."""
+        if (r.pid in bestOf and bestOf[r.pid].score < r.score) or \
+           (r.pid not in bestOf):
+            bestOf[r.pid] = r
+
+    @staticmethod
+    def _isChimericHit(r, opts):
+        """Return True if a primer hit r is in the MIDDLE of a trimmed
+        sequence and has a decent score, which suggests a chimera."""
+        return r.sStart > opts.min_dist_from_end and \
+            r.sEnd < r.sLen - opts.min_dist_from_end and \
+            r.score > opts.min_score
+
     def _getBestFrontBackRecord(self, domFN):
         """Parses DOM output from phmmer and fill in best_of_front, best_of_back
            bestOf: sequence id ---> DOMRecord
@@ -433,10 +505,7 @@ class Classifier(object):
                     format(r=r.sid, f=domFN))
             if r.sid not in bestOf:
                 bestOf[r.sid] = {}
-            if (r.pid in bestOf[r.sid] and
-                bestOf[r.sid][r.pid].score < r.score) or \
-               (r.pid not in bestOf[r.sid]):
-                bestOf[r.sid][r.pid] = r
+            self._addFrontBackHit(bestOf[r.sid], r)
         return (best_of_front, best_of_back)
 
     def _getChimeraRecord(self, domFN, opts):
@@ -453,9 +522,7 @@ class Classifier(object):
         for r in reader:
             # A hit has to be in the middle of sequence, and with
             # decent score.
-            if r.sStart > opts.min_dist_from_end and \
-               r.sEnd < r.sLen - opts.min_dist_from_end and \
-               r.score > opts.min_score:
+            if self._isChimericHit(r, opts):
                 suspicous_hits[r.sid].append(r)
         return suspicous_hits
 
@@ -584,6 +651,73 @@ class Classifier(object):
                     getDomRecord(dBack, k1, min_score),
                     getDomRecord(dFront, k2, min_score))
 
+    def _trimRead(self, read, dFront, dBack, primer_indices, min_score,
+                  change_read_id, ignore_polyA):
+        """Pick up the best primer combo of a read given its best front and
+        back primer hits, trim primers and polyA tail away from the read.
+
+        dFront/dBack: {primer_name:DOMRecord} or None
+        Return (annotation, seq), where annotation is a ReadAnnotation
+        indicating whether 5' primer, 3' primer and polyA tail of the read
+        are seen, and seq is the trimmed sequence.
+        """
+        pbread = PBRead(read)
+        logging.debug("Pick up best primer combo for {r}".
+                      format(r=read.name))
+        primerIndex, strand, fw, rc = self._pickBestPrimerCombo(
+            dFront, dBack, primer_indices, min_score)
+        logging.debug("read={0}\n".format(read.name) +
+                      "primer={0} strand={1} fw={2} rc={3}".
+                      format(primerIndex, strand, fw, rc))
+
+        if fw is None and rc is None:
+            # No primer seen in this sequence, classified
+            # as non-full-length
+            newName = pbread.name
+            if change_read_id:
+                newName = "{m}/{z}/{s1}_{e1}{isccs}".format(
+                          m=pbread.movie, z=pbread.zmw,
+                          s1=pbread.start, e1=pbread.end,
+                          isccs=("_CCS" if pbread.isCCS else ""))
+            return (ReadAnnotation(ID=newName), read.sequence[:])
+
+        seq = read.sequence[:] if strand == "+" else revcmp(read.sequence[:])
+        five_end, three_start = None, None
+        if fw is not None:
+            five_end = fw.sEnd
+        if rc is not None:
+            three_start = len(seq) - rc.sEnd
+
+        s, e = pbread.start, pbread.end
+        # Try to find polyA tail in read
+        polyAPos = self._findPolyA(seq, three_start=three_start)
+        if polyAPos >= 0:  # polyA found
+            seq = seq[:polyAPos]
+            e1 = s + polyAPos if strand == "+" else e - polyAPos
+        elif three_start is not None:  # polyA not found
+            seq = seq[:three_start]
+            e1 = s + three_start if strand == "+" else e - three_start
+        else:
+            e1 = e if strand == "+" else s
+
+        if five_end is not None:
+            seq = seq[five_end:]
+            s1 = s + five_end if strand == "+" else e - five_end
+        else:
+            s1 = s if strand == "+" else e
+
+        newName = pbread.name
+        if change_read_id:
+            newName = "{m}/{z}/{s1}_{e1}{isccs}".format(
+                m=pbread.movie, z=pbread.zmw, s1=s1, e1=e1,
+                isccs=("_CCS" if pbread.isCCS else ""))
+        # Create an annotation
+        annotation = ReadAnnotation(ID=newName, strand=strand,
+                                    fiveend=five_end, polyAend=polyAPos,
+                                    threeend=three_start, primer=primerIndex,
+                                    ignore_polyA=ignore_polyA)
+        return (annotation, seq)
+
     def _trimBarCode(self, reads_fn, out_fl_reads_fn, out_nfl_reads_fn,
                      primer_report_nfl_fn,
                      best_of_front, best_of_back, primer_indices,
@@ -623,75 +757,10 @@ class Classifier(object):
                 FastaWriter(out_fl_reads_fn) as fl_fawriter, \
                 open(primer_report_nfl_fn, 'w') as reporter:
             for read in fareader:
-                self.summary.num_reads += 1  # number of ROI reads
-                pbread = PBRead(read)
-                logging.debug("Pick up best primer combo for {r}".
-                              format(r=read.name))
-                primerIndex, strand, fw, rc = self._pickBestPrimerCombo(
-                    best_of_front[read.name], best_of_back[read.name],
-                    primer_indices, min_score)
-                logging.debug("read={0}\n".format(read.name) +
-                              "primer={0} strand={1} fw={2} rc={3}".
-                              format(primerIndex, strand, fw, rc))
-
-                if fw is None and rc is None:
-                    # No primer seen in this sequence, classified
-                    # as non-full-length
-                    newName = pbread.name
-                    if change_read_id:
-                        newName = "{m}/{z}/{s1}_{e1}{isccs}".format(
-                                  m=pbread.movie, z=pbread.zmw,
-                                  s1=pbread.start, e1=pbread.end,
-                                  isccs=("_CCS" if pbread.isCCS else ""))
-                    annotation = ReadAnnotation(ID=newName)
-                    # Write reports of nfl reads
-                    reporter.write(annotation.toReportRecord(delimitor=",") + "\n")
-                    if len(read.sequence) >= min_seq_len:
-                        # output non-full-length reads to nfl.trimmed.fasta
-                        nfl_fawriter.writeRecord(annotation.toAnnotation(),
-                                                 read.sequence[:])
-                        self.summary.num_nfl += 1
-                    else:
-                        self.summary.num_filtered_short_reads += 1
-                    continue
-                seq = read.sequence[:] if strand == "+" else revcmp(read.sequence[:])
-                five_end, three_start = None, None
-                if fw is not None:
-                    five_end = fw.sEnd
-                    self.summary.num_5_seen += 1
-                if rc is not None:
-                    three_start = len(seq) - rc.sEnd
-                    self.summary.num_3_seen += 1
-
-                s, e = pbread.start, pbread.end
-                # Try to find polyA tail in read
-                polyAPos = self._findPolyA(seq, three_start=three_start)
-                if polyAPos >= 0:  # polyA found
-                    seq = seq[:polyAPos]
-                    e1 = s + polyAPos if strand == "+" else e - polyAPos
-                    self.summary.num_polya_seen += 1
-                elif three_start is not None:  # polyA not found
-                    seq = seq[:three_start]
-                    e1 = s + three_start if strand == "+" else e - three_start
-                else:
-                    e1 = e if strand == "+" else s
-
-                if five_end is not None:
-                    seq = seq[five_end:]
-                    s1 = s + five_end if strand == "+" else e - five_end
-                else:
-                    s1 = s if strand == "+" else e
-
-                newName = pbread.name
-                if change_read_id:
-                    newName = "{m}/{z}/{s1}_{e1}{isccs}".format(
-                        m=pbread.movie, z=pbread.zmw, s1=s1, e1=e1,
-                        isccs=("_CCS" if pbread.isCCS else ""))
-                # Create an annotation
-                annotation = ReadAnnotation(ID=newName, strand=strand,
-                                            fiveend=five_end, polyAend=polyAPos,
-                                            threeend=three_start, primer=primerIndex,
-                                            ignore_polyA=ignore_polyA)
+                annotation, seq = self._trimRead(
+                    read, best_of_front[read.name], best_of_back[read.name],
+                    primer_indices, min_score, change_read_id, ignore_polyA)
+                self._summarizeTrimmedRead(annotation)
 
                 # Write reports for nfl reads
                 if annotation.isFullLength is not True:
@@ -709,6 +778,14 @@ class Classifier(object):
                 else:
                     self.summary.num_filtered_short_reads += 1
 
+    def _summarizeTrimmedRead(self, annotation):
+        """Count a trimmed read and whether its 5' primer, 3' primer and
+        polyA tail are seen in summary."""
+        self.summary.num_reads += 1  # number of ROI reads
+        self.summary.num_5_seen += annotation.fiveseen
+        self.summary.num_3_seen += annotation.threeseen
+        self.summary.num_polya_seen += annotation.polyAseen
+
     def _validate_outputs(self, out_dir, out_all_reads_fn):
         """Validate and create output directory."""
         logging.info("Creating output directory {d}.".format(d=out_dir))
@@ -932,15 +1009,176 @@ class Classifier(object):
         self._cleanup([self._primer_report_nfl_fn,
                        self._primer_report_fl_fn])
 
+    def _classifyRead(self, read, front_back_searcher, chimera_searcher,
+                      primer_indices):
+        """Classify a read in one pass using native PrimerSearchers: find
+        primers in its front and back windows, trim primers and polyA tail
+        away, and detect whether the trimmed read is chimeric if chimera
+        detection is required for it.
+        Return (annotation, seq), where annotation.chimera is 0 or 1 if
+        chimera detection has been applied, and None otherwise.
+        """
+        opts = self.chimera_detection_opts
+        window_size = opts.primer_search_window
+        dFront, dBack = {}, {}
+        for bestOf, window in ((dFront, read.sequence[:window_size]),
+                               (dBack, revcmp(read.sequence[-window_size:]))):
+            for r in self._nativePrimerHits(front_back_searcher, read.name, window):
+                # allow missing adapter
+                if r.sStart <= 48 and r.pStart <= 48:
+                    self._addFrontBackHit(bestOf, r)
+
+        annotation, seq = self._trimRead(read, dFront, dBack, primer_indices,
+                                         opts.min_score, self.change_read_id,
+                                         self.ignore_polyA)
+
+        if len(seq) >= opts.min_seq_len and \
+           (annotation.isFullLength is True or opts.detect_chimera_nfl is True):
+            annotation.chimera = 0
+            for r in self._nativePrimerHits(chimera_searcher, annotation.ID, seq):
+                if self._isChimericHit(r, opts):
+                    annotation.chimera = 1
+                    break
+        return (annotation, seq)
+
+    def _classifiedReads(self, front_back_searcher, chimera_searcher,
+                         primer_indices):
+        """Yield (annotation, seq) of each read in reads_fn, in input order,
+        as returned by _classifyRead.
+
+        If self.cpus > 1, reads are classified in batches of
+        STREAM_BATCH_SIZE reads by a pool of forked worker processes,
+        while at most 2 * self.cpus batches are in flight, so that memory
+        usage does not grow with the number of input reads.
+        """
+        if self.cpus <= 1:
+            with CCSInput(self.reads_fn) as reader:
+                for read in reader:
+                    yield self._classifyRead(read, front_back_searcher,
+                                             chimera_searcher, primer_indices)
+            return
+
+        # Workers inherit searchers, including native PrimerSearchers,
+        # instead of unpickling them per batch.
+        state = (self, front_back_searcher, chimera_searcher, primer_indices)
+        pending = deque()
+        with fork_pool(self.cpus, state) as pool:
+            for batch in _read_batches(self.reads_fn, STREAM_BATCH_SIZE):
+                pending.append(pool.apply_async(_classify_batch, (batch, )))
+                if len(pending) >= 2 * self.cpus:
+                    for item in pending.popleft().get():
+                        yield item
+            while len(pending) > 0:
+                for item in pending.popleft().get():
+                    yield item
+
+    @property
+    def streaming(self):
+        """Return True if reads are classified by runStreamingClassifier,
+        which requires the native primer search engine, and does not
+        create dom files which could be reused."""
+        return self.primer_search == "native" and not self.reuse_dom
+
+    def runStreamingClassifier(self):
+        """Find and trim primers and polyAs, and detect chimeras in one
+        streaming pass over reads_fn, in place of runPrimerTrimmer and
+        runChimeraDetector.
+        Reads are classified by the native primer search engine and
+        written to output files in input order, no intermediate trimmed
+        reads, chunked reads or dom files are created.
+        """
+        logging.info("Start to classify reads in one streaming pass.")
+        opts = self.chimera_detection_opts
+        primer_indices = self._processPrimers(
+            primer_fn=self.primer_fn,
+            window_size=opts.primer_search_window,
+            primer_out_fn=self.primer_front_back_fn,
+            revcmp_primers=False)
+        self._processPrimers(
+            primer_fn=self.primer_fn,
+            window_size=opts.primer_search_window,
+            primer_out_fn=self.primer_chimera_fn,
+            revcmp_primers=True)
+        front_back_searcher = self._primerSearcher(self.primer_front_back_fn)
+        chimera_searcher = self._primerSearcher(self.primer_chimera_fn)
+
+        # Non-chimeric nfl reads are written to out_nflnc_fn if chimera
+        # detection is required for nfl reads, otherwise all nfl reads are
+        # written to out_nfl_fn.
+        nfl_fn = self.out_nflnc_fn_fasta if opts.detect_chimera_nfl \
+            else self.out_nfl_fn_fasta
+        nflc_writer = FastaWriter(self.out_nflc_fn_fasta) \
+            if opts.detect_chimera_nfl else None
+        if opts.detect_chimera_nfl:
+            self.summary.num_nflnc, self.summary.num_nflc = 0, 0
+        try:
+            with FastaWriter(self.out_flnc_fn_fasta) as flnc_writer, \
+                    FastaWriter(self.out_flc_fn_fasta) as flc_writer, \
+                    FastaWriter(nfl_fn) as nfl_writer, \
+                    open(self._primer_report_fl_fn, 'w') as fl_reporter, \
+                    open(self._primer_report_nfl_fn, 'w') as nfl_reporter:
+                fl_reporter.write(ReadAnnotation.header(delimiter=",") + "\n")
+                for annotation, seq in self._classifiedReads(
+                        front_back_searcher, chimera_searcher, primer_indices):
+                    self._summarizeTrimmedRead(annotation)
+                    isFullLength = annotation.isFullLength is True
+                    report = annotation.toReportRecord(delimitor=",") + "\n"
+                    if len(seq) < opts.min_seq_len:
+                        self.summary.num_filtered_short_reads += 1
+                        # Short nfl reads are reported unless chimera
+                        # detection is applied on nfl reads.
+                        if not isFullLength and not opts.detect_chimera_nfl:
+                            nfl_reporter.write(report)
+                    elif isFullLength:
+                        self.summary.num_fl += 1
+                        if annotation.chimera == 0:
+                            self.summary.num_flnc += 1
+                            self.summary.num_flnc_bases += len(seq)
+                            flnc_writer.writeRecord(annotation.toAnnotation(), seq)
+                        else:
+                            self.summary.num_flc += 1
+                            flc_writer.writeRecord(annotation.toAnnotation(), seq)
+                        fl_reporter.write(report)
+                    else:
+                        self.summary.num_nfl += 1
+                        if annotation.chimera == 1:
+                            self.summary.num_nflc += 1
+                            nflc_writer.writeRecord(annotation.toAnnotation(), seq)
+                        else:
+                            if opts.detect_chimera_nfl:
+                                self.summary.num_nflnc += 1
+                            nfl_writer.writeRecord(annotation.toAnnotation(), seq)
+                        nfl_reporter.write(report)
+        finally:
+            if nflc_writer is not None:
+                nflc_writer.close()
+
+        if opts.detect_chimera_nfl:
+            # Concatenate out_nflnc_fn and out_nflc_fn as out_nfl_fn
+            cat_files(src=[self.out_nflnc_fn_fasta, self.out_nflc_fn_fasta],
+                      dst=self.out_nfl_fn_fasta)
+        # Concatenate out_flnc and out_nflnc (or out_nfl) to make out_all_reads_fn
+        cat_files(src=[self.out_flnc_fn_fasta, nfl_fn],
+                  dst=self.out_all_reads_fn_fasta)
+
+        # Concatenate primer reports of fl and nfl reads to make a full report.
+        cat_files(src=[self._primer_report_fl_fn, self._primer_report_nfl_fn],
+                  dst=self.primer_report_fn)
+        self._cleanup([self._primer_report_nfl_fn,
+                       self._primer_report_fl_fn])
+        logging.info("Done with classifying reads.")
+
     def run(self):
         """Classify/annotate reads according to 5' primer seen,
         3' primer seen, polyA seen, chimera (concatenation of two
         or multiple transcripts with primers seen in the middle of
         a read)
         (1) Create and validate input/output
-        (2) Check phmmer is runnable
+        (2) Check phmmer is runnable, if primers are searched by phmmer
         (3) Find primers using phmmer and trim away primers and polyAs
         (4) Detect chimeras from trimmed reads
+        If self.streaming, (3) and (4) are done in one pass over reads by
+        runStreamingClassifier.
         """
         # Validate input files and required data files.
         self._validate_inputs(self.reads_fn, self.primer_fn, self.pbmatrix_fn)
@@ -949,10 +1187,15 @@ class Classifier(object):
         self._validate_outputs(self.out_dir, self.out_all_reads_fn_fasta)
 
         # Sanity check phmmer can be called successfully.
-        self._checkPhmmer()
+        if self.primer_search == "phmmer":
+            self._checkPhmmer()
 
-        # Find and trim primers and polyAs.
-        self.runPrimerTrimmer()
+        if self.streaming:
+            # Find and trim primers and polyAs, and detect chimeras.
+            self.runStreamingClassifier()
+        else:
+            # Find and trim primers and polyAs.
+            self.runPrimerTrimmer()
 
         # Check whether no fl reads detected.
         no_flnc_errMsg = "No full-length non-chimeric reads detected."
@@ -960,7 +1203,7 @@ class Classifier(object):
             logging.error(no_flnc_errMsg)
             if not self.ignore_empty_output:
                 raise ClassifierException(no_flnc_errMsg)
-        else:
+        elif not self.streaming:
             # Detect chimeras and generate primer reports.
             self.runChimeraDetector()
 
@@ -986,6 +1229,36 @@ class Classifier(object):
         return 0
 
 
+# Read with a name and a sequence, sent to worker processes of
+# Classifier._classifiedReads.
+StreamRead = namedtuple("StreamRead", ("name", "sequence"))
+
+
+def _read_batches(reads_fn, batch_size):
+    """Yield lists of at most batch_size StreamReads in reads_fn."""
+    batch = []
+    with CCSInput(reads_fn) as reader:
+        for read in reader:
+            batch.append(StreamRead(read.name, read.sequence))
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+    if len(batch) > 0:
+        yield batch
+
+
+def _classify_batch(reads):
+    """
+    Worker of Classifier._classifiedReads, classify a batch of reads
+    and return a list of (annotation, seq).
+    """
+    classifier, front_back_searcher, chimera_searcher, primer_indices = \
+        fork_state()
+    return [classifier._classifyRead(read, front_back_searcher,
+                                     chimera_searcher, primer_indices)
+            for read in reads]
+
+
 if __name__ == "__main__":
     obj = Classifier()
     obj.run()
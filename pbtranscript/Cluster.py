@@ -15,8 +15,9 @@ from pbtranscript.Polish import Polish
 from pbtranscript.ice.IceFiles import IceFiles
 from pbtranscript.ice.IceInit import IceInit
 from pbtranscript.ice.IceIterative import IceIterative
-from pbtranscript.ice.IceUtils import fafn2fqfn, ice_fa2fq, \
-        set_probqv_from_ccs, set_probqv_from_fq, set_probqv_from_model, \
+from pbtranscript.ice.IceCheckpoint import latest_checkpoint
+from pbtranscript.ice.IceUtils import ice_fa2qvcache, \
+        set_probqv_from_qv_cache, set_probqv_from_model, \
         check_blasr, sanity_check_daligner
 from pbtranscript.__init__ import get_version
 
@@ -192,61 +193,23 @@ class Cluster(IceFiles):
         """Return path to pickle file with initial clusters."""
         return op.join(self.root_dir, "init.uc.pickle")
 
-    def run(self):
-        """Call ICE to cluster consensus isoforms."""
-        self.add_log("Start to run cluster.", level=logging.INFO)
-
-        if self.ice_opts.targeted_isoseq:
-            reads_in_first_split = 1000
-            self.ice_opts.flnc_reads_per_split = 10000
-            self.add_log("targeted_isoseq: further splitting JUST first " +
-                         "split to 1000. Changing flnc_reads_per_split=10000.")
-        else:
-            reads_in_first_split = None
-
-        # Split flnc_fa into smaller files and save files to _flnc_splitted_fas.
-        self.add_log("Splitting {flnc} into ".format(flnc=self.flnc_fa) +
-                     "smaller files each containing {n} reads.".format(
-                         n=self.ice_opts.flnc_reads_per_split),
-                     level=logging.INFO)
-        self._flnc_splitted_fas = splitFasta(
-            input_fasta=self.flnc_fa,
-            reads_per_split=self.ice_opts.flnc_reads_per_split,
-            out_dir=self.root_dir,
-            out_prefix="input.split",
-            reads_in_first_split=reads_in_first_split)
-        self.add_log("Splitted files are: " +
-                     "\n".join(self._flnc_splitted_fas),
-                     level=logging.INFO)
-
-        # This is the first piece of reads to work on
-        first_split_fa = self._flnc_splitted_fas[0]
-        first_split_fq = fafn2fqfn(first_split_fa)
-
+    def _init_ice_iterative(self, first_split_fa, qv_cache_fn):
+        """Initialize clusters of reads in first_split_fa by IceInit,
+        and return an IceIterative object built on them."""
         # Set up probability and quality value model
-        if self.ice_opts.use_finer_qv: # default off
-            # Use multi-Qvs from ccs.h5, no need to write FASTQ
-            self._probqv, msg = set_probqv_from_ccs(
-                ccs_fofn=self.ccs_fofn, fasta_filename=first_split_fa)
-        else: # use a single Qv from FASTQ
-            if self.ccs_fofn is not None:
-                self.add_log("Converting {fa} + {ccs} into {fq}\n".format(
-                    fa=first_split_fa, ccs=self.ccs_fofn,
-                    fq=first_split_fq), level=logging.INFO)
-                ice_fa2fq(in_fa=first_split_fa, ccs_fofn=self.ccs_fofn,
-                          out_fq=first_split_fq)
-                # Set probqv from the first splitted FASTQ file.
-                self._probqv, msg = set_probqv_from_fq(fastq_filename=first_split_fq)
-            else: # use predefined model
-                self._probqv, msg = set_probqv_from_model()
-            self.add_log(msg, level=logging.INFO)
+        if qv_cache_fn is not None:
+            self._probqv, msg = set_probqv_from_qv_cache(
+                qv_cache_filename=qv_cache_fn, fasta_filename=first_split_fa,
+                use_finer_qv=self.ice_opts.use_finer_qv,
+                ccs_fofn=self.ccs_fofn)
+        else: # use predefined model
+            self._probqv, msg = set_probqv_from_model()
+        self.add_log(msg, level=logging.INFO)
 
         # Initialize cluster by clique
         self.add_log("Finding maximal cliques: initializing IceInit.",
                      level=logging.INFO)
         self.iceinit = IceInit(readsFa=first_split_fa,
-                               qver_get_func=self._probqv.get_smoothed,
-                               qvmean_get_func=self._probqv.get_mean,
                                ice_opts=self.ice_opts,
                                sge_opts=self.sge_opts)
         uc = self.iceinit.uc
@@ -263,7 +226,7 @@ class Cluster(IceFiles):
         # Run IceIterative.
         self.add_log("Iterative clustering: initializing IceIterative.",
                      level=logging.INFO)
-        self.icec = IceIterative(
+        return IceIterative(
             fasta_filename=first_split_fa,
             fasta_filenames_to_add=self._flnc_splitted_fas[1:],
             all_fasta_filename=self.flnc_fa,
@@ -273,10 +236,78 @@ class Cluster(IceFiles):
             sge_opts=self.sge_opts,
             uc=uc,
             probQV=self._probqv,
-            fastq_filename=first_split_fq,
+            qv_cache_filename=qv_cache_fn,
             output_pickle_file=self.output_pickle_file,
             tmp_dir=self.tmp_dir)
 
+    def run(self):
+        """Call ICE to cluster consensus isoforms."""
+        self.add_log("Start to run cluster.", level=logging.INFO)
+
+        if self.ice_opts.targeted_isoseq:
+            reads_in_first_split = 1000
+            self.ice_opts.flnc_reads_per_split = 10000
+            self.add_log("targeted_isoseq: further splitting JUST first " +
+                         "split to 1000. Changing flnc_reads_per_split=10000.")
+        else:
+            reads_in_first_split = None
+
+        # Split flnc_fa into smaller files and save files to _flnc_splitted_fas.
+        self.add_log("Splitting {flnc} into ".format(flnc=self.flnc_fa) +
+                     "smaller files each containing {n} reads.".format(
+                         n=self.ice_opts.flnc_reads_per_split),
+                     level=logging.INFO)
+        self._flnc_splitted_fas = splitFasta(
+            input_fasta=self.flnc_fa,
+            reads_per_split=self.ice_opts.flnc_reads_per_split,
+            out_dir=self.root_dir,
+            out_prefix="input.split",
+            reads_in_first_split=reads_in_first_split)
+        self.add_log("Splitted files are: " +
+                     "\n".join(self._flnc_splitted_fas),
+                     level=logging.INFO)
+
+        # This is the first piece of reads to work on
+        first_split_fa = self._flnc_splitted_fas[0]
+
+        # Build QV cache
+        qv_cache_fn = None
+        if self.ccs_fofn is not None:
+            # Extract QVs of all flnc (and nfl if polishing) reads once,
+            # and save them to a QV cache shared by ICE and ice_partial.
+            qv_cache_fn = self.qv_cache_fn
+            in_fas = [self.flnc_fa]
+            if self.ice_opts.quiver and self.nfl_fa is not None:
+                in_fas.append(self.nfl_fa)
+            self.add_log("Building QV cache {f} from {fas} + {ccs}".format(
+                f=qv_cache_fn, fas=", ".join(in_fas), ccs=self.ccs_fofn),
+                level=logging.INFO)
+            ice_fa2qvcache(in_fas=in_fas, ccs_fofn=self.ccs_fofn,
+                           out_cache=qv_cache_fn,
+                           use_finer_qv=self.ice_opts.use_finer_qv)
+
+        checkpoint_fn, checkpoint = latest_checkpoint(self.checkpoint_dir)
+        if checkpoint is not None and \
+                realpath(checkpoint['header']['all_fasta_filename']) != self.flnc_fa:
+            self.add_log("Ignoring checkpoint {f} of another input.".format(
+                f=checkpoint_fn), level=logging.WARNING)
+            checkpoint = None
+
+        if checkpoint is not None:
+            # Resume IceIterative from the latest valid checkpoint.
+            self.add_log("Iterative clustering: resuming IceIterative " +
+                         "from checkpoint {f}.".format(f=checkpoint_fn),
+                         level=logging.INFO)
+            self.icec = IceIterative.from_checkpoint(
+                checkpoint=checkpoint,
+                ice_opts=self.ice_opts,
+                sge_opts=self.sge_opts,
+                output_pickle_file=self.output_pickle_file,
+                tmp_dir=self.tmp_dir)
+        else:
+            self.icec = self._init_ice_iterative(first_split_fa=first_split_fa,
+                                                 qv_cache_fn=qv_cache_fn)
+
         self.add_log("IceIterative log: {f}.".format(f=self.icec.log_fn))
         self.icec.run()
         self.add_log("IceIterative completed.", level=logging.INFO)
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+"""
+Pick DALIGNER block sizes (DBsplit -s) and numbers of parallel daligner
+and LA4Ice jobs from sizes of query and target databases, available
+cores and a memory budget.
+
+Each daligner job aligns a query block to a target block using
+DALIGNER_NUM_THREADS threads (hard-coded in daligner at compile time),
+and its memory is dominated by sorted k-mer lists of both blocks, so
+it is modeled as
+    DALIGNER_BYTES_PER_BASE * (bases of query block + bases of target block)
+  + DALIGNER_BYTES_PER_READ * (reads of query block + reads of target block).
+Each LA4Ice job is single-threaded and loads reads of both databases.
+
+Blocks are made small enough that there are enough block pairs to keep
+all cores busy and that a daligner job fits in the memory budget, but
+not smaller than MIN_SPLIT_SIZE, because every block pair re-indexes
+both blocks.
+"""
+
+import os
+import math
+import logging
+from collections import namedtuple
+
+from pbtranscript.io import ContigSetReaderWrapper
+
+__all__ = ["DALIGNER_NUM_THREADS",
+           "DEFAULT_SPLIT_SIZE",
+           "MIN_SPLIT_SIZE",
+           "DBSize",
+           "DalignerPlan",
+           "db_size",
+           "default_max_mem",
+           "num_blocks",
+           "daligner_job_mem",
+           "tune_split_sizes",
+           "tune_parallelism",
+           "tune_daligner"]
+
+#NTHREADS is hard-coded as 4 in daligner.
+DALIGNER_NUM_THREADS = 4
+
+# DBsplit -s, block size in Mbp
+DEFAULT_SPLIT_SIZE = 200
+MIN_SPLIT_SIZE = 10
+
+DALIGNER_BYTES_PER_BASE = 40
+DALIGNER_BYTES_PER_READ = 128
+LA4ICE_BYTES_PER_BASE = 2
+LA4ICE_BYTES_PER_READ = 128
+
+# Memory budget if physical memory can not be detected, 16 GB.
+FALLBACK_MAX_MEM = 16 * 1024 ** 3
+
+DBSize = namedtuple("DBSize", "n_reads n_bases")
+
+DalignerPlan = namedtuple("DalignerPlan",
+                          ["query_split_size", "target_split_size",
+                           "daligner_jobs", "threads_per_job", "la4ice_jobs"])
+
+
+def db_size(fasta_filename):
+    """Return DBSize(number of reads, number of bases) of a FASTA/FASTQ/
+    ContigSet file."""
+    n_reads, n_bases = 0, 0
+    reader = ContigSetReaderWrapper(fasta_filename)
+    for r in reader:
+        n_reads += 1
+        n_bases += len(r.sequence)
+    reader.close()
+    return DBSize(n_reads=n_reads, n_bases=n_bases)
+
+
+def default_max_mem():
+    """Return half of physical memory in bytes, or FALLBACK_MAX_MEM if
+    physical memory can not be detected."""
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') / 2
+    except (ValueError, OSError, AttributeError):
+        return FALLBACK_MAX_MEM
+
+
+def num_blocks(size, split_size):
+    """Return number of blocks of a database of DBSize size, split by
+    DBsplit -s{split_size}."""
+    return max(1, int(math.ceil(size.n_bases / (split_size * 1e6))))
+
+
+def _block_size(size, split_size):
+    """Return DBSize of the largest block of a database."""
+    n = num_blocks(size, split_size)
+    return DBSize(n_reads=int(math.ceil(size.n_reads / float(n))),
+                  n_bases=min(size.n_bases, int(split_size * 1e6)))
+
+
+def _split_size_of(size, n):
+    """Return block size in Mbp which splits a database into n blocks."""
+    mbp = int(math.ceil(size.n_bases / 1e6 / max(1, n)))
+    return max(MIN_SPLIT_SIZE, min(DEFAULT_SPLIT_SIZE, mbp))
+
+
+def _num_pairs(query_blocks, target_blocks, same_db):
+    """Return number of daligner jobs, each aligning a pair of blocks."""
+    if same_db:
+        return query_blocks * (query_blocks + 1) / 2
+    return query_blocks * target_blocks
+
+
+def daligner_job_mem(query_block, target_block):
+    """Return estimated memory in bytes of a daligner job aligning
+    query_block to target_block, both are DBSize."""
+    return DALIGNER_BYTES_PER_BASE * (query_block.n_bases + target_block.n_bases) + \
+           DALIGNER_BYTES_PER_READ * (query_block.n_reads + target_block.n_reads)
+
+
+def _la4ice_job_mem(query_size, target_size):
+    """Return estimated memory in bytes of a LA4Ice job."""
+    return LA4ICE_BYTES_PER_BASE * (query_size.n_bases + target_size.n_bases) + \
+           LA4ICE_BYTES_PER_READ * (query_size.n_reads + target_size.n_reads)
+
+
+def tune_split_sizes(query_size, target_size, cpus, max_mem, same_db=False):
+    """
+    Return (query_split_size, target_split_size) in Mbp.
+
+    Query (e.g., flnc or nfl reads) is split into just enough blocks to
+    run cpus/DALIGNER_NUM_THREADS daligner jobs at once; target (e.g.,
+    consensus isoforms) is kept in as few blocks as DEFAULT_SPLIT_SIZE
+    allows. Then the larger block is halved until a daligner job fits
+    in max_mem or both blocks are MIN_SPLIT_SIZE.
+    """
+    max_jobs = max(1, cpus / DALIGNER_NUM_THREADS)
+    if same_db: # n * (n+1) / 2 >= max_jobs
+        n = int(math.ceil((math.sqrt(8 * max_jobs + 1) - 1) / 2))
+    else:
+        n = max_jobs
+    q_split = _split_size_of(query_size, n)
+    t_split = q_split if same_db else DEFAULT_SPLIT_SIZE
+
+    while daligner_job_mem(_block_size(query_size, q_split),
+                           _block_size(target_size, t_split)) > max_mem:
+        if q_split <= MIN_SPLIT_SIZE and t_split <= MIN_SPLIT_SIZE:
+            break
+        if same_db or _block_size(query_size, q_split).n_bases >= \
+                      _block_size(target_size, t_split).n_bases:
+            q_split = max(MIN_SPLIT_SIZE, q_split / 2)
+        else:
+            t_split = max(MIN_SPLIT_SIZE, t_split / 2)
+        if same_db:
+            t_split = q_split
+    return (q_split, t_split)
+
+
+def tune_parallelism(query_size, target_size, query_blocks, target_blocks,
+                     cpus, max_mem, same_db=False, same_strand_only=False):
+    """
+    Return (number of parallel daligner jobs, number of parallel LA4Ice jobs)
+    given sizes and number of blocks of query and target databases.
+    """
+    query_block = DBSize(n_reads=int(math.ceil(query_size.n_reads / float(query_blocks))),
+                         n_bases=int(math.ceil(query_size.n_bases / float(query_blocks))))
+    target_block = DBSize(n_reads=int(math.ceil(target_size.n_reads / float(target_blocks))),
+                          n_bases=int(math.ceil(target_size.n_bases / float(target_blocks))))
+    n_pairs = _num_pairs(query_blocks, target_blocks, same_db)
+
+    daligner_jobs = min(max(1, cpus / DALIGNER_NUM_THREADS), n_pairs,
+                        max_mem / max(1, daligner_job_mem(query_block, target_block)))
+
+    n_la4ice_cmds = n_pairs * DALIGNER_NUM_THREADS * (1 if same_strand_only else 2)
+    la4ice_jobs = min(cpus, n_la4ice_cmds,
+                      max_mem / max(1, _la4ice_job_mem(query_size, target_size)))
+    return (max(1, daligner_jobs), max(1, la4ice_jobs))
+
+
+def tune_daligner(query_size, target_size, cpus, max_mem=None, same_db=False,
+                  same_strand_only=False):
+    """Return a DalignerPlan of aligning query to target, both are DBSize,
+    using cpus cores and at most max_mem bytes memory."""
+    if max_mem is None:
+        max_mem = default_max_mem()
+    q_split, t_split = tune_split_sizes(query_size=query_size,
+                                        target_size=target_size,
+                                        cpus=cpus, max_mem=max_mem,
+                                        same_db=same_db)
+    daligner_jobs, la4ice_jobs = tune_parallelism(
+        query_size=query_size, target_size=target_size,
+        query_blocks=num_blocks(query_size, q_split),
+        target_blocks=num_blocks(target_size, t_split),
+        cpus=cpus, max_mem=max_mem, same_db=same_db,
+        same_strand_only=same_strand_only)
+    plan = DalignerPlan(query_split_size=q_split, target_split_size=t_split,
+                        daligner_jobs=daligner_jobs,
+                        threads_per_job=DALIGNER_NUM_THREADS,
+                        la4ice_jobs=la4ice_jobs)
+    logging.info("DALIGNER plan for query of %d reads %d bases, target of "
+                 "%d reads %d bases, %d cpus, %d MB memory: %s",
+                 query_size.n_reads, query_size.n_bases,
+                 target_size.n_reads, target_size.n_bases,
+                 cpus, max_mem / 1024 / 1024, plan)
+    return plan
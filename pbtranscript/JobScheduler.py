@@ -0,0 +1,461 @@
+#!/usr/bin/env python
+
+"""
+Event-driven scheduler for local jobs and SGE jobs.
+
+A JobScheduler runs a DAG of Jobs (shell commands) through a backend,
+starting a job as soon as all jobs it depends on are done and it fits
+in the scheduler's resource slots (cores, memory and number of jobs).
+
+Backends post an event to the scheduler as soon as a job completes,
+rather than being polled at fixed intervals:
+  * LocalBackend runs jobs as local processes, a job completes when
+    its process exits.
+  * SgeBackend qsubs each job in a wrapper script, which writes exit
+    code of the job to a sentinel file, a job completes when its
+    sentinel file appears. qstat is only called once in a while, to
+    detect jobs which died (e.g., qdel-ed) without a sentinel file.
+
+Failed jobs are retried up to Job.retries times with exponential backoff.
+
+Example:
+    scheduler = JobScheduler(backend=LocalBackend(), cores=4)
+    a = scheduler.add_job(Job(name="a", cmd="echo a > a.txt"))
+    b = scheduler.add_job(Job(name="b", cmd="cat a.txt", depends_on=["a"]))
+    failed_jobs = scheduler.run()
+"""
+
+import os
+import os.path as op
+import time
+import signal
+import logging
+import threading
+import subprocess
+from collections import OrderedDict
+from Queue import Queue, Empty
+
+from pbtranscript.RunnerUtils import write_cmd_to_script, sge_submit, \
+    get_active_sge_jobs, kill_sge_jobs
+
+__all__ = ["Job", "JobScheduler", "LocalBackend", "SgeBackend",
+           "backoff_intervals", "wait_for_files"]
+
+# Job states
+PENDING, RUNNING, DONE, FAILED = "PENDING", "RUNNING", "DONE", "FAILED"
+
+
+def backoff_intervals(initial=1, maximum=60, factor=2):
+    """Yield exponentially growing intervals in seconds, starting from
+    initial, capped at maximum."""
+    interval = initial
+    while True:
+        yield interval
+        interval = min(maximum, interval * factor)
+
+
+def wait_for_files(filenames, timeout=None, initial_interval=0.1,
+                   max_interval=10):
+    """
+    Wait for all files in filenames to exist, checking at exponentially
+    growing intervals, so that files created shortly are picked up
+    shortly, and long waits do not hit the file system too often.
+    Return True if all files exist, False if timeout (in seconds) is
+    reached first.
+    """
+    start_t = time.time()
+    intervals = backoff_intervals(initial_interval, max_interval)
+    while True:
+        missing = [f for f in filenames if not op.exists(f)]
+        if len(missing) == 0:
+            return True
+        if timeout is not None and time.time() - start_t >= timeout:
+            return False
+        logging.debug("Waiting for %s files, e.g., %s", len(missing), missing[0])
+        time.sleep(next(intervals))
+
+
+class Job(object):
+
+    """
+    A shell command to be run by a JobScheduler.
+      name - unique name of this job
+      cmd - shell command
+      depends_on - names of jobs which must be done before this job starts
+      cores - number of cores required
+      memory - memory required in MB
+      retries - maximum number of times to retry this job if it fails
+      timeout - kill an attempt of this job after timeout seconds
+      script - script file to save cmd (required by SgeBackend)
+    """
+
+    def __init__(self, name, cmd, depends_on=(), cores=1, memory=0,
+                 retries=0, timeout=None, script=None):
+        self.name = name
+        self.cmd = cmd
+        self.depends_on = list(depends_on)
+        self.cores = cores
+        self.memory = memory
+        self.retries = retries
+        self.timeout = timeout
+        self.script = script
+
+        self.state = PENDING
+        self.attempts = 0           # number of attempts started
+        self.returncode = None      # exit code of the last attempt
+        self.output = ""            # output or error of the last attempt
+        self.not_before = 0         # do not start this job before
+        self.started_at = None      # start time of the last attempt
+
+    def __repr__(self):
+        return "<Job {n} {s}>".format(n=self.name, s=self.state)
+
+
+class LocalBackend(object):
+
+    """Run jobs as local processes. Each process is waited for by a
+    thread, which posts an event as soon as the process exits."""
+
+    def __init__(self):
+        self.events = None
+        self._procs = {}  # job name --> Popen
+
+    def start(self, events):
+        """Start posting (name, attempt, returncode, output) to events."""
+        self.events = events
+
+    def submit(self, job):
+        """Start a job in a new process group."""
+        p = subprocess.Popen(job.cmd, shell=True, stdout=subprocess.PIPE,
+                             stderr=subprocess.STDOUT, preexec_fn=os.setsid,
+                             close_fds=True)
+        self._procs[job.name] = p
+        t = threading.Thread(target=self._wait, args=(job.name, job.attempts, p))
+        t.daemon = True
+        t.start()
+
+    def _wait(self, name, attempt, p):
+        """Wait for process p of a job to exit, then post an event."""
+        out = p.communicate()[0]
+        self.events.put((name, attempt, p.returncode, out))
+
+    def kill(self, job):
+        """Kill the process group of a running job."""
+        p = self._procs.get(job.name)
+        if p is not None and p.poll() is None:
+            try:
+                os.killpg(p.pid, signal.SIGTERM)
+            except OSError:
+                pass
+
+    def stop(self):
+        """Nothing to clean up."""
+        pass
+
+
+class SgeBackend(object):
+
+    """
+    Submit jobs to SGE. Each job is qsub-ed in a wrapper script (Job.script)
+    which writes the exit code of the job to a sentinel file of the attempt
+    (script.<attempt>.done), so that a late write of a killed attempt can
+    not complete a retry.
+    A watcher thread checks sentinel files at short, exponentially growing
+    intervals (reset whenever a job completes), and calls qstat every
+    qstat_interval seconds, to fail jobs which have left the queue without
+    writing sentinel files.
+    """
+
+    def __init__(self, sge_opts, qsub_try_times=3, run_timeout=None,
+                 min_interval=0.2, max_interval=5, qstat_interval=60):
+        self.sge_opts = sge_opts
+        self.qsub_try_times = qsub_try_times
+        self.run_timeout = run_timeout
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.qstat_interval = qstat_interval
+
+        self.events = None
+        self._lock = threading.Lock()
+        self._running = {}  # job name --> (attempt, jid, sentinel)
+        self._missing = set()  # names of jobs missing from last qstat
+        self._stopped = threading.Event()
+        self._watcher = None
+
+    @staticmethod
+    def sentinel_of(script, attempt):
+        """Return sentinel file of an attempt to run a script."""
+        return "%s.%d.done" % (script, attempt)
+
+    def start(self, events):
+        """Start posting (name, attempt, returncode, output) to events."""
+        self.events = events
+        self._stopped.clear()
+        self._watcher = threading.Thread(target=self._watch)
+        self._watcher.daemon = True
+        self._watcher.start()
+
+    def submit(self, job):
+        """Write job.cmd to a wrapper script and qsub it."""
+        if job.script is None:
+            raise ValueError("SGE job {n} requires a script.".format(n=job.name))
+        sentinel = self.sentinel_of(job.script, job.attempts)
+        if op.exists(sentinel):
+            os.remove(sentinel)
+        cmd = job.cmd
+        if self.run_timeout is not None and not cmd.startswith("timeout"):
+            cmd = "timeout %d %s" % (self.run_timeout, cmd)
+        # Run cmd in a subshell, so that the sentinel is written even if
+        # cmd calls exit.
+        write_cmd_to_script(cmd=["(", cmd, ")",
+                                 "echo $? > {s}.tmp && mv {s}.tmp {s}\n".
+                                 format(s=sentinel)],
+                            script=job.script)
+        qsub_cmd = self.sge_opts.qsub_cmd(script=job.script,
+                                          num_threads=job.cores,
+                                          elog=job.script + ".elog",
+                                          olog=job.script + ".olog")
+        jid = sge_submit(qsub_cmd=qsub_cmd, qsub_try_times=self.qsub_try_times)
+        logging.debug("Submitted SGE job %s for %s", jid, job.name)
+        with self._lock:
+            self._running[job.name] = (job.attempts, jid, sentinel)
+
+    def _post(self, name, attempt, returncode, output):
+        """Post an event of a completed attempt of a job, stop watching it,
+        return False if the attempt is no longer watched (e.g., killed)."""
+        with self._lock:
+            item = self._running.get(name)
+            if item is None or item[0] != attempt:
+                return False
+            del self._running[name]
+        self._missing.discard(name)
+        self.events.put((name, attempt, returncode, output))
+        return True
+
+    def _check_sentinels(self):
+        """Post events of jobs whose sentinel files exist, return the
+        number of events posted."""
+        with self._lock:
+            running = self._running.items()
+        n = 0
+        for name, (attempt, jid, sentinel) in running:
+            if op.exists(sentinel):
+                with open(sentinel, 'r') as reader:
+                    code = reader.read().strip()
+                if self._post(name, attempt, int(code) if code.isdigit() else -1,
+                              "SGE job {j} exited with code {c}.".format(j=jid, c=code)):
+                    n += 1
+        return n
+
+    def _check_qstat(self):
+        """Fail jobs which are missing from qstat twice in a row and have not
+        written their sentinel files, return the number of events posted."""
+        try:
+            active_jids = get_active_sge_jobs()
+        except RuntimeError as e:
+            logging.warn("Unable to call qstat: %s", str(e))
+            return 0
+        with self._lock:
+            running = self._running.items()
+        n = 0
+        for name, (attempt, jid, sentinel) in running:
+            if jid in active_jids or op.exists(sentinel):
+                self._missing.discard(name)
+            elif name in self._missing:
+                if self._post(name, attempt, -1, "SGE job {j} left the queue "
+                              "without writing {s}.".format(j=jid, s=sentinel)):
+                    n += 1
+            else:
+                self._missing.add(name)
+        return n
+
+    def _watch(self):
+        """Watch sentinel files and qstat until stopped."""
+        intervals = backoff_intervals(self.min_interval, self.max_interval)
+        last_qstat_t = time.time()
+        while not self._stopped.is_set():
+            n = self._check_sentinels()
+            if time.time() - last_qstat_t >= self.qstat_interval:
+                n += self._check_qstat()
+                last_qstat_t = time.time()
+            if n > 0:
+                intervals = backoff_intervals(self.min_interval, self.max_interval)
+            self._stopped.wait(next(intervals))
+
+    def kill(self, job):
+        """qdel a running job."""
+        with self._lock:
+            item = self._running.pop(job.name, None)
+        if item is not None:
+            kill_sge_jobs(jids=[item[1]])
+
+    def stop(self):
+        """Stop the watcher thread."""
+        self._stopped.set()
+        if self._watcher is not None:
+            self._watcher.join()
+
+
+class JobScheduler(object):
+
+    """
+    Run a DAG of jobs through a backend (LocalBackend or SgeBackend).
+      cores - number of cores available to jobs, None if not limited.
+      memory - memory in MB available to jobs, None if not limited.
+      max_jobs - maximum number of jobs running at the same time.
+      initial_backoff, max_backoff - a failed job is retried after
+          initial_backoff * 2 ^ (attempts - 1) seconds, capped at max_backoff.
+    A job which requires more cores or memory than available is started
+    when no other job is running.
+    """
+
+    def __init__(self, backend, cores=None, memory=None, max_jobs=None,
+                 initial_backoff=1, max_backoff=60):
+        self.backend = backend
+        self.cores = cores
+        self.memory = memory
+        self.max_jobs = max_jobs
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.jobs = OrderedDict()  # job name --> Job
+
+    def add_job(self, job):
+        """Add a job and return it."""
+        if job.name in self.jobs:
+            raise ValueError("Job {n} already exists.".format(n=job.name))
+        self.jobs[job.name] = job
+        return job
+
+    def _validate(self):
+        """Check all dependencies exist and there is no cycle."""
+        visited, visiting = set(), set()
+
+        def visit(name):
+            """Depth first search from job name."""
+            if name in visited:
+                return
+            if name in visiting:
+                raise ValueError("Jobs depend on each other in a cycle: " +
+                                 "{n}.".format(n=name))
+            visiting.add(name)
+            for dep in self.jobs[name].depends_on:
+                if dep not in self.jobs:
+                    raise ValueError("Job {n} depends on unknown job {d}.".
+                                     format(n=name, d=dep))
+                visit(dep)
+            visiting.remove(name)
+            visited.add(name)
+
+        for name in self.jobs:
+            visit(name)
+
+    def _fits(self, job, running):
+        """Return True if job fits in resources left by running jobs."""
+        if len(running) == 0:
+            return True
+        if self.max_jobs is not None and len(running) >= self.max_jobs:
+            return False
+        if self.cores is not None and \
+           sum(j.cores for j in running) + job.cores > self.cores:
+            return False
+        if self.memory is not None and \
+           sum(j.memory for j in running) + job.memory > self.memory:
+            return False
+        return True
+
+    def _start(self, job):
+        """Start an attempt of job."""
+        job.attempts += 1
+        job.state = RUNNING
+        job.started_at = time.time()
+        logging.debug("Starting job %s (attempt %s): %s",
+                      job.name, job.attempts, job.cmd)
+        try:
+            self.backend.submit(job)
+        except (RuntimeError, OSError, IOError) as e:
+            self._complete(job, None, str(e))
+
+    def _complete(self, job, returncode, output):
+        """Mark an attempt of job completed, retry it if it failed and
+        has retries left."""
+        job.returncode, job.output = returncode, output
+        if returncode == 0:
+            job.state = DONE
+            return
+        if job.attempts <= job.retries:
+            delay = min(self.max_backoff,
+                        self.initial_backoff * 2 ** (job.attempts - 1))
+            logging.warn("Job %s failed (attempt %s), retry in %s seconds: %s",
+                         job.name, job.attempts, delay, output)
+            job.state = PENDING
+            job.not_before = time.time() + delay
+        else:
+            logging.error("Job %s failed: %s", job.name, output)
+            job.state = FAILED
+
+    def _next_wakeup(self, jobs):
+        """Return seconds until the next pending job may be retried or the
+        next running job times out, or None."""
+        times = [j.not_before for j in jobs if j.state == PENDING and
+                 j.not_before > 0]
+        times.extend(j.started_at + j.timeout for j in jobs
+                     if j.state == RUNNING and j.timeout is not None)
+        return max(0, min(times) - time.time()) if len(times) > 0 else None
+
+    def run(self):
+        """Run all jobs, return a list of failed jobs, including jobs which
+        did not start because jobs they depend on failed."""
+        self._validate()
+        jobs = self.jobs.values()
+        events = Queue()
+        self.backend.start(events)
+        try:
+            while True:
+                now = time.time()
+                for job in jobs:
+                    if job.state == RUNNING and job.timeout is not None and \
+                       now - job.started_at >= job.timeout:
+                        self.backend.kill(job)
+                        self._complete(job, None, "Timed out after {t} seconds.".
+                                       format(t=job.timeout))
+
+                for job in jobs:
+                    if job.state == PENDING and \
+                       any(self.jobs[d].state == FAILED for d in job.depends_on):
+                        job.state = FAILED
+                        job.output = "Upstream job failed."
+
+                running = [j for j in jobs if j.state == RUNNING]
+                started = False
+                for job in jobs:
+                    if job.state == PENDING and job.not_before <= now and \
+                       all(self.jobs[d].state == DONE for d in job.depends_on) and \
+                       self._fits(job, running):
+                        self._start(job)
+                        started = True
+                        if job.state == RUNNING:
+                            running.append(job)
+
+                if all(j.state in (DONE, FAILED) for j in jobs):
+                    break
+                if started and len(running) == 0:
+                    continue  # jobs failed to start, check their retries
+
+                wakeup = self._next_wakeup(jobs)
+                try:
+                    name, attempt, returncode, output = events.get(
+                        timeout=wakeup if wakeup is not None else 60)
+                except Empty:
+                    continue
+                job = self.jobs[name]
+                if job.state == RUNNING and job.attempts == attempt:
+                    self._complete(job, returncode, output)
+        except:
+            for job in jobs:
+                if job.state == RUNNING:
+                    self.backend.kill(job)
+            raise
+        finally:
+            self.backend.stop()
+
+        return [j for j in jobs if j.state == FAILED]
@@ -54,6 +54,20 @@ class BaseConstants(object):
     USE_FINER_QV_ID = "pbtranscript.task_options.use_finer_qv"
     USE_FINER_QV_DEFAULT = False
 
+    PARTIAL_COMBINE_BINS_ID = "pbtranscript.task_options.partial_combine_bins"
+    PARTIAL_COMBINE_BINS_DEFAULT = False
+    PARTIAL_COMBINE_BINS_DESC = "Assign each chunk of non-full-length reads " + \
+            "to consensus isoforms of all cluster bins in one ice_partial job, " + \
+            "instead of one job for each cluster bin (default %s)." % \
+            PARTIAL_COMBINE_BINS_DEFAULT
+
+    BATCH_BLASR_PER_BIN_ID = "pbtranscript.task_options.batch_blasr_per_bin"
+    BATCH_BLASR_PER_BIN_DEFAULT = False
+    BATCH_BLASR_PER_BIN_DESC = "Align subreads of all clusters in a polish " + \
+            "bin to consensus isoforms of the bin in one blasr call, " + \
+            "instead of one call for each cluster (default %s)." % \
+            BATCH_BLASR_PER_BIN_DEFAULT
+
 def add_classify_arguments(parser):
     """
     Add arguments for subcommand `classify`.  This expects the PbParser object
@@ -215,6 +229,16 @@ def add_classify_arguments(parser):
         name="Require polyA",
         description=helpstr)
 
+    helpstr = "Engine to search primers in reads, either phmmer, or " + \
+              "native, a built-in banded local aligner which does not " + \
+              "require HMMER, and classifies reads in one streaming " + \
+              "pass (default: phmmer)."
+    hmm_group.add_argument("--primer_search",
+                           dest="primer_search",
+                           choices=("phmmer", "native"),
+                           default="phmmer",
+                           help=helpstr)
+
     helpstr = "Reuse previously built dom files by phmmer"
     parser.add_argument("--reuse_dom",
                         dest="reuse_dom",
@@ -601,6 +625,15 @@ def add_tmp_dir_argument(parser):
     return parser
 
 
+def add_batch_blasr_per_bin_argument(parser):
+    """Add an argument to align subreads of all clusters in a polish
+    bin in one blasr call."""
+    parser.add_argument("--batch_blasr_per_bin", default=False,
+                        dest="batch_blasr_per_bin", action='store_true',
+                        help=BaseConstants.BATCH_BLASR_PER_BIN_DESC)
+    return parser
+
+
 def add_use_blasr_argument(parser):
     """Add an arugument to specify whether or not to use
     blasr or to use daligner. When turned on, use blasr,
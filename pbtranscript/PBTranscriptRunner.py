@@ -116,7 +116,8 @@ class PBTranscript(PBMultiToolRunner):
                                  out_nfl_fn=self.args.nfl_fa,
                                  ignore_polyA=self.args.ignore_polyA,
                                  reuse_dom=self.args.reuse_dom,
-                                 ignore_empty_output=self.args.ignore_empty_output)
+                                 ignore_empty_output=self.args.ignore_empty_output,
+                                 primer_search=self.args.primer_search)
                 obj.run()
             elif cmd == 'cluster':
                 ice_opts = IceOptions(quiver=self.args.quiver,
@@ -15,7 +15,7 @@ from pbtranscript.ice.IceUtils import build_sa, \
     convert_fofn_to_fasta
 from pbtranscript.PBTranscriptOptions import add_fofn_arguments, \
     add_ice_post_quiver_hq_lq_arguments, add_sge_arguments, \
-    add_tmp_dir_argument, \
+    add_tmp_dir_argument, add_batch_blasr_per_bin_argument, \
     add_nfl_fa_argument, add_cluster_root_dir_as_positional_argument
 from pbtranscript.ice.IceFiles import IceFiles
 from pbtranscript.ice.IceAllPartials import IceAllPartials
@@ -29,7 +29,7 @@ class Polish(IceFiles):
 
     def __init__(self, root_dir, nfl_fa, bas_fofn, ccs_fofn,
                  ice_opts, sge_opts, ipq_opts, fasta_fofn=None,
-                 tmp_dir=None):
+                 tmp_dir=None, batch_blasr_per_bin=False):
         """
         root_dir --- IceFiles.root_dir, usually data/clusterOutDir
         nfl_fa    --- non-full-length reads in fasta, e.g., isoseq_nfl.fasta
@@ -45,6 +45,8 @@ class Polish(IceFiles):
                                         isoforms in fasta|q
                      lq_isoforms_fa|fq: polished, low quality consensus
                                         isoforms in fasta|q
+        batch_blasr_per_bin --- align subreads of all clusters in a quiver
+                                bin in one blasr call (see IceQuiver)
         """
         IceFiles.__init__(self, prog_name="IcePolish", root_dir=root_dir,
                           bas_fofn=bas_fofn, ccs_fofn=ccs_fofn,
@@ -53,6 +55,7 @@ class Polish(IceFiles):
         self.ice_opts = ice_opts
         self.sge_opts = sge_opts
         self.ipq_opts = ipq_opts
+        self.batch_blasr_per_bin = batch_blasr_per_bin
 
         self.add_log("ece_penalty: {0}, ece_min_len: {1}".format(self.ice_opts.ece_penalty, self.ice_opts.ece_min_len))
 
@@ -150,7 +153,8 @@ class Polish(IceFiles):
                               bas_fofn=self.bas_fofn,
                               fasta_fofn=self.fasta_fofn,
                               sge_opts=self.sge_opts,
-                              tmp_dir=self.tmp_dir)
+                              tmp_dir=self.tmp_dir,
+                              batch_blasr_per_bin=self.batch_blasr_per_bin)
         self.add_log("IceQuiver log: {f}.".format(f=self.iceq.log_fn),
                      level=logging.INFO)
         self.iceq.run()
@@ -175,6 +179,7 @@ def add_ice_polish_arguments(parser):
     parser = add_ice_post_quiver_hq_lq_arguments(parser)
     parser = add_sge_arguments(parser, quiver_nproc=True, blasr_nproc=True)
     parser = add_tmp_dir_argument(parser)
+    parser = add_batch_blasr_per_bin_argument(parser)
     return parser
 
 
@@ -224,7 +229,8 @@ class PolishRunner(PBToolRunner):
                          sge_opts=sge_opts,
                          ice_opts=IceOptions(),
                          ipq_opts=ipq_opts,
-                         tmp_dir=args.tmp_dir)
+                         tmp_dir=args.tmp_dir,
+                         batch_blasr_per_bin=args.batch_blasr_per_bin)
             obj.run()
         except Exception as e:
             logging.error(str(e))
@@ -3,11 +3,9 @@
 """
 Job runner utils for both SGE jobs and local jobs.
 """
-import subprocess
 import logging
 import time
 import os
-from multiprocessing.pool import ThreadPool
 from pbcore.util.Process import backticks
 from pbtranscript.ClusterOptions import SgeOptions
 
@@ -41,30 +39,26 @@ def write_cmd_to_script(cmd, script):
 
 def local_job_runner(cmds_list, num_threads, throw_error=True):
     """
-    Execute a list of cmds locally using thread pool with at most
-    num_threads threads, wait for all jobs to finish before exit.
+    Execute a list of cmds locally in a JobScheduler with at most
+    num_threads jobs running at a time, wait for all jobs to finish
+    before exit.
 
     If throw_error is True, when any job failed, raise RuntimeError.
     If throw_error is False, return a list of cmds that failed.
 
     Parameters:
-      cmds_list - cmds that will be executed in ThreadPool
-      num_threads - number of threads that will be used in the ThreadPool
+      cmds_list - cmds that will be executed
+      num_threads - maximum number of cmds running at the same time
       throw_error - whether or not to throw RuntimeError when any of cmd failed.
-      rescue - whether or not to rescue this job
-      rescue_times - maximum number of rescue times
     """
-    run_cmd_in_shell = lambda x: backticks(x, merge_stderr=True)
-    try:
-        pool = ThreadPool(processes=num_threads)
-        rets = pool.map(run_cmd_in_shell, cmds_list)
-        pool.close()
-        pool.join()
-    except subprocess.CalledProcessError:
-        pass
+    from pbtranscript.JobScheduler import JobScheduler, LocalBackend, Job
+    scheduler = JobScheduler(backend=LocalBackend(), cores=num_threads)
+    for i, cmd in enumerate(cmds_list):
+        scheduler.add_job(Job(name=str(i), cmd=cmd))
+    failed_jobs = scheduler.run()
 
-    failed_cmds = [cmds_list[i] for i in range(0, len(cmds_list)) if rets[i][1] != 0]
-    failed_cmds_out = [rets[i][0] for i in range(0, len(cmds_list)) if rets[i][1] != 0]
+    failed_cmds = [job.cmd for job in failed_jobs]
+    failed_cmds_out = [job.output for job in failed_jobs]
 
     if throw_error and len(failed_cmds) > 0:
         errmsg = "\n".join(["CMD failed: %s, %s" % (cmd, out)
@@ -104,10 +98,10 @@ def sge_submit(qsub_cmd, qsub_try_times=1):
         if code == 0: # succeeded, break
             # Your job 596028 ("a.sh") has been submitted
             return str(out).split()[2]
-        else:
-            # failed, sleep for a little, try again
-            time.sleep(5)
-            try_times += 1
+        elif try_times < qsub_try_times:
+            # failed, back off for 1, 2, 4, ... (at most 60) seconds, try again
+            time.sleep(min(60, 2 ** (try_times - 1)))
+        try_times += 1
 
     raise RuntimeError("Unable to qsub CMD: {cmd}. Abort!:"
                        .format(cmd=qsub_cmd))
@@ -222,9 +216,10 @@ def sge_job_runner(cmds_list, script_files,
                    wait_timeout=600, run_timeout=600,
                    rescue=None, rescue_times=3):
     """
-    Write commands in cmds_list each to a file in script_files.
-    Qsub all scripts to sge, then qsub done_script which depends
-    on all previously submitted jobs to complete before it starts.
+    Write commands in cmds_list each to a file in script_files, and
+    run them on sge in a JobScheduler, which detects completed jobs
+    by sentinel files written by scripts rather than polling qstat.
+    Return a list of (cmd, script) of jobs which failed or were killed.
 
     Parameters:
       cmds_list - a list of commands to run
@@ -236,69 +231,47 @@ def sge_job_runner(cmds_list, script_files,
       sge_opts - sge options to submit sge jobs.
       qsub_try_time - Retry if qsub failed
 
-      wait_timeout - maximum time in seconds passed before qdel all jobs.
+      wait_timeout - maximum time in seconds passed before qdel a job,
+                     regardless of its status.
       run_timeout - maximum time in seconds allowing a sge job to be running
-                   before qdel this job
+                   before it is killed.
 
-      rescue - whether or not to rescue a qdel-ed job.
+      rescue - whether or not to rescue a failed or qdel-ed job.
                None - no rescue
                locally - yes, run it locally exactly once
-               sge - yes, run it through sge, try multiple times until suceed
-      rescue_times - maximum times of rescuing a qdel-ed job.
-
-    ToDo:
-    (1) if SGE fails at qsub, -- resubmit? wait? run local?
-    (2) add in ways to monitor if certain qsub jobs died or hung --- resubmit? kill? run local?
+               sge - yes, retry it through sge with backoff
+      rescue_times - maximum times of rescuing a job through sge.
     """
+    from pbtranscript.JobScheduler import JobScheduler, SgeBackend, Job
     assert isinstance(sge_opts, SgeOptions)
     if len(cmds_list) != len(script_files):
         raise ValueError("Number of commands and script files "
                          "passed to sge_job_runner must be the same.")
-    jids = []
-    jids_to_cmds = {}
-    jids_to_scripts = {}
-    for cmd, script in zip(cmds_list, script_files):
-        if run_timeout is not None and not cmd.startswith("timeout"):
-            cmd = "timeout %d %s" % (run_timeout, cmd)
-        write_cmd_to_script(cmd=cmd, script=script)
-        qsub_cmd = sge_opts.qsub_cmd(script=script, num_threads=num_threads_per_job,
-                                     elog=script+".elog", olog=script+".olog")
-        jid = sge_submit(qsub_cmd=qsub_cmd, qsub_try_times=qsub_try_times)
-        jids.append(jid)
-        jids_to_cmds[jid] = cmd
-        jids_to_scripts[jid] = script
+    if rescue not in (None, "locally", "sge"):
+        raise ValueError("Unable to recognize rescue type {r}.".format(r=rescue))
 
     # We used to submit a done job which waits for all previous submitted
-    # sge jobs to complete using 'qsub -hold_jid'. This is deprecated because:
-    # 1. some non-SGE clusters may not support -hold_jid option
-    # 2. we prefer a timeout schema. Sometimes one job may be indefinitley
-    # stuck on a node (becuz that node is zombied or used up by another job),
-    # in this case, the job simply sits there FOREVER. We would rather it kill
-    # off the qsub jobs that goes over the timeout and retry.
-    #
-    # Replace 'qsub -hold_jid' by wait_for_sge_jobs with timeout.
-
-    killed_jobs = wait_for_sge_jobs(jids=jids, wait_timeout=wait_timeout,
-                                    run_timeout=run_timeout)
-    killed_cmds = [jids_to_cmds[jid] for jid in killed_jobs]
-    killed_scripts = [jids_to_scripts[jid] for jid in killed_jobs]
-
-    if rescue is None or rescue_times <= 0:
-        return zip(killed_cmds, killed_scripts)
-    elif rescue == "locally": # retry at most once if running locally
-        ret = []
-        for killed_cmd, killed_script in zip(killed_cmds, killed_scripts):
-            failed = (len(local_job_runner(cmds_list=[killed_cmd],
-                                           num_threads=num_threads_per_job,
-                                           throw_error=False)) != 0)
-            if failed:
-                ret.append((killed_cmd, killed_script))
-        return ret
-    elif rescue == "sge":
-        return sge_job_runner(cmds_list=[], script_files=[],
-                              num_threads_per_job=num_threads_per_job,
-                              sge_opts=sge_opts, qsub_try_times=qsub_try_times,
-                              wait_timeout=wait_timeout, run_timeout=run_timeout,
-                              rescue=rescue, rescue_times=(rescue_times-1))
-    else:
-        raise ValueError("Unable to recognize rescue type {r}.".format(r=rescue))
+    # sge jobs to complete using 'qsub -hold_jid', then poll qstat until
+    # all jobs left the queue. Now each job writes a sentinel file on exit,
+    # and is qdel-ed after wait_timeout seconds, in case it is stuck on a
+    # zombied node.
+    backend = SgeBackend(sge_opts=sge_opts, qsub_try_times=qsub_try_times,
+                         run_timeout=run_timeout)
+    scheduler = JobScheduler(backend=backend, max_jobs=sge_opts.max_sge_jobs)
+    retries = max(0, rescue_times) if rescue == "sge" else 0
+    for cmd, script in zip(cmds_list, script_files):
+        scheduler.add_job(Job(name=script, cmd=cmd, script=script,
+                              cores=num_threads_per_job, retries=retries,
+                              timeout=wait_timeout))
+    failed_jobs = scheduler.run()
+
+    ret = []
+    for job in failed_jobs:
+        if rescue == "locally" and rescue_times > 0:
+            # retry at most once if running locally
+            if len(local_job_runner(cmds_list=[job.cmd],
+                                    num_threads=num_threads_per_job,
+                                    throw_error=False)) == 0:
+                continue
+        ret.append((job.cmd, job.script))
+    return ret
@@ -4,6 +4,8 @@ import os.path as op
 import shutil
 import logging
 import sys
+import multiprocessing
+from contextlib import contextmanager
 from time import sleep
 
 from pbcore.io import openDataSet, ContigSet
@@ -521,3 +523,39 @@ def use_samtools_v_1_3_1():
         return major >= 2 or (major == 1 and minor > 3) or (major == 1 and minor == 3 and last >= 1)
     except:
         return False
+
+
+# State of worker processes of the pool which is being created by fork_pool.
+_FORK_STATE = None
+
+
+@contextmanager
+def fork_pool(processes, state):
+    """
+    Yield a multiprocessing.Pool of processes, which are forked while
+    fork_state() returns state, so that worker functions of the pool can
+    read state (e.g., large dicts or native objects which can not be
+    pickled) without unpickling it per task.
+    The pool is closed and joined when the with-block ends, or terminated
+    if the with-block raises, including GeneratorExit of a generator which
+    is closed before it uses up the pool.
+    """
+    global _FORK_STATE
+    _FORK_STATE = state
+    try:
+        pool = multiprocessing.Pool(processes=processes)
+    finally:
+        _FORK_STATE = None
+    try:
+        yield pool
+        pool.close()
+    except (Exception, KeyboardInterrupt, GeneratorExit):
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def fork_state():
+    """Return state of fork_pool in its worker processes."""
+    return _FORK_STATE
@@ -16,13 +16,23 @@ Note that Branch input GMAP SAM file must be sorted by
     (2) reference coordinates.
 
 Note that Branch does not merge fuzzy junctions
+
+If Branch.run is called with cpus > 1, the SORTED GMAP SAM file is split
+into blocks at gaps which no alignment spans, which are collapsed by
+worker processes independently, then collapsed isoforms of blocks are
+renumbered and merged in order, so that outputs are exactly the same
+as collapsing the whole SAM file in one process.
 """
+import re
+import shutil
 import logging
+import tempfile
 import os.path as op
 
-from pbtranscript.Utils import ln, realpath
+from pbtranscript.Utils import ln, realpath, fork_pool, fork_state
 from pbtranscript.io import iter_gmap_sam, ContigSetReaderWrapper, \
-        CollapseGffWriter, GroupWriter, parse_ds_filename
+        CollapseGffWriter, CollapseGffRecord, GroupWriter, GroupRecord, \
+        parse_ds_filename, sam_offset_index_fn, read_sam_offset_index
 from pbtranscript.collapsing.common import CollapsedFiles
 from pbtranscript.collapsing.CollapsingUtils import collapse_sam_records, \
         collapse_fuzzy_junctions, pick_rep
@@ -75,21 +85,49 @@ class Branch(object):
 
     def run(self, allow_extra_5exon, skip_5_exon_alt,
             ignored_ids_fn, good_gff_fn, bad_gff_fn, group_fn,
-            tolerate_end=100):
+            tolerate_end=100, cpus=1):
         """
         Process the whole SAM file:
           (1) Group SAM records based on where they mapped to and strands
           (2) Collapse records, write collapsed isoforms to *_gff_writer,
               write supportive records associated with each collapsed isoforms
               to group_writer.
+        If cpus > 1, collapse blocks of the SAM file in cpus processes.
         """
         ignored_ids_writer = open(ignored_ids_fn, 'w') if ignored_ids_fn else None
         good_gff_writer = CollapseGffWriter(good_gff_fn) if good_gff_fn else None
         bad_gff_writer = CollapseGffWriter(bad_gff_fn) if bad_gff_fn else None
         group_writer = GroupWriter(group_fn) if group_fn else None
 
-        cuff_index = 1
-        for recs in iter_gmap_sam(sam_filename=self.sam_filename,
+        writers = (ignored_ids_writer, good_gff_writer, bad_gff_writer, group_writer)
+        if cpus <= 1:
+            self.collapse(sam_filename=self.sam_filename, cuff_index=1,
+                          allow_extra_5exon=allow_extra_5exon,
+                          skip_5_exon_alt=skip_5_exon_alt,
+                          ignored_ids_writer=ignored_ids_writer,
+                          good_gff_writer=good_gff_writer,
+                          bad_gff_writer=bad_gff_writer,
+                          group_writer=group_writer,
+                          tolerate_end=tolerate_end)
+        else:
+            self._parallel_collapse(cpus=cpus, writers=writers,
+                                    allow_extra_5exon=allow_extra_5exon,
+                                    skip_5_exon_alt=skip_5_exon_alt,
+                                    tolerate_end=tolerate_end)
+
+        # close writers.
+        for writer in writers:
+            if writer:
+                writer.close()
+
+    def collapse(self, sam_filename, cuff_index, allow_extra_5exon, skip_5_exon_alt,
+                 ignored_ids_writer, good_gff_writer, bad_gff_writer, group_writer,
+                 tolerate_end):
+        """
+        Collapse groups of overlapping records in sam_filename, numbering
+        loci from cuff_index, and return cuff_index of the next locus.
+        """
+        for recs in iter_gmap_sam(sam_filename=sam_filename,
                                   query_len_dict=self.isoform_len_dict,
                                   min_aln_coverage=self.min_aln_coverage,
                                   min_aln_identity=self.min_aln_identity,
@@ -107,11 +145,242 @@ class Branch(object):
                                          group_writer=group_writer,
                                          tolerate_end=tolerate_end)
                     cuff_index += 1
+        return cuff_index
 
-        # close writers.
-        for writer in (ignored_ids_writer, good_gff_writer, bad_gff_writer, bad_gff_writer):
-            if writer:
-                writer.close()
+    def _parallel_collapse(self, cpus, writers, **kwargs):
+        """
+        Split self.sam_filename into blocks, collapse blocks in a pool of
+        cpus processes, renumber collapsed loci of each block so that they
+        follow loci of previous blocks, and write them to writers, which are
+        (ignored_ids_writer, good_gff_writer, bad_gff_writer, group_writer).
+        """
+        tmp_dir = tempfile.mkdtemp(prefix="collapse_blocks_")
+        try:
+            # about 4 blocks per process to balance loads of processes.
+            block_size = op.getsize(self.sam_filename) // (4 * cpus) + 1
+            index_fn = sam_offset_index_fn(self.sam_filename)
+            blocks = split_sorted_gmap_sam(self.sam_filename, tmp_dir, block_size,
+                                           index_fn=index_fn if op.exists(index_fn) else None)
+            if len(blocks) == 0:
+                log.warning("No records in %s!", self.sam_filename)
+                return
+            log.info("Collapsing %d blocks of %s in %d processes.",
+                     len(blocks), self.sam_filename, cpus)
+
+            # Workers inherit kwargs, including isoform_len_dict, instead
+            # of unpickling them per block.
+            with fork_pool(min(cpus, len(blocks)), (self, kwargs)) as pool:
+                cuff_index = 1
+                for n_loci, block_outputs in pool.imap(_collapse_block, blocks):
+                    for writer, items in zip(writers, block_outputs):
+                        if writer is None:
+                            continue
+                        for item in items:
+                            if isinstance(item, str):
+                                writer.write(item)
+                            else:
+                                writer.writeRecord(renumber_locus(item, cuff_index - 1))
+                    cuff_index += n_loci
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+class _ListWriter(object):
+    """Save records and ignored ids which are written to it in a list."""
+    def __init__(self):
+        self.items = []
+
+    def write(self, msg):
+        """Save an ignored id message."""
+        self.items.append(msg)
+
+    def writeRecord(self, record):
+        """Save a CollapseGffRecord or GroupRecord."""
+        self.items.append(record)
+
+
+def _collapse_block(block_sam):
+    """
+    Worker of Branch._parallel_collapse, collapse a block of SAM records
+    with loci numbered from 1, return (number of loci, (ignored ids,
+    good gff records, bad gff records, group records)).
+    """
+    branch, kwargs = fork_state()
+    writers = [_ListWriter() for dummy_i in range(4)]
+    next_cuff_index = branch.collapse(sam_filename=block_sam, cuff_index=1,
+                                      ignored_ids_writer=writers[0],
+                                      good_gff_writer=writers[1],
+                                      bad_gff_writer=writers[2],
+                                      group_writer=writers[3], **kwargs)
+    return next_cuff_index - 1, tuple(w.items for w in writers)
+
+
+def _shift_pb_id(pb_id, offset):
+    """Shift locus index of a PB id (e.g., PB.3 or PB.3.2) by offset."""
+    fields = pb_id.split('.')
+    fields[1] = str(int(fields[1]) + offset)
+    return '.'.join(fields)
+
+
+def renumber_locus(record, offset):
+    """Return a copy of a CollapseGffRecord or GroupRecord, of which
+    locus index of PB ids is shifted by offset, e.g., PB.3.2 -> PB.{3+offset}.2"""
+    if offset == 0:
+        return record
+    if isinstance(record, GroupRecord):
+        return GroupRecord(name=_shift_pb_id(record.name, offset),
+                           members=record.members)
+    return CollapseGffRecord(seqid=record.seqid, start=record.start, end=record.end,
+                             feature=record.feature, strand=record.strand,
+                             gene_id=_shift_pb_id(record.gene_id, offset),
+                             transcript_id=_shift_pb_id(record.transcript_id, offset))
+
+
+_CIGAR_REF_OPS = re.compile(r"(\d+)([MDN=X])")
+
+
+def _ref_end(pos, cigar):
+    """Return 0-based exclusive end on reference of an alignment starting
+    at 1-based pos, which is never less than GMAPSAMRecord.sEnd."""
+    return pos - 1 + sum(int(n) for n, dummy_op in _CIGAR_REF_OPS.findall(cigar))
+
+
+class _SamBlockSplitter(object):
+    """Write records of a SORTED GMAP SAM file to block SAM files in
+    out_dir, see split_sorted_gmap_sam."""
+    def __init__(self, sam_filename, out_dir, block_size, header):
+        self.sam_filename = sam_filename
+        self.out_dir = out_dir
+        self.block_size = block_size
+        self.header = header
+        self.blocks = []
+        self._writer, self._n_bytes = None, 0
+        self._s_id, self._max_end, self._last_start = None, -1, -1
+
+    def _new_block(self):
+        """Start writing a new block SAM file."""
+        self.close()
+        self.blocks.append(op.join(self.out_dir, "block_%d.sam" % len(self.blocks)))
+        self._writer = open(self.blocks[-1], 'w')
+        self._writer.writelines(self.header)
+        self._n_bytes = 0
+
+    def add(self, line):
+        """Write a record, in a new block if it starts after ends of all
+        previous alignments and the current block is full."""
+        fields = line.split('\t', 6)
+        if fields[2] != '*': # mapped, the same as GMAPSAMRecord.is_mapped
+            start = int(fields[3]) - 1
+            if fields[2] == self._s_id and start < self._last_start:
+                raise ValueError("SAM file %s is NOT sorted. ABORT!" % self.sam_filename)
+            if self._writer is None or (self._n_bytes >= self.block_size and
+                                        (fields[2] != self._s_id or start > self._max_end)):
+                self._new_block()
+            if fields[2] != self._s_id:
+                self._s_id, self._max_end = fields[2], -1
+            self._max_end = max(self._max_end, _ref_end(int(fields[3]), fields[5]))
+            self._last_start = start
+        elif self._writer is None:
+            self._new_block()
+        self._writer.write(line)
+        self._n_bytes += len(line)
+
+    def add_reference(self, s_id, reader, length):
+        """Write all records of reference s_id, which are the next length
+        bytes of reader. Records are copied without being parsed, unless a
+        new block may start among them."""
+        starts_block = self._writer is None or \
+                       (s_id != '*' and self._n_bytes >= self.block_size)
+        n_bytes = 0 if starts_block else self._n_bytes
+        if s_id != '*' and n_bytes + length > self.block_size:
+            while length > 0:
+                line = reader.readline()
+                if len(line) == 0:
+                    raise ValueError("SAM file %s is truncated." % self.sam_filename)
+                self.add(line)
+                length -= len(line)
+            return
+        if starts_block:
+            self._new_block()
+        if s_id != '*':
+            self._s_id = s_id
+        self._n_bytes += length
+        while length > 0:
+            data = reader.read(min(length, 1024 * 1024))
+            if len(data) == 0:
+                raise ValueError("SAM file %s is truncated." % self.sam_filename)
+            self._writer.write(data)
+            length -= len(data)
+
+    def close(self):
+        """Close the current block SAM file."""
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+def _reference_ranges(reader, index, records_start, file_size):
+    """Return [(reference name, offset, length)] of records of references
+    in a sorted SAM file, given its offset index read by
+    read_sam_offset_index, or None if the index does not agree with
+    the SAM file (e.g., the index is stale)."""
+    items = sorted((offset, rname) for rname, (offset, dummy_n) in index.iteritems())
+    if len(items) == 0 or items[0][0] != records_start:
+        return None if records_start != file_size else []
+    ret = []
+    for i, (offset, rname) in enumerate(items):
+        end = items[i + 1][0] if i + 1 < len(items) else file_size
+        reader.seek(offset)
+        if end <= offset or reader.readline().split('\t', 3)[2:3] != [rname]:
+            return None
+        ret.append((rname, offset, end - offset))
+    return ret
+
+
+def split_sorted_gmap_sam(sam_filename, out_dir, block_size, index_fn=None):
+    """
+    Split a SORTED GMAP SAM file into block SAM files in out_dir, each
+    having the SAM header and at least block_size bytes of records
+    (except the last one), return block SAM files in order.
+
+    A new block only starts at a record which is on a different reference,
+    or starts after ends of all previous alignments, so that every group
+    of overlapping records yielded by iter_gmap_sam is in one block, and
+    unmapped records always stay with their previous records.
+
+    If index_fn is not None, it is an offset index of sam_filename (see
+    sort_sam_stream), which is used to seek to records of each reference
+    and copy them without parsing, unless a new block may start among them.
+    Blocks are the same as splitting sam_filename without index_fn.
+    """
+    with open(sam_filename, 'r') as reader:
+        header = []
+        line = reader.readline()
+        while line.startswith('@'):
+            header.append(line)
+            line = reader.readline()
+        records_start = reader.tell() - len(line)
+        splitter = _SamBlockSplitter(sam_filename, out_dir, block_size, header)
+
+        ranges = None
+        if index_fn is not None:
+            ranges = _reference_ranges(reader, read_sam_offset_index(index_fn),
+                                       records_start, op.getsize(sam_filename))
+            if ranges is None:
+                log.warning("Ignoring offset index %s, which does not agree with %s.",
+                            index_fn, sam_filename)
+        try:
+            if ranges is not None:
+                for s_id, offset, length in ranges:
+                    reader.seek(offset)
+                    splitter.add_reference(s_id, reader, length)
+            else:
+                reader.seek(records_start)
+                for line in reader:
+                    splitter.add(line)
+        finally:
+            splitter.close()
+    return splitter.blocks
 
 
 class CollapseIsoformsRunner(CollapsedFiles):
@@ -130,7 +399,7 @@ class CollapseIsoformsRunner(CollapsedFiles):
     """
     def __init__(self, isoform_filename, sam_filename, output_prefix,
                  min_aln_coverage, min_aln_identity, min_flnc_coverage,
-                 max_fuzzy_junction, allow_extra_5exon, skip_5_exon_alt):
+                 max_fuzzy_junction, allow_extra_5exon, skip_5_exon_alt, cpus=1):
         """
         Parameters:
           isoform_filename -- input file containing isoforms, as fastq|fasta|contigset
@@ -144,6 +413,7 @@ class CollapseIsoformsRunner(CollapsedFiles):
           max_fuzzy_junction -- max edit distance between fuzzy-matching exons
           allow_extra_5exon -- whether or not to allow shorter 5' exons
           skip_5_exon_alt -- whether or not to skip alternative 5' exons
+          cpus -- number of processes collapsing blocks of sam_filename in parallel
         """
         self.suffix = parse_ds_filename(isoform_filename)[1]
         super(CollapseIsoformsRunner, self).__init__(prefix=output_prefix,
@@ -159,6 +429,7 @@ class CollapseIsoformsRunner(CollapsedFiles):
         self.max_fuzzy_junction = int(max_fuzzy_junction)
         self.allow_extra_5exon = bool(allow_extra_5exon)
         self.skip_5_exon_alt = bool(skip_5_exon_alt)
+        self.cpus = int(cpus)
 
     @property
     def shall_collapse_fuzzy_junctions(self):
@@ -210,7 +481,8 @@ class CollapseIsoformsRunner(CollapsedFiles):
               ignored_ids_fn=self.ignored_ids_txt_fn,
               good_gff_fn=self.good_unfuzzy_gff_fn,
               bad_gff_fn=self.bad_unfuzzy_gff_fn,
-              group_fn=self.unfuzzy_group_fn)
+              group_fn=self.unfuzzy_group_fn,
+              cpus=self.cpus)
 
         logging.info("Good unfuzzy isoforms written to: %s", realpath(self.good_unfuzzy_gff_fn))
         logging.info("Bad unfuzzy isoforms written to: %s", realpath(self.bad_unfuzzy_gff_fn))
@@ -13,13 +13,15 @@ import os.path as op
 import logging
 import random
 import string
+import subprocess
 from collections import defaultdict
 import numpy as np
 from pbcore.io import FastaWriter, FastqWriter, ContigSet
-from pbtranscript.Utils import execute, rmpath, as_contigset, realpath, real_upath
+from pbtranscript.Utils import execute, as_contigset, realpath, real_upath
 from pbtranscript.io import ContigSetReaderWrapper, FastaRandomReader, FastqRandomReader, \
     CollapseGffRecord, CollapseGffReader, CollapseGffWriter, \
-    GroupRecord, GroupReader, GroupWriter, parse_ds_filename
+    GroupRecord, GroupReader, GroupWriter, parse_ds_filename, \
+    sort_sam_stream, SORT_SAM_MAX_MEM
 from pbtranscript.collapsing import c_branch, IntervalTree
 
 __all__ = ["ContiVec",
@@ -53,17 +55,22 @@ def copy_sam_header(in_sam, out_sam):
 
 
 def map_isoforms_and_sort(input_filename, sam_filename,
-                          gmap_db_dir, gmap_db_name, gmap_nproc):
+                          gmap_db_dir, gmap_db_name, gmap_nproc,
+                          sort_max_mem=SORT_SAM_MAX_MEM, tmp_dir=None,
+                          index_fn=None):
     """
-    Map isoforms to references by gmap, generate a sam output and sort sam.
+    Map isoforms to references by gmap, and sort sam output of gmap
+    while gmap is running.
     Parameters:
         input_filename -- input isoforms. e.g., hq_isoforms.fasta|fastq|xml
         sam_filename -- output sam file, produced by gmap and sorted.
         gmap_db_dir -- gmap database directory
         gmap_db_name -- gmap database name
         gmap_nproc -- gmap nproc
+        sort_max_mem -- memory budget in bytes of sorting sam records
+        tmp_dir -- directory to spill sorted runs of sam records
+        index_fn -- if not None, write offset index of sorted sam to index_fn
     """
-    unsorted_sam_filename = sam_filename + ".tmp"
     log_filename = sam_filename + ".log"
 
     gmap_input_filename = input_filename
@@ -77,50 +84,51 @@ def map_isoforms_and_sort(input_filename, sam_filename,
     # In order to prevent mount issues, cd to ${gmap_db_dir} and ls ${gmap_db_name}.* files
     cwd = realpath(os.getcwd())
     cmd_args = ['cd %s' % real_upath(op.join(gmap_db_dir, gmap_db_name)),
-                'ls *.iit *meta', 'sleep 3', 'cd %s' % real_upath(cwd)]
+                'ls *.iit *meta', 'cd %s' % real_upath(cwd)]
     execute(' && '.join(cmd_args))
 
-    cmd_args = ['gmap', '-D {d}'.format(d=real_upath(gmap_db_dir)),
-                '-d {name}'.format(name=gmap_db_name),
-                '-t {nproc}'.format(nproc=gmap_nproc),
-                '-n 0',
-                '-z sense_force',
+    cmd_args = ['gmap', '-D', realpath(gmap_db_dir),
+                '-d', gmap_db_name,
+                '-t', str(gmap_nproc),
+                '-n', '0',
+                '-z', 'sense_force',
                 '--cross-species',
-                '-f samse',
-                '--max-intronlength-ends 200000', # for long genes
-                real_upath(gmap_input_filename),
-                '>', real_upath(unsorted_sam_filename),
-                '2>{log}'.format(log=real_upath(log_filename))]
-    # Call gmap to map isoforms to reference and output sam.
-    try:
-        execute(' '.join(cmd_args))
-    except Exception:
-        logging.debug("gmap failed, try again.")
-        execute('sleep 3')
-        execute(' '.join(cmd_args))
-
-    # sort sam file
-    sort_sam(in_sam=unsorted_sam_filename, out_sam=sam_filename)
-
-    # remove intermediate unsorted sam file.
-    rmpath(unsorted_sam_filename)
-
-
-def sort_sam(in_sam, out_sam):
+                '-f', 'samse',
+                '--max-intronlength-ends', '200000', # for long genes
+                realpath(gmap_input_filename)]
+    # Call gmap to map isoforms to reference, and sort sam records
+    # streamed from its stdout. Retry once if gmap failed.
+    for try_times in (1, 2):
+        logging.debug("CMD: %s", ' '.join(cmd_args))
+        with open(log_filename, 'w') as log_writer:
+            p = subprocess.Popen(cmd_args, stdout=subprocess.PIPE, stderr=log_writer)
+            error = None
+            try:
+                sort_sam_stream(in_stream=p.stdout, out_sam=sam_filename,
+                                max_mem=sort_max_mem, tmp_dir=tmp_dir,
+                                index_fn=index_fn)
+            except ValueError as e: # e.g., truncated output of a failed gmap
+                error = e
+            finally:
+                p.stdout.close()
+                code = p.wait()
+        if code == 0:
+            if error is not None:
+                raise error
+            return
+        if try_times == 1:
+            logging.debug("gmap failed, try again.")
+    raise RuntimeError("CMD failed: %s, see %s" % (' '.join(cmd_args), log_filename))
+
+
+def sort_sam(in_sam, out_sam, max_mem=SORT_SAM_MAX_MEM, tmp_dir=None, index_fn=None):
     """
-    Sort input sam file and write to output sam file.
+    Sort input sam file by (reference name, position) and write to
+    output sam file.
     """
-    # Copy SAM headers
-    copy_sam_header(in_sam=in_sam, out_sam=out_sam)
-
-    # Call sort to sort gmap output sam file
-    cmd_args = ['sort', '-k 3,3', '-k 4,4n', real_upath(in_sam),
-                '| grep -v \'^@\' ', ' >> ', real_upath(out_sam)]
-
-    if os.stat(in_sam).st_size == 0: # overwrite cmds if file is empty
-        cmd_args = ['touch', out_sam]
-
-    execute(' '.join(cmd_args))
+    with open(in_sam, 'r') as reader:
+        sort_sam_stream(in_stream=reader, out_sam=out_sam, max_mem=max_mem,
+                        tmp_dir=tmp_dir, index_fn=index_fn)
 
 
 def concatenate_sam(in_sam_files, sam_out):
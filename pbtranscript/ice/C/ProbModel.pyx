@@ -3,6 +3,7 @@
 # distutils: sources = ProbModel.cpp
 from pbtranscript.io.BasQV import basQVcacher, fastqQVcacher
 from pbtranscript.io.ContigSetReaderWrapper import ContigSetReaderWrapper
+from pbtranscript.ice.c_IceUtils import eval_hit
 from pbcore.io import FastqReader
 from libc.math cimport log
 
@@ -12,9 +13,14 @@ class ProbFromFastq:
     """
     Probability model constructed from Fastq files using 
     a single QV for everything
+
+    If qv_cache_filename is not None, QVs are memory mapped from
+    a QV cache file (see write_qv_cache), and reads can be added
+    by ids using add_seqs_from_fasta without converting to FASTQ.
     """
-    def __init__(self, fastq_filename,
-                 prob_threshold=.1, window_size=DEFAULT_WINDOW_SIZE):
+    def __init__(self, fastq_filename=None,
+                 prob_threshold=.1, window_size=DEFAULT_WINDOW_SIZE,
+                 qv_cache_filename=None):
         self.qver = fastqQVcacher()
         self.fastq_filename = fastq_filename
         self.seqids = []
@@ -22,7 +28,10 @@ class ProbFromFastq:
         self.window_size = window_size
         self.full_prob = None
 
-        self.add_seqs_from_fastq(fastq_filename)
+        if qv_cache_filename is not None:
+            self.qver.open_cache(qv_cache_filename)
+        if fastq_filename is not None:
+            self.add_seqs_from_fastq(fastq_filename)
 
     def get_smoothed(self, qID, qvname, position=None):
         """
@@ -46,6 +55,26 @@ class ProbFromFastq:
         if smooth:
             self.qver.presmooth(newids, self.window_size, fastq_filename)
 
+    def add_seqs_from_fasta(self, fasta_filename, smooth=True):
+        """Add sequence ids from a fasta file, QVs of these reads
+        must be available in the QV cache."""
+        with ContigSetReaderWrapper(fasta_filename) as reader:
+            newids = [r.name.split()[0] for r in reader]
+        self.seqids += newids
+        if smooth:
+            self.qver.presmooth(newids, self.window_size)
+
+    def add_seqs_from_qvs(self, seqids, qvs, smooth=True):
+        """Add sequences given their ids and lists of QVs."""
+        self.qver.add_qvs(seqids, qvs)
+        self.seqids += seqids
+        if smooth:
+            self.qver.presmooth(seqids, self.window_size)
+
+    def write_qv_cache(self, qv_cache_filename):
+        """Save smoothed QVs of all sequences to a QV cache file."""
+        self.qver.write_cache(qv_cache_filename)
+
     def get_mean(self, qID, qvname):
         """Return mean QV of read=qID, type=qvname"""
         return self.qver.get_mean(qID, qvname)
@@ -63,6 +92,16 @@ class ProbFromFastq:
         prob_err = self.qver.get(qID, None)
         return calc_aln_log_prob2(prob_err, len(prob_err), list(fakecigar), 
                                   qStart, qEnd)
+
+    def calc_prob_from_hit(self, qID, qStart, qEnd, qAln, alnStr, sAln,
+                           ece_penalty, ece_min_len):
+        """
+        Check an alignment for large non-matches and calculate its log
+        probability in one pass, see c_IceUtils.eval_hit.
+        Return None if the alignment has large non-matches.
+        """
+        return eval_hit(qAln, alnStr, sAln, ece_penalty, ece_min_len,
+                        qStart, qEnd, prob_err=self.qver.get(qID, None))
         
 
 class ProbFromQV:
@@ -70,10 +109,15 @@ class ProbFromQV:
     """
     Probability model constructed from FOFN files using
     quality values.
+
+    If qv_cache_filename is not None, QVs are memory mapped from
+    a QV cache file (see write_qv_cache), only reads which are
+    not in the cache are read from input_fofn.
     """
 
     def __init__(self, input_fofn, fasta_filename=None,
-                 prob_threshold=.1, window_size=DEFAULT_WINDOW_SIZE):
+                 prob_threshold=.1, window_size=DEFAULT_WINDOW_SIZE,
+                 qv_cache_filename=None):
         self.qver = basQVcacher()
         self.input_fofn = input_fofn
         self.seqids = []
@@ -87,6 +131,8 @@ class ProbFromQV:
                 for line in f:
                     self.qver.add_bash5(line.strip())
 
+        if qv_cache_filename is not None:
+            self.qver.open_cache(qv_cache_filename)
         if fasta_filename is not None:
             self.add_seqs_from_fasta(fasta_filename)
 
@@ -118,6 +164,10 @@ class ProbFromQV:
         self.seqids += newids
         self.qver.presmooth(newids, self.window_size)
 
+    def write_qv_cache(self, qv_cache_filename):
+        """Save smoothed QVs of all sequences to a QV cache file."""
+        self.qver.write_cache(qv_cache_filename)
+
     def remove_ids(self, ids):
         """Remove ids from self.seqids."""
         for _id in ids:
@@ -135,9 +185,22 @@ class ProbFromQV:
                                  len(prob_del), list(fakecigar), 
                                  qStart, qEnd)
 
+    def calc_prob_from_hit(self, qID, qStart, qEnd, qAln, alnStr, sAln,
+                           ece_penalty, ece_min_len):
+        """
+        Check an alignment for large non-matches and calculate its log
+        probability in one pass, see c_IceUtils.eval_hit.
+        Return None if the alignment has large non-matches.
+        """
+        prob_qvs = (self.qver.get(qID, 'SubstitutionQV'),
+                    self.qver.get(qID, 'InsertionQV'),
+                    self.qver.get(qID, 'DeletionQV'))
+        return eval_hit(qAln, alnStr, sAln, ece_penalty, ece_min_len,
+                        qStart, qEnd, prob_qvs=prob_qvs)
+
 
-cdef double calc_aln_log_prob(list prob_sub, list prob_ins,
-                              list prob_del, int n,
+cdef double calc_aln_log_prob(const float[:] prob_sub, const float[:] prob_ins,
+                              const float[:] prob_del, int n,
                               list fakecigar, int qStart, int qEnd):
     """
     Calculate log probabilities from alignment cigar strings using Cython.
@@ -170,7 +233,7 @@ cdef double calc_aln_log_prob(list prob_sub, list prob_ins,
     return score
 
 
-cdef double calc_aln_log_prob2(list prob_err, int n,
+cdef double calc_aln_log_prob2(const float[:] prob_err, int n,
                                list fakecigar, int qStart, int qEnd):
     """
     Calculate log probabilities from alignment cigar strings using Cython.
@@ -178,7 +241,7 @@ cdef double calc_aln_log_prob2(list prob_err, int n,
     cdef int i, cur_q_pos
     cdef double score, tmp, one_three
 
-    cdef int max_pos = len(prob_err)
+    cdef int max_pos = prob_err.shape[0]
     one_three = log(1 / 3.)
     cur_q_pos = qStart
     score = 0.
@@ -287,3 +350,14 @@ class ProbFromModel:
             else:  # x == 'D', don't advance qpos
                 score += prob_del
         return score
+
+    def calc_prob_from_hit(self, qID, qStart, qEnd, qAln, alnStr, sAln,
+                           ece_penalty, ece_min_len):
+        """
+        Check an alignment for large non-matches and calculate its log
+        probability in one pass, see c_IceUtils.eval_hit.
+        Return None if the alignment has large non-matches.
+        """
+        return eval_hit(qAln, alnStr, sAln, ece_penalty, ece_min_len,
+                        qStart, qEnd,
+                        rates=(self.r_mis, self.r_ins, self.r_del))
@@ -0,0 +1,474 @@
+# cython: boundscheck=False, wraparound=False, cdivision=True
+"""
+A native graph and quasi-clique engine, which is used by IceInit to
+find initial clusters in place of networkx and pClique.
+
+AlignGraph keeps an undirected graph of reads as a compact CSR adjacency
+built directly from a stream of edges (e.g., LA4Ice hits). Its
+find_cliques() finds mutually exclusive quasi-cliques, largest-degree
+nodes first, the same way as IceInit used to with pClique.grasp:
+for each remaining node, a GRASP (greedy randomized adaptive search) of
+quasi-gamma-cliques is run on the subgraph of the node and its remaining
+neighbors, where the subgraph is kept as bitsets, so that degrees of
+nodes within candidates or cliques are counted by popcount.
+
+GRASP iterations use a seeded splitmix64 random number generator, so
+that the same graph and seed always give the same cliques.
+"""
+from libc.stdlib cimport malloc, calloc, free, qsort
+from libc.string cimport memset, memcpy
+
+__all__ = ["AlignGraph"]
+
+ctypedef unsigned long long word_t
+
+cdef extern from *:
+    int __builtin_popcountll(unsigned long long) nogil
+
+
+cdef struct Rng:
+    word_t state
+
+
+cdef inline word_t _rng_next(Rng * rng) nogil:
+    """Return the next random 64-bit integer (splitmix64)."""
+    cdef word_t z
+    rng.state += <word_t>0x9E3779B97F4A7C15ULL
+    z = rng.state
+    z = (z ^ (z >> 30)) * <word_t>0xBF58476D1CE4E5B9ULL
+    z = (z ^ (z >> 27)) * <word_t>0x94D049BB133111EBULL
+    return z ^ (z >> 31)
+
+
+cdef inline double _rng_uniform(Rng * rng, double a, double b) nogil:
+    """Return a random float in [a, b)."""
+    return a + (b - a) * (_rng_next(rng) >> 11) * (1.0 / 9007199254740992.0)
+
+
+cdef inline int _rng_below(Rng * rng, int n) nogil:
+    """Return a random integer in [0, n)."""
+    return <int>(_rng_next(rng) % <word_t>n)
+
+
+cdef void _shuffle(int * xs, int n, Rng * rng) nogil:
+    """Shuffle xs[0:n] in place (Fisher-Yates)."""
+    cdef int i, j, t
+    for i in range(n - 1, 0, -1):
+        j = _rng_below(rng, i + 1)
+        t = xs[i]
+        xs[i] = xs[j]
+        xs[j] = t
+
+
+cdef inline bint _has(word_t * row, int j) nogil:
+    """Return True if bit j of row is set."""
+    return (row[j >> 6] >> (j & 63)) & 1
+
+
+cdef inline void _set(word_t * row, int j) nogil:
+    """Set bit j of row."""
+    row[j >> 6] |= (<word_t>1) << (j & 63)
+
+
+cdef inline int _count2(word_t * a, word_t * b, int nw) nogil:
+    """Return popcount of a & b."""
+    cdef int i, c = 0
+    for i in range(nw):
+        c += __builtin_popcountll(a[i] & b[i])
+    return c
+
+
+cdef inline int _count3(word_t * a, word_t * b, word_t * c, int nw) nogil:
+    """Return popcount of a & b & c."""
+    cdef int i, n = 0
+    for i in range(nw):
+        n += __builtin_popcountll(a[i] & b[i] & c[i])
+    return n
+
+
+cdef struct SubGraph:
+    # A subgraph of m nodes, of which row i of bits, bits[i*nw:(i+1)*nw],
+    # is the bitset of neighbors of node i.
+    int m
+    int nw
+    word_t * bits
+    # buffers of m ints and of nw words
+    int * buf1
+    int * buf2
+    int * buf3
+    word_t * mask1
+    word_t * mask2
+
+
+cdef inline word_t * _row(SubGraph * g, int i) nogil:
+    """Return bitset of neighbors of node i."""
+    return g.bits + <size_t>i * g.nw
+
+
+cdef void _to_mask(SubGraph * g, int * nodes, int n, word_t * mask) nogil:
+    """Set mask to the bitset of nodes[0:n]."""
+    cdef int i
+    memset(mask, 0, g.nw * sizeof(word_t))
+    for i in range(n):
+        _set(mask, nodes[i])
+
+
+cdef bint _is_quasi_clique(SubGraph * g, int * nodes, int n, double threshold) nogil:
+    """Return True if every node of nodes[0:n] has at least threshold
+    neighbors within nodes[0:n]."""
+    cdef int i
+    _to_mask(g, nodes, n, g.mask2)
+    for i in range(n):
+        if _count2(_row(g, nodes[i]), g.mask2, g.nw) < threshold:
+            return False
+    return True
+
+
+cdef int _construct(SubGraph * g, double alpha, int start, int * Q, Rng * rng) nogil:
+    """
+    Greedily grow a clique Q from start, each time picking a random
+    candidate, among candidates of which degrees within candidates are
+    at least min + alpha * (max - min), return size of Q.
+    """
+    cdef int * C = g.buf1
+    cdef int * RCL = g.buf2
+    cdef int * degs = g.buf3
+    cdef int len_Q = 1, len_C = 0, n_rcl, i, j, u, d, min_deg, max_deg
+    cdef double threshold
+    Q[0] = start
+    for j in range(g.m):
+        if _has(_row(g, start), j):
+            C[len_C] = j
+            len_C += 1
+    while len_C > 0:
+        _to_mask(g, C, len_C, g.mask1)
+        min_deg, max_deg = g.m, -1
+        for i in range(len_C):
+            d = _count2(_row(g, C[i]), g.mask1, g.nw)
+            degs[i] = d
+            min_deg = min(min_deg, d)
+            max_deg = max(max_deg, d)
+        threshold = min_deg + alpha * (max_deg - min_deg)
+        n_rcl = 0
+        for i in range(len_C):
+            if degs[i] >= threshold:
+                RCL[n_rcl] = i
+                n_rcl += 1
+        if n_rcl == 0:
+            break
+        u = C[RCL[_rng_below(rng, n_rcl)]]
+        Q[len_Q] = u
+        len_Q += 1
+        # update candidates to neighbors of u
+        j = 0
+        for i in range(len_C):
+            if _has(_row(g, u), C[i]):
+                C[j] = C[i]
+                j += 1
+        len_C = j
+    return len_Q
+
+
+cdef bint _local(SubGraph * g, int * Q, int * len_Q, double gamma, Rng * rng) nogil:
+    """
+    Try a (2, 1)-exchange of Q, which removes a node from Q and adds
+    two candidates, so that Q remains a quasi-gamma-clique.
+    Return True if Q has been enlarged.
+    """
+    cdef int * cand = g.buf1
+    cdef int * choices = g.buf2
+    cdef int * newQ = g.buf3
+    cdef int n = len_Q[0], len_cand = 0, i, k, v, u, best_u, y, best_y, ww
+    cdef double threshold = gamma * n
+    _to_mask(g, Q, n, g.mask1)
+    for i in range(g.m):
+        if not _has(g.mask1, i) and _count2(_row(g, i), g.mask1, g.nw) >= threshold:
+            cand[len_cand] = i
+            len_cand += 1
+    if len_cand < 2:
+        return False
+
+    for i in range(len_cand):
+        choices[i] = i
+    _shuffle(choices, len_cand, rng)
+
+    for k in range(len_cand):
+        v = choices[k]
+        # u, the candidate sharing the most neighbors in Q with v
+        best_u, best_y = 0, -1
+        for u in range(len_cand):
+            y = 0 if u == v else _count3(_row(g, cand[v]), _row(g, cand[u]),
+                                         g.mask1, g.nw)
+            if y > best_y:
+                best_u, best_y = u, y
+        if best_y < threshold:
+            continue
+        # try replacing Q[ww], which is not a neighbor of v, by u and v
+        for ww in range(n):
+            if _has(_row(g, cand[v]), Q[ww]):
+                continue
+            memcpy(newQ, Q, ww * sizeof(int))
+            memcpy(newQ + ww, Q + ww + 1, (n - ww - 1) * sizeof(int))
+            newQ[n - 1] = cand[best_u]
+            newQ[n] = cand[v]
+            if _is_quasi_clique(g, newQ, n + 1, gamma * (n + 1)):
+                memcpy(Q, newQ, (n + 1) * sizeof(int))
+                len_Q[0] = n + 1
+                return True
+    return False
+
+
+cdef void _local_extra(SubGraph * g, int * Q, int * len_Q, double gamma, Rng * rng) nogil:
+    """Add candidates to Q as long as Q remains a quasi-gamma-clique."""
+    cdef int * cand = g.buf1
+    cdef int n = len_Q[0], len_cand = 0, i, x
+    cdef double threshold = gamma * (n + 1)
+    _to_mask(g, Q, n, g.mask1)
+    for i in range(g.m):
+        if not _has(g.mask1, i) and _count2(_row(g, i), g.mask1, g.nw) >= threshold:
+            cand[len_cand] = i
+            len_cand += 1
+    _shuffle(cand, len_cand, rng)
+    while len_cand > 0:
+        len_cand -= 1
+        x = cand[len_cand]
+        Q[n] = x
+        if _is_quasi_clique(g, Q, n + 1, threshold):
+            n += 1
+            threshold = gamma * (n + 1)
+    len_Q[0] = n
+
+
+cdef int _grasp(SubGraph * g, double gamma, int maxitr, int start,
+                int * Q, int * bestQ, Rng * rng) nogil:
+    """Grasp a quasi-gamma-clique containing start in maxitr iterations,
+    save it to bestQ and return its size, or return 0 if start has no
+    neighbor."""
+    cdef int k, len_Q, len_best = 0
+    cdef double alpha
+    for k in range(maxitr):
+        # randomly pick alpha uniformly from [0.1, 0.9]
+        alpha = _rng_uniform(rng, 0.1, 0.9)
+        len_Q = _construct(g, alpha, start, Q, rng)
+        if len_Q <= 1:
+            return 0
+        while _local(g, Q, &len_Q, gamma, rng):
+            pass
+        _local_extra(g, Q, &len_Q, gamma, rng)
+        if len_Q > len_best:
+            memcpy(bestQ, Q, len_Q * sizeof(int))
+            len_best = len_Q
+    return len_best
+
+
+cdef int _cmp_int(const void * a, const void * b) nogil:
+    """Compare two ints, for qsort."""
+    return (<const int *>a)[0] - (<const int *>b)[0]
+
+
+cdef class AlignGraph:
+    """
+    An undirected graph of reads, each edge of which represents an
+    alignment between two reads.
+
+    Example:
+        g = AlignGraph()
+        for r in hits:
+            g.add_edge(r.qID, r.cID)
+        cliques = g.find_cliques(gamma=0.8, maxitr=5)
+    """
+
+    cdef dict node_ids
+    cdef public list names
+    cdef list src
+    cdef list dst
+    cdef int n
+    cdef int * indptr
+    cdef int * indices
+
+    def __cinit__(self):
+        self.indptr = NULL
+        self.indices = NULL
+
+    def __init__(self):
+        self.node_ids = {}
+        self.names = []
+        self.src = []
+        self.dst = []
+        self.n = -1
+
+    def __dealloc__(self):
+        free(self.indptr)
+        free(self.indices)
+
+    cdef int _node_id(self, name):
+        """Return id of a node, add it to graph if it is new."""
+        i = self.node_ids.get(name)
+        if i is None:
+            i = len(self.names)
+            self.node_ids[name] = i
+            self.names.append(name)
+        return i
+
+    def add_edge(self, a, b):
+        """Add an edge between node a and node b, ignore self loops."""
+        cdef int i = self._node_id(a), j = self._node_id(b)
+        if i != j:
+            self.src.append(i)
+            self.dst.append(j)
+            self.n = -1
+
+    def nodes(self):
+        """Return nodes in the order they were added."""
+        return list(self.names)
+
+    def number_of_nodes(self):
+        """Return number of nodes."""
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.node_ids
+
+    cdef int _build(self) except -1:
+        """Build CSR adjacency, of which neighbors of each node are
+        sorted and unique, from edges added so far."""
+        cdef int n = len(self.names), m = len(self.src), i, j, k, e, a, b
+        cdef int * deg
+        if self.n == n:
+            return 0
+        free(self.indptr)
+        free(self.indices)
+        self.indptr = <int *>calloc(n + 1, sizeof(int))
+        self.indices = <int *>malloc(max(1, 2 * m) * sizeof(int))
+        deg = <int *>calloc(n + 1, sizeof(int))
+        if self.indptr == NULL or self.indices == NULL or deg == NULL:
+            free(deg)
+            raise MemoryError()
+        try:
+            for e in range(m):
+                deg[<int>self.src[e]] += 1
+                deg[<int>self.dst[e]] += 1
+            for i in range(n):
+                self.indptr[i + 1] = self.indptr[i] + deg[i]
+                deg[i] = self.indptr[i]
+            for e in range(m):
+                a, b = self.src[e], self.dst[e]
+                self.indices[deg[a]] = b
+                deg[a] += 1
+                self.indices[deg[b]] = a
+                deg[b] += 1
+            # sort neighbors, remove duplicated edges and compact in place
+            k = 0
+            for i in range(n):
+                a, b = self.indptr[i], self.indptr[i + 1]
+                qsort(self.indices + a, b - a, sizeof(int), _cmp_int)
+                self.indptr[i] = k
+                for j in range(a, b):
+                    if j == a or self.indices[j] != self.indices[j - 1]:
+                        self.indices[k] = self.indices[j]
+                        k += 1
+            self.indptr[n] = k
+        finally:
+            free(deg)
+        self.n = n
+        return 0
+
+    def neighbors(self, name):
+        """Return neighbors of a node."""
+        self._build()
+        cdef int i = self.node_ids[name], j
+        return [self.names[self.indices[j]]
+                for j in range(self.indptr[i], self.indptr[i + 1])]
+
+    def degree(self, name):
+        """Return degree of a node."""
+        self._build()
+        cdef int i = self.node_ids[name]
+        return self.indptr[i + 1] - self.indptr[i]
+
+    def find_cliques(self, double gamma=0.8, int maxitr=5, seed=0):
+        """
+        Find mutually exclusive quasi-gamma-cliques, return a list of
+        cliques, each of which is a list of nodes, in the order they are
+        found. For each node, from the largest to the smallest degree
+        (ties broken by the order nodes were added), which is not yet in
+        any clique, grasp a quasi-gamma-clique from the subgraph of the
+        node and its neighbors which are not in any clique in maxitr
+        iterations. Nodes not in any clique are not returned.
+        """
+        self._build()
+        cdef int n = self.n, node, a, j, k, m, len_clique
+        cdef Rng rng
+        cdef SubGraph g
+        cdef char * used = <char *>calloc(max(1, n), sizeof(char))
+        cdef int * local_ids = <int *>malloc(max(1, n) * sizeof(int))
+        cdef int * sub = <int *>malloc(max(1, n) * sizeof(int))
+        cdef int * Q = <int *>malloc(max(1, n + 1) * sizeof(int))
+        cdef int * bestQ = <int *>malloc(max(1, n + 1) * sizeof(int))
+        g.bits = NULL
+        g.buf1 = <int *>malloc(max(1, n + 1) * sizeof(int))
+        g.buf2 = <int *>malloc(max(1, n + 1) * sizeof(int))
+        g.buf3 = <int *>malloc(max(1, n + 1) * sizeof(int))
+        g.mask1 = <word_t *>malloc(max(1, (n + 63) // 64) * sizeof(word_t))
+        g.mask2 = <word_t *>malloc(max(1, (n + 63) // 64) * sizeof(word_t))
+        rng.state = <word_t>seed
+        cliques = []
+        try:
+            if (used == NULL or local_ids == NULL or sub == NULL or Q == NULL or
+                    bestQ == NULL or g.buf1 == NULL or g.buf2 == NULL or
+                    g.buf3 == NULL or g.mask1 == NULL or g.mask2 == NULL):
+                raise MemoryError()
+            for j in range(n):
+                local_ids[j] = -1
+
+            degrees = [self.indptr[j + 1] - self.indptr[j] for j in range(n)]
+            order = sorted(range(n), key=lambda i: (-degrees[i], i))
+            for node in order:
+                if used[node]:
+                    continue
+                # subgraph of node and its neighbors which are not used yet
+                m = 1
+                sub[0] = node
+                for j in range(self.indptr[node], self.indptr[node + 1]):
+                    if not used[self.indices[j]]:
+                        sub[m] = self.indices[j]
+                        m += 1
+                if m <= 1:
+                    continue
+                for a in range(m):
+                    local_ids[sub[a]] = a
+                g.m = m
+                g.nw = (m + 63) // 64
+                g.bits = <word_t *>calloc(<size_t>m * g.nw, sizeof(word_t))
+                if g.bits == NULL:
+                    raise MemoryError()
+                for a in range(m):
+                    for j in range(self.indptr[sub[a]], self.indptr[sub[a] + 1]):
+                        k = local_ids[self.indices[j]]
+                        if k >= 0:
+                            _set(_row(&g, a), k)
+                with nogil:
+                    len_clique = _grasp(&g, gamma, maxitr, 0, Q, bestQ, &rng)
+                free(g.bits)
+                g.bits = NULL
+                for a in range(m):
+                    local_ids[sub[a]] = -1
+                if len_clique > 0:
+                    clique = []
+                    for a in range(len_clique):
+                        used[sub[bestQ[a]]] = 1
+                        clique.append(self.names[sub[bestQ[a]]])
+                    cliques.append(clique)
+        finally:
+            free(g.bits)
+            free(g.buf1)
+            free(g.buf2)
+            free(g.buf3)
+            free(g.mask1)
+            free(g.mask2)
+            free(used)
+            free(local_ids)
+            free(sub)
+            free(Q)
+            free(bestQ)
+        return cliques
@@ -0,0 +1,205 @@
+"""Compiled kernels of pbtranscript.ice.IceUtils."""
+# distutils: language = c++
+import numpy as np
+from libc.stdlib cimport malloc, free
+from libc.math cimport log
+
+# modes of computing alignment log probabilities in eval_hit
+cdef enum:
+    NO_PROB, PROB_ERR, PROB_QVS, PROB_RATES
+
+
+def eval_alignment(bytes q_aln, bytes aln_str, bytes s_aln):
+    """
+    Go through an alignment, e.g., alnStr |||**||||**|||*|*|, to determine
+    the sequence of 'M' (matches), 'S' (sub), 'I', 'D'. Every non-match
+    is a penalty.
+
+    q_aln, aln_str, s_aln --- aligned query, alignment string and aligned
+        subject, e.g., qAln, alnStr and sAln of a BLASRRecord
+
+    Returns: cigar string, binary ECE array (np.uint8, 1 is a penalty)
+    """
+    cdef int n = len(aln_str)
+    if len(q_aln) != n or len(s_aln) != n:
+        raise ValueError("qAln, alnStr and sAln must have the same length.")
+
+    cdef const char *qa = q_aln
+    cdef const char *aa = aln_str
+    cdef const char *sa = s_aln
+
+    cigar = bytearray(n)
+    cdef char *cg = cigar
+    ece = np.zeros(n, dtype=np.uint8)
+    cdef unsigned char[:] ec = ece
+
+    cdef int offset
+    for offset in range(n):
+        if aa[offset] == '|':  # match
+            cg[offset] = 'M'
+            continue
+        elif qa[offset] == '-':  # deletion
+            cg[offset] = 'D'
+        elif sa[offset] == '-':  # insertion
+            cg[offset] = 'I'
+        else:  # substitution
+            cg[offset] = 'S'
+        ec[offset] = 1
+
+    return bytes(cigar), ece
+
+
+cdef inline bint ece_step(int *prefix, int j, int min_len, int *min_r):
+    """
+    Given prefix[0..j], prefix sums of the -penalty/+1 vector of an ECE
+    array, return True if there exists i <= j - min_len such that
+    prefix[i] <= prefix[j], i.e., a window of at least min_len columns
+    ending at j in which non-matches dominate. min_r keeps the minimum
+    of prefix[0..j-min_len] seen so far.
+    """
+    if j < min_len:
+        return False
+    if prefix[j - min_len] < min_r[0]:
+        min_r[0] = prefix[j - min_len]
+    return prefix[j] >= min_r[0]
+
+
+def large_nonmatch(const unsigned char[:] ece_arr, int penalty, int min_len):
+    """
+    Return True if a binary ECE array (1 is a penalty) has a region of
+    at least min_len bases in which penalties are not outweighed by
+    matches, each penalty counts +1 and each match counts -penalty.
+
+    Equivalent to findECE([0] + list(ece_arr * (penalty + 1) - penalty),
+    ..., min_len, give_up_as_soon_one_found=True), but scans ece_arr only
+    once and stops as soon as such a region is found.
+    """
+    cdef int n = ece_arr.shape[0]
+    cdef int j, min_r = 0
+    cdef bint found = min_len <= 0
+    cdef int *prefix = <int *>malloc((n + 1) * sizeof(int))
+    prefix[0] = 0
+    for j in range(1, n + 1):
+        if found:
+            break
+        prefix[j] = prefix[j - 1] + (1 if ece_arr[j - 1] else -penalty)
+        found = ece_step(prefix, j, min_len, &min_r)
+    free(prefix)
+    return found
+
+
+def eval_hit(bytes q_aln, bytes aln_str, bytes s_aln, int penalty,
+             int min_len, int q_start=0, int q_end=0,
+             prob_err=None, prob_qvs=None, rates=None):
+    """
+    Evaluate a hit in a single pass over its alignment, fusing
+    eval_alignment, large_nonmatch and calc_prob_from_aln of a
+    probability model, without building a cigar string or an ECE array.
+
+    As eval_blasr_alignment does, every non-match is a penalty.
+
+    q_aln, aln_str, s_aln --- aligned query, alignment string and aligned
+        subject, e.g., qAln, alnStr and sAln of a BLASRRecord
+    penalty, min_len --- ece_penalty and ece_min_len
+    q_start, q_end --- start and end of the alignment on query
+    At most one of the following may be given to compute the log
+        probability of the alignment:
+    prob_err --- a float array of error probabilities of query,
+        same as ProbFromFastq.calc_prob_from_aln
+    prob_qvs --- (SubstitutionQV, InsertionQV, DeletionQV) float arrays of
+        probabilities of query, same as ProbFromQV.calc_prob_from_aln
+    rates --- (r_mis, r_ins, r_del) fixed error rates, same as
+        ProbFromModel.calc_prob_from_aln
+
+    Returns None if the alignment has large non-matches, otherwise the
+    log probability of the alignment (0. if no probabilities are given).
+    """
+    cdef int n = len(aln_str)
+    if len(q_aln) != n or len(s_aln) != n:
+        raise ValueError("qAln, alnStr and sAln must have the same length.")
+    if min_len <= 0:
+        return None
+
+    cdef const char *qa = q_aln
+    cdef const char *aa = aln_str
+    cdef const char *sa = s_aln
+
+    cdef int mode = NO_PROB
+    cdef const float[:] p_sub, p_ins, p_del
+    cdef double log_mat = 0, log_sub = 0, log_ins = 0, log_del = 0
+    if prob_err is not None:
+        mode = PROB_ERR
+        p_sub = prob_err
+        p_ins = p_sub
+        p_del = p_sub
+    elif prob_qvs is not None:
+        mode = PROB_QVS
+        p_sub, p_ins, p_del = prob_qvs
+    elif rates is not None:
+        mode = PROB_RATES
+        r_mis, r_ins, r_del = rates
+        log_mat = log(1 - r_mis - r_ins - r_del)
+        log_sub = log(r_mis)
+        log_ins = log(r_ins)
+        log_del = log(r_del)
+
+    cdef double one_three = log(1 / 3.), score = 0., tmp
+    cdef int j, min_r = 0, cur_q_pos = q_start
+    cdef char x
+    cdef bint scoring = mode != NO_PROB, found = False
+    cdef int *prefix = <int *>malloc((n + 1) * sizeof(int))
+    prefix[0] = 0
+    try:
+        for j in range(1, n + 1):
+            if aa[j - 1] == '|':
+                x = 'M'
+            elif qa[j - 1] == '-':
+                x = 'D'
+            elif sa[j - 1] == '-':
+                x = 'I'
+            else:
+                x = 'S'
+            prefix[j] = prefix[j - 1] + (-penalty if x == 'M' else 1)
+            if ece_step(prefix, j, min_len, &min_r):
+                found = True
+                break
+
+            if not scoring:
+                continue
+            if mode == PROB_RATES:
+                score += log_mat if x == 'M' else log_sub if x == 'S' else \
+                         log_ins if x == 'I' else log_del
+                continue
+            if mode == PROB_ERR and cur_q_pos >= p_sub.shape[0]:
+                # ToDo: this is a bug caused by daligner coordinates issues,
+                # same as calc_aln_log_prob2, stop scoring here
+                scoring = False
+                continue
+            if x == 'M':
+                if mode == PROB_ERR:
+                    tmp = 1 - p_sub[cur_q_pos]
+                else:
+                    tmp = 1 - p_sub[cur_q_pos] - p_ins[cur_q_pos] - \
+                          p_del[cur_q_pos]
+                # sanity check...sometimes this can have < 0 prob,
+                # so assign it a small prob like 0.001
+                if tmp <= 0:
+                    tmp = 0.001
+                score += log(tmp)
+                cur_q_pos += 1
+            elif x == 'S':
+                score += log(p_sub[cur_q_pos]) + one_three
+                cur_q_pos += 1
+            elif x == 'I':
+                score += log(p_ins[cur_q_pos]) + one_three
+                cur_q_pos += 1
+            else:  # x == 'D', don't advance qpos
+                score += log(p_del[cur_q_pos])
+    finally:
+        free(prefix)
+
+    if found:
+        return None
+    if scoring and mode != PROB_RATES:
+        assert cur_q_pos == q_end
+    return score
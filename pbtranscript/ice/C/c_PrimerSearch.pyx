@@ -0,0 +1,246 @@
+# cython: boundscheck=False, wraparound=False
+"""
+A native primer search engine, which is used by Classifier in place
+of phmmer to find primer hits in reads.
+
+For each (read, primer) pair, k-mers of the primer are looked up in
+the read to find seed diagonals; seeds on nearby diagonals are merged
+into a band, and a banded local alignment (Smith-Waterman-Gotoh) of
+the primer against the read is computed within each band.
+
+Scores are in bits, default scoring parameters approximate phmmer
+scores (--mxfile PBMATRIX.txt --popen 0.07 --pextend 0.07) of primer
+hits, so that thresholds such as min_score can be shared by the two
+engines.
+
+Primers are searched on the given strand only, as with phmmer,
+Classifier writes reverse complemented primers to primer files
+whenever both strands need to be searched.
+"""
+from libc.stdlib cimport malloc, free
+
+__all__ = ["PrimerSearcher"]
+
+cdef double NEG_INF = -1e30
+
+
+cdef inline int _base_code(char c):
+    """Return 0, 1, 2, 3 for A, C, G, T (case insensitive), or 4."""
+    if c == 'A' or c == 'a':
+        return 0
+    elif c == 'C' or c == 'c':
+        return 1
+    elif c == 'G' or c == 'g':
+        return 2
+    elif c == 'T' or c == 't':
+        return 3
+    return 4
+
+
+cdef list _kmer_codes(bytes seq, int k):
+    """Return codes of k-mers in seq, -1 for k-mers containing non-ACGT."""
+    cdef int n = len(seq), i, c, code = 0, valid = 0
+    cdef int mask = (1 << (2 * k)) - 1
+    cdef const char * s = seq
+    cdef list ret = []
+    for i in range(n):
+        c = _base_code(s[i])
+        if c == 4:
+            valid = 0
+            code = 0
+        else:
+            code = ((code << 2) | c) & mask
+            valid += 1
+        if i >= k - 1:
+            ret.append(code if valid >= k else -1)
+    return ret
+
+
+cdef class PrimerSearcher:
+
+    """
+    Search primers in sequences.
+
+    Example:
+        searcher = PrimerSearcher([('F0', 'AAGCAGTGG...'), ('R0', '...')])
+        for (primer_index, score, pStart, pEnd, sStart, sEnd) in \\
+                searcher.search(seq):
+            ...
+    where primer hits primer[pStart:pEnd] and seq[sStart:sEnd].
+    """
+
+    cdef public list names
+    cdef public list sequences
+    cdef public int k
+    cdef public int band
+    cdef public double match
+    cdef public double mismatch
+    cdef public double gap_open
+    cdef public double gap_extend
+    cdef public double min_report_score
+    cdef dict kmer_index
+
+    def __init__(self, primers, int k=6, int band=8, double match=1.1,
+                 double mismatch=-1.6, double gap_open=-3.8,
+                 double gap_extend=-1.6, double min_report_score=8.0):
+        """
+        primers --- a list of (primer name, primer sequence)
+        k --- k-mer size of seeds
+        band --- extend band of seed diagonals by band on both sides
+        match, mismatch --- scores of matching and mismatching bases in bits
+        gap_open, gap_extend --- scores of opening and extending a gap
+        min_report_score --- only report hits with score >= min_report_score
+        """
+        if k < 1 or k > 14:
+            raise ValueError("k-mer size must be within [1, 14].")
+        self.names = [str(name) for name, dummy_seq in primers]
+        self.sequences = [bytes(seq).upper() for dummy_name, seq in primers]
+        self.k = k
+        self.band = band
+        self.match = match
+        self.mismatch = mismatch
+        self.gap_open = gap_open
+        self.gap_extend = gap_extend
+        self.min_report_score = min_report_score
+        # k-mer code --> list of (primer index, position in primer)
+        self.kmer_index = {}
+        cdef int pi, pos, code
+        for pi, seq in enumerate(self.sequences):
+            for pos, code in enumerate(_kmer_codes(seq, k)):
+                if code >= 0:
+                    self.kmer_index.setdefault(code, []).append((pi, pos))
+
+    def search(self, seq):
+        """
+        Search all primers in seq, return a list of hits
+        (primer_index, score, pStart, pEnd, sStart, sEnd),
+        at most one hit per primer per band of seed diagonals.
+        """
+        cdef bytes bseq = bytes(seq).upper()
+        cdef int pos, code, pi, ppos
+        # primer index --> list of diagonals (position in seq - position in primer)
+        cdef dict diags = {}
+        for pos, code in enumerate(_kmer_codes(bseq, self.k)):
+            if code >= 0 and code in self.kmer_index:
+                for pi, ppos in self.kmer_index[code]:
+                    diags.setdefault(pi, []).append(pos - ppos)
+
+        ret = []
+        cdef int dlo, dhi, d
+        cdef list ds
+        for pi in sorted(diags.keys()):
+            ds = sorted(set(diags[pi]))
+            # merge seed diagonals within 2 * band into one band
+            dlo = dhi = ds[0]
+            for d in ds[1:]:
+                if d - dhi > 2 * self.band:
+                    self._append_hit(ret, pi, bseq, dlo, dhi)
+                    dlo = d
+                dhi = d
+            self._append_hit(ret, pi, bseq, dlo, dhi)
+        return ret
+
+    cdef _append_hit(self, list ret, int pi, bytes seq, int dlo, int dhi):
+        """Align primer pi against seq within diagonals [dlo-band, dhi+band],
+        append the best hit to ret if its score >= min_report_score."""
+        hit = self._align(self.sequences[pi], seq,
+                          dlo - self.band, dhi + self.band)
+        if hit is not None and hit[0] >= self.min_report_score:
+            ret.append((pi, ) + hit)
+
+    cdef _align(self, bytes primer, bytes seq, int dlo, int dhi):
+        """
+        Banded local alignment of primer against seq, only cells (i, j)
+        with dlo <= j - i <= dhi are computed.
+        Return (score, pStart, pEnd, sStart, sEnd) of the best local
+        alignment, or None.
+        """
+        cdef int m = len(primer), n = len(seq)
+        cdef const char * p = primer
+        cdef const char * s = seq
+        # seq[j0:j1] is the region covered by the band.
+        cdef int j0 = max(0, dlo), j1 = min(n, m + dhi)
+        if j1 <= j0 or m == 0:
+            return None
+        cdef int w = j1 - j0 + 1
+        cdef double *H = <double *>malloc(2 * w * sizeof(double))
+        cdef double *E = <double *>malloc(2 * w * sizeof(double))
+        cdef double *F = <double *>malloc(2 * w * sizeof(double))
+        # start positions (i, j) of alignments ending at H, E and F
+        cdef int *HI = <int *>malloc(2 * w * sizeof(int))
+        cdef int *HJ = <int *>malloc(2 * w * sizeof(int))
+        cdef int *EI = <int *>malloc(2 * w * sizeof(int))
+        cdef int *EJ = <int *>malloc(2 * w * sizeof(int))
+        cdef int *FI = <int *>malloc(2 * w * sizeof(int))
+        cdef int *FJ = <int *>malloc(2 * w * sizeof(int))
+
+        cdef int i, j, jj, cur, prev, lo, hi, c
+        cdef double h, sub, best = 0.0
+        cdef int best_i = 0, best_j = 0, best_si = 0, best_sj = 0
+        for jj in range(2 * w):
+            H[jj] = 0.0
+            E[jj] = NEG_INF
+            F[jj] = NEG_INF
+            HI[jj] = HJ[jj] = EI[jj] = EJ[jj] = FI[jj] = FJ[jj] = 0
+
+        # row i (1..m) is primer[i-1], column jj (1..w-1) is seq[j0+jj-1]
+        for i in range(1, m + 1):
+            cur, prev = (i % 2) * w, ((i - 1) % 2) * w
+            lo = max(1, i - 1 + dlo - j0 + 1)
+            hi = min(w - 1, i - 1 + dhi - j0 + 1)
+            # reset cells which are out of band
+            for jj in range(0, w):
+                if jj < lo or jj > hi:
+                    H[cur + jj] = 0.0
+                    E[cur + jj] = NEG_INF
+                    F[cur + jj] = NEG_INF
+            c = _base_code(p[i - 1])
+            for jj in range(lo, hi + 1):
+                j = j0 + jj - 1
+                # gap in primer
+                if H[cur + jj - 1] + self.gap_open >= E[cur + jj - 1] + self.gap_extend:
+                    E[cur + jj] = H[cur + jj - 1] + self.gap_open
+                    EI[cur + jj], EJ[cur + jj] = HI[cur + jj - 1], HJ[cur + jj - 1]
+                else:
+                    E[cur + jj] = E[cur + jj - 1] + self.gap_extend
+                    EI[cur + jj], EJ[cur + jj] = EI[cur + jj - 1], EJ[cur + jj - 1]
+                # gap in seq
+                if H[prev + jj] + self.gap_open >= F[prev + jj] + self.gap_extend:
+                    F[cur + jj] = H[prev + jj] + self.gap_open
+                    FI[cur + jj], FJ[cur + jj] = HI[prev + jj], HJ[prev + jj]
+                else:
+                    F[cur + jj] = F[prev + jj] + self.gap_extend
+                    FI[cur + jj], FJ[cur + jj] = FI[prev + jj], FJ[prev + jj]
+
+                sub = self.match if (c != 4 and c == _base_code(s[j])) \
+                    else self.mismatch
+                h = H[prev + jj - 1] + sub
+                if H[prev + jj - 1] <= 0.0:  # a new alignment starts here
+                    HI[cur + jj], HJ[cur + jj] = i - 1, j
+                else:
+                    HI[cur + jj], HJ[cur + jj] = HI[prev + jj - 1], HJ[prev + jj - 1]
+                if E[cur + jj] > h:
+                    h = E[cur + jj]
+                    HI[cur + jj], HJ[cur + jj] = EI[cur + jj], EJ[cur + jj]
+                if F[cur + jj] > h:
+                    h = F[cur + jj]
+                    HI[cur + jj], HJ[cur + jj] = FI[cur + jj], FJ[cur + jj]
+                if h <= 0.0:
+                    h = 0.0
+                H[cur + jj] = h
+                if h > best:
+                    best, best_i, best_j = h, i, j + 1
+                    best_si, best_sj = HI[cur + jj], HJ[cur + jj]
+
+        free(H)
+        free(E)
+        free(F)
+        free(HI)
+        free(HJ)
+        free(EI)
+        free(EJ)
+        free(FI)
+        free(FJ)
+        if best <= 0.0:
+            return None
+        return (round(best, 1), best_si, best_i, best_sj, best_j)
@@ -1,6 +1,8 @@
 import sys
+import numpy as np
 from pbcore.io import BasH5Reader
-from pbtranscript.io import BamCollection 
+from pbtranscript.io import BamCollection
+from pbtranscript.io.QVStore import qvs_to_probs
 from cpython cimport bool
 from libc.math cimport pow
 from libcpp.deque cimport deque
@@ -12,17 +14,19 @@ ctypedef cython.int INTT
 cdef inline double qv_to_prob(double qv):
     return pow(10, -qv / 10.)
 
-cpdef precache_helper(char * bas_file, list seqids, list QV_names, dict qv_dict):
+cpdef precache_helper(char * bas_file, list seqids, list QV_names, object qv_store):
+    """
+    Read QVs of seqids (which must be in the same bas file) and add
+    them, transformed to prob, to qv_store (a QVStore) in one batch.
+    """
     cdef bool is_CCS
     cdef int s
     cdef int e
     cdef char strand
-    cdef double qv
 
     cdef bool is_bam
 
     is_bam = False
-    # qv_dict = {} # seqid --> qv_name --> list of qv (transformed to prob)
     if (bas_file.endswith("h5")):
         bas = BasH5Reader(bas_file)
     elif bas_file.endswith("bam") or bas_file.endswith("xml"):
@@ -33,6 +37,10 @@ cpdef precache_helper(char * bas_file, list seqids, list QV_names, dict qv_dict)
 
     # print >> sys.stderr, "worker precaching {0} ids from {1}".
     #format(len(seqids), bas_file)
+    names, lengths = [], []
+    qvs_of = {}
+    for qv_name in QV_names:
+        qvs_of[qv_name] = []
     for seqid in seqids:  # must be in the same bas file
         seqid = seqid.split()[0]
         # in case there is extra information like fiveseen=1;threeseen=0;
@@ -50,13 +58,11 @@ cpdef precache_helper(char * bas_file, list seqids, list QV_names, dict qv_dict)
             s, e = e, s
             strand = '-'
 
-        qv_dict[seqid] = {}
+        if not is_bam:
+            zmw = bas[hn]
+        else:
+            zmw = bas["%s/%s" % (movie, hn)]
         for qv_name in QV_names:
-            zmw = None
-            if not is_bam:
-                zmw = bas[hn]
-            else:
-                zmw = bas["%s/%s" % (movie, hn)]
             if is_CCS:
                 if zmw.ccsRead is not None:
                     qvs = zmw.ccsRead.qv(qv_name)[s:e]
@@ -66,10 +72,16 @@ cpdef precache_helper(char * bas_file, list seqids, list QV_names, dict qv_dict)
                 qvs = zmw.read(s, e).qv(qv_name)
             if strand == '-':
                 qvs = qvs[::-1]
-            qv_dict[seqid][qv_name] = [qv_to_prob(qv) for qv in qvs]
-            del qvs
+            qvs_of[qv_name].append(qvs)
+        names.append(seqid)
+        lengths.append(len(qvs))
     del bas
 
+    if len(names) > 0:
+        for qv_name in QV_names:
+            qvs_of[qv_name] = qvs_to_probs(np.concatenate(qvs_of[qv_name]))
+        qv_store.extend(names, lengths, qvs_of)
+
 
 def fastq_precache_helper(seqid, qvs, qv_dict):
     """
@@ -136,3 +148,76 @@ cdef maxval_per_window_helper(list arr, int window_size, list result):
         result.append(arr[j])
 
     q.clear()
+
+
+def maxval_per_window_bulk(const float[:] src, float[:] dst,
+                           long long[:] offsets, long long[:] lengths,
+                           int window_size):
+    """
+    Apply maxval_per_window to every read segment [offset, offset+length)
+    of a flat QV buffer src and write results to the same segments of dst,
+    e.g., QVStore.track('DeletionQV') --> QVStore.track('DeletionQV_smoothed').
+    """
+    cdef Py_ssize_t i
+    for i in xrange(offsets.shape[0]):
+        maxval_per_window_segment(src[offsets[i]:offsets[i] + lengths[i]],
+                                  dst[offsets[i]:offsets[i] + lengths[i]],
+                                  window_size)
+
+
+cdef maxval_per_window_segment(const float[:] arr, float[:] result, int window_size):
+    """Same as maxval_per_window_helper, but reads from and writes to buffers.
+    Only the first len(arr) values are written."""
+    cdef deque[int] q
+    cdef int i, j, k
+    cdef float new_element
+    cdef int len_arr
+    cdef int w2
+
+    len_arr = arr.shape[0]
+    w2 = window_size / 2
+    k = 0
+
+    i = 0
+    for j in xrange(1, w2 + 1):
+        if arr[j] >= arr[i]:
+            i = j
+    q.push_back(i)
+    result[k] = arr[i]  # this is the max for 0-th element
+    k += 1
+
+    for i in xrange(-w2 + 1, len_arr - window_size + 1):
+        # now looking at range [i, i+window_size)
+        j = q.front()
+        if j < i:
+            q.pop_front()
+        new_element = arr[i + window_size - 1]
+        if q.empty():
+            q.push_back(i + window_size - 1)
+        elif new_element >= arr[j]:
+            q.clear()
+            q.push_back(i + window_size - 1)
+        else:
+            while not q.empty():
+                j = q.back()
+                q.pop_back()
+                if arr[j] > new_element:
+                    q.push_back(j)
+                    break
+            q.push_back(i + window_size - 1)
+        j = q.front()
+        if k < len_arr:
+            result[k] = arr[j]
+        k += 1
+
+    # finish the remainder
+    for i in xrange(len_arr - w2, len_arr):
+        j = q.front()
+        while j < i - w2:
+            q.pop_front()
+            j = q.front()
+        if k < len_arr:
+            result[k] = arr[j]
+        k += 1
+
+    q.clear()
@@ -15,10 +15,10 @@ IceAllPartials procedures:
 
 import os.path as op
 import logging
-import time
 from pbtranscript.PBTranscriptOptions import \
     add_sge_arguments, add_fofn_arguments, add_tmp_dir_argument
 from pbtranscript.Utils import realpath, mkdir, real_upath, ln
+from pbtranscript.JobScheduler import wait_for_files
 from pbtranscript.ice.IceFiles import IceFiles
 from pbtranscript.ice.IceUtils import combine_nfl_pickles
 from pbtranscript.ice.__init__ import ICE_PARTIAL_PY
@@ -161,6 +161,8 @@ class IceAllPartials(IceFiles):
                   "--done={d} ".format(d=real_upath(self.done_filenames[idx]))
             if self.ccs_fofn is not None:
                 cmd += "--ccs_fofn={f} ".format(f=real_upath(self.ccs_fofn))
+                if op.exists(self.qv_cache_fn):
+                    cmd += "--qv_cache={f} ".format(f=real_upath(self.qv_cache_fn))
             if self.tmp_dir is not None:
                 cmd += "--tmp_dir={t}".format(t=self.tmp_dir)
 
@@ -200,16 +202,9 @@ class IceAllPartials(IceFiles):
         self.add_log("Waiting for pickles {ps} to be created.".
                      format(ps=", ".join(pickle_filenames)),
                      level=logging.INFO)
-        stop = False
-        sleep_time = 10
-        while stop is not True:
-            stop = all(op.exists(p) for p in pickle_filenames) and \
-                all(op.exists(d) for d in done_filenames)
-            sleep_time = min(600, sleep_time * 2)
-            time.sleep(sleep_time)
-            self.add_log("Waiting for pickles to be created: {ps}".
-                         format(ps=", ".join([p for p in pickle_filenames
-                                              if op.exists(p)])))
+        # Check at growing intervals, from 0.1 second to 60 seconds.
+        wait_for_files(list(pickle_filenames) + list(done_filenames),
+                       initial_interval=0.1, max_interval=60)
 
     def combinePickles(self, pickle_filenames, out_pickle):
         """Combine all *.pickle files to one and dump to self.out_pickle."""
@@ -0,0 +1,188 @@
+"""
+Define checkpoints of IceIterative, which are compact snapshots of
+ICE states (uc, d, refs, newids, changes, iterNum, RNG state, ...)
+written after every step, so that an interrupted ICE job can resume
+from the latest checkpoint.
+
+A checkpoint is an uncompressed numpy .npz file, read ids are stored
+once as a newline-separated string, and clusters, members and
+probabilities are stored as integer/float arrays, which is much faster
+to load than a pickle of nested dicts.
+"""
+import os
+import os.path as op
+import re
+import json
+import logging
+import zipfile
+import numpy as np
+
+from pbtranscript.ice.MembershipMatrix import MembershipMatrix
+
+__all__ = ["CHECKPOINT_VERSION",
+           "checkpoint_filename",
+           "list_checkpoints",
+           "write_checkpoint",
+           "read_checkpoint",
+           "latest_checkpoint",
+           "remove_checkpoints"]
+
+CHECKPOINT_MAGIC = "ICE_CHECKPOINT"
+CHECKPOINT_VERSION = 1
+
+_CHECKPOINT_RE = re.compile(r"^ice_checkpoint\.(\d+)\.npz$")
+
+
+def checkpoint_filename(checkpoint_dir, index):
+    """Return $checkpoint_dir/ice_checkpoint.$index.npz"""
+    return op.join(checkpoint_dir, "ice_checkpoint.{i:06d}.npz".format(i=index))
+
+
+def list_checkpoints(checkpoint_dir):
+    """Return [(index, filename)] of checkpoints in checkpoint_dir, from
+    the oldest to the latest."""
+    if not op.isdir(checkpoint_dir):
+        return []
+    ret = []
+    for fn in os.listdir(checkpoint_dir):
+        m = _CHECKPOINT_RE.match(fn)
+        if m is not None:
+            ret.append((int(m.group(1)), op.join(checkpoint_dir, fn)))
+    return sorted(ret)
+
+
+def _str_to_arr(s):
+    """Encode a string as a uint8 array."""
+    return np.frombuffer(s, dtype=np.uint8)
+
+
+def _arr_to_strs(arr):
+    """Decode a uint8 array to a list of newline-separated strings."""
+    s = arr.tostring()
+    return s.split('\n') if len(s) > 0 else []
+
+
+def write_checkpoint(filename, header, uc, d, refs, newids, changes):
+    """
+    Write a checkpoint to filename atomically, i.e., it is first written
+    to a temporary file, which is then renamed to filename.
+
+    header --- a json serializable dict of scalars, e.g., iterNum,
+               fasta_filename, random state
+    uc --- dict, cid --> list of member read ids
+    d --- MembershipMatrix, read id --> cid --> log prob
+    refs --- dict, cid --> consensus fasta filename or None
+    newids --- set of read ids
+    changes --- set of cids
+    """
+    names, name_index = [], {}
+
+    def index_of(name):
+        """Return index of read id name in names."""
+        try:
+            return name_index[name]
+        except KeyError:
+            name_index[name] = len(names)
+            names.append(name)
+            return name_index[name]
+
+    uc_cids = sorted(uc.keys())
+    uc_indptr = np.zeros(len(uc_cids) + 1, dtype=np.int64)
+    uc_members = []
+    for i, cid in enumerate(uc_cids):
+        uc_members.extend(index_of(x) for x in uc[cid])
+        uc_indptr[i + 1] = len(uc_members)
+
+    d_qids, d_indptr, d_cids, d_probs = d.to_arrays()
+    d_rows = [index_of(x) for x in d_qids]
+    newids_arr = [index_of(x) for x in sorted(newids)]
+
+    ref_cids = sorted(refs.keys())
+    ref_fns = ["" if refs[cid] is None else refs[cid] for cid in ref_cids]
+
+    header = dict(header)
+    header.update({'magic': CHECKPOINT_MAGIC,
+                   'version': CHECKPOINT_VERSION,
+                   'num_reads': len(names),
+                   'num_clusters': len(uc_cids)})
+
+    tmp_filename = filename + ".{pid}.tmp".format(pid=os.getpid())
+    with open(tmp_filename, 'wb') as f:
+        np.savez(f,
+                 header=_str_to_arr(json.dumps(header)),
+                 names=_str_to_arr('\n'.join(names)),
+                 uc_cids=np.array(uc_cids, dtype=np.int64),
+                 uc_indptr=uc_indptr,
+                 uc_members=np.array(uc_members, dtype=np.int32),
+                 d_rows=np.array(d_rows, dtype=np.int32),
+                 d_indptr=d_indptr, d_cids=d_cids, d_probs=d_probs,
+                 newids=np.array(newids_arr, dtype=np.int32),
+                 ref_cids=np.array(ref_cids, dtype=np.int64),
+                 ref_fns=_str_to_arr('\n'.join(ref_fns)),
+                 changes=np.array(sorted(changes), dtype=np.int64))
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmp_filename, filename)
+
+
+def read_checkpoint(filename):
+    """
+    Read a checkpoint, return a dict with keys 'header', 'uc', 'd',
+    'refs', 'newids' and 'changes', see write_checkpoint.
+    Raise ValueError if filename is not a valid checkpoint.
+    """
+    try:
+        with np.load(filename) as a:
+            header = json.loads(a['header'].tostring())
+            if header.get('magic', None) != CHECKPOINT_MAGIC or \
+               header.get('version', None) != CHECKPOINT_VERSION:
+                raise ValueError("Unknown checkpoint format.")
+            names = _arr_to_strs(a['names'])
+            if len(names) != header['num_reads']:
+                raise ValueError("Expecting %d reads, got %d." %
+                                 (header['num_reads'], len(names)))
+
+            uc_cids, uc_indptr = a['uc_cids'], a['uc_indptr']
+            uc_members = a['uc_members']
+            uc = {}
+            for i, cid in enumerate(uc_cids.tolist()):
+                uc[cid] = [names[x] for x in
+                           uc_members[uc_indptr[i]:uc_indptr[i + 1]].tolist()]
+            if len(uc) != header['num_clusters']:
+                raise ValueError("Expecting %d clusters, got %d." %
+                                 (header['num_clusters'], len(uc)))
+
+            d = MembershipMatrix.from_arrays(
+                qids=[names[x] for x in a['d_rows'].tolist()],
+                indptr=a['d_indptr'], cids=a['d_cids'], probs=a['d_probs'])
+
+            ref_fns = _arr_to_strs(a['ref_fns'])
+            refs = dict((cid, fn if len(fn) > 0 else None) for cid, fn
+                        in zip(a['ref_cids'].tolist(), ref_fns))
+
+            newids = set(names[x] for x in a['newids'].tolist())
+            changes = set(a['changes'].tolist())
+    except (IOError, OSError, KeyError, IndexError, TypeError,
+            zipfile.BadZipfile) as e:
+        raise ValueError("Unable to read checkpoint %s: %r" % (filename, e))
+
+    return {'header': header, 'uc': uc, 'd': d, 'refs': refs,
+            'newids': newids, 'changes': changes}
+
+
+def latest_checkpoint(checkpoint_dir):
+    """Return (filename, checkpoint) of the latest valid checkpoint in
+    checkpoint_dir, or (None, None) if there is none."""
+    for dummy_index, fn in reversed(list_checkpoints(checkpoint_dir)):
+        try:
+            return fn, read_checkpoint(fn)
+        except ValueError as e:
+            logging.warning("Ignoring invalid checkpoint %s: %s", fn, str(e))
+    return None, None
+
+
+def remove_checkpoints(checkpoint_dir, keep=0):
+    """Remove all but the latest `keep` checkpoints in checkpoint_dir."""
+    checkpoints = list_checkpoints(checkpoint_dir)
+    for dummy_index, fn in checkpoints[:max(0, len(checkpoints) - keep)]:
+        os.remove(fn)
@@ -28,6 +28,7 @@ class IceFiles(object):
                           --- 1/  c10000, c10001, ..., c19999
                           ...
                           each c? folder contains data for a cluster id=c?
+                          --- gcon_cache/  cached consensus sequences
                      script/
                           --- 0/  gcon_job_?.sh, gcon jobs in the first iteration
                           --- 1/  gcon_job_?.sh, gcon jobs in the second iteration
@@ -107,12 +108,38 @@ class IceFiles(object):
         """Return $log_dir/quivered"""
         return op.join(self.log_dir, "quivered")
 
+    @property
+    def subread_store_fa(self):
+        """Return $root_dir/quivered/subreads_by_cluster.fasta, trimmed raw
+        subreads of all clusters stored cluster by cluster (see
+        SubreadStore), when input subreads are in FASTA."""
+        return op.join(self.quivered_dir, "subreads_by_cluster.fasta")
+
+    @property
+    def subread_store_bam(self):
+        """Return $root_dir/quivered/subreads_by_cluster.bam, like
+        subread_store_fa, when input subreads are in BAM."""
+        return op.join(self.quivered_dir, "subreads_by_cluster.bam")
+
     @property
     def nfl_all_pickle_fn(self):
         """Return $root_dir/$nfl_dir/nfl.all.partial_uc.pickle,
         this pickle file has all the paitial uc."""
         return op.join(self.nfl_dir, "nfl.all.partial_uc.pickle")
 
+    @property
+    def checkpoint_dir(self):
+        """Return $root_dir/output/checkpoints, where IceIterative writes
+        checkpoints to resume from."""
+        return op.join(self.out_dir, "checkpoints")
+
+    @property
+    def qv_cache_fn(self):
+        """Return $root_dir/output/input.qvcache, QV cache of all flnc
+        and nfl reads, built once and memory mapped by ICE, ice_partial
+        and polish steps."""
+        return op.join(self.out_dir, "input.qvcache")
+
     @property
     def final_consensus_fa(self):
         """Return final consensus Fasta file."""
@@ -194,6 +221,17 @@ class IceFiles(object):
         """
         return op.join(self.cluster_dir(cid), "g_consensus_ref.fasta")
 
+    @property
+    def gcon_cache_dir(self):
+        """Return $tmp_dir/gcon_cache, which caches consensus sequences
+        of clusters, keyed by hashes of their gcon input reads."""
+        return op.join(self.tmp_dir, "gcon_cache")
+
+    def gcon_cache_fa(self, key):
+        """Return $gcon_cache_dir/$key[:2]/$key.fasta, which is the
+        cached consensus sequence of gcon input reads of hash key."""
+        return op.join(self.gcon_cache_dir, key[:2], key + ".fasta")
+
     def first_seq_fa_of_cluster(self, cid):
         """Return $cluster_dir(cid)/in.fasta.1stseq.fasta"""
         return op.join(self.cluster_dir(cid), "in.fasta.1stseq.fasta")
@@ -2,17 +2,19 @@
 Class ICEIterative for iterative clustering and error correction.
 """
 import cPickle
+import hashlib
 import json
 import math
 import os
 import os.path as op
+import re
 import shutil
 import logging
 import random
 from datetime import datetime
 from multiprocessing.pool import ThreadPool
 
-from pbtranscript.Utils import mknewdir, real_upath
+from pbtranscript.Utils import mkdir, mknewdir, real_upath
 from pbtranscript.io import FastaRandomReader, \
     BLASRM5Reader, LA4IceReader, DazzIDHandler
 from pbtranscript.io.ContigSetReaderWrapper import ContigSetReaderWrapper
@@ -20,11 +22,15 @@ from pbtranscript.ice.IceFiles import IceFiles
 from pbtranscript.ice_daligner import DalignerRunner
 from pbtranscript.ice_pbdagcon import runConsensus
 from pbtranscript.ice.IceInit import IceInit
+from pbtranscript.ice.MembershipMatrix import MembershipMatrix
+from pbtranscript.ice.IceCheckpoint import checkpoint_filename, \
+    list_checkpoints, write_checkpoint, remove_checkpoints
 from pbtranscript.ice.IceUtils import sanity_check_gcon, \
-    sanity_check_sge, possible_merge, blasr_against_ref, \
-    get_the_only_fasta_record, cid_with_annotation, \
-    daligner_against_ref, ice_fa2fq, fafn2fqfn, \
-    set_probqv_from_ccs, set_probqv_from_fq, set_probqv_from_model
+    sanity_check_sge, possible_merge, possible_merge_prefilter, \
+    blasr_against_ref, get_the_only_fasta_record, cid_with_annotation, \
+    daligner_against_refs, ice_fa2fq, fafn2fqfn, \
+    set_probqv_from_ccs, set_probqv_from_fq, set_probqv_from_model, \
+    set_probqv_from_qv_cache
 
 
 random.seed(0)
@@ -43,8 +49,8 @@ class IceIterative(IceFiles):
                  ice_opts, sge_opts,
                  uc=None, probQV=None,
                  refs=None, d=None, is_FL=True, qv_prob_threshold=.03,
-                 fastq_filename=None, output_pickle_file=None,
-                 tmp_dir=None):
+                 fastq_filename=None, qv_cache_filename=None,
+                 output_pickle_file=None, tmp_dir=None):
         """
         fasta_filename --- the current fasta filename containing
             all the "active" reads (reads that are allowed to move
@@ -55,6 +61,10 @@ class IceIterative(IceFiles):
         fastq_filename --- should be the FASTQ version of fasta_filename,
             if is None, it will be converted using ice_fa2fq when needed
 
+        qv_cache_filename --- a QV cache file of all reads built by
+            ice_fa2qvcache. If not None, QVs of reads are memory mapped
+            from it, and no FASTQ files are written.
+
         fasta_filenames_to_add --- fasta files to be added
             to clusters. In the first round, the union of
             fasta_filename and fasta_filenames to add is
@@ -110,8 +120,8 @@ class IceIterative(IceFiles):
             self.newids.update(set([r.id for r in cs]))
         self.seq_dict = FastaRandomReader(all_fasta_filename)
 
-        # probability dict, seqid --> cluster index i --> P(seq|C_i)
-        self.d = {}
+        # probability matrix, seqid --> cluster index i --> P(seq|C_i)
+        self.d = MembershipMatrix()
 
         self.refs = {}  # cluster index --> gcon output consensus filename
         self.uc = {}  # cluster index --> list of member seqids
@@ -157,13 +167,16 @@ class IceIterative(IceFiles):
         # If True, use multi-Qvs from ccs.h5 files.
         self.use_finer_qv = ice_opts.use_finer_qv
 
-        # unless fastq_filename is already given
+        self.qv_cache_filename = qv_cache_filename
+
+        # unless fastq_filename or qv_cache_filename is already given
         # converting input fasta + ccs_fofn --> fastq
         # so instead of using .ccs.h5 we can use just one QV from FASTQ
-        if fastq_filename is not None:
-            self.fastq_filename = fastq_filename
-        else:
-            if self.use_finer_qv: # use multi-QVs from ccs.h5
+        self.fastq_filename = fastq_filename
+        if fastq_filename is None:
+            if qv_cache_filename is not None:
+                pass # read QVs from the QV cache
+            elif self.use_finer_qv: # use multi-QVs from ccs.h5
                 pass # no need to convert FASTA to FASTQ
             elif ccs_fofn is None:
                 pass # get prob QVs from a fixed model
@@ -179,7 +192,13 @@ class IceIterative(IceFiles):
                          level=logging.INFO)
             self.probQV = probQV
         else:
-            if self.use_finer_qv:
+            if self.qv_cache_filename is not None:
+                self.probQV, msg = set_probqv_from_qv_cache(
+                    qv_cache_filename=self.qv_cache_filename,
+                    fasta_filename=self.fasta_filename,
+                    use_finer_qv=self.use_finer_qv,
+                    ccs_fofn=ccs_fofn)
+            elif self.use_finer_qv:
                 self.probQV, msg = set_probqv_from_ccs(
                     ccs_fofn=ccs_fofn,
                     fasta_filename=self.fasta_filename)
@@ -219,11 +238,18 @@ class IceIterative(IceFiles):
         else:
             self.add_log("Loading probabilities from a prob dict directly.",
                          level=logging.INFO)
-            self.d = d
+            self.d = d if isinstance(d, MembershipMatrix) else \
+                MembershipMatrix.from_dict(d)
 
         self.removed_qids = set()
         self.global_count = 0
 
+        # The last step (e.g., 'run_til_end', 'add_new_batch') before which
+        # this object is restored from a checkpoint, None if not restored.
+        self.stage = None
+        # Number of the latest checkpoints to keep.
+        self.num_checkpoints_to_keep = 2
+
     @property
     def tmpConsensusFa(self):
         """Return tmp consensus Fasta file. e.g.,
@@ -296,7 +322,7 @@ class IceIterative(IceFiles):
         """
         for dummy_cid, v in self.uc.iteritems():
             for qid in v:
-                self.d[qid] = {}
+                self.d.reset_read(qid)
 
     def sanity_check_uc_refs(self):
         """
@@ -335,6 +361,7 @@ class IceIterative(IceFiles):
             sge_opts=a['sge_opts'],
             uc=a['uc'],
             probQV=probQV,
+            qv_cache_filename=a.get('qv_cache_filename', None),
             refs=a['refs'],
             d=a['d'],
             qv_prob_threshold=a['qv_prob_threshold'])
@@ -392,9 +419,10 @@ class IceIterative(IceFiles):
         """Write an instance of IceIterative to a pickle file."""
         with open(pickle_filename, 'w') as f:
             d = {'uc': self.uc,
-                 'd': self.d,
+                 'd': self.d.to_dict(),
                  'refs': self.refs,
                  'ccs_fofn': self.ccs_fofn,
+                 'qv_cache_filename': self.qv_cache_filename,
                  'fasta_filename': self.fasta_filename,
                  'fasta_filenames_to_add': self.fasta_filenames_to_add,
                  'all_fasta_filename': self.all_fasta_filename,
@@ -409,6 +437,87 @@ class IceIterative(IceFiles):
                           'sge_opts': self.sge_opts})
                 cPickle.dump(d, f)
 
+    def checkpoint(self, stage):
+        """
+        Write a checkpoint of the current state after step stage,
+        so that ICE can resume from it, keep the latest
+        num_checkpoints_to_keep checkpoints.
+        """
+        time0 = datetime.now()
+        mkdir(self.checkpoint_dir)
+        checkpoints = list_checkpoints(self.checkpoint_dir)
+        index = checkpoints[-1][0] + 1 if len(checkpoints) > 0 else 0
+        fn = checkpoint_filename(self.checkpoint_dir, index)
+
+        version, internal_state, gauss_next = random.getstate()
+        header = {'stage': stage,
+                  'iterNum': self.iterNum,
+                  'global_count': self.global_count,
+                  'random_prob': self.random_prob,
+                  'random_state': [version, list(internal_state), gauss_next],
+                  'fasta_filename': self.fasta_filename,
+                  'fasta_filenames_to_add': self.fasta_filenames_to_add,
+                  'all_fasta_filename': self.all_fasta_filename,
+                  'ccs_fofn': self.ccs_fofn,
+                  'qv_cache_filename': self.qv_cache_filename,
+                  'qv_prob_threshold': self.qv_prob_threshold,
+                  'root_dir': self.root_dir}
+        write_checkpoint(filename=fn, header=header, uc=self.uc, d=self.d,
+                         refs=self.refs, newids=self.newids,
+                         changes=self.changes)
+        remove_checkpoints(self.checkpoint_dir,
+                           keep=self.num_checkpoints_to_keep)
+        self.add_log("Writing checkpoint {f} after {s} took {t}.".format(
+            f=fn, s=stage, t=datetime.now() - time0), level=logging.INFO)
+
+    @staticmethod
+    def from_checkpoint(checkpoint, ice_opts, sge_opts, probQV=None,
+                        output_pickle_file=None, tmp_dir=None):
+        """
+        Restore an instance of IceIterative from a checkpoint returned by
+        IceCheckpoint.read_checkpoint. If probQV is None, probabilities
+        and QVs of reads in the checkpoint's fasta_filename are loaded.
+        Consensus of clusters whose reference files are missing is
+        recomputed.
+        """
+        h = checkpoint['header']
+        _str = lambda x: None if x is None else str(x)
+        obj = IceIterative(
+            fasta_filename=_str(h['fasta_filename']),
+            fasta_filenames_to_add=[str(fn) for fn in h['fasta_filenames_to_add']],
+            all_fasta_filename=_str(h['all_fasta_filename']),
+            ccs_fofn=_str(h['ccs_fofn']),
+            root_dir=_str(h['root_dir']),
+            ice_opts=ice_opts,
+            sge_opts=sge_opts,
+            uc=checkpoint['uc'],
+            probQV=probQV,
+            qv_cache_filename=_str(h['qv_cache_filename']),
+            refs=checkpoint['refs'],
+            d=checkpoint['d'],
+            qv_prob_threshold=h['qv_prob_threshold'],
+            output_pickle_file=output_pickle_file,
+            tmp_dir=tmp_dir)
+        obj.newids = checkpoint['newids']
+        obj.changes = checkpoint['changes']
+        obj.iterNum = h['iterNum']
+        obj.global_count = h['global_count']
+        obj.random_prob = h['random_prob']
+        obj.stage = str(h['stage'])
+
+        missing = [cid for cid in obj.uc if obj.refs.get(cid, None) is None or
+                   not op.exists(obj.refs[cid])]
+        if len(missing) > 0:
+            obj.add_log("Re-running gcon for {n} clusters without references.".
+                        format(n=len(missing)), level=logging.INFO)
+            obj.run_gcon_parallel(missing)
+
+        version, internal_state, gauss_next = h['random_state']
+        random.setstate((version, tuple(internal_state), gauss_next))
+        obj.add_log("Restored from a checkpoint after {s}.".format(s=obj.stage),
+                    level=logging.INFO)
+        return obj
+
     def make_new_cluster(self):
         """Add a new cluster to self.uc."""
         best_i = max(self.uc.keys()) + 1
@@ -435,9 +544,7 @@ class IceIterative(IceFiles):
         """
         self.add_log("Deleting cluster %s" % from_i)
         del self.uc[from_i]
-        for k in self.d:
-            if from_i in self.d[k]:
-                del self.d[k][from_i]
+        self.d.delete_cluster(from_i)
         del self.refs[from_i]
 
         dirname = self.cluster_dir(from_i)
@@ -453,13 +560,11 @@ class IceIterative(IceFiles):
         for cid, members in self.uc.iteritems():
             if len(members) <= 2:  # match singleton criterion here
                 for x in members:
-                    if len(self.d[x]) > 1:
+                    if self.d.num_clusters(x) > 1:
                         return False
             else:
                 for x in members:
-                    if cid not in self.d[x]:
-                        return False
-                    if self.d[x][cid] != max(self.d[x].itervalues()):
+                    if not self.d.is_best(x, cid):
                         return False
         return True
 
@@ -520,7 +625,21 @@ class IceIterative(IceFiles):
         if self.sge_opts.use_sge:
             mknewdir(op.join(self.log_dir, str(self.iterNum)))
 
-        effective_cids = [cid for cid in cids if len(self.uc[cid]) > 2]
+        # gcon input of a cluster is a deterministic function of its members,
+        # skip clusters whose consensus has been cached.
+        cache_keys = {}  # cid --> hash of gcon input reads
+        cached_cids = set()
+        for cid in cids:
+            if len(self.uc[cid]) > 2:
+                cache_keys[cid] = self.gcon_cache_key(self.gcon_in_seqids(cid))
+                if op.exists(self.gcon_cache_fa(cache_keys[cid])):
+                    cached_cids.add(cid)
+        if len(cached_cids) > 0:
+            self.add_log("Reusing cached consensus of {n} clusters.".
+                         format(n=len(cached_cids)), level=logging.INFO)
+
+        effective_cids = [cid for cid in cids if len(self.uc[cid]) > 2 and
+                          cid not in cached_cids]
         count_jobs = len(effective_cids)
         chunk_size = count_jobs / self.num_jobs + (count_jobs % self.num_jobs > 0)
 
@@ -544,7 +663,8 @@ class IceIterative(IceFiles):
             os.makedirs(dirname)
             in_fa_filename = self.write_in_fasta(cid)
 
-            if len(self.uc[cid]) <= 2:  # don't even bother running gcon
+            if len(self.uc[cid]) <= 2 or cid in cached_cids:
+                # don't even bother running gcon
                 # for now do nothing and let the else statement below
                 # take care of it
                 pass
@@ -560,7 +680,7 @@ class IceIterative(IceFiles):
 
                 cmd = "{script} ".format(script=self.gcon_py) + argstr
                 job_sh_dict[job_i].write(cmd)
-                jobs.append(argstr)
+                jobs.append((len(self.uc[cid]), argstr))
                 effective_i += 1
                 if effective_i % chunk_size == 0:
                     self.add_log("Writing script to %s" % (job_sh_dict[job_i].name))
@@ -607,6 +727,9 @@ class IceIterative(IceFiles):
                 for job_i, f in job_sh_dict.iteritems():
                     f.close()
 
+                # Run jobs of large clusters first, so that small clusters
+                # fill in idle threads at the end.
+                jobs = [argstr for dummy_n, argstr in sorted(jobs, reverse=True)]
                 msg = "Adding {n} ice_pbdagcon jobs to thread pool.".\
                     format(n=len(jobs))
                 self.add_log(msg, level=logging.INFO)
@@ -647,7 +770,7 @@ class IceIterative(IceFiles):
         #msg = "Choosing ref files for {n} clusters.".format(n=len(cids))
         #self.add_log(msg, level=logging.INFO)
         for cid in cids:
-            self.refs[cid] = self.choose_ref_file(cid)
+            self.refs[cid] = self.choose_ref_file(cid, cache_key=cache_keys.get(cid))
             #msg = "Choosing ref file for {cid} = {f}".format(
             #    cid=cid, f=self.refs[cid])
             #self.add_log(msg)
@@ -659,20 +782,68 @@ class IceIterative(IceFiles):
 
         self.iterNum += 1
 
-    def choose_ref_file(self, cid):
+    def gcon_cache_key(self, seqids):
+        """Return hash of ids and sequences of gcon input reads seqids and
+        gcon options, which is used as key of the consensus cache."""
+        h = hashlib.sha1("maxScore={s}\n".format(s=self.ice_opts.maxScore))
+        for seqid in sorted(seqids):
+            h.update(">{0}\n{1}\n".format(seqid, self.seq_dict[seqid].sequence))
+        return h.hexdigest()
+
+    def cache_consensus(self, cache_key, filename):
+        """Copy consensus filename to the consensus cache."""
+        cache_fa = self.gcon_cache_fa(cache_key)
+        if not op.exists(op.dirname(cache_fa)):
+            try:
+                os.makedirs(op.dirname(cache_fa))
+            except OSError:  # created by another process meanwhile
+                pass
+        tmp_fa = cache_fa + ".{pid}.tmp".format(pid=os.getpid())
+        shutil.copyfile(filename, tmp_fa)
+        os.rename(tmp_fa, cache_fa)  # never expose a partial file
+
+    def restore_cached_consensus(self, cid, cache_key):
         """
-        Return g_consensus.fasta if not empty (i.e. gcon succeeded)
+        Write cached consensus of cache_key to g_consensus.fasta of cluster
+        cid and return it. The consensus may have been cached by another
+        cluster, so its name, c{other cid} or c{other cid}_ref, is renamed
+        to c{cid} or c{cid}_ref.
+        """
+        cons = self.g_consensus_fa_of_cluster(cid)
+        mkdir(op.dirname(cons))
+        tmp_fa = cons + ".{pid}.tmp".format(pid=os.getpid())
+        with open(self.gcon_cache_fa(cache_key), 'r') as reader, \
+             open(tmp_fa, 'w') as writer:
+            for line in reader:
+                if line.startswith('>'):
+                    line = re.sub(r"^>c\d+", ">c{0}".format(cid), line)
+                writer.write(line)
+        os.rename(tmp_fa, cons)
+        return cons
+
+    def choose_ref_file(self, cid, cache_key=None):
+        """
+        Return cached consensus of gcon input reads, renamed after cid, if
+        cache_key is not None and the consensus has been cached
+        Otherwise return g_consensus.fasta if not empty (i.e. gcon succeeded)
         Otherwise return g_consensus_ref.fasta if not empty
         Finally, just randomly pick the 1st sequence as cluster representative
+        Consensus produced by gcon is cached if cache_key is not None.
         """
         cons = self.g_consensus_fa_of_cluster(cid)
         cons_ref = self.g_consensus_ref_fa_of_cluster(cid)
 
-        if op.exists(cons) and os.stat(cons).st_size > 0:
+        if cache_key is not None and op.exists(self.gcon_cache_fa(cache_key)):
+            return self.restore_cached_consensus(cid, cache_key)
+        elif op.exists(cons) and os.stat(cons).st_size > 0:
             # self.add_log("Picking up {f} as reference.".format(f=cons))
+            if cache_key is not None:
+                self.cache_consensus(cache_key, cons)
             return cons
         elif op.exists(cons_ref) and os.stat(cons_ref).st_size > 0:
             # self.add_log("Picking up {f} as reference.".format(f=cons_ref))
+            if cache_key is not None:
+                self.cache_consensus(cache_key, cons_ref)
             return cons_ref
         elif len(self.uc[cid]) > 3:
             self.add_log("Neither {0} nor {1} exists!.".format(cons, cons_ref))
@@ -691,16 +862,12 @@ class IceIterative(IceFiles):
 
     def clean_prob_for_cids(self, cids):
         """
-        Takes |qIDs| x |cIds| time....
+        Takes time linear to the number of reads aligned to cids.
 
         For every d[qID][cID] such that qID is in self.newids
         and cID is in cids, delete it
         """
-        for qid in self.newids:
-            # msg = "cleaning prob for {qid}".format(qid=qid)
-            # self.add_log(msg)
-            for cid in set(cids).intersection(self.d[qid]):
-                del self.d[qid][cid]
+        self.d.invalidate_clusters(cids, self.newids)
 
     def final_round_before_freeze(self, min_cluster_size):
         """
@@ -723,13 +890,11 @@ class IceIterative(IceFiles):
         for cid in cids:
             n = len(self.uc[cid])
             for qid in self.uc[cid]:
-                if (n < min_cluster_size or
-                        cid not in self.d[qid] or
-                        self.d[qid][cid] != max(self.d[qid].itervalues())):
+                if n < min_cluster_size or not self.d.is_best(qid, cid):
                     msg = "Final round: remove {0} (from {1}) because {2}".\
-                        format(qid, cid, self.d[qid])
+                        format(qid, cid, dict(self.d.items(qid)))
                     self.add_log(msg)
-                    del self.d[qid]
+                    self.d.delete_read(qid)
                     self.remove_from_cluster(qid, cid)
                     if (cid in self.uc and
                             len(self.uc[cid]) < self.rerun_gcon_size):
@@ -737,6 +902,18 @@ class IceIterative(IceFiles):
                     self.removed_qids.add(qid)
         self.run_gcon_parallel(self.changes)
 
+    def gcon_in_seqids(self, cid):
+        """
+        Return ids of a subsample of num=self.dagcon_in_fa_subsample reads
+        of cluster cid, as gcon input. The subsample is a deterministic
+        function of members of the cluster.
+        """
+        seqids = sorted(self.uc[cid])
+        if len(seqids) <= self.dagcon_in_fa_subsample:
+            return seqids
+        seed = int(hashlib.sha1("\n".join(seqids)).hexdigest()[:8], 16)
+        return random.Random(seed).sample(seqids, self.dagcon_in_fa_subsample)
+
     def write_in_fasta(self, cid, write_all=False):
         """
         Write the ./tmp/<cid/10000 mod>/c<cid>/in.fasta for cluster cid.
@@ -745,9 +922,7 @@ class IceIterative(IceFiles):
         """
         #in_filename = op.join('./tmp/', str(cid/10000), 'c'+str(cid), 'in.fasta')
         in_filename = op.join(self.clusterInFa(cid))
-        seqids = self.uc[cid]
-        if not write_all:
-            seqids = random.sample(seqids, min(self.dagcon_in_fa_subsample, len(seqids)))
+        seqids = self.uc[cid] if write_all else self.gcon_in_seqids(cid)
         with open(in_filename, 'w') as f:
             for seqid in seqids:
                 f.write(">{0}\n{1}\n".format(seqid,
@@ -764,12 +939,11 @@ class IceIterative(IceFiles):
         """
         orphan = []
         for sid in self.newids:
-            if len(self.d[sid]) == 0:  # no match to existing cluster
+            best = self.d.best(sid)
+            if best is None:  # no match to existing cluster
                 orphan.append(sid)
             else:
-                best = self.d[sid].items()
-                best.sort(key=lambda x: x[1], reverse=True)
-                cid = best[0][0]
+                cid = best[0]
                 r = self.seq_dict[sid]
                 msg = "adding {0} to c{1}".format(sid, cid)
                 self.add_log(msg)
@@ -807,13 +981,13 @@ class IceIterative(IceFiles):
                 if len(self.uc[cid]) < self.rerun_gcon_size:
                     continue  # no way it's needed
                 for qid in set(self.uc[cid]).difference(self.newids):
-                    self.d[qid] = {cid: -0}
+                    self.d.reset_read(qid, [(cid, -0)])
         else:
             for cid, qids in self.uc.iteritems():
                 if len(self.uc[cid]) < self.rerun_gcon_size:
                     continue  # no way it's needed
                 for qid in set(qids).difference(self.newids):
-                    self.d[qid] = {cid: -0}
+                    self.d.reset_read(qid, [(cid, -0)])
 
     def calc_cluster_prob(self, force_calc=False, use_blasr=False):
         """
@@ -844,7 +1018,8 @@ class IceIterative(IceFiles):
                                     target_filename=real_upath(self.refConsensusFa),
                                     query_converted=False, target_converted=False,
                                     is_FL=True, same_strand_only=True,
-                                    use_sge=False, sge_opts=None, cpus=4)
+                                    use_sge=False, sge_opts=None,
+                                    cpus=self.blasr_nproc)
             runner.run(min_match_len=self.ice_opts.low_cDNA_size,
                        output_dir=output_dir,
                        sensitive_mode=self.ice_opts.sensitive_mode)
@@ -912,25 +1087,21 @@ class IceIterative(IceFiles):
 
     def g2(self, runner):
         """
-        like g(), calculates membership prob and update self.d dict
+        like g(), calculates membership prob and update self.d
         by going through the .las.out files
         (REMEMBER to pre-clean the self.d)
         """
-        for la4ice_filename in runner.la4ice_filenames:
-            for hit in daligner_against_ref(query_dazz_handler=runner.query_dazz_handler,
-                                            target_dazz_handler=runner.target_dazz_handler,
-                                            la4ice_filename=la4ice_filename,
-                                            is_FL=True, sID_starts_with_c=True,
-                                            qver_get_func=self.probQV.get_smoothed,
-                                            qvmean_get_func=self.probQV.get_mean,
-                                            qv_prob_threshold=self.qv_prob_threshold,
-                                            ece_penalty=self.ece_penalty, ece_min_len=self.ece_min_len,
-                                            same_strand_only=True, no_qv_or_aln_checking=False):
-                if hit.qID not in self.d:
-                    self.d[hit.qID] = {}
-                if hit.fakecigar is not None:
-                    self.d[hit.qID][hit.cID] = self.probQV.calc_prob_from_aln(
-                        hit.qID, hit.qStart, hit.qEnd, hit.fakecigar)
+        for hit in daligner_against_refs(la4ice_filenames=runner.la4ice_filenames,
+                                         num_processes=self.blasr_nproc,
+                                         query_dazz_handler=runner.query_dazz_handler,
+                                         target_dazz_handler=runner.target_dazz_handler,
+                                         is_FL=True, sID_starts_with_c=True,
+                                         ece_penalty=self.ece_penalty, ece_min_len=self.ece_min_len,
+                                         same_strand_only=True, no_qv_or_aln_checking=False,
+                                         probqv=self.probQV):
+            self.d.add_read(hit.qID)
+            if hit.aligned:
+                self.d.set(hit.qID, hit.cID, hit.log_prob)
 
 
     def g(self, output_filename):
@@ -942,22 +1113,18 @@ class IceIterative(IceFiles):
         EVEN THOUGH THIS IS NOT CURRENTLY USED (g2 is called for daligner)
         I'm still keeping this because may eventually use BLASR again
         """
-        # for qID, cID, qStart, qEnd, _missed_q, _missed_t, fakecigar, _ece_arr
+        # for qID, cID, qStart, qEnd, _missed_q, _missed_t, log_prob
         for hit in blasr_against_ref(
                 output_filename=output_filename,
                 is_FL=self.is_FL, sID_starts_with_c=True,
-                qver_get_func=self.probQV.get_smoothed,
-                qvmean_get_func=self.probQV.get_mean,
-                qv_prob_threshold=self.qv_prob_threshold,
                 ece_penalty=self.ece_penalty,
-                ece_min_len=self.ece_min_len):
+                ece_min_len=self.ece_min_len,
+                probqv=self.probQV):
 
-            if hit.qID not in self.d:
-                self.d[hit.qID] = {}
+            self.d.add_read(hit.qID)
 
-            if hit.fakecigar is not None:
-                self.d[hit.qID][hit.cID] = self.probQV.calc_prob_from_aln(
-                    hit.qID, hit.qStart, hit.qEnd, hit.fakecigar)
+            if hit.aligned:
+                self.d.set(hit.qID, hit.cID, hit.log_prob)
 
     def run_til_end(self, max_iter=99):
         """
@@ -991,8 +1158,6 @@ class IceIterative(IceFiles):
                 self.add_log("Clustering orphan reads and adding them to uc.")
                 time_1 = datetime.now()
                 iceinit = IceInit(readsFa=self.tmpOrphanFa,
-                                  qver_get_func=self.probQV.get_smoothed,
-                                  qvmean_get_func=self.probQV.get_mean,
                                   ice_opts=self.ice_opts,
                                   sge_opts=self.sge_opts)
 
@@ -1052,20 +1217,18 @@ class IceIterative(IceFiles):
 
         for qID in self.d:
             old_i = qid_to_cid[qID]
-            x = self.d[qID].items()
+            x = self.d.sorted_items(qID)
             if len(x) == 0:
                 # no best! move it to the orphan group
                 self.remove_from_cluster(qID, old_i)
                 orphan.append(qID)
             else:
-                x.sort(key=lambda p: p[1], reverse=True)
                 best_i, best_i_prob = x[0][0], x[0][1]
                 if best_i != qid_to_cid[qID]:
                     # moving assignment from old_i to best_i
                     msg = "best for {0} is {1},{2} (currently: {3}, {4})".\
                         format(qID, best_i, best_i_prob, old_i,
-                               (self.d[qID][old_i] if old_i in self.d[qID]
-                                else 'None'))
+                               self.d.get(qID, old_i, 'None'))
                     self.add_log(msg)
 
                     # move qID to best_i
@@ -1171,14 +1334,15 @@ class IceIterative(IceFiles):
         with ContigSetReaderWrapper(self.fasta_filename) as cs:
             for r in cs:
                 rid = r.name.split()[0]
-                self.d[rid] = {}
+                self.d.reset_read(rid)
                 self.newids.add(rid)
 
         # adding {new batch} to probQV
         # now probQV contains
         # {new batch} + {any id removed from final round} + {active ids}
-        if self.use_finer_qv or self.ccs_fofn is None:
-            # use multi-Qvs from ccs or use predefined Qvs.
+        if self.use_finer_qv or self.ccs_fofn is None or \
+                self.qv_cache_filename is not None:
+            # use multi-Qvs from ccs, predefined Qvs or the QV cache.
             self.probQV.add_seqs_from_fasta(fasta_filename=batch_filename,
                                             smooth=True)
         else: # use a single Qv from FASTQ
@@ -1203,8 +1367,6 @@ class IceIterative(IceFiles):
             os.remove(self.selfBlasrFN(ofa))
 
         iceinit = IceInit(readsFa=ofa,
-                          qver_get_func=self.probQV.get_smoothed,
-                          qvmean_get_func=self.probQV.get_mean,
                           ice_opts=self.ice_opts,
                           sge_opts=self.sge_opts)
         uc = iceinit.uc
@@ -1281,8 +1443,9 @@ class IceIterative(IceFiles):
                     assert seqids == set(members)
                     assert op.exists(self.refs[cid])
             for x in self.d:
-                if len(self.d[x]) == 1 and self.d[x].values()[0] == 0:
-                    cid = self.d[x].keys()[0]
+                items = self.d.items(x)
+                if len(items) == 1 and items[0][1] == 0:
+                    cid = items[0][0]
                     assert len(self.uc[cid]) >= self.rerun_gcon_size
         except AssertionError:
             errMsg = "Cluster sanity check failed!"
@@ -1321,6 +1484,7 @@ class IceIterative(IceFiles):
             #'output/upto_'+f+'.pickle')
             self.write_consensus(self.uptoConsensusFa(f))
             #'output/upto_'+f+'.consensus.fasta')
+            self.checkpoint(stage="add_new_batch")
 
     def run_post_ICE_merging(self, consensusFa, pickleFN, max_iter, use_blasr):
         """
@@ -1371,14 +1535,16 @@ class IceIterative(IceFiles):
                                     target_filename=real_upath(fasta_filename),
                                     is_FL=True, same_strand_only=True,
                                     query_converted=False, target_converted=False,
-                                    use_sge=False, sge_opts=None, cpus=4)
+                                    use_sge=False, sge_opts=None,
+                                    cpus=self.blasr_nproc)
             # run this locally
             runner.run(min_match_len=self.ice_opts.low_cDNA_size,
                        output_dir=output_dir,
                        sensitive_mode=self.ice_opts.sensitive_mode)
 
             for la4ice_filename in runner.la4ice_filenames:
-                for r in LA4IceReader(la4ice_filename):
+                for r in LA4IceReader(la4ice_filename,
+                                      prefilter=possible_merge_prefilter):
                     r.qID = runner.query_dazz_handler[r.qID]
                     r.sID = runner.query_dazz_handler[r.sID]
                     if possible_merge(r=r, ece_penalty=self.ece_penalty, ece_min_len=self.ece_min_len):
@@ -1488,9 +1654,15 @@ class IceIterative(IceFiles):
         msg = "IceIterative run."
         self.add_log(msg, level=logging.INFO)
 
-        msg = "First one run of run_til_end()."
-        self.add_log(msg, level=logging.INFO)
-        self.run_til_end(1)
+        if self.stage is None:
+            msg = "First one run of run_til_end()."
+            self.add_log(msg, level=logging.INFO)
+            self.run_til_end(1)
+            self.checkpoint(stage="run_til_end")
+        else:
+            msg = "Resuming after {s}, {n} files to add.".format(
+                s=self.stage, n=len(self.fasta_filenames_to_add))
+            self.add_log(msg, level=logging.INFO)
         sizes = [len(self.uc)]
 
         msg = "Adding new reads to constructed clusters."
@@ -1539,6 +1711,9 @@ class IceIterative(IceFiles):
         # Write a csv report: line = read cluster
         self.write_report(report_fn=self.report_fn, uc=self.uc)
 
+        # Checkpoints are no longer needed.
+        remove_checkpoints(self.checkpoint_dir)
+
         msg = "IceIterative completed."
         self.add_log(msg, level=logging.INFO)
 
@@ -50,11 +50,11 @@ import os
 import os.path as op
 import time
 import logging
-from cPickle import dump
+from cPickle import dump, load
 import json
 
 from pbcommand.models import FileTypes
-from pbcore.io import ContigSet
+from pbcore.io import ContigSet, FastaWriter
 
 from pbtranscript.ClusterOptions import IceOptions
 from pbtranscript.Utils import realpath, touch, real_upath, execute
@@ -64,7 +64,7 @@ from pbtranscript.io.ContigSetReaderWrapper import ContigSetReaderWrapper
 from pbtranscript.ice_daligner import DalignerRunner
 from pbtranscript.ice.ProbModel import ProbFromModel, ProbFromQV, ProbFromFastq
 from pbtranscript.ice.IceUtils import blasr_against_ref, \
-        daligner_against_ref, ice_fa2fq
+        daligner_against_refs, ice_fa2fq, set_probqv_from_qv_cache
 from pbtranscript.ice.__init__ import ICE_PARTIAL_PY
 
 
@@ -74,7 +74,9 @@ def build_uc_from_partial_daligner(input_fasta, ref_fasta, out_pickle,
                                    use_finer_qv=False,
                                    cpus=24,
                                    no_qv_or_aln_checking=True,
-                                   tmp_dir=None):
+                                   tmp_dir=None,
+                                   qv_cache_filename=None,
+                                   target_converted=True):
     """
     Given an input_fasta file of non-full-length (partial) reads and
     (unpolished) consensus isoforms sequences in ref_fasta, align reads to
@@ -90,6 +92,13 @@ def build_uc_from_partial_daligner(input_fasta, ref_fasta, out_pickle,
 
     tmp_dir - where to save intermediate files such as dazz files.
               if None, writer dazz files to the same directory as query/target.
+
+    qv_cache_filename --- If not None, memory map QVs of reads from this
+    QV cache file (see ice_fa2qvcache) instead of reading ccs_fofn.
+
+    target_converted --- If True, ref_fasta has been converted to a dazz
+    database (e.g., by ICE), otherwise convert it, unless a dazz database
+    of the same content hash exists.
     """
     input_fasta = realpath(input_fasta)
     ref_fasta = realpath(ref_fasta)
@@ -103,7 +112,8 @@ def build_uc_from_partial_daligner(input_fasta, ref_fasta, out_pickle,
     runner = DalignerRunner(query_filename=input_fasta,
                             target_filename=ref_fasta,
                             is_FL=False, same_strand_only=False,
-                            query_converted=False, target_converted=True,
+                            query_converted=False,
+                            target_converted=target_converted,
                             dazz_dir=tmp_dir, script_dir=op.join(output_dir, "script"),
                             use_sge=False, sge_opts=None, cpus=cpus)
     runner.run(min_match_len=300, output_dir=output_dir, sensitive_mode=ice_opts.sensitive_mode)
@@ -119,18 +129,31 @@ def build_uc_from_partial_daligner(input_fasta, ref_fasta, out_pickle,
             probqv = ProbFromModel(.01, .07, .06)
         else:
             start_t = time.time()
-            if use_finer_qv:
-                probqv = ProbFromQV(input_fofn=ccs_fofn, fasta_filename=input_fasta)
-                logging.info("Loading QVs from %s + %s took %s secs",
-                             ccs_fofn, input_fasta, time.time()-start_t)
-            else:
-                input_fastq = input_fasta[:input_fasta.rfind('.')] + '.fastq'
-                logging.info("Converting %s + %s --> %s",
-                             input_fasta, ccs_fofn, input_fastq)
-                ice_fa2fq(input_fasta, ccs_fofn, input_fastq)
-                probqv = ProbFromFastq(input_fastq)
-                logging.info("Loading QVs from %s took %s secs",
-                             input_fastq, time.time()-start_t)
+            probqv = None
+            if qv_cache_filename is not None:
+                try:
+                    probqv, msg = set_probqv_from_qv_cache(
+                        qv_cache_filename=qv_cache_filename,
+                        fasta_filename=input_fasta,
+                        use_finer_qv=use_finer_qv, ccs_fofn=ccs_fofn)
+                    logging.info(msg)
+                except KeyError:
+                    # e.g., nfl reads are not cached if ICE ran without polish
+                    logging.warning("Not all reads in %s are in QV cache %s.",
+                                    input_fasta, qv_cache_filename)
+            if probqv is None:
+                if use_finer_qv:
+                    probqv = ProbFromQV(input_fofn=ccs_fofn, fasta_filename=input_fasta)
+                    logging.info("Loading QVs from %s + %s took %s secs",
+                                 ccs_fofn, input_fasta, time.time()-start_t)
+                else:
+                    input_fastq = input_fasta[:input_fasta.rfind('.')] + '.fastq'
+                    logging.info("Converting %s + %s --> %s",
+                                 input_fasta, ccs_fofn, input_fastq)
+                    ice_fa2fq(input_fasta, ccs_fofn, input_fastq)
+                    probqv = ProbFromFastq(input_fastq)
+                    logging.info("Loading QVs from %s took %s secs",
+                                 input_fastq, time.time()-start_t)
 
     logging.info("Calling dalign_against_ref ...")
 
@@ -139,27 +162,24 @@ def build_uc_from_partial_daligner(input_fasta, ref_fasta, out_pickle,
     seen = set()  # reads seen
     logging.info("Building uc from DALIGNER hits.")
 
-    for la4ice_filename in runner.la4ice_filenames:
-        start_t = time.time()
-        hitItems = daligner_against_ref(query_dazz_handler=runner.query_dazz_handler,
-                                        target_dazz_handler=runner.target_dazz_handler,
-                                        la4ice_filename=la4ice_filename,
-                                        is_FL=False,
-                                        sID_starts_with_c=True,
-                                        qver_get_func=probqv.get_smoothed,
-                                        qvmean_get_func=probqv.get_mean,
-                                        ece_penalty=1,
-                                        ece_min_len=20,
-                                        same_strand_only=False,
-                                        no_qv_or_aln_checking=no_qv_or_aln_checking)
-        for h in hitItems:
-            if h.ece_arr is not None:
-                if h.cID not in partial_uc:
-                    partial_uc[h.cID] = set()
-                partial_uc[h.cID].add(h.qID)
-                seen.add(h.qID)
-        logging.info("processing %s took %s sec",
-                     la4ice_filename, str(time.time()-start_t))
+    start_t = time.time()
+    hitItems = daligner_against_refs(la4ice_filenames=runner.la4ice_filenames,
+                                     num_processes=cpus, aligned_only=True,
+                                     query_dazz_handler=runner.query_dazz_handler,
+                                     target_dazz_handler=runner.target_dazz_handler,
+                                     is_FL=False,
+                                     sID_starts_with_c=True,
+                                     ece_penalty=1,
+                                     ece_min_len=20,
+                                     same_strand_only=False,
+                                     no_qv_or_aln_checking=no_qv_or_aln_checking)
+    for h in hitItems:
+        if h.cID not in partial_uc:
+            partial_uc[h.cID] = set()
+        partial_uc[h.cID].add(h.qID)
+        seen.add(h.qID)
+    logging.info("processing %d las.out files took %s sec",
+                 len(runner.la4ice_filenames), str(time.time()-start_t))
 
     for k in partial_uc:
         partial_uc[k] = list(partial_uc[k])
@@ -243,8 +263,6 @@ def build_uc_from_partial(input_fasta, ref_fasta, out_pickle,
     hitItems = blasr_against_ref(output_filename=m5_file,
                                  is_FL=False,
                                  sID_starts_with_c=True,
-                                 qver_get_func=probqv.get_smoothed,
-                                 qvmean_get_func=probqv.get_mean,
                                  ece_penalty=1,
                                  ece_min_len=10,
                                  same_strand_only=False)
@@ -254,7 +272,7 @@ def build_uc_from_partial(input_fasta, ref_fasta, out_pickle,
     seen = set()  # reads seen
     logging.info("Building uc from BLASR hits.")
     for h in hitItems:
-        if h.ece_arr is not None:
+        if h.aligned:
             if h.cID not in partial_uc:
                 partial_uc[h.cID] = set()
             partial_uc[h.cID].add(h.qID)
@@ -285,6 +303,80 @@ def build_uc_from_partial(input_fasta, ref_fasta, out_pickle,
     touch(done_filename)
 
 
+def combine_consensus_of_bins(ref_fastas, bin_indices, out_fasta):
+    """
+    Concatenate unpolished consensus isoforms of cluster bins into out_fasta,
+    so that nfl reads can be assigned to isoforms of all bins in one pass.
+
+    Cluster ids of consensus isoforms are unique only within a bin, and
+    daligner_against_ref requires reference ids to be c<int>, therefore
+    the i-th isoform in out_fasta is renamed to c<i>, while its bin-prefixed
+    id, e.g., b<bin_index>_c12/f3p0/1234, is saved as its description.
+
+    Parameters:
+      ref_fastas -- consensus isoforms of cluster bins, e.g., final.consensus.fasta
+      bin_indices -- cluster bin indices of ref_fastas
+      out_fasta -- output combined consensus isoforms
+    """
+    if len(ref_fastas) != len(bin_indices):
+        raise ValueError("Number of consensus files and cluster bins must agree.")
+    # A stale config of a previous combined reference must not be reused.
+    for fn in (out_fasta, "%s.sensitive.config" % out_fasta):
+        if op.exists(fn):
+            os.remove(fn)
+
+    logging.info("Combining consensus isoforms of cluster bins %s to %s.",
+                 ",".join([str(i) for i in bin_indices]), out_fasta)
+    n = 0
+    with FastaWriter(out_fasta) as writer:
+        for bin_index, ref_fasta in zip(bin_indices, ref_fastas):
+            for r in ContigSetReaderWrapper(ref_fasta):
+                writer.writeRecord("c{n} b{b}_{cid}".format(
+                    n=n, b=bin_index, cid=r.name.split()[0]), r.sequence)
+                n += 1
+    return n
+
+
+def split_combined_nfl_pickle(combined_pickle, combined_fasta,
+                              bin_indices, out_pickles):
+    """
+    Split combined_pickle, which assigns nfl reads to isoforms in
+    combined_fasta (see combine_consensus_of_bins), to out_pickles,
+    one for each cluster bin in bin_indices, as if nfl reads were
+    assigned to consensus isoforms of each bin separately.
+    A read is nohit in a bin if it aligns to no isoform of that bin.
+    """
+    if len(out_pickles) != len(bin_indices):
+        raise ValueError("Number of output pickles and cluster bins must agree.")
+
+    # c<i> in combined_fasta --> (bin_index, cluster id within bin)
+    cid_to_bin_cid = {}
+    for r in ContigSetReaderWrapper(combined_fasta):
+        fields = r.name.split()
+        b, cid = fields[1].split('_', 1)
+        cid_to_bin_cid[int(fields[0][1:])] = (int(b[1:]),
+                                              int(cid.split('/')[0][1:]))
+
+    with open(combined_pickle, 'r') as f:
+        a = load(f)
+
+    partial_ucs = dict([(bin_index, {}) for bin_index in bin_indices])
+    all_reads = set(a['nohit'])
+    for k, reads in a['partial_uc'].iteritems():
+        bin_index, cid = cid_to_bin_cid[k]
+        partial_ucs[bin_index][cid] = reads
+        all_reads.update(reads)
+
+    for bin_index, out_pickle in zip(bin_indices, out_pickles):
+        partial_uc = partial_ucs[bin_index]
+        seen = set([r for reads in partial_uc.itervalues() for r in reads])
+        logging.debug("Dumping uc of cluster bin %s to a pickle: %s.",
+                      bin_index, out_pickle)
+        with open(out_pickle, 'w') as f:
+            dump({'partial_uc': partial_uc,
+                  'nohit': all_reads.difference(seen)}, f)
+
+
 class IcePartialOne(object):
 
     """Assign nfl reads of a given fasta to isoforms."""
@@ -296,7 +388,8 @@ class IcePartialOne(object):
     def __init__(self, input_fasta, ref_fasta, out_pickle,
                  ccs_fofn=None,
                  done_filename=None, blasr_nproc=12,
-                 use_blasr=False, tmp_dir=None):
+                 use_blasr=False, tmp_dir=None, qv_cache_filename=None,
+                 target_converted=True):
         self.input_fasta = input_fasta
         self.ref_fasta = ref_fasta
         self.out_pickle = out_pickle
@@ -305,6 +398,9 @@ class IcePartialOne(object):
         self.blasr_nproc = blasr_nproc
         self.tmp_dir = tmp_dir
         self.use_blasr = use_blasr # True: use blasr, False, use daligner
+        self.qv_cache_filename = qv_cache_filename
+        # False if ref_fasta may have not been converted to a dazz database
+        self.target_converted = target_converted
 
     def cmd_str(self):
         """Return a cmd string (ice_partial.py one)."""
@@ -315,12 +411,13 @@ class IcePartialOne(object):
                              done_filename=self.done_filename,
                              blasr_nproc=self.blasr_nproc,
                              use_blasr=self.use_blasr,
-                             tmp_dir=self.tmp_dir)
+                             tmp_dir=self.tmp_dir,
+                             qv_cache_filename=self.qv_cache_filename)
 
     def _cmd_str(self, input_fasta, ref_fasta, out_pickle,
                  ccs_fofn=None,
                  done_filename=None, blasr_nproc=12,
-                 use_blasr=False, tmp_dir=None):
+                 use_blasr=False, tmp_dir=None, qv_cache_filename=None):
         """Return a cmd string (ice_partil.py one)"""
         cmd = self.prog + \
               "{f} ".format(f=input_fasta) + \
@@ -336,6 +433,8 @@ class IcePartialOne(object):
             cmd += "--use_blasr "
         if tmp_dir is not None:
             cmd += "--tmp_dir {t} ".format(t=tmp_dir)
+        if qv_cache_filename is not None:
+            cmd += "--qv_cache {q} ".format(q=qv_cache_filename)
         return cmd
 
     def run(self):
@@ -348,7 +447,9 @@ class IcePartialOne(object):
                                            ccs_fofn=self.ccs_fofn,
                                            cpus=self.blasr_nproc,
                                            no_qv_or_aln_checking=True,
-                                           tmp_dir=self.tmp_dir)
+                                           tmp_dir=self.tmp_dir,
+                                           qv_cache_filename=self.qv_cache_filename,
+                                           target_converted=self.target_converted)
         else:
             # replaced by dagliner above
             build_uc_from_partial(input_fasta=self.input_fasta,
@@ -382,6 +483,11 @@ def add_ice_partial_one_arguments(parser):
                             "out_pickle is done.")
     arg_parser = add_use_blasr_argument(arg_parser)
     arg_parser = add_tmp_dir_argument(arg_parser)
+    arg_parser.add_argument("--qv_cache", dest="qv_cache_filename",
+                            type=str, default=None,
+                            help="A QV cache file of reads (e.g., " +
+                            "cluster_out/output/input.qvcache), " +
+                            "used instead of reading QVs from ccs_fofn.")
 
 # ToDo: comment OUT BLASR-related arguments; using DALIGNER
     arg_parser.add_argument("--blasr_nproc", dest="blasr_nproc",
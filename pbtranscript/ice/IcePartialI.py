@@ -223,8 +223,8 @@ class IcePartialI(object):
                          ref_fasta=None):
         """
         Check inputs, write $ICE_PARTIAL_PY i command to script_file
-        and return (input_fasta, ref_fasta, out_pickle, done_file)
-        for the i-th chunk of nfl reads.
+        and return (input_fasta, ref_fasta, out_pickle, done_file,
+        qv_cache_fn) for the i-th chunk of nfl reads.
         """
         icef = IceFiles(prog_name="ice_partial_{i}".format(i=i),
                         root_dir=root_dir, no_log_f=False)
@@ -245,6 +245,9 @@ class IcePartialI(object):
         # $input_fasta.partial_uc.sh
         script_file = icef.nfl_script_i(i)
 
+        # root_dir/output/input.qvcache, if ICE has built it
+        qv_cache_fn = icef.qv_cache_fn if nfs_exists(icef.qv_cache_fn) else None
+
         # Check if inputs exist.
         errMsg = ""
         if not nfs_exists(input_fasta):
@@ -286,7 +289,7 @@ class IcePartialI(object):
                      format(script_file=script_file))
         icef.close_log()
 
-        return (input_fasta, ref_fasta, out_pickle, done_file)
+        return (input_fasta, ref_fasta, out_pickle, done_file, qv_cache_fn)
 
     def run(self):
         """Run IcePartialI"""
@@ -297,7 +300,7 @@ class IcePartialI(object):
         # Validate input files, write equivalent command
         # to script_file.
         for i in self.i:
-            input_fasta, ref_fasta, out_pickle, done_file = \
+            input_fasta, ref_fasta, out_pickle, done_file, qv_cache_fn = \
                 self._validate_inputs(root_dir=self.root_dir,
                                       i=i, ccs_fofn=self.ccs_fofn,
                                       blasr_nproc=self.blasr_nproc,
@@ -311,4 +314,5 @@ class IcePartialI(object):
                                            ccs_fofn=self.ccs_fofn,
                                            done_filename=done_file,
                                            cpus=self.blasr_nproc,
-                                           no_qv_or_aln_checking=True)
+                                           no_qv_or_aln_checking=True,
+                                           qv_cache_filename=qv_cache_fn)
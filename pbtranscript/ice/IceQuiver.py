@@ -5,9 +5,11 @@ Polish consensus isoforms created by ICE, using
 quiver for RS2 data, and Arrow for Sequel data.
 """
 
+import os
 import os.path as op
 import logging
 import shutil
+import time
 import cPickle
 import json
 from math import ceil
@@ -21,13 +23,24 @@ from pbtranscript.Utils import mkdir, real_upath, nfs_exists, \
     use_samtools_v_1_3_1
 from pbtranscript.ice.IceUtils import get_the_only_fasta_record, \
     is_blank_sam, concat_sam, blasr_for_quiver, trim_subreads_and_write, \
-    is_blank_bam, concat_bam
+    is_blank_bam, concat_bam, iter_trimmed_subreads, \
+    filter_alignments_of_clusters
 from pbtranscript.ice.IceFiles import IceFiles
+from pbtranscript.ice.PolishCost import n_subreads_of_zmw_func, \
+    consensus_lengths, polish_costs, polish_costs_of_clusters, balanced_bins
+from pbtranscript.ice.SubreadStore import SubreadStore, write_subread_store, \
+    subread_store_offsets_fn, subread_store_lock_fn, subread_store_signature, \
+    acquire_subread_store_lock
+from pbtranscript.JobScheduler import backoff_intervals
 from pbtranscript.io import MetaSubreadFastaReader, BamCollection, \
-    FastaRandomReader
+    FastaRandomReader, BamWriter
 from pbcore.io import FastaWriter
 
 
+# Seconds to wait for another polish chunk to extract the subread store.
+SUBREAD_STORE_WAIT_TIMEOUT = 4 * 3600
+
+
 class IceQuiver(IceFiles):
 
     """Ice Quiver."""
@@ -37,13 +50,19 @@ class IceQuiver(IceFiles):
            "isoforms, using quiver for RS2 data and arrow for Sequel data."
 
     def __init__(self, root_dir, bas_fofn, fasta_fofn, sge_opts,
-                 tmp_dir=None, prog_name=None):
+                 tmp_dir=None, prog_name=None, batch_blasr_per_bin=False):
+        """
+        batch_blasr_per_bin --- if True, align subreads of all clusters in
+            a quiver bin to consensus of the bin in one blasr call, rather
+            than calling blasr for each cluster.
+        """
         # Initialize super class IceFiles.
         prog_name = "IceQuiver" if prog_name is None else prog_name
         super(IceQuiver, self).__init__(prog_name=prog_name,
                                         root_dir=root_dir, bas_fofn=bas_fofn,
                                         fasta_fofn=fasta_fofn, tmp_dir=tmp_dir)
         self.sge_opts = sge_opts
+        self.batch_blasr_per_bin = batch_blasr_per_bin
         self.use_samtools_v_1_3_1 = use_samtools_v_1_3_1()
 
     def validate_inputs(self):
@@ -124,6 +143,19 @@ class IceQuiver(IceFiles):
         """
         return self._quivered_bin_prefix(first, last) + ".ref.fasta"
 
+    def raw_file_of_quivered_bin(self, first, last, bam=False):
+        """Return $_quivered_bin_prefix.raw.fasta|bam, raw subreads of all
+        clusters in this bin, which are aligned by a batched blasr call."""
+        return self._quivered_bin_prefix(first, last) + \
+               (".raw.bam" if bam else ".raw.fasta")
+
+    def unfiltered_sam_of_quivered_bin(self, first, last, bam=False):
+        """Return $_quivered_bin_prefix.unfiltered.sam|bam, output of the
+        batched blasr call, before alignments of subreads to consensus of
+        other clusters are filtered out."""
+        return self._quivered_bin_prefix(first, last) + \
+               (".unfiltered.bam" if bam else ".unfiltered.sam")
+
     def cmph5_of_quivered_bin(self, first, last):
         """Return $_quivered_bin_prefix.cmp.h5"""
         return self._quivered_bin_prefix(first, last) + ".cmp.h5"
@@ -139,6 +171,16 @@ class IceQuiver(IceFiles):
         """Return $_quivered_bin_prefix.sh"""
         return self._quivered_bin_prefix(first, last) + ".sh"
 
+    def cost_of_quivered_bin(self, first, last):
+        """Return $_quivered_bin_prefix.cost, which saves predicted
+        polish cost of clusters in this bin (see PolishCost)."""
+        return self._quivered_bin_prefix(first, last) + ".cost"
+
+    def runtime_of_quivered_bin(self, first, last):
+        """Return $_quivered_bin_prefix.runtime, which saves the actual
+        runtime in seconds of script_of_quivered_bin."""
+        return self._quivered_bin_prefix(first, last) + ".runtime"
+
     def reconstruct_ref_fa_for_clusters_in_bin(self, cids, refs):
         """
         Reconstruct ref_fa of the cluster in the new tmp_dir
@@ -184,7 +226,7 @@ class IceQuiver(IceFiles):
           in either uc or partial_uc.
 
         cids --- cluster ids
-        d --- MetaSubreadFastaReader or BamCollection
+        d --- SubreadStore, MetaSubreadFastaReader or BamCollection
         uc --- uc[k] returns fl ccs reads associated with cluster k
         partial_uc --- partial_uc[k] returns nfl ccs reads associated with cluster k
         """
@@ -192,6 +234,11 @@ class IceQuiver(IceFiles):
         file_func = self.raw_bam_of_cluster if bam \
                     else self.raw_fa_of_cluster
 
+        if isinstance(d, SubreadStore):
+            # subreads of clusters are already trimmed and contiguous
+            d.write_clusters(cids=cids, out_file_func=file_func)
+            return
+
         for k in cids:  # for each cluster k
             # write cluster k's associated raw subreads to raw_fa
             # Trim both ends of subreads (which contain primers and polyAs)
@@ -306,6 +353,113 @@ class IceQuiver(IceFiles):
 
         return valid_cids
 
+    def create_raw_file_for_bin(self, cids, d, uc, partial_uc, bam=False):
+        """
+        Write raw subreads of zmws associated with clusters in cids (in
+        either uc or partial_uc) to raw_file_of_quivered_bin, where each
+        subread is written once even if its zmw is assigned to more than
+        one cluster (e.g., nfl reads in partial_uc).
+        Return owners, {zmw: set of clusters in cids the zmw is assigned to}.
+
+        d --- SubreadStore, MetaSubreadFastaReader or BamCollection
+        """
+        first, last = cids[0], cids[-1]
+        out_fn = self.raw_file_of_quivered_bin(first, last, bam=bam)
+        self.add_log("Writing raw subreads of clusters between " +
+                     "{first} and {last} to {f}.".format(first=first, last=last,
+                                                         f=out_fn))
+        owners = defaultdict(set)
+        seen = set()
+        writer = BamWriter(out_fn, d.header) if bam else open(out_fn, 'w')
+        for k in cids:
+            if isinstance(d, SubreadStore):
+                subreads = d.iter_subreads(k)
+            else:
+                subreads = iter_trimmed_subreads(
+                    reader=d, in_seqids=uc[k] + partial_uc[k],
+                    trim_len=IceQuiverOptions.trim_subread_flank_len,
+                    min_len=IceQuiverOptions.min_trimmed_subread_len,
+                    ignore_keyerror=True, bam=bam)
+            for rec in subreads:
+                name = rec.query_name if bam else rec[0]
+                owners['/'.join(name.split('/')[0:2])].add(k)
+                if name not in seen:
+                    seen.add(name)
+                    if bam:
+                        writer.write(rec)
+                    else:
+                        writer.write(">{0}\n{1}\n".format(*rec))
+        writer.close()
+        return owners
+
+    def create_sam_for_bin_by_batched_blasr(self, cids, refs, owners, bam=False):
+        """
+        Align raw subreads of all clusters in cids to consensus sequences
+        of these clusters in one blasr call, then only keep alignments of
+        subreads to consensus of their own clusters, and write them to
+        sam|bam_of_quivered_bin directly, write consensus sequences of
+        `valid` clusters to ref_fa_of_quivered_bin.
+        A cluser is not valid if (1) or (2)
+            (1) identical sequences already exists in another cluster
+                (rare, but happens)
+            (2) the alignment is empty (also rare, but happens)
+        Return valid_cids, a list of valid cluster ids
+
+        This function has to be called after create_raw_file_for_bin.
+        """
+        first, last = cids[0], cids[-1]
+        bin_ref_fa = self.ref_fa_of_quivered_bin(first, last)
+        bin_sam_file = self.bam_of_quivered_bin(first, last) if bam else \
+                       self.sam_of_quivered_bin(first, last)
+        raw_fn = self.raw_file_of_quivered_bin(first, last, bam=bam)
+        unfiltered_fn = self.unfiltered_sam_of_quivered_bin(first, last, bam=bam)
+
+        ref_recs, ref_cids, seqs_seen = {}, {}, {}
+        with open(bin_ref_fa, 'w') as bin_ref_fa_writer:
+            for cid in cids:
+                ref_rec = get_the_only_fasta_record(refs[cid])
+                name = ref_rec.name.strip()
+                seq = ref_rec.sequence.strip()
+                if seq not in seqs_seen:
+                    seqs_seen[seq] = cid
+                    ref_recs[cid] = (name, seq)
+                    ref_cids[name.split()[0]] = cid
+                    bin_ref_fa_writer.write(">{0}\n{1}\n".format(name, seq))
+                else:
+                    self.add_log("ignoring {0} because identical sequence!".
+                                 format(cid))
+
+        valid_cids = []
+        if any(len(owners[zmw] & set(ref_recs.keys())) > 0 for zmw in owners):
+            self.add_log("Aligning raw subreads of clusters between " +
+                         "{first} and {last} in a batch.".format(first=first, last=last))
+            # report enough hits so that hits to consensus of a subread's
+            # own cluster are not crowded out by similar isoforms
+            n_refs = len(ref_recs)
+            blasr_for_quiver(query_fn=raw_fn, ref_fasta=bin_ref_fa,
+                             out_fn=unfiltered_fn, bam=bam, run_cmd=True,
+                             blasr_nproc=self.sge_opts.blasr_nproc,
+                             bestn=max(5, n_refs), nCandidates=max(10, 2 * n_refs))
+            valid_cids = filter_alignments_of_clusters(in_fn=unfiltered_fn,
+                                                       out_fn=bin_sam_file,
+                                                       ref_cids=ref_cids,
+                                                       owners=owners, bam=bam)
+            os.remove(unfiltered_fn)
+
+        for cid in set(ref_recs.keys()) - set(valid_cids):
+            self.add_log("ignoring {0} because no alignments!".format(cid))
+
+        # Only keep consensus sequences of valid clusters.
+        with open(bin_ref_fa, 'w') as bin_ref_fa_writer:
+            for cid in valid_cids:
+                bin_ref_fa_writer.write(">{0}\n{1}\n".format(*ref_recs[cid]))
+
+        if len(valid_cids) == 0:
+            self.add_log("No alignments were found for clusters between " +
+                         "{first} and {last}.".format(first=first, last=last),
+                         level=logging.WARNING)
+        return valid_cids
+
     def quiver_cmds_for_bin(self, cids, quiver_nproc=2, bam=False):
         """
         Return a list of quiver related cmds. Input format can be FASTA or BAM.
@@ -381,7 +535,14 @@ class IceQuiver(IceFiles):
                      format(f=bin_sh, first=first, last=last))
         with open(bin_sh, 'w') as f:
             f.write("#!/bin/bash\n")
-            f.write("\n".join(cmds))
+            f.write("start_t=$(date +%s)\n")
+            f.write("\n".join(cmds) + "\n")
+            # Record runtime, to be compared with predicted cost of this bin,
+            # and keep exit status of the last cmd as exit status of script.
+            f.write("ret=$?\n")
+            f.write("echo $(($(date +%s) - start_t)) > {f}\n".format(
+                f=real_upath(self.runtime_of_quivered_bin(first, last))))
+            f.write("exit $ret\n")
 
         return bin_sh
 
@@ -448,6 +609,10 @@ class IceQuiver(IceFiles):
             its consensus sequence and create sam_of_cluster(k).
         (3) Concat all sam files of `valid` clusters to sam_of_quivered_bin, and
             concat ref seqs of all `valid` clusters to ref_fa_of_quivered_bin
+            If self.batch_blasr_per_bin, (1)-(3) are replaced by
+            writing subreads of all clusters to raw_file_of_quivered_bin,
+            and aligning them to consensus of all clusters in one blasr
+            call, see create_sam_for_bin_by_batched_blasr.
         (4) Make commands including
                 samtoh5, loadPulses, cmph5tools.py, loadChemistry, ..., quiver
             in order to convert sam_of_quivered_bin to cmph5_of_quivered_bin.
@@ -456,28 +621,39 @@ class IceQuiver(IceFiles):
               * or execute scripts sequentially on local machine
         """
         if not isinstance(d, BamCollection) and \
-           not isinstance(d, MetaSubreadFastaReader):
+           not isinstance(d, MetaSubreadFastaReader) and \
+           not isinstance(d, SubreadStore):
             raise TypeError("%s.create_a_quiver_bin, does not support %s" %
                             (self.__class__.__name__, type(d)))
 
         self.add_log("Creating a quiver job bin for clusters "
                      "[%s, %s]" % (cids[0], cids[-1]), level=logging.INFO)
 
-        bam = True if isinstance(d, BamCollection) else False
+        bam = d.bam if isinstance(d, SubreadStore) else \
+              isinstance(d, BamCollection)
 
-        # For each cluster in bin, create its raw subreads fasta file.
-        self.create_raw_files_for_clusters_in_bin(cids=cids, d=d, uc=uc,
+        if self.batch_blasr_per_bin:
+            # Write raw subreads of all clusters in bin to a file, align
+            # them to consensus of all clusters in bin in one blasr call.
+            owners = self.create_raw_file_for_bin(cids=cids, d=d, uc=uc,
                                                   partial_uc=partial_uc,
                                                   bam=bam)
+            valid_cids = self.create_sam_for_bin_by_batched_blasr(
+                cids=cids, refs=refs, owners=owners, bam=bam)
+        else:
+            # For each cluster in bin, create its raw subreads fasta file.
+            self.create_raw_files_for_clusters_in_bin(cids=cids, d=d, uc=uc,
+                                                      partial_uc=partial_uc,
+                                                      bam=bam)
 
-        # For each cluster in bin, align its raw subreads to ref to build a sam
-        self.create_sams_for_clusters_in_bin(cids=cids, refs=refs, bam=bam)
+            # For each cluster in bin, align its raw subreads to ref to build a sam
+            self.create_sams_for_clusters_in_bin(cids=cids, refs=refs, bam=bam)
 
-        # Concatenate sam | ref files of 'valid' clusters in this bin to create
-        # a big sam | ref file.
-        valid_cids = self.concat_valid_sams_and_refs_for_bin(cids=cids,
-                                                             refs=refs,
-                                                             bam=bam)
+            # Concatenate sam | ref files of 'valid' clusters in this bin to create
+            # a big sam | ref file.
+            valid_cids = self.concat_valid_sams_and_refs_for_bin(cids=cids,
+                                                                 refs=refs,
+                                                                 bam=bam)
 
         # quiver cmds for this bin
         cmds = []
@@ -491,28 +667,63 @@ class IceQuiver(IceFiles):
         # Write quiver cmds for this bin to $root_dir/quivered/c{}_{}.sh
         return self.create_quiver_sh_for_bin(cids=cids, cmds=cmds)
 
+    def predict_polish_costs(self, d, uc, partial_uc, cids):
+        """
+        Return {cid: predicted polish cost} of clusters in cids, given
+        number of subreads of zmws in uc and partial_uc (looked up in
+        index of subreads d, or in SubreadStore d) and lengths of
+        consensus isoforms.
+        """
+        self.add_log("Predicting polish costs of {n} clusters.".format(n=len(cids)))
+        lens = consensus_lengths(self.final_consensus_fa) \
+               if nfs_exists(self.final_consensus_fa) else {}
+        if isinstance(d, SubreadStore):
+            return polish_costs_of_clusters(cids=cids, consensus_lens=lens,
+                                            n_subreads_of_cluster=d.num_subreads)
+        return polish_costs(cids=cids, uc=uc, partial_uc=partial_uc,
+                            consensus_lens=lens,
+                            n_subreads_of_zmw=n_subreads_of_zmw_func(d))
+
+    @staticmethod
+    def split_clusters_into_bins(cids, costs=None, num_clusters_per_bin=100):
+        """
+        Split clusters in cids into quiver bins, return a list of bins,
+        each of which is a list of sorted cluster ids.
+        If costs is None, put every {num_clusters_per_bin} clusters into
+        a bin, otherwise, pack clusters into the same number of bins so
+        that total predicted costs of bins are roughly the same.
+        """
+        if costs is None:
+            return [cids[i:i + num_clusters_per_bin]
+                    for i in xrange(0, len(cids), num_clusters_per_bin)]
+        n_bins = int(ceil(len(cids) / float(num_clusters_per_bin)))
+        return balanced_bins(dict((k, costs[k]) for k in cids), n_bins)
+
     def create_quiver_bins(self, d, uc, partial_uc, refs, keys, start, end,
-                           sge_opts):
+                           sge_opts, costs=None):
         """
-        Create quiver bins by putting every 100 clusters into a bin.
+        Create quiver bins of clusters in keys[start:end] (see
+        split_clusters_into_bins).
         For each bin, create a bash script (e.g., script_of_quivered_bin).
         Return a list of scripts to run.
         """
         bin_scripts = []
-        for i in xrange(start, end, 100):  # Put every 100 clusters to a bin
-            cids = keys[i:min(end, i + 100)]
+        for cids in self.split_clusters_into_bins(keys[start:end], costs):
             bin_sh = self.create_a_quiver_bin(cids=cids, d=d, uc=uc,
                                               partial_uc=partial_uc,
                                               refs=refs, sge_opts=sge_opts)
-            bin_scripts += bin_sh
+            bin_scripts.append(bin_sh)
         return bin_scripts
 
     def create_quiver_bins_and_submit_jobs(self, d, uc, partial_uc, refs, keys,
-                                           start, end, submitted, sge_opts):
+                                           start, end, submitted, sge_opts,
+                                           costs=None):
         """
-        Put every 100 clusters together and create bins. Create a bash script
-        (e.g., script_of_quivered_bin), for each bin, and submit the script
-        either using qsub or running it locally.
+        Put clusters in keys[start:end] into bins, every 100 clusters
+        together if costs is None, otherwise, bins of balanced predicted
+        costs. Create a bash script (e.g., script_of_quivered_bin),
+        for each bin, and submit the script either using qsub or running
+        it locally.
         return all bash scripts in a list.
         """
         if start >= end or start < 0 or start > len(keys) or end > len(keys):
@@ -528,8 +739,10 @@ class IceQuiver(IceFiles):
                                                         refs=refs)
 
         all_todo = []
-        for i in xrange(start, end, 100):  # Put every 100 clusters to a bin
-            cids = keys[i:min(end, i + 100)]
+        for cids in self.split_clusters_into_bins(keys[start:end], costs):
+            if costs is not None:
+                with open(self.cost_of_quivered_bin(cids[0], cids[-1]), 'w') as f:
+                    f.write("%d\n" % sum(costs[k] for k in cids))
             bin_sh = self.create_a_quiver_bin(cids=cids, d=d, uc=uc,
                                               partial_uc=partial_uc,
                                               refs=refs, sge_opts=sge_opts)
@@ -538,7 +751,7 @@ class IceQuiver(IceFiles):
             # submit the created script of this quiver bin
             self.submit_todo_quiver_jobs(todo=[bin_sh], submitted=submitted,
                                          sge_opts=sge_opts)
-        # end of for i in xrange(start, end, 100):
+        # end of for cids in self.split_clusters_into_bins(...)
         return all_todo
 
     @property
@@ -584,6 +797,68 @@ class IceQuiver(IceFiles):
         self.add_log("File indexing done.")
         return d
 
+    def open_or_build_subread_store(self, uc, partial_uc):
+        """
+        Return a SubreadStore of trimmed raw subreads of all clusters in uc.
+        The store is extracted from input subreads once per cluster bin,
+        by whichever polish chunk comes first, and shared by all chunks,
+        so that chunks do not index input subreads and look up zmws.
+        Other chunks wait for the store, take over the lock if its holder
+        fails or is gone, or extract it by themselves if it is not done in
+        SUBREAD_STORE_WAIT_TIMEOUT seconds.
+        """
+        bam = guess_file_format(self.bas_fofn) == FILE_FORMATS.BAM
+        store_fn = self.subread_store_bam if bam else self.subread_store_fa
+        inputs = [self.bas_fofn] if bam else \
+                 get_files_from_file_or_fofn(self.fasta_fofn)
+        signature = subread_store_signature(
+            filenames=inputs + [self.final_pickle_fn, self.nfl_all_pickle_fn],
+            trim_len=IceQuiverOptions.trim_subread_flank_len,
+            min_len=IceQuiverOptions.min_trimmed_subread_len)
+
+        lock_fn = subread_store_lock_fn(store_fn)
+        offsets_fn = subread_store_offsets_fn(store_fn)
+        start_t, intervals = time.time(), backoff_intervals(0.1, 10)
+        waiting = False
+        while True:
+            store = SubreadStore.open(store_fn, signature)
+            if store is not None:
+                self.add_log("Using subread store {f}.".format(f=store_fn))
+                return store
+            # Take the lock if it is free, released by a failed holder,
+            # or left behind by a holder which is gone.
+            locked = acquire_subread_store_lock(lock_fn)
+            if locked or time.time() - start_t >= SUBREAD_STORE_WAIT_TIMEOUT:
+                break
+            if not waiting:
+                self.add_log("Waiting for subread store {f}.".format(f=store_fn))
+                waiting = True
+            time.sleep(next(intervals))
+
+        try:
+            if locked: # the previous holder may have just finished
+                store = SubreadStore.open(store_fn, signature)
+            if store is None:
+                if locked and op.exists(offsets_fn):
+                    os.remove(offsets_fn) # out of date
+                self.add_log("Extracting subreads of {n} clusters to {f}.".
+                             format(n=len(uc), f=store_fn), level=logging.INFO)
+                write_subread_store(reader=self.index_input_subreads(),
+                                    cids=uc.keys(), uc=uc, partial_uc=partial_uc,
+                                    out_file=store_fn,
+                                    trim_len=IceQuiverOptions.trim_subread_flank_len,
+                                    min_len=IceQuiverOptions.min_trimmed_subread_len,
+                                    signature=signature, bam=bam)
+                store = SubreadStore.open(store_fn, signature)
+        except Exception:
+            if locked and op.exists(offsets_fn):
+                os.remove(offsets_fn)
+            raise
+        finally:
+            if locked:
+                os.remove(lock_fn)
+        return store
+
     def submitted_quiver_jobs_log_of_chunk_i(self, i, num_chunks):
         """A txt file to save all submitted quiver jobs of the
         (i / num_chunks)-th workload. Format:
@@ -607,11 +882,12 @@ class IceQuiver(IceFiles):
         number of nodes, we divide quiver jobs into num_chunks workloads
         of roughly the same size, and are processing the i-th workload
         now.
-        (1) load uc, partial_uc and refs from pickles and index subreads
-            in fasta and save to d
+        (1) load uc, partial_uc and refs from pickles, and open the
+            subread store of this cluster bin (extract it from input
+            subreads if this is the first chunk to need it) and save to d
         (2) write report if this is the first chunk (e.g, i==0)
-        (3) Assume clusters are divided into num_chunks parts, process
-            the i-th part.
+        (3) Divide clusters into num_chunks parts of roughly the same
+            predicted polish cost, process the i-th part.
         """
         if (i >= num_chunks):
             raise ValueError("Chunk index {i} should be less than {N}.".
@@ -625,25 +901,35 @@ class IceQuiver(IceFiles):
             self.write_report(report_fn=self.report_fn,
                               uc=uc, partial_uc=partial_uc)
 
-        # Index input subreads in fasta_fofn or bas_fofn,
-        d = self.index_input_subreads()
+        # Open subread store of all clusters, rather than indexing input
+        # subreads in fasta_fofn or bas_fofn in every chunk.
+        d = self.open_or_build_subread_store(uc=uc, partial_uc=partial_uc)
 
         # good = [x for x in uc if len(uc[x]) > 1 or len(partial_uc2[x]) >= 10]
         # bug 24984, call quiver on everything, no selection is needed.
         keys = sorted([x for x in uc])  # sort cluster ids
 
-        # Compute number of clusters in i-th chunk
-        num_clusters_per_chunk = int(ceil(len(keys) / float(num_chunks)))
-        num_clusters_in_chunk_i = max(0, min(len(keys) - i * num_clusters_per_chunk,
-                                             num_clusters_per_chunk))
-        start = i * num_clusters_per_chunk
-        end = start + num_clusters_in_chunk_i
+        # Clusters of a few highly expressed genes may have far more subreads
+        # than others, so rather than putting the same number of clusters
+        # into each chunk, balance predicted polish costs of chunks. Every
+        # chunk computes the same partition, as balanced_bins is deterministic.
+        costs = self.predict_polish_costs(d=d, uc=uc, partial_uc=partial_uc,
+                                          cids=keys)
+        chunks = balanced_bins(costs, num_chunks)
+        keys_in_chunk_i = chunks[i] if i < len(chunks) else []
+        self.add_log("Chunk {i}/{N} has {n} clusters, predicted cost {c}.".format(
+            i=i, N=num_chunks, n=len(keys_in_chunk_i),
+            c=sum(costs[k] for k in keys_in_chunk_i)), level=logging.INFO)
 
         submitted = []
         # Create quiver bins and submit jobs
         all_todo = self.create_quiver_bins_and_submit_jobs(d=d, uc=uc,
-                                                           partial_uc=partial_uc, refs=refs, keys=keys, start=start,
-                                                           end=end, submitted=submitted, sge_opts=self.sge_opts)
+                                                           partial_uc=partial_uc, refs=refs,
+                                                           keys=keys_in_chunk_i, start=0,
+                                                           end=len(keys_in_chunk_i),
+                                                           submitted=submitted,
+                                                           sge_opts=self.sge_opts,
+                                                           costs=costs)
 
         # Write submitted quiver jobs to
         # $root_dir/log/submitted_quiver_jobs.{i}of{num_chunks}.txt
@@ -87,7 +87,7 @@ from pbtranscript.PBTranscriptOptions import \
         add_cluster_root_dir_as_positional_argument, \
         add_fofn_arguments, add_cluster_summary_report_arguments, \
         add_ice_post_quiver_hq_lq_arguments, add_tmp_dir_argument, \
-        add_sge_arguments, _wrap_parser # FIXME
+        add_sge_arguments, add_batch_blasr_per_bin_argument, _wrap_parser # FIXME
 from pbtranscript.ice.IceQuiver import IceQuiver
 from pbtranscript.ice.IceQuiverPostprocess import IceQuiverPostprocess
 from pbtranscript.ice.__init__ import ICE_QUIVER_PY
@@ -104,7 +104,8 @@ class IceQuiverAll(object):
     prog = "%s all " % ICE_QUIVER_PY
 
     def __init__(self, root_dir, bas_fofn, fasta_fofn, sge_opts, ipq_opts,
-                 report_fn=None, summary_fn=None, tmp_dir=None, prog_name=None):
+                 report_fn=None, summary_fn=None, tmp_dir=None, prog_name=None,
+                 batch_blasr_per_bin=False):
         prog_name = prog_name if prog_name is not None else "IceQuiverAll"
         self.root_dir = root_dir
         self.bas_fofn = bas_fofn
@@ -114,17 +115,19 @@ class IceQuiverAll(object):
         self.sge_opts = sge_opts
         self.ipq_opts = ipq_opts
         self.tmp_dir = tmp_dir
+        self.batch_blasr_per_bin = batch_blasr_per_bin
 
     def cmd_str(self):
         """Return a cmd string. ($ICE_QUIVER_PY all)."""
         return self._cmd_str(root_dir=self.root_dir, bas_fofn=self.bas_fofn,
                              fasta_fofn=self.fasta_fofn, sge_opts=self.sge_opts,
                              ipq_opts=self.ipq_opts, report_fn=self.report_fn,
-                             summary_fn=self.summary_fn, tmp_dir=self.tmp_dir)
+                             summary_fn=self.summary_fn, tmp_dir=self.tmp_dir,
+                             batch_blasr_per_bin=self.batch_blasr_per_bin)
 
 
     def _cmd_str(self, root_dir, bas_fofn, fasta_fofn, sge_opts, ipq_opts,
-                 report_fn, summary_fn, tmp_dir):
+                 report_fn, summary_fn, tmp_dir, batch_blasr_per_bin=False):
         """Return a cmd string. ($ICE_QUIVER_PY all)."""
         cmd = self.prog + \
               "{d} ".format(d=root_dir) + \
@@ -138,13 +141,16 @@ class IceQuiverAll(object):
             cmd += "--summary={f} ".format(f=summary_fn)
         cmd += sge_opts.cmd_str(show_blasr_nproc=True, show_quiver_nproc=True)
         cmd += ipq_opts.cmd_str()
+        if batch_blasr_per_bin is True:
+            cmd += "--batch_blasr_per_bin "
         return cmd
 
     def run(self):
         """Run"""
         iceq = IceQuiver(root_dir=self.root_dir, bas_fofn=self.bas_fofn,
                          fasta_fofn=self.fasta_fofn, sge_opts=self.sge_opts,
-                         tmp_dir=self.tmp_dir)
+                         tmp_dir=self.tmp_dir,
+                         batch_blasr_per_bin=self.batch_blasr_per_bin)
         iceq.validate_inputs()
         iceq.run()
 
@@ -169,4 +175,5 @@ def add_ice_quiver_all_arguments(parser):
     arg_parser = add_sge_arguments(arg_parser, quiver_nproc=True,
                                    blasr_nproc=True)
     arg_parser = add_tmp_dir_argument(arg_parser)
+    arg_parser = add_batch_blasr_per_bin_argument(arg_parser)
     return parser
@@ -135,7 +135,7 @@ Alternative way to call this script:
 from pbtranscript.__init__ import get_version
 from pbtranscript.PBTranscriptOptions import add_fofn_arguments, \
     add_sge_arguments, add_cluster_root_dir_as_positional_argument, \
-    add_tmp_dir_argument
+    add_tmp_dir_argument, add_batch_blasr_per_bin_argument
 from pbtranscript.ice.IceQuiver import IceQuiver
 from pbtranscript.ice.__init__ import ICE_QUIVER_PY
 
@@ -153,6 +153,7 @@ def add_ice_quiver_i_arguments(parser):
     parser = add_fofn_arguments(parser, bas_fofn=True)
     parser = add_sge_arguments(parser, quiver_nproc=True, blasr_nproc=True)
     parser = add_tmp_dir_argument(parser)
+    parser = add_batch_blasr_per_bin_argument(parser)
 
     return parser
 
@@ -166,7 +167,8 @@ class IceQuiverI(object):
 
     prog = "%s i " % ICE_QUIVER_PY
 
-    def __init__(self, root_dir, i, N, bas_fofn, fasta_fofn, sge_opts, tmp_dir=None):
+    def __init__(self, root_dir, i, N, bas_fofn, fasta_fofn, sge_opts, tmp_dir=None,
+                 batch_blasr_per_bin=False):
         self.root_dir = root_dir
         self.N = int(N)
         self.i = i
@@ -174,6 +176,7 @@ class IceQuiverI(object):
         self.fasta_fofn = fasta_fofn
         self.sge_opts = sge_opts
         self.tmp_dir = tmp_dir
+        self.batch_blasr_per_bin = batch_blasr_per_bin
 
     def getVersion(self):
         """Return version string."""
@@ -183,9 +186,11 @@ class IceQuiverI(object):
         """Return a cmd string of IceQuiverI ($ICE_QUIVER_PY i)."""
         return self._cmd_str(root_dir=self.root_dir, i=self.i, N=self.N,
                              bas_fofn=self.bas_fofn, fasta_fofn=self.fasta_fofn,
-                             sge_opts=self.sge_opts, tmp_dir=self.tmp_dir)
+                             sge_opts=self.sge_opts, tmp_dir=self.tmp_dir,
+                             batch_blasr_per_bin=self.batch_blasr_per_bin)
 
-    def _cmd_str(self, root_dir, i, N, bas_fofn, fasta_fofn, sge_opts, tmp_dir):
+    def _cmd_str(self, root_dir, i, N, bas_fofn, fasta_fofn, sge_opts, tmp_dir,
+                 batch_blasr_per_bin=False):
         """Return a cmd string of IceQuiverI ($ICE_QUIVER_PY i)."""
         cmd = self.prog + \
             "{d} ".format(d=root_dir) + \
@@ -197,6 +202,8 @@ class IceQuiverI(object):
         cmd += sge_opts.cmd_str(show_blasr_nproc=True, show_quiver_nproc=True)
         if tmp_dir is not None:
             cmd += "--tmp_dir={tmp_dir} ".format(tmp_dir=tmp_dir)
+        if batch_blasr_per_bin is True:
+            cmd += "--batch_blasr_per_bin "
         return cmd
 
     def run(self):
@@ -209,7 +216,8 @@ class IceQuiverI(object):
                              sge_opts=self.sge_opts,
                              tmp_dir=self.tmp_dir,
                              prog_name="ice_quiver_{i}of{N}".
-                                       format(i=chunk, N=self.N))
+                                       format(i=chunk, N=self.N),
+                             batch_blasr_per_bin=self.batch_blasr_per_bin)
             cmd_str = self.cmd_str()
             iceq.add_log(cmd_str)
 
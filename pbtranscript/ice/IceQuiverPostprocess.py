@@ -132,8 +132,10 @@ from pbtranscript.PBTranscriptOptions import \
     add_cluster_summary_report_arguments, _wrap_parser # FIXME
 from pbtranscript.Utils import phred_to_qv, as_contigset, \
     get_all_files_in_dir, ln, nfs_exists
+from pbtranscript.JobScheduler import backoff_intervals
 from pbtranscript.ice.IceFiles import IceFiles
 from pbtranscript.ice.IceUtils import cid_with_annotation
+from pbtranscript.ice.PolishCost import write_polish_cost_report
 from pbtranscript.ice.__init__ import ICE_QUIVER_PY
 
 
@@ -304,6 +306,12 @@ class IceQuiverPostprocess(IceFiles):
                            b=self.qv_trim_3,
                            c=self.hq_quiver_min_accuracy))
 
+    @property
+    def polish_cost_report_fn(self):
+        """Return $root_dir/quivered/polish_cost_report.csv, which compares
+        predicted and actual runtime of quivered bins."""
+        return op.join(self.quivered_dir, "polish_cost_report.csv")
+
     @property
     def quivered_bad_fa(self):
         """Return $root_dir/all_quivered_lq.fasta"""
@@ -433,9 +441,12 @@ class IceQuiverPostprocess(IceFiles):
                          level=logging.ERROR)
             return -1
         elif self.use_sge is True:
+            # Check at growing intervals, from 5 seconds to 180 seconds.
+            intervals = backoff_intervals(initial=5, maximum=180)
             while job_stats != "DONE":
-                self.add_log("Sleeping for 180 seconds.")
-                sleep(180)
+                sleep_time = next(intervals)
+                self.add_log("Sleeping for {t} seconds.".format(t=sleep_time))
+                sleep(sleep_time)
                 job_stats = self.check_quiver_jobs_completion()
                 if job_stats == "DONE":
                     break
@@ -455,6 +466,11 @@ class IceQuiverPostprocess(IceFiles):
 
         self.pickup_best_clusters(self.fq_filenames)
 
+        # Compare predicted polish costs of quivered bins with actual runtime.
+        write_polish_cost_report(
+            bin_prefixes=[fq[:-len(".quivered.fastq")] for fq in self.fq_filenames],
+            report_fn=self.polish_cost_report_fn)
+
         self.add_log("Creating polished high quality consensus isoforms.")
         if self.hq_isoforms_fa is not None:
             ln(self.quivered_good_fa, self.hq_isoforms_fa)
@@ -4,6 +4,7 @@ import os.path as op
 import logging
 import shutil
 import filecmp
+import hashlib
 import random
 import time
 from cPickle import dump, load
@@ -16,12 +17,14 @@ from pbcore.io import FastaReader, FastaWriter, FastqWriter, \
 from pbtranscript.Utils import realpath, mkdir, execute, \
         write_files_to_fofn, real_upath, \
         get_files_from_file_or_fofn, \
-        FILE_FORMATS, guess_file_format
+        FILE_FORMATS, guess_file_format, fork_pool, fork_state
 from pbtranscript.RunnerUtils import write_cmd_to_script
-from pbtranscript.findECE import findECE
+from pbtranscript.ice.c_IceUtils import eval_alignment, eval_hit, \
+    large_nonmatch
 from pbtranscript.io.BasQV import basQVcacher
+from pbtranscript.io.QVStore import QVStore
 from pbtranscript.io import BLASRM5Reader, MetaSubreadFastaReader, \
-        BamCollection, BamWriter, LA4IceReader
+        BamCollection, BamWriter, LA4IceReader, concat_bam_files
 from pbtranscript.io.ContigSetReaderWrapper import ContigSetReaderWrapper
 from pbtranscript.ice_daligner import DalignerRunner
 from pbtranscript.ice.ProbModel import ProbFromQV, \
@@ -144,138 +147,30 @@ def sanity_check_sge(sge_opts, scriptDir, testDirName="gcon_test_dir"):
         return True
 
 
-def eval_blasr_alignment(record, qver_get_func, qvmean_get_func,
-                         sID_starts_with_c, qv_prob_threshold, debug=False):
+def eval_blasr_alignment(record, debug=False):
     """
     Takes a BLASRRecord (blasr -m 5) and goes through the
     alignment string
     ex: |||**||||**|||*|*|
     to determine the sequence of 'M' (matches), 'S' (sub), 'I', 'D'
 
-    qver_get_func --- could be either basQV.basQVcacher.get() or
-        basQV.basQVcacher.get_smoothed()
+    QVs are not used: every non-match ('S', 'I', 'D') counts as a penalty.
+    Per-base QVs used to be compared against dicts of mean QVs, which is
+    always True in python 2, so QVs never explained away a non-match.
 
-    For any non-match, if either or both query/target's QV indicate
-    that the event ('S', 'I', 'D') is expected
-    (ex: insertion prob >= qv_prob_threshold),
-    then it does not count as a penalty.
-
-    Returns: cigar string, binary ECE array
-
-    NOTE: long insertions/deletions are still a difficult problem
-    because alignments can be arbitrary right now the quick solution is:
-          use probqv get_smoothed
-    however, with homopolymers, penalization can still happen unless
-    I write code to check specifically for homopolymers, (otherwise the
-    cigar_str[-1]=='D' or 'I' sets in). -- Liz
+    Returns: cigar string, binary ECE array (np.uint8), computed by
+    pbtranscript.ice.c_IceUtils.eval_alignment
     """
     if debug:
         import pdb
         pdb.set_trace()
 
-    if record.qStrand == '+':
-        query_qver_get_func = lambda _name, _pos: qver_get_func(record.qID, _name, min(_pos+record.qStart, record.qLength-1))
-        query_qver_get_func1 = lambda _name, _pos: qver_get_func(record.qID, _name, min(_pos+record.qStart+1, record.qLength-1))
-    elif record.qStrand == '-':
-        query_qver_get_func = lambda _name, _pos: qver_get_func(record.qID, _name, max(0, record.qEnd-1-_pos))
-        query_qver_get_func1 = lambda _name, _pos: qver_get_func(record.qID, _name, max(0, record.qEnd-1-_pos-1))
-    else:
+    if record.qStrand not in ('+', '-'):
         raise Exception, "Unknown strand type {0}".format(record.qStrand)
-
-    if record.sStrand == '+':
-        subject_qver_get_func = lambda _name, _pos: qver_get_func(record.sID, _name, min(_pos+record.sStart, record.sLength-1))
-        subject_qver_get_func1 = lambda _name, _pos: qver_get_func(record.sID, _name, min(_pos+record.sStart+1, record.sLength-1))
-    elif record.sStrand == '-':
-        subject_qver_get_func = lambda _name, _pos: qver_get_func(record.sID, _name, max(0, record.sEnd-1-_pos))
-        subject_qver_get_func1 = lambda _name, _pos: qver_get_func(record.sID, _name, max(0, record.sEnd-1-_pos-1))
-    else:
+    if record.sStrand not in ('+', '-'):
         raise Exception, "Unknown strand type {0}".format(record.sStrand)
 
-    # if mean_qv_for_q|s is not given, always revert back to qv_prob_threshold
-    if qvmean_get_func is None:
-        mean_qv_for_q = {'D': qv_prob_threshold, 'S': qv_prob_threshold, 'I': qv_prob_threshold}
-        mean_qv_for_s = None if sID_starts_with_c else {'D': qv_prob_threshold, 'S': qv_prob_threshold, 'I': qv_prob_threshold}
-    else:
-        mean_qv_for_q = {'D': qvmean_get_func(record.qID, 'DeletionQV'),
-                         'I': qvmean_get_func(record.qID, 'InsertionQV'),
-                         'S': qvmean_get_func(record.qID, 'SubstitutionQV')}
-        if sID_starts_with_c:
-            mean_qv_for_s = None
-        else:
-            mean_qv_for_s = {'D': qvmean_get_func(record.sID, 'DeletionQV'),
-                            'I': qvmean_get_func(record.sID, 'InsertionQV'),
-                            'S': qvmean_get_func(record.sID, 'SubstitutionQV')}
-
-    q_index = 0
-    s_index = 0
-    last_state, last_tracking_nt, homopolymer_so_far = None, None, False
-    cigar_str = ''
-    # binary array of 0|1 where 1 is a penalty
-    ece = np.zeros(len(record.alnStr), dtype=np.int)
-    for offset, nt_aln in enumerate(record.alnStr):
-        if nt_aln == '|':  # match
-            cigar_str += 'M'
-            q_index += 1
-            s_index += 1
-            last_state = 'M'
-        elif record.qAln[offset] == '-':  # deletion
-            # for deletion, cases where consider a non-match
-            # (1) IF last position was not "D"
-            #        case 1a: both query and subject has very good prob
-            # (2) IF last position was "D" (q_index did not advance)
-            #        case 2a: both query and subject has very good prob
-            #        case 2b: subject has good prob; query has bad prob AND last-cur pos is NOT homopolymer
-            # case 1a and case 2a have the same condition
-            # case 2b arises because the only possible explanation would have been query have bad prob,
-            #   but it was used to explain the last deletion and the advanced S nucleotide is diff from the last S
-            s_is_good = sID_starts_with_c or subject_qver_get_func('InsertionQV', s_index) < mean_qv_for_s
-            q_is_good = query_qver_get_func1('DeletionQV', q_index) < mean_qv_for_q
-            if last_state != 'D': # entering D state now, record s
-                last_tracking_nt = record.sAln[offset]
-                homopolymer_so_far = True
-                if (s_is_good and q_is_good):
-                    ece[offset] = 1
-            else:  # already in D state, which means q_index did not advance, hence q_is_good is the same
-                homopolymer_so_far = (record.sAln[offset] == last_tracking_nt)
-                if (s_is_good and (q_is_good or not homopolymer_so_far)):
-                    ece[offset] = 1
-
-            cigar_str += 'D'
-            s_index += 1
-            last_state = 'D'
-        elif record.sAln[offset] == '-':  # insertion
-            # for insertion, cases where consider a non-match
-            # (1) IF last position was not "I"
-            #        case 1a: both query and subject has very good prob
-            # (2) IF last position was "I" (s_index did not advance)
-            #        case 2a: both query and subject has very good prob
-            #        case 2b: query has good prob; subject has bad prob AND last-cur pos is NOT homopolymer
-            q_is_good = query_qver_get_func('InsertionQV', q_index) < mean_qv_for_q
-            s_is_good = sID_starts_with_c or subject_qver_get_func1('DeletionQV', s_index) < mean_qv_for_s
-
-            if last_state != 'I':
-                last_tracking_nt = record.qAln[offset]
-                homopolymer_so_far = True
-                if (q_is_good and s_is_good):
-                    ece[offset] = 1
-            else: # already in "I" state, s_index did not advance, s_is_good is the same
-                homopolymer_so_far = (record.qAln[offset] == last_tracking_nt)
-                if q_is_good and (s_is_good or not homopolymer_so_far):
-                    ece[offset] = 1
-
-            cigar_str += 'I'
-            q_index += 1
-            last_state = 'I'
-        else:  # substitution
-            cigar_str += 'S'
-            if query_qver_get_func('SubstitutionQV', q_index) < mean_qv_for_q and \
-               (sID_starts_with_c or subject_qver_get_func('SubstitutionQV', s_index) < mean_qv_for_s):
-                ece[offset] = 1
-            q_index += 1
-            s_index += 1
-            last_state = 'S'
-
-    return cigar_str, ece
+    return eval_alignment(record.qAln, record.alnStr, record.sAln)
 
 
 class HitItem(object):
@@ -283,19 +178,28 @@ class HitItem(object):
     """
     Simply define an object class for saving items produced by
     blasr_against_ref or daligner_against_ref.
+
+    log_prob is the log probability of an aligned hit, computed by
+    eval_hit_record (0. if no probability model is given), or None if
+    the hit is rejected, or accepted without alignment checking (i.e.,
+    daligner_against_ref(no_qv_or_aln_checking=True), for nfl reads
+    whose hits are used as membership only).
     """
 
     def __init__(self, qID, cID, qStart=None, qEnd=None,
-                 missed_q=None, missed_t=None,
-                 fakecigar=None, ece_arr=None):
+                 missed_q=None, missed_t=None, log_prob=None):
         self.qID = qID
         self.cID = cID
         self.qStart = qStart
         self.qEnd = qEnd
         self.missed_q = missed_q
         self.missed_t = missed_t
-        self.fakecigar = fakecigar
-        self.ece_arr = ece_arr
+        self.log_prob = log_prob
+
+    @property
+    def aligned(self):
+        """Return True if qID aligns to cID, i.e., the hit is not rejected."""
+        return self.qStart is not None
 
     def __str__(self):
         return """{qID}/{qStart}_{qEnd} aligns to {cID}""".format(
@@ -303,19 +207,19 @@ class HitItem(object):
                 qStart=self.qStart, qEnd=self.qEnd)
 
 def blasr_against_ref(output_filename, is_FL, sID_starts_with_c,
-                      qver_get_func, qvmean_get_func, qv_prob_threshold=.03,
                       ece_penalty=1, ece_min_len=20, same_strand_only=True,
-                      max_missed_start=200, max_missed_end=50):
+                      max_missed_start=200, max_missed_end=50, probqv=None):
     """
     Excluding criteria:
     (1) self hit
     (2) opposite strand hit  (should already be in the same orientation;
         can override with <same_strand_only> set to False)
     (3) less than 90% aligned or more than 50 bp missed
+    (4) alignment has large non-matches, every non-match is a penalty,
+        regardless of QVs (see eval_blasr_alignment)
 
-    qver_get_func --- should be basQV.basQVcacher.get() or
-                      .get_smoothed(), or can just pass in
-                      lambda (x, y): 1. to ignore QV
+    probqv --- if not None, a probability model (e.g., ProbFromQV) used to
+               compute log_prob of accepted hits, see eval_hit_record
     """
     with BLASRM5Reader(output_filename) as reader:
         for r in reader:
@@ -353,44 +257,37 @@ def blasr_against_ref(output_filename, is_FL, sID_starts_with_c,
                           (r.qLength - r.qEnd > max_missed_end)):
                 yield HitItem(qID=r.qID, cID=cID)
             else:
-                cigar_str, ece_arr = eval_blasr_alignment(
-                    record=r,
-                    qver_get_func=qver_get_func,
-                    qvmean_get_func=qvmean_get_func,
-                    sID_starts_with_c=sID_starts_with_c,
-                    qv_prob_threshold=qv_prob_threshold)
-
-                if alignment_has_large_nonmatch(ece_arr,
-                                                ece_penalty, ece_min_len):
+                log_prob = eval_hit_record(r, probqv, ece_penalty, ece_min_len)
+                if log_prob is None:  # large non-matches
                     yield HitItem(qID=r.qID, cID=cID)
                 else:
                     yield HitItem(qID=r.qID, cID=cID,
                                   qStart=r.qStart, qEnd=r.qEnd,
                                   missed_q=missed_q * 1. / r.qLength,
                                   missed_t=missed_t * 1. / r.sLength,
-                                  fakecigar=cigar_str,
-                                  ece_arr=ece_arr)
+                                  log_prob=log_prob)
 
 
 def daligner_against_ref(query_dazz_handler, target_dazz_handler, la4ice_filename,
                          is_FL, sID_starts_with_c,
-                         qver_get_func, qvmean_get_func, qv_prob_threshold=.03,
                          ece_penalty=1, ece_min_len=20, same_strand_only=True, no_qv_or_aln_checking=False,
-                         max_missed_start=200, max_missed_end=50):
+                         max_missed_start=200, max_missed_end=50, probqv=None):
     """
     Excluding criteria:
     (1) self hit
     (2) opposite strand hit  (should already be in the same orientation;
         can override with <same_strand_only> set to False)
     (3) less than 90% aligned or more than 50 bp missed
+    (4) alignment has large non-matches, unless no_qv_or_aln_checking
 
     Parameters:
       query_dazz_handler - query dazz handler in DalignRunner
       target_dazz_handler - target dazz handler in DalignRunner
       la4ice_filename - la4ice output of DalignRunner
-      qver_get_func - returns a list of qvs of (read, qvname)
-                      e.g. basQV.basQVcacher.get() or .get_smoothed()
-      qvmean_get_func - which returns mean QV of (read, qvname)
+      no_qv_or_aln_checking - if True, accept hits without checking
+               alignments, log_prob of such hits is None
+      probqv - if not None, a probability model (e.g., ProbFromQV) used to
+               compute log_prob of accepted hits, see eval_hit_record
     """
     for r in LA4IceReader(la4ice_filename):
         missed_q = r.qStart + r.qLength - r.qEnd
@@ -427,9 +324,7 @@ def daligner_against_ref(query_dazz_handler, target_dazz_handler, la4ice_filenam
             yield HitItem(qID=r.qID, cID=cID,
                           qStart=r.qStart, qEnd=r.qEnd,
                           missed_q=missed_q * 1. / r.qLength,
-                          missed_t=missed_t * 1. / r.sLength,
-                          fakecigar=1,
-                          ece_arr=1)
+                          missed_t=missed_t * 1. / r.sLength)
             continue
 
         # full-length case: allow up to 200bp of 5' not aligned
@@ -439,23 +334,78 @@ def daligner_against_ref(query_dazz_handler, target_dazz_handler, la4ice_filenam
                        (r.qLength - r.qEnd > max_missed_end))):
             yield HitItem(qID=r.qID, cID=cID)
         else:
-            cigar_str, ece_arr = eval_blasr_alignment(
-                record=r,
-                qver_get_func=qver_get_func,
-                sID_starts_with_c=sID_starts_with_c,
-                qv_prob_threshold=qv_prob_threshold,
-                qvmean_get_func=qvmean_get_func)
-            #else: # don't use QV, just look at alignment
-
-            if alignment_has_large_nonmatch(ece_arr, ece_penalty, ece_min_len):
+            log_prob = eval_hit_record(r, probqv, ece_penalty, ece_min_len)
+            if log_prob is None:  # large non-matches
                 yield HitItem(qID=r.qID, cID=cID)
             else:
                 yield HitItem(qID=r.qID, cID=cID,
                               qStart=r.qStart, qEnd=r.qEnd,
                               missed_q=missed_q * 1. / r.qLength,
                               missed_t=missed_t * 1. / r.sLength,
-                              fakecigar=cigar_str,
-                              ece_arr=ece_arr)
+                              log_prob=log_prob)
+
+
+def _daligner_hits_of_file(la4ice_filename):
+    """
+    Worker of daligner_against_refs, evaluate hits in a LA4Ice output file
+    and return a list of compact tuples of HitItem fields.
+    """
+    kwargs = dict(fork_state())
+    aligned_only = kwargs.pop('aligned_only')
+    return [(h.qID, h.cID, h.qStart, h.qEnd, h.missed_q, h.missed_t, h.log_prob)
+            for h in daligner_against_ref(la4ice_filename=la4ice_filename, **kwargs)
+            if h.aligned or not aligned_only]
+
+
+def daligner_against_refs(la4ice_filenames, num_processes=1,
+                          aligned_only=False, **kwargs):
+    """
+    Yield HitItems of daligner_against_ref(la4ice_filename=f, **kwargs)
+    for each f in la4ice_filenames (e.g., DalignerRunner.la4ice_filenames),
+    in the same order as calling daligner_against_ref serially.
+
+    If num_processes > 1, files are evaluated in a pool of forked worker
+    processes. Workers share QVs of the probability model with the parent
+    process (QVs are stored in numpy buffers or a memory-mapped QV cache,
+    so they are not copied), and only send back compact tuples of hits.
+
+    aligned_only --- if True, skip rejected hits (see HitItem.aligned)
+    """
+    if num_processes <= 1 or len(la4ice_filenames) <= 1:
+        for la4ice_filename in la4ice_filenames:
+            for hit in daligner_against_ref(la4ice_filename=la4ice_filename, **kwargs):
+                if hit.aligned or not aligned_only:
+                    yield hit
+        return
+
+    # Workers inherit kwargs, including dazz handlers and the probability
+    # model, instead of unpickling them per task.
+    with fork_pool(min(num_processes, len(la4ice_filenames)),
+                   dict(kwargs, aligned_only=aligned_only)) as pool:
+        for items in pool.imap(_daligner_hits_of_file, la4ice_filenames):
+            for item in items:
+                yield HitItem(*item)
+
+
+def eval_hit_record(record, probqv, ece_penalty, ece_min_len):
+    """
+    Check whether an alignment record (BLASRRecord or LA4IceRecord) has
+    large non-matches, and if not, compute its log probability using
+    probqv, all in one pass over the alignment without building a cigar
+    string or an ECE array. This is equivalent to, but much faster than,
+    eval_blasr_alignment + alignment_has_large_nonmatch +
+    probqv.calc_prob_from_aln.
+
+    Return None if the alignment has large non-matches, otherwise
+    log probability of the alignment (0. if probqv is None).
+    """
+    if probqv is None:
+        return eval_hit(record.qAln, record.alnStr, record.sAln,
+                        ece_penalty, ece_min_len)
+    return probqv.calc_prob_from_hit(record.qID, record.qStart, record.qEnd,
+                                     record.qAln, record.alnStr, record.sAln,
+                                     ece_penalty, ece_min_len)
+
 
 def alignment_has_large_nonmatch(ece_arr, penalty, min_len):
     """
@@ -468,28 +418,40 @@ def alignment_has_large_nonmatch(ece_arr, penalty, min_len):
     by low base QVs (in other words, "reject" as an isoform hit and
     don't put in the same cluster)
     """
-    ece_arr = ece_arr * (penalty + 1)
-    s = [0] + list(ece_arr - penalty)
-    # fix this later to something faster & better
-    return len(findECE(s, len(s), min_len, True)) > 0
+    return large_nonmatch(np.asarray(ece_arr, dtype=np.uint8), penalty, min_len)
 
 
-def possible_merge(r, ece_penalty, ece_min_len,
-                   max_missed_start=200, max_missed_end=50):
+def possible_merge_prefilter(r, max_missed_start=200, max_missed_end=50):
     """
-    r --- BLASRM5Record
-    Criteria:
+    Criteria of possible_merge which only look at the header of r
+    (not alignment strings), can be used as a LA4IceReader prefilter.
     (1) identity >= 90% and same strand
     (2) check criteria for how much is allowed to differ on the
         5' / 3' ends
     """
-    if r.sID == r.qID or r.identity < 90 or r.strand == '-':
+    if r.identity < 90 or r.strand == '-':
         return False
     # intentional here to prevent disrupting future ICE runs
     # MORE lenient on 5' but NOT on 3'
     if ((r.qLength - r.qEnd) > max_missed_end or (r.sLength - r.sEnd) > max_missed_end or
             r.qStart > max_missed_start or r.sStart > max_missed_start):
         return False
+    return True
+
+
+def possible_merge(r, ece_penalty, ece_min_len,
+                   max_missed_start=200, max_missed_end=50):
+    """
+    r --- BLASRM5Record
+    Criteria:
+    (1) identity >= 90% and same strand
+    (2) check criteria for how much is allowed to differ on the
+        5' / 3' ends
+    (3) no large non-matches
+    """
+    if r.sID == r.qID or not possible_merge_prefilter(
+            r, max_missed_start=max_missed_start, max_missed_end=max_missed_end):
+        return False
 
     arr = np.array([(x == '*') * 1 for x in r.alnStr])
     if alignment_has_large_nonmatch(ece_arr=arr,
@@ -564,105 +526,63 @@ def concat_sam(samfiles, outsam_filename):
     @RG     ID:2caa54eef6   PU:in.raw_with_partial.fasta       SM:NO_CHIP_ID
     @PG     ID:BLASR        VN:1.3.1.126469 CL:blasr in.raw_with_partial.fasta g_consensus.fasta -nproc 12 -bestn 5 -nCandidates 10 -sam -out out.sam
 
-    NOTE: check for M5 conflicts; manipulate them if it conflicts
-    """
-    f_sq = open(outsam_filename + '.sq', 'w')
-    f_bd = open(outsam_filename + '.bd', 'w')
-
-    rg_line = None
-    pg_line = None
-
-    md5_seen = set()
+    Write @HD of the first sam, @SQ of all sams, @RG and @PG of the first
+    sam, then stream alignments of all sams to outsam_filename.
 
+    NOTE: check for M5 conflicts; if an M5 is already seen, replace it by
+    md5 of itself (repeatedly), so that the output is deterministic.
+    """
     if len(samfiles) == 0:
         raise ValueError("No sam input files to concatenate.")
 
-    h = open(samfiles[0])
-    line = h.readline()
-    assert line.startswith('@HD')
-    f_sq.write(line)
-    line = h.readline()
-    assert line.startswith('@SQ')
-    line = h.readline()
-    assert line.startswith('@RG')
-    rg_line = line  # write at the end
-    line = h.readline()
-    assert line.startswith('@PG')
-    pg_line = line  # write at the end
-    h.close()
-
-    for f in samfiles:
+    sq_lines = []
+    md5_seen = set()
+    for i, f in enumerate(samfiles):
         with open(f) as h:
-            assert h.readline().startswith('@HD')
+            hd_line = h.readline()
+            assert hd_line.startswith('@HD')
             line = h.readline()
             assert line.startswith('@SQ')
             # ------- check for MD5 conflicts ----------- #
             m5 = line.strip().split()[-1]
             assert m5.startswith("M5:")
-            if m5 not in md5_seen:
-                f_sq.write(line)
-                md5_seen.add(m5)
-            else:
-                s = list(m5[3:])
-                while True:
-                    # create a random m5 string.
-                    random.shuffle(s)
-                    s = "".join(s)
-                    if s not in md5_seen:
-                        break
+            m5 = m5[3:]
+            if m5 in md5_seen:
+                s = m5
+                while s in md5_seen:
+                    s = hashlib.md5(s).hexdigest()
                 line = line[:line.find('M5:')] + 'M5:' + s + '\n'
                 logging.debug("MD5 conflict: change to {0}".format(s))
-                md5_seen.add(s)
-                f_sq.write(line)
-            # ----- end MD5 checking and writing --------- #
-            assert h.readline().startswith('@RG')
-            assert h.readline().startswith('@PG')
-            for line in h:
-                f_bd.write(line)
-
-    f_bd.close()
-    f_sq.write(rg_line)
-    f_sq.write(pg_line)
-    f_sq.close()
-
-    cmd = "cat {0}.sq {0}.bd > {0}".format(real_upath(outsam_filename))
-    execute(cmd=cmd,
-            errmsg="Failed to concat sam files! Abort.",
-            errcls=IOError)
-
-    os.remove(f_sq.name)
-    os.remove(f_bd.name)
-
-
-def concat_bam_header(in_fns, out_fn=None):
-    """Concat bam headers in in_fns and save to out_fn,
-    return the merged bam header as an instance of BamHeader"""
-    from pbtranscript.io import BamHeader
-    h = BamHeader(ignore_pg=True)
-    for in_fn in in_fns:
-        s = Samfile(in_fn, 'rb')
-        h.add(s.header)
-        s.close()
-    if out_fn is not None:
-        o = Samfile(out_fn, 'wh', header=h.header)
-        o.close()
-    return h
+                m5 = s
+            md5_seen.add(m5)
+            sq_lines.append(line)
+            # ----- end MD5 checking --------- #
+            rg_line = h.readline()
+            assert rg_line.startswith('@RG')
+            pg_line = h.readline()
+            assert pg_line.startswith('@PG')
+            if i == 0:
+                # write @HD, @RG and @PG of the first sam file
+                header_lines = (hd_line, rg_line, pg_line)
+
+    with open(outsam_filename, 'w') as writer:
+        writer.write(header_lines[0])
+        writer.writelines(sq_lines)
+        writer.writelines(header_lines[1:])
+        for f in samfiles:
+            with open(f) as h:
+                for dummy_i in range(4): # skip @HD, @SQ, @RG, @PG
+                    h.readline()
+                shutil.copyfileobj(h, writer)
 
 
 def concat_bam(in_fns, out_fn):
     """Concat input bam files to an output bam file.
-    Note that each input bam has ONLY one reference sequence.
+    Headers are merged once and tids are remapped by reference names,
+    compressed records are streamed without decoding,
+    see pbtranscript.io.BamConcat.
     """
-    # construct sam header
-    h = concat_bam_header(in_fns)
-    o = BamWriter(out_fn, header=h)
-    for index, in_fn in enumerate(in_fns):
-        s = Samfile(in_fn, 'rb')
-        for r in s:
-            r.tid = index # Overwrite tid !!!
-            o.write(r)
-        s.close()
-    o.close()
+    concat_bam_files(in_fns, out_fn)
 
 
 def convert_fofn_to_fasta(fofn_filename, out_filename, fasta_out_dir,
@@ -716,32 +636,16 @@ def build_sa(input_fasta, out_sa):
         raise IOError("Unable to find fasta file {f}.".format(f=input_fasta))
 
 
-def trim_subreads_and_write(reader, in_seqids, out_file, trim_len, min_len,
-                            ignore_keyerror=False, bam=False):
-    """ Extract (dump) raw subreads of every zmws from in_seqeids from reader
-    to out_file.
-        reader --- provides random access to raw subreads in input file.
-                   type = MetaSubreadFastaReader, when input files are in FASTA,
-                   and reads are in format <movie>/<holeNumber>/<subread or CCS>.
-                   type = BamCollection, when input files are in BAM.
-        trim_len --- trim the first and last n bases when input is BAM
-        min_len --- minimum read length to write a subread when input is BAM
-        in_seqids --- zmw ids to dump
-        out_file --- a FASTA file when input files are in FASTA; a BAM file when
-                     input files are in BAM.
-        return movies seen
+def iter_trimmed_subreads(reader, in_seqids, trim_len, min_len,
+                          ignore_keyerror=False, bam=False, movies=None):
+    """ Iterate over raw subreads of every zmws from in_seqids in reader,
+    each of which is trimmed by trim_len bases at both ends.
+        reader --- MetaSubreadFastaReader or BamCollection, see
+                   trim_subreads_and_write
+        movies --- if not None, add movies of zmws seen to this set
+    Yield pysam AlignedSegment objects if bam, otherwise (name, sequence).
     """
-    movies = set()
     zmw_seen = set()
-    f = None # output open file handler
-
-    if bam:
-        assert isinstance(reader, BamCollection)
-        f = BamWriter(out_file, reader.header)
-    else:
-        assert isinstance(reader, MetaSubreadFastaReader)
-        f = FastaWriter(out_file)
-
     for seqid in in_seqids:
         zmw = seqid
         try:
@@ -750,14 +654,15 @@ def trim_subreads_and_write(reader, in_seqids, out_file, trim_len, min_len,
             raise ValueError("%s does not contain a valid pacbio zmw id." % seqid)
 
         if zmw not in zmw_seen:
-            movies.add(zmw.split('/')[0])
+            if movies is not None:
+                movies.add(zmw.split('/')[0])
             zmw_seen.add(zmw)
             try:
                 if bam:
                     for rec in reader[zmw].subreads:
                         if len(rec) >= 2*trim_len + min_len:
-                            f.write(rec.Clip(rec.readStart+trim_len,
-                                             rec.readEnd-trim_len))
+                            yield rec.Clip(rec.readStart+trim_len,
+                                           rec.readEnd-trim_len)
                 else:
                     for rec in reader[zmw]:
                         if len(rec) >= 2*trim_len + min_len:
@@ -765,22 +670,57 @@ def trim_subreads_and_write(reader, in_seqids, out_file, trim_len, min_len,
                                 m, hn, s_e = rec.name.split('/')
                                 s, e = [int(x) for x in s_e.split('_')]
                                 new_id = "%s/%s/%d_%d" % (m, hn, s+trim_len, e-trim_len)
-                                f.writeRecord(new_id, rec.sequence[trim_len:-trim_len])
                             except ValueError:
                                 raise ValueError("%s is not a valid pacbio subread." % rec.name)
+                            yield (new_id, rec.sequence[trim_len:-trim_len])
             except KeyError:
                 if ignore_keyerror:
                     logging.warning("Ignoring {zmw} because the input FASTA/BAM ".
                                     format(zmw=zmw) + " does not contain it.")
                 else:
                     raise ValueError("{0} doesn't exist. Abort!".format(zmw))
+
+
+def trim_subreads_and_write(reader, in_seqids, out_file, trim_len, min_len,
+                            ignore_keyerror=False, bam=False):
+    """ Extract (dump) raw subreads of every zmws from in_seqeids from reader
+    to out_file.
+        reader --- provides random access to raw subreads in input file.
+                   type = MetaSubreadFastaReader, when input files are in FASTA,
+                   and reads are in format <movie>/<holeNumber>/<subread or CCS>.
+                   type = BamCollection, when input files are in BAM.
+        trim_len --- trim the first and last n bases when input is BAM
+        min_len --- minimum read length to write a subread when input is BAM
+        in_seqids --- zmw ids to dump
+        out_file --- a FASTA file when input files are in FASTA; a BAM file when
+                     input files are in BAM.
+        return movies seen
+    """
+    movies = set()
+    f = None # output open file handler
+
+    if bam:
+        assert isinstance(reader, BamCollection)
+        f = BamWriter(out_file, reader.header)
+    else:
+        assert isinstance(reader, MetaSubreadFastaReader)
+        f = FastaWriter(out_file)
+
+    for rec in iter_trimmed_subreads(reader=reader, in_seqids=in_seqids,
+                                     trim_len=trim_len, min_len=min_len,
+                                     ignore_keyerror=ignore_keyerror,
+                                     bam=bam, movies=movies):
+        if bam:
+            f.write(rec)
+        else:
+            f.writeRecord(*rec)
     f.close()
 
     return movies
 
 
 def blasr_for_quiver(query_fn, ref_fasta, out_fn, bam=False,
-                     run_cmd=True, blasr_nproc=12):
+                     run_cmd=True, blasr_nproc=12, bestn=5, nCandidates=10):
     """
     query_fn  --- should be in.raw.fasta|bam
     ref_fasta --- reference fasta (ex: g_consensus.fasta) to align to
@@ -792,7 +732,7 @@ def blasr_for_quiver(query_fn, ref_fasta, out_fn, bam=False,
     cmd = "blasr {i} ".format(i=real_upath(query_fn)) + \
           "{r} ".format(r=real_upath(ref_fasta)) + \
           "--nproc {n} ".format(n=blasr_nproc) + \
-          "--bestn 5 --nCandidates 10 " + \
+          "--bestn {b} --nCandidates {c} ".format(b=bestn, c=nCandidates) + \
           ("--sam --clipping soft " if not bam else "--bam ") + \
           "--out {o} ".format(o=real_upath(out_fn)) + \
           "1>/dev/null 2>/dev/null"
@@ -803,6 +743,86 @@ def blasr_for_quiver(query_fn, ref_fasta, out_fn, bam=False,
     return cmd
 
 
+# Mapping quality blasr assigns to a unique hit, e.g., a subread aligned
+# to consensus of its own cluster only.
+BLASR_UNIQUE_MAPQ = 254
+
+
+def filter_alignments_of_clusters(in_fn, out_fn, ref_cids, owners, bam=False):
+    """
+    Filter alignments of subreads of many clusters to consensus sequences
+    of these clusters (e.g., output of a batched blasr_for_quiver), only
+    keep alignments of subreads to consensus of their own clusters, and
+    only keep references which have alignments in header.
+
+    Mapping qualities of kept alignments are reset to BLASR_UNIQUE_MAPQ,
+    as if each subread were aligned to consensus of its own cluster only,
+    because blasr spreads mapping qualities across hits to similar
+    isoforms, and quiver|arrow drop alignments of low mapping qualities.
+
+    in_fn --- input sam|bam file
+    out_fn --- output sam|bam file
+    ref_cids --- {reference name: cluster id}
+    owners --- {zmw: set of clusters which the zmw is assigned to}
+    Return cluster ids of references which have alignments, in the order
+    of references in header of in_fn.
+    """
+    def _keep(qname, rname):
+        """Return True if subread qname belongs to cluster of rname."""
+        return ref_cids.get(rname, None) in \
+               owners.get('/'.join(qname.split('/')[0:2]), ())
+
+    if bam:
+        s = Samfile(in_fn, 'rb', check_sq=False)
+        refs = list(s.references)
+        kept_tids = set(r.tid for r in s
+                        if r.tid >= 0 and _keep(r.query_name, refs[r.tid]))
+        s.close()
+
+        s = Samfile(in_fn, 'rb', check_sq=False)
+        header = dict(s.header)
+        header['SQ'] = [sq for tid, sq in enumerate(header.get('SQ', []))
+                        if tid in kept_tids]
+        new_tids = dict((tid, i) for i, tid in enumerate(sorted(kept_tids)))
+        o = Samfile(out_fn, 'wb', header=header)
+        for r in s:
+            if r.tid in kept_tids and _keep(r.query_name, refs[r.tid]):
+                r.tid = new_tids[r.tid]
+                r.mapping_quality = BLASR_UNIQUE_MAPQ
+                o.write(r)
+        o.close()
+        s.close()
+        valid_refs = [refs[tid] for tid in sorted(kept_tids)]
+    else:
+        refs, kept_refs = [], set()
+        with open(in_fn, 'r') as reader:
+            for line in reader:
+                if line.startswith('@SQ'):
+                    refs.extend(f[3:] for f in line.rstrip('\n').split('\t')
+                                if f.startswith('SN:'))
+                elif not line.startswith('@'):
+                    fields = line.split('\t', 3)
+                    if _keep(fields[0], fields[2]):
+                        kept_refs.add(fields[2])
+
+        with open(in_fn, 'r') as reader, open(out_fn, 'w') as writer:
+            for line in reader:
+                if line.startswith('@SQ'):
+                    if any(f[3:] in kept_refs for f in line.rstrip('\n').split('\t')
+                           if f.startswith('SN:')):
+                        writer.write(line)
+                elif line.startswith('@'):
+                    writer.write(line)
+                else:
+                    fields = line.split('\t', 5)
+                    if fields[2] in kept_refs and _keep(fields[0], fields[2]):
+                        fields[4] = str(BLASR_UNIQUE_MAPQ)
+                        writer.write('\t'.join(fields))
+        valid_refs = [ref for ref in refs if ref in kept_refs]
+
+    return [ref_cids[ref] for ref in valid_refs]
+
+
 def num_reads_in_fasta(in_fa):
     """Return the number of reads in the in_fa fasta file."""
     if (not in_fa.endswith(".fa")) and (not in_fa.endswith(".fasta")):
@@ -979,9 +999,9 @@ def fafn2fqfn(fafn):
         return fafn + ".fastq"
 
 
-def ice_fa2fq(in_fa, ccs_fofn, out_fq):
-    """Convert an input FASTA file to an output FASTQ file,
-       reading QVs from the input ccs.h5, ccs.bam or ccs FOFN.
+def _iter_reads_and_qvs(in_fa, ccs_fofn):
+    """Yield (read, qvs) for every read in an input FASTA file,
+       reading QualityValue from the input ccs.h5, ccs.bam or ccs FOFN.
     """
     ccs_fns = get_files_from_file_or_fofn(ccs_fofn)
     fmt = guess_file_format(ccs_fns)
@@ -997,8 +1017,7 @@ def ice_fa2fq(in_fa, ccs_fofn, out_fq):
         raise IOError("ice_fa2fq does not support input %s." %
                       ccs_fofn)
 
-    with ContigSetReaderWrapper(in_fa) as reader, \
-            FastqWriter(out_fq) as writer:
+    with ContigSetReaderWrapper(in_fa) as reader:
         for r in reader:
             logging.debug("Getting QVs for {name} ...".format(name=r.name))
             seqid = r.name.split(' ')[0]
@@ -1024,7 +1043,7 @@ def ice_fa2fq(in_fa, ccs_fofn, out_fq):
             if len(r.sequence) != len(qvs):
                 raise ValueError("Sequence and QVs of {r} should be the same!".
                                  format(r=r.name))
-            writer.writeRecord(r.name, r.sequence[:], qvs)
+            yield r, qvs
 
     if fmt == FILE_FORMATS.H5:
         for bas_file, bas_handler in bas_handlers.iteritems():
@@ -1034,6 +1053,53 @@ def ice_fa2fq(in_fa, ccs_fofn, out_fq):
         qver.close()
 
 
+def ice_fa2fq(in_fa, ccs_fofn, out_fq):
+    """Convert an input FASTA file to an output FASTQ file,
+       reading QVs from the input ccs.h5, ccs.bam or ccs FOFN.
+    """
+    with FastqWriter(out_fq) as writer:
+        for r, qvs in _iter_reads_and_qvs(in_fa=in_fa, ccs_fofn=ccs_fofn):
+            writer.writeRecord(r.name, r.sequence[:], qvs)
+
+
+def ice_fa2qvcache(in_fas, ccs_fofn, out_cache, use_finer_qv=False):
+    """
+    Build a QV cache file of all reads in input FASTA files, reading QVs
+    from the input ccs.h5, ccs.bam or ccs FOFN, so that QVs are extracted
+    only once, then memory mapped by ICE, ice_partial and polish steps.
+        use_finer_qv --- if True, cache InsertionQV, SubstitutionQV and
+                         DeletionQV for ProbFromQV, otherwise, cache
+                         QualityValue for ProbFromFastq.
+    Reuse out_cache if it has already been built from the same inputs.
+    """
+    attrs = {'in_fas': [realpath(fa) for fa in in_fas],
+             'ccs_fofn': realpath(ccs_fofn),
+             'use_finer_qv': use_finer_qv}
+    if op.exists(out_cache):
+        try:
+            if QVStore.open(out_cache).attrs.get('sources') == attrs:
+                logging.info("Reusing QV cache %s", out_cache)
+                return
+        except (IOError, ValueError, KeyError):
+            pass
+        logging.info("Rebuilding QV cache %s", out_cache)
+
+    if use_finer_qv:
+        probqv = ProbFromQV(input_fofn=ccs_fofn)
+        for in_fa in in_fas:
+            probqv.add_seqs_from_fasta(in_fa)
+    else:
+        probqv = ProbFromFastq()
+        for in_fa in in_fas:
+            seqids, qvs = [], []
+            for r, read_qvs in _iter_reads_and_qvs(in_fa=in_fa, ccs_fofn=ccs_fofn):
+                seqids.append(r.name.split()[0])
+                qvs.append(read_qvs)
+            probqv.add_seqs_from_qvs(seqids, qvs)
+    probqv.qver.qv.attrs['sources'] = attrs
+    probqv.write_qv_cache(out_cache)
+
+
 def set_probqv_from_ccs(ccs_fofn, fasta_filename):
     """Set probability and quality values from ccs.h5,
     return probqv, log_info."""
@@ -1066,6 +1132,24 @@ def set_probqv_from_fq(fastq_filename):
     return probqv, msg
 
 
+def set_probqv_from_qv_cache(qv_cache_filename, fasta_filename,
+                             use_finer_qv=False, ccs_fofn=None):
+    """Set probability and QVs of reads in fasta_filename from a QV cache
+    file built by ice_fa2qvcache, return probqv, log_info."""
+    start_t = time.time()
+    if use_finer_qv:
+        probqv = ProbFromQV(input_fofn=ccs_fofn,
+                            fasta_filename=fasta_filename,
+                            qv_cache_filename=qv_cache_filename)
+    else:
+        probqv = ProbFromFastq(qv_cache_filename=qv_cache_filename)
+        probqv.add_seqs_from_fasta(fasta_filename)
+    msg = "Loading QVs of {fa} from {f} took {t} sec.".\
+          format(fa=fasta_filename, f=qv_cache_filename,
+                 t=(time.time()-start_t))
+    return probqv, msg
+
+
 def write_cluster_report(report_fn, uc, partial_uc):
     """
     Write a CSV report to report_fn, each line contains three columns:
@@ -0,0 +1,304 @@
+"""
+Define MembershipMatrix, a sparse matrix of membership probabilities
+of reads in clusters, used by IceIterative.
+"""
+from array import array
+import numpy as np
+
+__all__ = ["MembershipMatrix"]
+
+
+class MembershipMatrix(object):
+
+    """
+    A sparse matrix of membership log probabilities, read --> cluster --> P(read|C_i).
+
+    Reads are encoded as integer row indices, a row stores ids of clusters
+    and log probabilities of the read in two compact parallel arrays, in
+    insertion order. A column index (cluster id --> set of rows) makes
+    deleting or invalidating a cluster cost O(number of reads aligned
+    to the cluster) instead of O(number of reads).
+
+    A read may be present with no cluster (an empty row), which means
+    that the read has been looked at but matches no cluster.
+
+    to_dict() and from_dict() convert from/to the dict of dicts
+    (seqid --> cid --> log prob) which is written to pickle and json files.
+    to_arrays() and from_arrays() convert from/to numpy arrays in CSR
+    format, which are written to ICE checkpoints.
+    """
+
+    def __init__(self):
+        self._row_of = {}    # read id --> row index
+        self._read_ids = []  # row index --> read id, None if row is free
+        self._cids = []      # row index --> array of cluster ids or None
+        self._probs = []     # row index --> array of log probs or None
+        self._free_rows = []
+        self._col = {}       # cluster id --> set of row indices
+
+    def __len__(self):
+        return len(self._row_of)
+
+    def __contains__(self, qid):
+        return qid in self._row_of
+
+    def __iter__(self):
+        """Iterate over read ids, in row order."""
+        return (qid for qid in self._read_ids if qid is not None)
+
+    def __eq__(self, another):
+        return isinstance(another, MembershipMatrix) and \
+            self.to_dict() == another.to_dict()
+
+    def __ne__(self, another):
+        return not self.__eq__(another)
+
+    def __repr__(self):
+        return "<MembershipMatrix of {r} reads, {c} clusters, {n} probs>".\
+            format(r=len(self), c=len(self._col), n=self.nnz)
+
+    @property
+    def nnz(self):
+        """Return the number of (read, cluster) probabilities."""
+        return sum(len(rows) for rows in self._col.itervalues())
+
+    def _row(self, qid):
+        """Return row index of read qid, raise KeyError if not exists."""
+        return self._row_of[qid]
+
+    def add_read(self, qid):
+        """Add read qid with no cluster if it is not present, return its row."""
+        try:
+            return self._row_of[qid]
+        except KeyError:
+            if self._free_rows:
+                row = self._free_rows.pop()
+                self._read_ids[row] = qid
+            else:
+                row = len(self._read_ids)
+                self._read_ids.append(qid)
+                self._cids.append(None)
+                self._probs.append(None)
+            self._row_of[qid] = row
+            return row
+
+    def _clear_row(self, row):
+        """Remove all clusters from a row."""
+        cids = self._cids[row]
+        if cids is not None:
+            for cid in cids:
+                self._discard_from_col(cid, row)
+            self._cids[row] = None
+            self._probs[row] = None
+
+    def _discard_from_col(self, cid, row):
+        """Remove row from column cid, drop the column if it is empty."""
+        rows = self._col[cid]
+        rows.discard(row)
+        if len(rows) == 0:
+            del self._col[cid]
+
+    def _remove_entry(self, row, cid):
+        """Remove cluster cid from a row, return False if not present."""
+        cids = self._cids[row]
+        try:
+            idx = cids.index(cid)
+        except (AttributeError, ValueError):  # empty row or cid not in row
+            return False
+        if len(cids) == 1:
+            self._cids[row] = None
+            self._probs[row] = None
+        else:
+            cids.pop(idx)
+            self._probs[row].pop(idx)
+        return True
+
+    def reset_read(self, qid, items=()):
+        """Add read qid if not present, then replace its probabilities
+        with (cid, log prob) pairs in items, e.g., reset_read(qid) makes
+        qid match no cluster, and reset_read(qid, [(cid, -0)]) freezes qid
+        in cluster cid."""
+        row = self.add_read(qid)
+        self._clear_row(row)
+        for cid, prob in items:
+            self._set(row, cid, prob)
+
+    def delete_read(self, qid):
+        """Delete read qid and all its probabilities."""
+        row = self._row_of.pop(qid)
+        self._clear_row(row)
+        self._read_ids[row] = None
+        self._free_rows.append(row)
+
+    def set(self, qid, cid, prob):
+        """Set log probability of read qid in cluster cid, add qid if
+        it is not present."""
+        self._set(self.add_read(qid), cid, prob)
+
+    def _set(self, row, cid, prob):
+        """Set log probability of row in cluster cid."""
+        cids = self._cids[row]
+        if cids is None:
+            self._cids[row] = array('l', [cid])
+            self._probs[row] = array('d', [prob])
+        else:
+            try:
+                self._probs[row][cids.index(cid)] = prob
+                return
+            except ValueError:
+                cids.append(cid)
+                self._probs[row].append(prob)
+        self._col.setdefault(cid, set()).add(row)
+
+    def get(self, qid, cid, default=None):
+        """Return log probability of read qid in cluster cid, or default
+        if qid does not align to cid. Raise KeyError if qid is not present."""
+        row = self._row(qid)
+        cids = self._cids[row]
+        if cids is not None:
+            try:
+                return self._probs[row][cids.index(cid)]
+            except ValueError:
+                pass
+        return default
+
+    def has(self, qid, cid):
+        """Return True if read qid has a probability in cluster cid."""
+        cids = self._cids[self._row(qid)]
+        return cids is not None and cid in cids
+
+    def num_clusters(self, qid):
+        """Return the number of clusters which read qid aligns to."""
+        cids = self._cids[self._row(qid)]
+        return 0 if cids is None else len(cids)
+
+    def items(self, qid):
+        """Return a list of (cid, log prob) of read qid, in insertion order."""
+        row = self._row(qid)
+        cids = self._cids[row]
+        if cids is None:
+            return []
+        return zip(cids, self._probs[row])
+
+    def sorted_items(self, qid):
+        """Return a list of (cid, log prob) of read qid, sorted by log prob
+        from high to low, ties are broken by insertion order."""
+        return sorted(self.items(qid), key=lambda x: x[1], reverse=True)
+
+    def best(self, qid):
+        """Return (cid, log prob) of the best cluster of read qid, the
+        first inserted one if there is a tie, or None if qid aligns to
+        no cluster."""
+        row = self._row(qid)
+        probs = self._probs[row]
+        if probs is None:
+            return None
+        idx = probs.index(max(probs))
+        return self._cids[row][idx], probs[idx]
+
+    def is_best(self, qid, cid):
+        """Return True if cluster cid has the highest log probability
+        among all clusters of read qid."""
+        row = self._row(qid)
+        cids = self._cids[row]
+        if cids is None:
+            return False
+        try:
+            idx = cids.index(cid)
+        except ValueError:
+            return False
+        probs = self._probs[row]
+        return probs[idx] == max(probs)
+
+    def clusters(self):
+        """Return ids of clusters which have at least one probability."""
+        return self._col.keys()
+
+    def reads_of_cluster(self, cid):
+        """Return ids of reads which have a probability in cluster cid."""
+        return [self._read_ids[row] for row in self._col.get(cid, ())]
+
+    def delete_cluster(self, cid):
+        """Delete column cid, in O(number of reads aligned to cid)."""
+        for row in self._col.pop(cid, ()):
+            self._remove_entry(row, cid)
+
+    def invalidate_clusters(self, cids, qids=None):
+        """
+        Delete probabilities of reads in qids (all reads if None) in
+        clusters cids, in O(number of reads aligned to cids).
+        """
+        rows = None if qids is None else \
+            set(self._row_of[qid] for qid in qids if qid in self._row_of)
+        for cid in set(cids):
+            col = self._col.get(cid)
+            if col is None:
+                continue
+            targets = col if rows is None else \
+                (col & rows if len(col) <= len(rows) else rows & col)
+            for row in list(targets):
+                self._remove_entry(row, cid)
+                col.discard(row)
+            if len(col) == 0:
+                del self._col[cid]
+
+    def to_dict(self):
+        """Return a dict of dicts, seqid --> cid --> log prob, which is
+        compatible with pickle and json files of IceIterative."""
+        return dict((qid, dict(self.items(qid))) for qid in self)
+
+    @classmethod
+    def from_dict(cls, d):
+        """Create a MembershipMatrix from a dict of dicts,
+        seqid --> cid --> log prob."""
+        m = cls()
+        for qid, probs in d.iteritems():
+            m.reset_read(qid, probs.iteritems())
+        return m
+
+    def to_arrays(self):
+        """
+        Return (qids, indptr, cids, probs) in CSR format, where qids is
+        a list of read ids, probabilities of qids[i] are probs[indptr[i]:
+        indptr[i+1]] in clusters cids[indptr[i]:indptr[i+1]].
+        """
+        qids = list(self)
+        indptr = np.zeros(len(qids) + 1, dtype=np.int64)
+        cids, probs = array('l'), array('d')
+        for i, qid in enumerate(qids):
+            row = self._row_of[qid]
+            if self._cids[row] is not None:
+                cids.extend(self._cids[row])
+                probs.extend(self._probs[row])
+            indptr[i + 1] = len(cids)
+        return (qids, indptr, np.frombuffer(cids, dtype='l').copy(),
+                np.frombuffer(probs, dtype='d').copy())
+
+    @classmethod
+    def from_arrays(cls, qids, indptr, cids, probs):
+        """Create a MembershipMatrix from CSR arrays, see to_arrays."""
+        m = cls()
+        # slicing python arrays is much faster than slicing numpy arrays
+        cids = array('l', np.ascontiguousarray(cids, dtype='l').tostring())
+        probs = array('d', np.ascontiguousarray(probs, dtype='d').tostring())
+        indptr = [int(x) for x in indptr]
+        col = m._col
+        for row, qid in enumerate(qids):
+            m._row_of[qid] = row
+            start, end = indptr[row], indptr[row + 1]
+            if end > start:
+                row_cids = cids[start:end]
+                m._cids.append(row_cids)
+                m._probs.append(probs[start:end])
+                for cid in row_cids:
+                    try:
+                        col[cid].add(row)
+                    except KeyError:
+                        col[cid] = set([row])
+            else:
+                m._cids.append(None)
+                m._probs.append(None)
+        m._read_ids = list(qids)
+        if len(m._row_of) != len(m._read_ids):
+            raise ValueError("Read ids must be unique.")
+        return m
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+"""
+Estimate costs of polishing (quiver|arrow) consensus isoforms, and
+pack clusters into chunks and quiver bins of roughly the same cost.
+
+Polishing a cluster aligns all subreads of zmws assigned to the cluster
+(in uc or partial_uc) to its consensus sequence and calls variants, so
+its cost is modeled as
+    (number of subreads of its zmws + 1) * (length of its consensus),
+where number of subreads of zmws is looked up in the pbi (or FASTA
+index) of input subreads, or number of subreads of the cluster is read
+from a SubreadStore, and 1 accounts for per-cluster overhead.
+"""
+
+import heapq
+import logging
+import os.path as op
+
+from pbtranscript.io import BamCollection, MetaSubreadFastaReader, \
+    ContigSetReaderWrapper
+from pbtranscript.io.FastaIndex import zmw_of_read_name
+
+__all__ = ["n_subreads_of_zmw_func",
+           "consensus_lengths",
+           "cluster_polish_cost",
+           "polish_costs",
+           "polish_costs_of_clusters",
+           "balanced_bins",
+           "write_polish_cost_report"]
+
+
+def n_subreads_of_zmw_func(d):
+    """Return a function which returns number of subreads of a zmw
+    (e.g., movie/holeNumber) in d, a BamCollection or MetaSubreadFastaReader."""
+    if isinstance(d, BamCollection):
+        return d.numReadsOfZmw
+    elif isinstance(d, MetaSubreadFastaReader):
+        return d.num_subreads_of_zmw
+    raise TypeError("n_subreads_of_zmw_func does not support %s" % type(d))
+
+
+def consensus_lengths(consensus_fa):
+    """Return {cluster_id: length} of consensus isoforms in consensus_fa,
+    e.g., final.consensus.fasta, where ids are like c12 or c12/f3p0/1234."""
+    return dict((int(r.name.split()[0].split('/')[0][1:]), len(r.sequence))
+                for r in ContigSetReaderWrapper(consensus_fa))
+
+
+def cluster_polish_cost(read_ids, consensus_len, n_subreads_of_zmw):
+    """Return predicted cost of polishing a cluster, given ids of ccs
+    reads assigned to it, length of its consensus, and a function which
+    returns number of subreads of a zmw. Zmws which can not be found
+    have no subread, the same as trim_subreads_and_write(ignore_keyerror=True).
+    """
+    n_subreads = 0
+    for zmw in set(zmw_of_read_name(r) for r in read_ids):
+        try:
+            n_subreads += n_subreads_of_zmw(zmw)
+        except (KeyError, ValueError):
+            pass
+    return (n_subreads + 1) * max(1, consensus_len)
+
+
+def polish_costs(cids, uc, partial_uc, consensus_lens, n_subreads_of_zmw):
+    """Return {cid: predicted polish cost} of clusters in cids.
+
+    uc --- uc[k] returns fl ccs reads associated with cluster k
+    partial_uc --- partial_uc[k] returns nfl ccs reads associated with cluster k
+    consensus_lens --- consensus_lens[k] returns length of consensus of cluster k
+    n_subreads_of_zmw --- a function returning number of subreads of a zmw
+    """
+    return dict((k, cluster_polish_cost(read_ids=uc[k] + partial_uc[k],
+                                        consensus_len=consensus_lens.get(k, 0),
+                                        n_subreads_of_zmw=n_subreads_of_zmw))
+                for k in cids)
+
+
+def polish_costs_of_clusters(cids, consensus_lens, n_subreads_of_cluster):
+    """Return {cid: predicted polish cost} of clusters in cids, given a
+    function which returns number of subreads of a cluster, e.g.,
+    SubreadStore.num_subreads."""
+    return dict((k, (n_subreads_of_cluster(k) + 1) * max(1, consensus_lens.get(k, 0)))
+                for k in cids)
+
+
+def balanced_bins(costs, n_bins):
+    """
+    Pack items into at most n_bins bins so that total costs of bins are
+    roughly the same, return a list of bins, each of which is a sorted
+    list of items, and bins are sorted by their first items.
+
+    Greedily put items, from the most to the least costly, into the
+    least loaded bin (i.e., longest processing time first), which is
+    at most 4/3 of the optimal makespan. Ties are broken by items, so
+    that every caller packs the same costs into the same bins.
+
+    costs --- {item: cost}
+    """
+    n_bins = max(1, min(int(n_bins), len(costs)))
+    heap = [(0, i) for i in range(n_bins)]
+    bins = [[] for dummy_i in range(n_bins)]
+    for item in sorted(costs, key=lambda k: (-costs[k], k)):
+        load, i = heapq.heappop(heap)
+        bins[i].append(item)
+        heapq.heappush(heap, (load + costs[item], i))
+    return sorted([sorted(b) for b in bins if len(b) > 0], key=lambda b: b[0])
+
+
+def _read_number(fn):
+    """Return the number saved in file fn, or None if not available."""
+    try:
+        with open(fn, 'r') as reader:
+            return float(reader.read().strip())
+    except (IOError, ValueError):
+        return None
+
+
+def write_polish_cost_report(bin_prefixes, report_fn):
+    """
+    Given prefixes of quivered bins, each having a predicted polish cost
+    in $prefix.cost and the actual runtime in seconds in $prefix.runtime,
+    write predicted runtime (i.e., cost scaled by total actual runtime
+    over total cost) vs actual runtime of bins to report_fn as csv.
+    Return max ratio of actual over predicted runtime of bins.
+    """
+    rows = [(op.basename(prefix), _read_number(prefix + ".cost"),
+             _read_number(prefix + ".runtime")) for prefix in bin_prefixes]
+    done = [(c, t) for dummy_name, c, t in rows if c is not None and t is not None]
+    sec_per_cost = sum(t for c, t in done) / sum(c for c, t in done) \
+        if len(done) > 0 and sum(c for c, t in done) > 0 else None
+
+    max_ratio = None
+    with open(report_fn, 'w') as writer:
+        writer.write("bin,predicted_cost,predicted_runtime,actual_runtime\n")
+        for name, cost, runtime in rows:
+            predicted = cost * sec_per_cost \
+                if cost is not None and sec_per_cost is not None else None
+            writer.write("{b},{c},{p},{a}\n".format(
+                b=name, c="NA" if cost is None else int(cost),
+                p="NA" if predicted is None else "%.1f" % predicted,
+                a="NA" if runtime is None else int(runtime)))
+            if predicted and runtime is not None:
+                max_ratio = max(max_ratio, runtime / predicted)
+    logging.info("Predicted vs actual runtime of %d quivered bins written to %s, "
+                 "max actual/predicted ratio: %s", len(rows), report_fn, max_ratio)
+    return max_ratio
@@ -0,0 +1,264 @@
+#!/usr/bin/env python
+
+"""
+A cluster-ordered store of trimmed raw subreads of a cluster bin.
+
+Polishing a consensus isoform needs raw subreads of all zmws assigned
+to its cluster (in uc or partial_uc). Rather than every polish chunk
+indexing all input subreads and looking up zmws one by one, subreads of
+all clusters are extracted once into a store, in which subreads of each
+cluster are contiguous, so that raw subreads of a cluster can be written
+with a sequential range read.
+
+A store is either a FASTA file (when input subreads are in FASTA) or a
+BAM file (when input subreads are in BAM), plus an offset table
+$store.offsets, each line of which has tab-separated
+    cluster id, start offset, end offset, number of subreads,
+where offsets are byte offsets of FASTA or BGZF virtual offsets of BAM.
+The first line of the offset table is a signature of inputs which the
+store is extracted from, so that an out of date store is never used.
+
+The store is written to temporary files and renamed, offset table last,
+so readers either see a complete store or no store at all.
+
+A store is extracted by whichever process holds its lock file
+$store.lock, which records host and pid of the holder. A lock whose
+holder is gone, or which is older than SUBREAD_STORE_LOCK_MAX_AGE
+seconds, is stale and may be taken over.
+"""
+
+import os
+import os.path as op
+import errno
+import socket
+import time
+import hashlib
+import logging
+
+from pbtranscript.ice.IceUtils import iter_trimmed_subreads
+from pbtranscript.io import BamWriter
+from pbtranscript.libs import AlignmentFile
+
+__all__ = ["SubreadStore",
+           "write_subread_store",
+           "subread_store_offsets_fn",
+           "subread_store_lock_fn",
+           "subread_store_signature",
+           "acquire_subread_store_lock",
+           "subread_store_lock_is_stale",
+           "SUBREAD_STORE_LOCK_MAX_AGE"]
+
+# Seconds after which a lock of a subread store is considered stale,
+# e.g., its holder was killed on another host.
+SUBREAD_STORE_LOCK_MAX_AGE = 4 * 3600
+
+
+def subread_store_offsets_fn(store_fn):
+    """Return offset table of a subread store."""
+    return store_fn + ".offsets"
+
+
+def subread_store_lock_fn(store_fn):
+    """Return lock file of a subread store."""
+    return store_fn + ".lock"
+
+
+def subread_store_lock_is_stale(lock_fn, max_age=SUBREAD_STORE_LOCK_MAX_AGE):
+    """Return True if lock_fn exists, and either its holder process on this
+    host is gone, or lock_fn has not been modified for max_age seconds."""
+    try:
+        age = time.time() - os.stat(lock_fn).st_mtime
+        with open(lock_fn, 'r') as reader:
+            fields = reader.read().split()
+    except (IOError, OSError): # released meanwhile
+        return False
+    if age >= max_age:
+        return True
+    if len(fields) == 2 and fields[0] == socket.gethostname():
+        try:
+            os.kill(int(fields[1]), 0)
+        except ValueError:
+            return False
+        except OSError as e:
+            return e.errno == errno.ESRCH
+    return False
+
+
+def acquire_subread_store_lock(lock_fn, max_age=SUBREAD_STORE_LOCK_MAX_AGE):
+    """Create lock_fn which records host and pid of this process, taking
+    over a stale lock. Return True if created, False if lock_fn is held
+    by another process."""
+    for dummy_i in range(2):
+        try:
+            fd = os.open(lock_fn, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except OSError:
+            if not subread_store_lock_is_stale(lock_fn, max_age=max_age):
+                return False
+            logging.warning("Removing stale lock %s.", lock_fn)
+            try:
+                os.remove(lock_fn)
+            except OSError: # removed by another process meanwhile
+                pass
+            continue
+        os.write(fd, "{h}\t{p}\n".format(h=socket.gethostname(), p=os.getpid()))
+        os.close(fd)
+        return True
+    return False
+
+
+def subread_store_signature(filenames, trim_len, min_len):
+    """Return sha1 of paths, sizes and mtimes of input files (e.g., input
+    subreads and pickles of uc and partial_uc), and trimming parameters."""
+    h = hashlib.sha1("trim_len={t}, min_len={m}\n".format(t=trim_len, m=min_len))
+    for fn in filenames:
+        st = os.stat(fn)
+        h.update("{f}\t{s}\t{m}\n".format(f=op.abspath(fn), s=st.st_size,
+                                          m=int(st.st_mtime)))
+    return h.hexdigest()
+
+
+def write_subread_store(reader, cids, uc, partial_uc, out_file,
+                        trim_len, min_len, signature, bam=False):
+    """
+    Extract trimmed raw subreads of clusters in cids from reader
+    to a subread store out_file, return number of subreads written.
+
+    reader --- MetaSubreadFastaReader or BamCollection
+    uc --- uc[k] returns fl ccs reads associated with cluster k
+    partial_uc --- partial_uc[k] returns nfl ccs reads associated with cluster k
+    signature --- signature of inputs, see subread_store_signature
+    """
+    offsets_fn = subread_store_offsets_fn(out_file)
+    tmp_file = out_file + ".{pid}.tmp".format(pid=os.getpid())
+    tmp_offsets_fn = offsets_fn + ".{pid}.tmp".format(pid=os.getpid())
+    n_total = 0
+    try:
+        writer = BamWriter(tmp_file, reader.header) if bam else open(tmp_file, 'w')
+        offsets_writer = open(tmp_offsets_fn, 'w')
+        offsets_writer.write("#{s}\n".format(s=signature))
+        tell = writer.peer.tell if bam else writer.tell
+        for k in sorted(cids, key=int):
+            start, n = tell(), 0
+            for rec in iter_trimmed_subreads(reader=reader,
+                                             in_seqids=uc[k] + partial_uc[k],
+                                             trim_len=trim_len, min_len=min_len,
+                                             ignore_keyerror=True, bam=bam):
+                if bam:
+                    writer.write(rec)
+                else:
+                    writer.write(">{0}\n{1}\n".format(*rec))
+                n += 1
+            offsets_writer.write("{k}\t{s}\t{e}\t{n}\n".format(k=k, s=start,
+                                                              e=tell(), n=n))
+            n_total += n
+        writer.close()
+        offsets_writer.close()
+        os.rename(tmp_file, out_file)
+        os.rename(tmp_offsets_fn, offsets_fn)
+    finally:
+        for fn in (tmp_file, tmp_offsets_fn):
+            if op.exists(fn):
+                os.remove(fn)
+    logging.info("%d subreads of %d clusters written to subread store %s",
+                 n_total, len(cids), out_file)
+    return n_total
+
+
+class SubreadStore(object):
+
+    """Read-only subread store written by write_subread_store."""
+
+    def __init__(self, filename):
+        self.filename = op.abspath(filename)
+        self.bam = self.filename.endswith(".bam")
+        self.signature = None
+        self._offsets = {}
+        with open(subread_store_offsets_fn(self.filename), 'r') as reader:
+            self.signature = reader.readline().strip().lstrip('#')
+            for line in reader:
+                k, start, end, n = [int(x) for x in line.split('\t')]
+                self._offsets[k] = (start, end, n)
+
+    @classmethod
+    def open(cls, filename, signature=None):
+        """Return a SubreadStore of filename, or None if the store does
+        not exist or its signature does not match signature."""
+        if not op.exists(filename) or \
+           not op.exists(subread_store_offsets_fn(filename)):
+            return None
+        store = cls(filename)
+        if signature is not None and store.signature != signature:
+            logging.info("Subread store %s is out of date.", filename)
+            return None
+        return store
+
+    @property
+    def cids(self):
+        """Return sorted ids of clusters in this store."""
+        return sorted(self._offsets.keys())
+
+    def __contains__(self, cid):
+        return int(cid) in self._offsets
+
+    def num_subreads(self, cid):
+        """Return number of trimmed subreads of cluster cid."""
+        return self._offsets[int(cid)][2]
+
+    @property
+    def header(self):
+        """Return bam header of this store, None if it is a FASTA store."""
+        if not self.bam:
+            return None
+        reader = AlignmentFile(self.filename, "rb", check_sq=False)
+        header = reader.header
+        reader.close()
+        return header
+
+    def iter_subreads(self, cid):
+        """Iterate over subreads of cluster cid, yield pysam AlignedSegment
+        objects if this is a BAM store, otherwise (name, sequence)."""
+        start, end, n = self._offsets[int(cid)]
+        if n == 0:
+            return
+        if self.bam:
+            reader = AlignmentFile(self.filename, "rb", check_sq=False)
+            try:
+                reader.seek(start)
+                for dummy_i in xrange(n):
+                    yield next(reader)
+            finally:
+                reader.close()
+        else:
+            with open(self.filename, 'r') as reader:
+                reader.seek(start)
+                lines = reader.read(end - start).split('\n')
+            for i in xrange(0, 2 * n, 2):
+                yield (lines[i][1:], lines[i + 1])
+
+    def write_clusters(self, cids, out_file_func):
+        """Write subreads of each cluster k in cids to out_file_func(k),
+        a FASTA file or a BAM file, visiting the store from head to tail."""
+        cids = sorted(cids, key=lambda k: self._offsets[int(k)][0])
+        if self.bam:
+            reader = AlignmentFile(self.filename, "rb", check_sq=False)
+            try:
+                for k in cids:
+                    start, dummy_end, n = self._offsets[int(k)]
+                    with BamWriter(out_file_func(k), reader.header) as writer:
+                        if n > 0:
+                            reader.seek(start)
+                        for dummy_i in xrange(n):
+                            writer.write(next(reader))
+            finally:
+                reader.close()
+        else:
+            with open(self.filename, 'r') as reader:
+                for k in cids:
+                    start, end, dummy_n = self._offsets[int(k)]
+                    reader.seek(start)
+                    with open(out_file_func(k), 'w') as writer:
+                        writer.write(reader.read(end - start))
+
+    def __repr__(self):
+        return "<%s: %s, %d clusters>" % (self.__class__.__name__,
+                                          self.filename, len(self._offsets))
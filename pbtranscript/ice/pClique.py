@@ -117,8 +117,9 @@ def local(H, Q, gamma):
     logging.debug("gamma threshold is {t}".format(t=gamma_threshold))
     #cand = filter(lambda i: i not in Q and
     #              h_summed2[i] >= gamma_threshold, xrange(n))
+    Q_set = set(Q)
     cand = [i for i in xrange(n)
-            if i not in Q and h_summed2[i] >= gamma_threshold]
+            if i not in Q_set and h_summed2[i] >= gamma_threshold]
     logging.debug("there are {0} candidates...".format(len(cand)))
     len_cand = len(cand)
     if len_cand < 2:
@@ -165,8 +166,9 @@ def local_extra(H, Q, gamma):
     gamma_threshold = gamma*(len_Q+1)
     #cand = filter(lambda i: h_summed2[i] >= gamma_threshold and
     #              i not in Q, xrange(n))
+    Q_set = set(Q)
     cand = [i for i in xrange(n)
-            if i not in Q and h_summed2[i] >= gamma_threshold]
+            if i not in Q_set and h_summed2[i] >= gamma_threshold]
     random.shuffle(cand)
     while len(cand) > 0:
         x = cand.pop()
@@ -22,16 +22,15 @@ from pbtranscript.ClusterOptions import SgeOptions
 from pbtranscript.Utils import realpath, mkdir, mknewdir
 from pbtranscript.RunnerUtils import write_cmd_to_script, \
     sge_job_runner, local_job_runner
-from pbtranscript.io import DazzIDHandler
+from pbtranscript.io import DazzIDHandler, reads_hash_and_size
+from pbtranscript.DalignerTuner import DALIGNER_NUM_THREADS, DBSize, \
+    default_max_mem, tune_daligner, tune_parallelism
 
 __author__ = "etseng@pacificbiosciences.com"
 
 #logger = logging.getLogger(op.basename(__file__))
 #logger.setLevel(logging.DEBUG)
 
-#NTHREADS is hard-coded as 4 in daligner.
-DALIGNER_NUM_THREADS = 4
-
 class DalignerRunner(object):
     """
     DalignerRunner, which aligns query FASTA file to target
@@ -41,7 +40,8 @@ class DalignerRunner(object):
                  is_FL, same_strand_only,
                  query_converted=False, target_converted=False,
                  dazz_dir=None, script_dir="scripts/",
-                 use_sge=False, sge_opts=None, cpus=24):
+                 use_sge=False, sge_opts=None, cpus=24,
+                 max_mem=None, plan=None):
         """
         Parameters:
           query_filename - query FASTA file
@@ -62,6 +62,11 @@ class DalignerRunner(object):
           use_sge - submit daligner jobs to sge or run them locally?
           sge_opts - sge options
           cpus - total number of cpus that can be used to align query to target.
+          max_mem - memory budget in bytes of running daligner and LA4Ice jobs
+                    locally, if None, use half of physical memory.
+          plan - a DalignerTuner.DalignerPlan of block sizes and number of
+                 parallel jobs, if None, tune it from sizes of query and
+                 target, cpus and max_mem.
         """
         self.query_filename = realpath(query_filename)
         self.target_filename = realpath(target_filename)
@@ -71,20 +76,48 @@ class DalignerRunner(object):
         self.dazz_dir = dazz_dir
         self.script_dir = realpath(script_dir)
         self.output_dir = ""
+        self.max_mem = default_max_mem() if max_mem is None else max_mem
+
+        same_db = self.query_filename == self.target_filename
+        # Read query and target once for both sizes and content hashes.
+        query_hash, n_reads, n_bases = reads_hash_and_size(self.query_filename)
+        query_size = DBSize(n_reads=n_reads, n_bases=n_bases)
+        target_hash, target_size = query_hash, query_size
+        if not same_db:
+            target_hash, n_reads, n_bases = reads_hash_and_size(self.target_filename)
+            target_size = DBSize(n_reads=n_reads, n_bases=n_bases)
+        if plan is None:
+            plan = tune_daligner(query_size=query_size, target_size=target_size,
+                                 cpus=cpus, max_mem=self.max_mem, same_db=same_db,
+                                 same_strand_only=same_strand_only)
 
         self.query_dazz_handler = DazzIDHandler(self.query_filename,
                                                 converted=query_converted,
-                                                dazz_dir=dazz_dir)
+                                                dazz_dir=dazz_dir,
+                                                split_size=plan.query_split_size,
+                                                reads_hash=query_hash)
         # target may have already been converted (if shared)
-        target_converted = (target_converted or
-                            self.query_filename == self.target_filename)
+        target_converted = (target_converted or same_db)
         self.target_dazz_handler = DazzIDHandler(self.target_filename,
                                                  converted=target_converted,
-                                                 dazz_dir=dazz_dir)
+                                                 dazz_dir=dazz_dir,
+                                                 split_size=plan.target_split_size,
+                                                 reads_hash=target_hash)
 
         self.target_blocks = self.target_dazz_handler.num_blocks
         self.query_blocks = self.query_dazz_handler.num_blocks
 
+        # Databases converted earlier may be split differently than planned.
+        daligner_jobs, la4ice_jobs = tune_parallelism(
+            query_size=query_size, target_size=target_size,
+            query_blocks=self.query_blocks, target_blocks=self.target_blocks,
+            cpus=cpus, max_mem=self.max_mem, same_db=same_db,
+            same_strand_only=same_strand_only)
+        self.plan = plan._replace(daligner_jobs=min(plan.daligner_jobs, daligner_jobs),
+                                  la4ice_jobs=min(plan.la4ice_jobs, la4ice_jobs))
+        logging.debug("%s query blocks, %s target blocks, %s", self.query_blocks,
+                      self.target_blocks, self.plan)
+
         self.use_sge = use_sge
         self.sge_opts = sge_opts
 
@@ -284,7 +317,9 @@ class DalignerRunner(object):
     def run(self, output_dir='.', min_match_len=300, sensitive_mode=False):
         """
         if self.use_sge --- writes to <scripts>/daligner_job_#.sh
-        else --- run locally, dividing into self.cpus/4 tasks (capped max at 4)
+        else --- run locally, running self.plan.daligner_jobs daligner jobs
+                 and self.plan.la4ice_jobs LA4Ice jobs at a time, which are
+                 tuned from sizes of query and target, cpus and memory.
 
         NOTE 1: when using SGE, be careful that multiple calls to this might
         end up writing to the SAME job.sh files, this should be avoided by
@@ -325,15 +360,15 @@ class DalignerRunner(object):
                 sge_job_runner(cmds_list=daligner_cmds,
                                script_files=self.daligner_scripts,
                                #done_script=self.daligner_done_script,
-                               num_threads_per_job=DALIGNER_NUM_THREADS,
+                               num_threads_per_job=self.plan.threads_per_job,
                                sge_opts=self.sge_opts, qsub_try_times=3,
                                wait_timeout=600, run_timeout=600,
                                rescue="sge", rescue_times=3))
         else:
-            # max 4 at a time to avoid running out of memory...
+            # number of jobs at a time is bounded by memory budget
             failed.extend(
                 local_job_runner(cmds_list=daligner_cmds,
-                                 num_threads=max(1, min(self.cpus/4, 4))))
+                                 num_threads=self.plan.daligner_jobs))
         logging.info("daligner jobs took " + str(time.time()-start_t) + " sec.")
 
         # (b) run all LA4Ice jobs
@@ -353,10 +388,9 @@ class DalignerRunner(object):
                                wait_timeout=600, run_timeout=600,
                                rescue="sge", rescue_times=3))
         else:
-            # max 4 at a time to avoid running out of memory...
             failed.extend(
                 local_job_runner(cmds_list=la4ice_cmds,
-                                 num_threads=max(1, min(self.cpus, 4))))
+                                 num_threads=self.plan.la4ice_jobs))
         logging.info("LA4Ice jobs took " + str(time.time()-start_t) + " sec.")
         os.chdir(old_dir)
 
@@ -395,6 +429,10 @@ def add_ice_daligner_arguments(parser):
     helpstr = "Query and target reads are of the same strand"
     parser.add_argument("--same_strand_only", default=False, action="store_true", help=helpstr)
 
+    helpstr = "Memory budget in MB of running daligner and LA4Ice jobs locally " + \
+              "(default: half of physical memory)"
+    parser.add_argument("--max_mem", type=int, default=None, help=helpstr)
+
     parser = add_sge_arguments(parser, blasr_nproc=True)
     return parser
 
@@ -430,7 +468,10 @@ class IceDalignerRunner(PBToolRunner):
                              target_filename=args.target_fasta,
                              is_FL=args.is_FL, same_strand_only=args.same_strand_only,
                              query_converted=False, target_converted=False,
-                             use_sge=args.use_sge, sge_opts=sge_opts)
+                             use_sge=args.use_sge, sge_opts=sge_opts,
+                             cpus=args.blasr_nproc,
+                             max_mem=None if args.max_mem is None
+                             else args.max_mem * 1024 * 1024)
         obj.run(output_dir=args.output_dir)
 
 
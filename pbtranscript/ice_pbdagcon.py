@@ -41,6 +41,7 @@ Precursor to using the smrtpipe pbdagcon
 from argparse import ArgumentParser
 from collections import defaultdict
 import os
+import subprocess
 import sys
 
 import numpy as np
@@ -163,6 +164,153 @@ def make_aln_input_to_ref(fasta_filename, ref_filename,
     os.remove(tmp_out)
 
 
+def align_all_vs_all_by_blasr(fasta_filename, out_filename, nproc=8,
+                              maxScore=-1000):
+    """
+    Align all reads in fasta_filename against each other by blasr -m 5,
+    using the same parameters as choose_template_by_blasr.
+
+    Returns: a list of split blasr -m 5 lines.
+    """
+    cmd = "blasr --nproc {nproc} ".format(nproc=nproc) + \
+          "--maxScore {score} ".format(score=maxScore) + \
+          "--maxLCPLength 15 --bestn 10 --nCandidates 50 " + \
+          "-m 5 {fa} {fa} ".format(fa=fasta_filename) + \
+          "--out {out} ".format(out=out_filename) + \
+          "1>/dev/null 2>/dev/null"
+
+    out, code, msg = backticks(cmd)
+    if code != 0:
+        errMsg = "Unable to align {fa} all vs all".format(fa=fasta_filename)
+        raise AlignGraphUtilError(errMsg)
+
+    with open(out_filename) as f:
+        return [line.strip().split() for line in f if len(line.strip()) > 0]
+
+
+def _read_id_of_qname(qname, read_ids):
+    """blasr may append /<start>_<end> to query names, remove it."""
+    if qname in read_ids or qname.rfind('/') < 0:
+        return qname
+    return qname[:qname.rfind('/')]
+
+
+def choose_template_from_m5(m5_fields, fd, min_number_reads=1):
+    """
+    Choose the best template for gcon reference from split blasr -m 5
+    all vs all lines, the same way as choose_template_by_blasr.
+    Pick the one that has the highest average hit similarity to others.
+
+    Similarity of a hit is computed from nMatch, nMismatch, nIns and nDel
+    of its -m 5 line, as 2*nMatch / (2*(nMatch+nMismatch) + nIns + nDel),
+    instead of reading percentSimilarity printed by blasr -m 1. The two
+    may differ slightly, e.g., in rounding. Mean similarities are rounded
+    up to integers by np.ceil in both, so templates may only differ when
+    a mean similarity is close to an integer.
+
+    fd --- FastaRandomReader of reads
+
+    Returns: id of the selected read
+    """
+    # blasr -m 5 output format:
+    # (0) qName (1) qLength (2) qStart (3) qEnd (4) qStrand
+    # (5) tName (6) tLength (7) tStart (8) tEnd (9) tStrand
+    # (10) score (11) nMatch (12) nMismatch (13) nIns (14) nDel ...
+    read_ids = set(fd.keys())
+    scores = defaultdict(lambda: [])
+    for raw in m5_fields:
+        qID, tID = _read_id_of_qname(raw[0], read_ids), raw[5]
+        if qID == tID:
+            continue  # self-hit, ignore
+        if raw[4] != raw[9]:
+            continue  # has to be on same strand
+        # percentSimilarity of blasr -m 1
+        n_match, n_mismatch = int(raw[11]), int(raw[12])
+        n_ins, n_del = int(raw[13]), int(raw[14])
+        scores[qID].append(n_match * 2 * 100. /
+                           (2 * (n_match + n_mismatch) + n_ins + n_del))
+
+    # find the one with the highest average alignment similarity
+    score_array = []
+    for k, v in scores.iteritems():
+        score_array.append((np.ceil(np.mean(v)), k))
+    if len(score_array) < min_number_reads:
+        errMsg = "Not enough number of reads in " + \
+                 "choose_template_from_m5 {0} < {1}".format(
+                     len(score_array), min_number_reads)
+        raise AlignGraphUtilError(errMsg)
+
+    score_array.sort(reverse=True)
+
+    # Find the longest sequence that is within the std deviation of
+    # the best score
+    best_mean, best_id = score_array[0]
+    best_len = len(fd[best_id].sequence)
+    for _mean, _id in score_array[1:]:
+        if _mean != best_mean:
+            break
+        _len = len(fd[_id].sequence)
+        if _len > best_len:
+            best_id = _id
+            best_len = _len
+
+    return best_id
+
+
+def write_aln_input_to_ref_from_m5(m5_fields, ref_id, consensus_name,
+                                   out_filename, read_ids):
+    """
+    Reuse all vs all blasr -m 5 alignments to make alignments of reads
+    to ref_id, renaming ref_id to consensus_name, as make_aln_input_to_ref
+    does with --bestn 1, i.e., only keep the first (best) hit of each read,
+    and drop any read whose best hit is on the opposite strand.
+
+    read_ids --- ids of all reads
+
+    Returns: ids of reads which have no alignment to ref_id.
+    """
+    read_ids = list(read_ids)
+    _read_ids = set(read_ids)
+    aligned = set()
+    with open(out_filename, 'w') as f:
+        for raw in m5_fields:
+            if raw[5] != ref_id:
+                continue
+            qID = _read_id_of_qname(raw[0], _read_ids)
+            if qID in aligned:
+                continue  # --bestn 1
+            aligned.add(qID)
+            if raw[4] != raw[9]:
+                continue  # opp strand
+            f.write(" ".join(raw[:5] + [consensus_name] + raw[6:]) + "\n")
+    return [read_id for read_id in read_ids if read_id not in aligned]
+
+
+def call_pbdagcon(aln_filename, cons_filename, min_seq_len=300, nproc=8):
+    """
+    Call pbdagcon on a blasr -m 5 alignment file, read consensus sequences
+    from its stdout and write those without 'N' to cons_filename.
+    """
+    cmd = ["pbdagcon", "-t", "0", "-m", str(min_seq_len), "-c", "1",
+           "-j", str(nproc), aln_filename]
+    with open(os.devnull, 'w') as devnull:
+        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=devnull)
+        out, dummy_err = p.communicate()
+    if p.returncode != 0:
+        raise AlignGraphUtilError("Cannot run command: %s" % " ".join(cmd))
+
+    with open(cons_filename, 'w') as writer:
+        for block in out.split('>')[1:]:
+            lines = block.split('\n')
+            name = lines[0].strip()
+            if "/" in name:
+                # change cid format from c{cid}/0_{len} to c{cid}
+                name = name[:name.find('/')]
+            seq = ''.join(line.strip() for line in lines[1:])
+            if not 'N' in seq: # Don't write if seq contains N
+                writer.write(">{0}\n{1}\n".format(name, seq))
+
+
 def pbdagcon_wrapper(fasta_filename, output_prefix,
                      consensus_name, nproc=8,
                      maxScore=-1000, min_seq_len=300):
@@ -170,47 +318,51 @@ def pbdagcon_wrapper(fasta_filename, output_prefix,
     (1) Find the best seed as reference
     (2) Align rest to seed
     (3) Call pbdagcon
+
+    blasr is called only once to align all reads against each other,
+    alignments in (1) are reused in (2). Only reads which do not align
+    to the seed in (1) are aligned to the seed again.
     """
     ref_filename = output_prefix + '_ref.fasta'
     try:
-        out_filename_m1 = output_prefix + ".saln.m1"
-        ref = choose_template_by_blasr(fasta_filename=fasta_filename,
-                                       out_filename=out_filename_m1,
-                                       nproc=nproc, maxScore=maxScore)
-        os.remove(out_filename_m1)
+        fd = FastaRandomReader(fasta_filename)
+        out_filename_m5 = output_prefix + ".saln.all"
+        m5_fields = align_all_vs_all_by_blasr(fasta_filename=fasta_filename,
+                                              out_filename=out_filename_m5,
+                                              nproc=nproc, maxScore=maxScore)
+        os.remove(out_filename_m5)
+        ref_id = choose_template_from_m5(m5_fields=m5_fields, fd=fd)
+        ref = fd[ref_id]
 
         with open(ref_filename, 'w') as f:
             f.write(">{0}\n{1}\n".format(consensus_name, ref.sequence))
 
         # create alignment file
         aln_filename = output_prefix + '.saln'
-        make_aln_input_to_ref(fasta_filename=fasta_filename,
-                              ref_filename=ref_filename,
-                              out_filename=aln_filename,
-                              nproc=nproc)
+        unaligned_ids = write_aln_input_to_ref_from_m5(
+            m5_fields=m5_fields, ref_id=ref_id,
+            consensus_name=consensus_name, out_filename=aln_filename,
+            read_ids=fd.keys())
+
+        if len(unaligned_ids) > 0:
+            unaligned_fa = output_prefix + '.unaligned.fasta'
+            unaligned_aln = output_prefix + '.unaligned.saln'
+            with open(unaligned_fa, 'w') as f:
+                for read_id in unaligned_ids:
+                    f.write(">{0}\n{1}\n".format(read_id, fd[read_id].sequence))
+            make_aln_input_to_ref(fasta_filename=unaligned_fa,
+                                  ref_filename=ref_filename,
+                                  out_filename=unaligned_aln,
+                                  nproc=nproc)
+            with open(aln_filename, 'a') as f, open(unaligned_aln) as h:
+                f.write(h.read())
+            os.remove(unaligned_fa)
+            os.remove(unaligned_aln)
 
-        cons_filename = output_prefix + '.fasta'
-        tmp_cons_filename = output_prefix + '.fasta.tmp'
         # call pbdagcon
-        cmd = "pbdagcon -t 0 -m {minlen} -c 1 -j {nproc} {aln} > {out}".format(
-            minlen=min_seq_len, nproc=nproc, aln=aln_filename,
-            out=tmp_cons_filename)
-        cmd += " 2>/dev/null"
-        out, code, msg = backticks(cmd)
-        if code != 0:
-            raise AlignGraphUtilError("Cannot run command: %s" % cmd)
-
-        with FastaReader(tmp_cons_filename) as reader, \
-            open(cons_filename, 'w') as writer:
-            for rec in reader:
-                name = rec.name.strip()
-                if "/" in name:
-                    # change cid format from c{cid}/0_{len} to c{cid}
-                    name = name[:name.find('/')]
-                seq = rec.sequence.strip()
-                if not 'N' in seq: # Don't write if seq contains N
-                    writer.write(">{0}\n{1}\n".format(name, seq))
-        os.remove(tmp_cons_filename)
+        call_pbdagcon(aln_filename=aln_filename,
+                      cons_filename=output_prefix + '.fasta',
+                      min_seq_len=min_seq_len, nproc=nproc)
 
     except AlignGraphUtilError:
         # pick the first sequence as reference as a backup plan
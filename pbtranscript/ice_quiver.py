@@ -187,7 +187,8 @@ class IceQuiverRunner(PBMultiToolRunner):
                                    fasta_fofn=None,
                                    sge_opts=sge_opts,
                                    ipq_opts=ipq_opts,
-                                   tmp_dir=args.tmp_dir)
+                                   tmp_dir=args.tmp_dir,
+                                   batch_blasr_per_bin=args.batch_blasr_per_bin)
             elif cmd == "i":
                 sge_opts = SgeOptions(unique_id=args.unique_id,
                                       use_sge=args.use_sge,
@@ -198,7 +199,8 @@ class IceQuiverRunner(PBMultiToolRunner):
                                  bas_fofn=args.bas_fofn,
                                  fasta_fofn=None,
                                  sge_opts=sge_opts,
-                                 tmp_dir=args.tmp_dir)
+                                 tmp_dir=args.tmp_dir,
+                                 batch_blasr_per_bin=args.batch_blasr_per_bin)
             elif cmd == "merge":
                 obj = IceQuiverMerge(root_dir=args.root_dir, N=args.N)
             elif cmd == "postprocess":
@@ -0,0 +1,364 @@
+#!/usr/bin/env python
+
+"""
+Concatenate BAM files by streaming BGZF blocks, without decoding records.
+
+Headers of all input BAM files are merged once, then reference id (tid)
+of records in each input is mapped to the id of the same reference name
+in the merged header:
+    * if tids of an input are unchanged (e.g., the first input), its
+      compressed BGZF blocks after the header are copied as they are;
+    * otherwise, its blocks are inflated, refID and next_refID fields of
+      every binary record are patched in place, and blocks are deflated
+      again.
+
+Layouts of BGZF blocks and BAM records follow the SAM/BAM format
+specification (SAMv1), section 4.
+"""
+
+import struct
+import zlib
+
+from pbtranscript.io.PbiBamIO import BamHeader
+
+__all__ = ["BgzfReader",
+           "BgzfWriter",
+           "read_bam_header",
+           "write_bam_header",
+           "parse_bam_header_text",
+           "bam_header_text",
+           "concat_bam_files"]
+
+BGZF_MAGIC = "\x1f\x8b\x08\x04"
+# Uncompressed bytes per BGZF block, same as htslib.
+BGZF_BLOCK_SIZE = 0xff00
+# Max compressed bytes per BGZF block.
+BGZF_MAX_BLOCK_SIZE = 0x10000
+# An empty BGZF block which marks end of file.
+BGZF_EOF = ("\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00\x42\x43"
+            "\x02\x00\x1b\x00\x03\x00\x00\x00\x00\x00\x00\x00\x00\x00")
+BAM_MAGIC = "BAM\x01"
+
+_INT32 = struct.Struct("<i")
+# magic, MTIME, XFL, OS, XLEN, SI1, SI2, SLEN, BSIZE
+_BGZF_HEADER = struct.Struct("<4sIBBHBBHH")
+# CRC32, ISIZE
+_BGZF_TRAILER = struct.Struct("<II")
+
+# Byte offsets of refID and next_refID in a binary BAM record, which
+# starts with int32 block_size.
+_REFID_OFFSET = 4
+_NEXT_REFID_OFFSET = 24
+
+# Order of tags of header lines, other tags follow in alphabetical order.
+_HEADER_TAG_ORDER = {'HD': ['VN', 'SO', 'GO'],
+                     'SQ': ['SN', 'LN', 'AS', 'M5', 'UR', 'SP'],
+                     'RG': ['ID', 'SM', 'LB', 'DS', 'PU', 'PI', 'CN', 'DT',
+                            'PL', 'FO', 'KS', 'PG', 'PM'],
+                     'PG': ['ID', 'PN', 'CL', 'PP', 'DS', 'VN']}
+_HEADER_RECORD_ORDER = ['HD', 'SQ', 'RG', 'PG', 'CO']
+
+
+class BgzfReader(object):
+
+    """Read a BGZF file block by block, either as raw compressed
+    blocks or as inflated data."""
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._f = open(filename, 'rb')
+        self._buf = ""
+        self._pos = 0
+
+    def read_raw_block(self):
+        """Return the next compressed block as is, or None at end of file."""
+        head = self._f.read(12)
+        if len(head) == 0:
+            return None
+        if len(head) != 12 or head[0:4] != BGZF_MAGIC:
+            raise IOError("%s is not a BGZF file." % self.filename)
+        xlen = struct.unpack("<H", head[10:12])[0]
+        extra = self._f.read(xlen)
+        bsize, i = None, 0
+        while i + 4 <= len(extra):
+            slen = struct.unpack("<H", extra[i + 2:i + 4])[0]
+            if extra[i:i + 2] == "BC" and slen == 2:
+                bsize = struct.unpack("<H", extra[i + 4:i + 6])[0]
+            i += 4 + slen
+        if bsize is None:
+            raise IOError("%s is not a BGZF file, no block size." % self.filename)
+        n = bsize + 1 - 12 - xlen
+        rest = self._f.read(n)
+        if len(rest) != n:
+            raise IOError("BGZF file %s is truncated." % self.filename)
+        return head + extra + rest
+
+    @staticmethod
+    def inflate(block):
+        """Return uncompressed data of a raw BGZF block."""
+        xlen = struct.unpack("<H", block[10:12])[0]
+        data = zlib.decompress(block[12 + xlen:-8], -15)
+        if len(data) != struct.unpack("<I", block[-4:])[0]:
+            raise IOError("BGZF block is corrupted.")
+        return data
+
+    @staticmethod
+    def is_empty_block(block):
+        """Return True if a raw BGZF block has no data (e.g., EOF marker)."""
+        return struct.unpack("<I", block[-4:])[0] == 0
+
+    def read_block(self):
+        """Return uncompressed data of the next block, or None at end of
+        file. Data left in the current block must be consumed first."""
+        assert self._pos >= len(self._buf)
+        block = self.read_raw_block()
+        return None if block is None else self.inflate(block)
+
+    def read(self, n):
+        """Read n bytes of uncompressed data."""
+        chunks = []
+        while n > 0:
+            if self._pos >= len(self._buf):
+                data = self.read_block()
+                if data is None:
+                    raise IOError("Unexpected end of file %s." % self.filename)
+                self._buf, self._pos = data, 0
+                continue
+            chunk = self._buf[self._pos:self._pos + n]
+            self._pos += len(chunk)
+            n -= len(chunk)
+            chunks.append(chunk)
+        return "".join(chunks)
+
+    def remaining(self):
+        """Return and consume uncompressed data left in the current block."""
+        data = self._buf[self._pos:]
+        self._buf, self._pos = "", 0
+        return data
+
+    def close(self):
+        """Close file."""
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+class BgzfWriter(object):
+
+    """Write data to a BGZF file, in blocks of BGZF_BLOCK_SIZE
+    uncompressed bytes, or copy raw compressed blocks."""
+
+    def __init__(self, filename, level=6):
+        self.filename = filename
+        self.level = level
+        self._f = open(filename, 'wb')
+        self._buf = []
+        self._len = 0
+
+    def _deflate(self, data):
+        """Return data compressed as one or more BGZF blocks."""
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+        cdata = compressor.compress(data) + compressor.flush()
+        if len(cdata) + 26 > BGZF_MAX_BLOCK_SIZE: # incompressible data
+            half = len(data) / 2
+            return self._deflate(data[:half]) + self._deflate(data[half:])
+        return _BGZF_HEADER.pack(BGZF_MAGIC, 0, 0, 0xff, 6, ord('B'), ord('C'),
+                                 2, len(cdata) + 25) + cdata + \
+               _BGZF_TRAILER.pack(zlib.crc32(data) & 0xffffffff, len(data))
+
+    def _flush(self, full_blocks_only=False):
+        """Compress buffered data to blocks, keep data of the last
+        partial block in buffer if full_blocks_only."""
+        data = "".join(self._buf)
+        start = 0
+        while len(data) - start >= BGZF_BLOCK_SIZE or \
+              (not full_blocks_only and start < len(data)):
+            self._f.write(self._deflate(data[start:start + BGZF_BLOCK_SIZE]))
+            start += BGZF_BLOCK_SIZE
+        rest = data[start:]
+        self._buf = [rest] if len(rest) > 0 else []
+        self._len = len(rest)
+
+    def write(self, data):
+        """Write uncompressed data."""
+        self._buf.append(data)
+        self._len += len(data)
+        if self._len >= BGZF_BLOCK_SIZE:
+            self._flush(full_blocks_only=True)
+
+    def write_raw_block(self, block):
+        """Flush buffered data, then copy a raw compressed block."""
+        self._flush()
+        self._f.write(block)
+
+    def close(self):
+        """Flush buffered data, write EOF marker and close file."""
+        self._flush()
+        self._f.write(BGZF_EOF)
+        self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def read_bam_header(reader):
+    """Read binary header of a BAM file from a BgzfReader,
+    return (header text, [(reference name, reference length)])."""
+    if reader.read(4) != BAM_MAGIC:
+        raise IOError("%s is not a BAM file." % reader.filename)
+    l_text = _INT32.unpack(reader.read(4))[0]
+    text = reader.read(l_text).rstrip("\0")
+    n_ref = _INT32.unpack(reader.read(4))[0]
+    refs = []
+    for dummy_i in xrange(n_ref):
+        l_name = _INT32.unpack(reader.read(4))[0]
+        name = reader.read(l_name)[:-1]
+        refs.append((name, _INT32.unpack(reader.read(4))[0]))
+    return text, refs
+
+
+def write_bam_header(writer, text, refs):
+    """Write binary header of a BAM file to a BgzfWriter,
+    refs --- [(reference name, reference length)]."""
+    data = [BAM_MAGIC, _INT32.pack(len(text)), text, _INT32.pack(len(refs))]
+    for name, length in refs:
+        data.extend([_INT32.pack(len(name) + 1), name, "\0",
+                     _INT32.pack(length)])
+    writer.write("".join(data))
+
+
+def parse_bam_header_text(text, refs=()):
+    """Parse SAM header text to a dict like pysam headers, e.g.,
+    {'HD': {'VN': '1.5'}, 'SQ': [{'SN': 'c0', 'LN': 1000}], 'CO': ['...']}.
+    If there is no @SQ line, references are taken from refs,
+    [(reference name, reference length)]."""
+    header = {}
+    for line in text.splitlines():
+        if not line.startswith('@'):
+            continue
+        fields = line.split('\t')
+        tag = fields[0][1:]
+        if tag == 'CO':
+            header.setdefault(tag, []).append('\t'.join(fields[1:]))
+            continue
+        record = dict(f.split(':', 1) for f in fields[1:] if ':' in f)
+        if tag == 'SQ' and 'LN' in record:
+            record['LN'] = int(record['LN'])
+        if tag == 'HD':
+            header[tag] = record
+        else:
+            header.setdefault(tag, []).append(record)
+    if len(header.get('SQ', [])) == 0 and len(refs) > 0:
+        header['SQ'] = [{'SN': name, 'LN': length} for name, length in refs]
+    return header
+
+
+def bam_header_text(header):
+    """Return SAM header text of a header dict."""
+    lines = []
+    tags = [t for t in _HEADER_RECORD_ORDER if t in header] + \
+           sorted(t for t in header if t not in _HEADER_RECORD_ORDER)
+    for tag in tags:
+        records = header[tag]
+        if isinstance(records, dict):
+            records = [records]
+        for record in records:
+            if tag == 'CO':
+                lines.append("@CO\t%s" % record)
+                continue
+            order = _HEADER_TAG_ORDER.get(tag, [])
+            keys = [k for k in order if k in record] + \
+                   sorted(k for k in record if k not in order)
+            lines.append("@" + tag + "".join("\t%s:%s" % (k, record[k])
+                                             for k in keys))
+    return "".join(line + "\n" for line in lines)
+
+
+def _patch_tids(buf, remap):
+    """Patch refID and next_refID of whole records at the head of
+    bytearray buf to remap[refID] and remap[next_refID] in place,
+    return number of bytes of whole records."""
+    offset, n = 0, len(buf)
+    unpack_from, pack_into = _INT32.unpack_from, _INT32.pack_into
+    while offset + 4 <= n:
+        end = offset + 4 + unpack_from(buf, offset)[0]
+        if end > n:
+            break
+        for field in (offset + _REFID_OFFSET, offset + _NEXT_REFID_OFFSET):
+            tid = unpack_from(buf, field)[0]
+            if tid >= 0:
+                pack_into(buf, field, remap[tid])
+        offset = end
+    return offset
+
+
+def _copy_records(reader, writer):
+    """Copy records left in reader to writer, compressed blocks as they are."""
+    writer.write(reader.remaining())
+    while True:
+        block = reader.read_raw_block()
+        if block is None:
+            break
+        if not BgzfReader.is_empty_block(block):
+            writer.write_raw_block(block)
+
+
+def _copy_patched_records(reader, writer, remap):
+    """Copy records left in reader to writer, patching tids by remap."""
+    buf = bytearray(reader.remaining())
+    while True:
+        n = _patch_tids(buf, remap)
+        writer.write(str(buf[:n]))
+        del buf[:n]
+        data = reader.read_block()
+        if data is None:
+            break
+        buf.extend(data)
+    if len(buf) > 0:
+        raise IOError("BAM file %s is truncated." % reader.filename)
+
+
+def concat_bam_files(in_fns, out_fn, level=6):
+    """
+    Concatenate input BAM files to out_fn, whose header merges headers
+    of all inputs (@PG lines are ignored, @SQ and @RG lines are unique by
+    SN and ID), and return the number of inputs whose records are copied
+    without re-compression.
+    level --- zlib compression level of re-compressed blocks
+    """
+    if len(in_fns) == 0:
+        raise ValueError("No bam input files to concatenate.")
+
+    merged = BamHeader(ignore_pg=True)
+    ref_names = []
+    for in_fn in in_fns:
+        with BgzfReader(in_fn) as reader:
+            text, refs = read_bam_header(reader)
+        merged.add(parse_bam_header_text(text, refs))
+        ref_names.append([name for name, dummy_len in refs])
+
+    sqs = merged.referenceSequences
+    tids = dict((sq['SN'], tid) for tid, sq in enumerate(sqs))
+
+    n_copied = 0
+    writer = BgzfWriter(out_fn, level=level)
+    write_bam_header(writer, bam_header_text(merged.header),
+                     [(sq['SN'], int(sq['LN'])) for sq in sqs])
+    for in_fn, names in zip(in_fns, ref_names):
+        remap = [tids[name] for name in names]
+        with BgzfReader(in_fn) as reader:
+            read_bam_header(reader)
+            if remap == range(len(remap)):
+                _copy_records(reader, writer)
+                n_copied += 1
+            else:
+                _copy_patched_records(reader, writer, remap)
+    writer.close()
+    return n_copied
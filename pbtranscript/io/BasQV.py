@@ -42,7 +42,9 @@ Read and cache quality value from Base/CCS.H5 files.
 import os
 import logging
 from collections import defaultdict
+import numpy as np
 from pbcore.io import FastqReader, ConsensusReadSet
+from pbtranscript.io.QVStore import QVStore, qvs_to_probs
 import pbtranscript.io.c_basQV as c_basQV
 
 
@@ -110,6 +112,25 @@ class dataset_wrapper(object):
         return self.file_name
 
 
+def write_qv_cache(qver, filename):
+    """Save QVs of a basQVcacher|fastqQVcacher to a QV cache file."""
+    qver.qv.attrs['cacher'] = qver.__class__.__name__
+    qver.qv.attrs['window_size'] = qver.window_size
+    qver.qv.write(filename)
+
+
+def open_qv_cache(qver, filename):
+    """Memory map QVs of a basQVcacher|fastqQVcacher from a QV cache file
+    written by write_qv_cache."""
+    store = QVStore.open(filename)
+    if store.attrs.get('cacher') != qver.__class__.__name__:
+        raise IOError("QV cache {f} was not written by {c}.".format(
+            f=filename, c=qver.__class__.__name__))
+    qver.qv = store
+    qver.window_size = store.attrs['window_size']
+    qver.cache_window_size = store.attrs['window_size']
+
+
 class basQVcacher(object):
 
     """Cache quality values from bas.h5/bam files."""
@@ -119,29 +140,26 @@ class basQVcacher(object):
         self.bas_dict = {}
         self.bas_files = {}
 
-        # subread seqid --> qv_name --> list of qv (transformed to prob)
-        self.qv = {}
-        self.qv_mean = {} # seqid --> qv_name --> mean qv
+        # columnar store of subread seqid --> qv_name --> qvs
+        # (transformed to prob), smoothed qvs are saved as
+        # qv_name + '_smoothed', mean qvs are computed for qv_names.
+        self.qv = QVStore()
         # smoothing window size, set when presmooth() is called
         self.window_size = None
+        # smoothing window size of reads memory mapped from a QV cache
+        self.cache_window_size = None
 
     def get(self, seqid, qv_name, position=None):
         """Get quality value of type qv_name for a sequence seqid."""
-        if position is None:
-            return self.qv[seqid][qv_name]
-        else:
-            return self.qv[seqid][qv_name][position]
+        return self.qv.get(seqid, qv_name, position)
 
     def get_smoothed(self, seqid, qv_name, position=None):
         """Get smooth qv of type qv_name for seqid."""
-        if position is None:
-            return self.qv[seqid][qv_name + '_smoothed']
-        else:
-            return self.qv[seqid][qv_name + '_smoothed'][position]
+        return self.qv.get(seqid, qv_name + '_smoothed', position)
 
     def get_mean(self, seqid, qv_name):
         """Return mean QV of read=seqid, type=qv_name."""
-        return self.qv_mean[seqid][qv_name]
+        return self.qv.get_mean(seqid, qv_name)
 
     def add_bash5(self, filename):
         """Add a bas.h5/ccs.h5/ccs.bam to cacher."""
@@ -187,15 +205,26 @@ class basQVcacher(object):
         else:
             raise IOError("Unsupported file format: %s" % filename)
 
+    def write_cache(self, filename):
+        """Save cached and smoothed QVs to a QV cache file."""
+        write_qv_cache(self, filename)
+
+    def open_cache(self, filename):
+        """Memory map cached and smoothed QVs from a QV cache file."""
+        open_qv_cache(self, filename)
+
     def precache(self, seqids):
         """
-        Precache QV probabilities for seqids.
+        Precache QV probabilities for seqids, skipping reads which
+        are already cached (e.g., in a QV cache file).
         """
         # for subread ex:
         # m120407_063017_4.../13/2571_3282
         # for CCS ex:
         # m120407_063017_4.../13/300_10_CCS
 
+        seqids = [seqid for seqid in seqids if seqid not in self.qv]
+
         # sort seqids by movie to save time
         seqids.sort(key=lambda x: (x.split('/')[0], int(x.split('/')[1])))
 
@@ -214,8 +243,8 @@ class basQVcacher(object):
                 raise IOError("Could not read {s} from input bas/ccs fofn.".
                               format(s=seqid))
 
-        for bas_file, seqids in bas_job_dict.iteritems():
-            c_basQV.precache_helper(bas_file, seqids,
+        for bas_file, bas_seqids in bas_job_dict.iteritems():
+            c_basQV.precache_helper(bas_file, bas_seqids,
                                     basQVcacher.qv_names, self.qv)
 
         self.make_qv_mean(seqids)
@@ -224,30 +253,26 @@ class basQVcacher(object):
         """
         precache MUST BE already called! Otherwise will have error!
         """
+        if window_size != self.cache_window_size:
+            # reads of a QV cache are smoothed with another window, copy
+            # them (not the whole cache) into memory to smooth them again
+            self.qv.detach(seqids)
         self.window_size = window_size
-        for seqid in seqids:
-            # logging.debug("smoothing sequence " + seqid)
-            # Replace .smooth_qv_regions by c_baseQV.maxval_per_window
-            for qv_name in basQVcacher.qv_names:
-                self.qv[seqid][qv_name + '_smoothed'] = \
-                    c_basQV.maxval_per_window(self.qv[seqid][qv_name],
-                                              window_size)
+        offsets, lengths = self.qv.segments(
+            [seqid for seqid in seqids if not self.qv.mapped(seqid)])
+        for qv_name in basQVcacher.qv_names:
+            c_basQV.maxval_per_window_bulk(
+                self.qv.track(qv_name), self.qv.track(qv_name + '_smoothed'),
+                offsets, lengths, window_size)
 
     def make_qv_mean(self, seqids):
         """Compute mean QVs for reads in seqids."""
-        for seqid in seqids:
-            self.qv_mean[seqid] = {}
-            for qv_name in self.qv[seqid]:
-                self.qv_mean[seqid][qv_name] = sum(self.qv[seqid][qv_name])*1./len(self.qv[seqid][qv_name])
+        self.qv.compute_means(basQVcacher.qv_names, seqids)
 
     def remove_unsmoothed(self):
         """Remove unsmoothed QVs."""
-        for k, dummy_v in self.qv.iteritems():
-            for qv_name in basQVcacher.qv_names:
-                try:
-                    del self.qv[k][qv_name]
-                except KeyError:
-                    pass  # may have already been deleted. OK.
+        for qv_name in basQVcacher.qv_names:
+            self.qv.remove_track(qv_name)
 
 
 class fastqQVcacher(object):
@@ -261,74 +286,93 @@ class fastqQVcacher(object):
     """
 
     def __init__(self):
-        # subread seqid --> None --> list of qv (transformed to prob)
-        self.qv = {}
-        self.qv_mean = {} # seqid --> qv mean
+        # columnar store of subread seqid --> 'unsmoothed'|'smoothed'
+        # --> qvs (transformed to prob), mean qvs of 'unsmoothed'
+        self.qv = QVStore()
         # smoothing window size, set when presmooth() is called
         self.window_size = None
+        # smoothing window size of reads memory mapped from a QV cache
+        self.cache_window_size = None
 
     def get(self, seqid, qv_type, position=None):
         """
         <qv_type> is ignored
         """
-        if position is None:
-            return self.qv[seqid]['unsmoothed']
-        else:
-            return self.qv[seqid]['unsmoothed'][position]
+        return self.qv.get(seqid, 'unsmoothed', position)
 
     def get_smoothed(self, seqid, qv_type, position=None):
         """
         <qv_type> is ignored
         """
-        if position is None:
-            return self.qv[seqid]['smoothed']
-        else:
-            return self.qv[seqid]['smoothed'][position]
+        return self.qv.get(seqid, 'smoothed', position)
 
     def get_mean(self, seqid, qv_name):
         """Return mean QV of seqid."""
-        return self.qv_mean[seqid]
+        return self.qv.get_mean(seqid, 'unsmoothed')
+
+    def write_cache(self, filename):
+        """Save cached and smoothed QVs to a QV cache file."""
+        write_qv_cache(self, filename)
+
+    def open_cache(self, filename):
+        """Memory map cached and smoothed QVs from a QV cache file."""
+        open_qv_cache(self, filename)
 
     def precache_fastq(self, fastq_filename):
         """
         Cache each sequence in the FASTQ file into self.qv
         """
+        seqids, qvs = [], []
         for r in FastqReader(fastq_filename):
-            seqid = r.name.split()[0]
-            self.qv[seqid] = {}
-            c_basQV.fastq_precache_helper(seqid, r.quality, self.qv)
-            self.make_qv_mean([seqid])
+            seqids.append(r.name.split()[0])
+            qvs.append(r.quality)
+        self.add_qvs(seqids, qvs)
+
+    def add_qvs(self, seqids, qvs):
+        """Convert qvs of seqids to probabilities and add them in bulk."""
+        if len(seqids) == 0:
+            return
+        lengths = [len(q) for q in qvs]
+        self.qv.extend(seqids, lengths,
+                       {'unsmoothed': qvs_to_probs(np.concatenate(qvs))})
+        self.make_qv_mean(seqids)
 
     def presmooth(self, seqids, window_size, fastq_filename=None):
         """
         precache MUST BE already called! Otherwise will have error!
         """
-        self.window_size = window_size
-        for seqid in seqids:
-            try:
-                self.qv[seqid]['smoothed'] = c_basQV.maxval_per_window(
-                    self.qv[seqid]['unsmoothed'], window_size)
-            except KeyError:
-                if fastq_filename is None:
-                    raise KeyError("Qvs of {seqid} ".format(seqid=seqid) +
-                                   "must be precached.")
-                for r in FastqReader(fastq_filename):
-                    if r.name.split()[0] == seqid:
-                        self.qv[seqid] = {}
-                        c_basQV.fastq_precache_helper(seqid, r.quality, self.qv)
-                        break
-                raise KeyError("Qvs of {seqid} ".format(seqid=seqid) +
+        missing = [seqid for seqid in seqids if seqid not in self.qv]
+        if len(missing) > 0:
+            if fastq_filename is None:
+                raise KeyError("Qvs of {seqid} ".format(seqid=missing[0]) +
+                               "must be precached.")
+            missing = set(missing)
+            found, qvs = [], []
+            for r in FastqReader(fastq_filename):
+                seqid = r.name.split()[0]
+                if seqid in missing:
+                    found.append(seqid)
+                    qvs.append(r.quality)
+            self.add_qvs(found, qvs)
+            missing.difference_update(found)
+            if len(missing) > 0:
+                raise KeyError("Qvs of {seqid} ".format(seqid=missing.pop()) +
                                "could not be read from {fq}".format(fq=fastq_filename))
+        if window_size != self.cache_window_size:
+            # reads of a QV cache are smoothed with another window, copy
+            # them (not the whole cache) into memory to smooth them again
+            self.qv.detach(seqids)
+        self.window_size = window_size
+        offsets, lengths = self.qv.segments(
+            [seqid for seqid in seqids if not self.qv.mapped(seqid)])
+        c_basQV.maxval_per_window_bulk(
+            self.qv.track('unsmoothed'), self.qv.track('smoothed'),
+            offsets, lengths, window_size)
 
     def make_qv_mean(self, seqids):
         """Compute mean QV for every reads in seqids."""
-        for seqid in seqids:
-            self.qv_mean[seqid] = sum(self.qv[seqid]['unsmoothed']) * 1. / len(self.qv[seqid]['unsmoothed'])
+        self.qv.compute_means(['unsmoothed'], seqids)
 
     def remove_unsmoothed(self):
         """Remove unsmoothed qvs."""
-        for k, dummy_v in self.qv.iteritems():
-            try:
-                del self.qv[k]['unsmoothed']
-            except KeyError:
-                pass # may have already been deleted. OK.
+        self.qv.remove_track('unsmoothed')
@@ -0,0 +1,138 @@
+"""Compiled scanner of LA4Ice output, used by LA4IceReader."""
+# distutils: language = c++
+# cython: boundscheck=False, wraparound=False
+from libc.stdlib cimport strtod
+from libc.string cimport memchr
+
+cdef inline bint is_space(unsigned char c):
+    return c == ' ' or c == '\t' or c == '\r'
+
+
+cdef inline Py_ssize_t skip_spaces(const unsigned char[:] buf,
+                                   Py_ssize_t i, Py_ssize_t end):
+    while i < end and is_space(buf[i]):
+        i += 1
+    return i
+
+
+cdef inline Py_ssize_t skip_token(const unsigned char[:] buf,
+                                  Py_ssize_t i, Py_ssize_t end):
+    while i < end and not is_space(buf[i]):
+        i += 1
+    return i
+
+
+cdef inline Py_ssize_t line_end(const unsigned char[:] buf, Py_ssize_t i):
+    """Return offset of the first newline at or after i, or len(buf)."""
+    cdef Py_ssize_t n = buf.shape[0]
+    cdef const void *p
+    if i >= n:
+        return n
+    p = memchr(&buf[i], c'\n', n - i)
+    return n if p == NULL else <const unsigned char *>p - &buf[0]
+
+
+cdef long parse_long(const unsigned char[:] buf, Py_ssize_t *i,
+                     Py_ssize_t end) except? -1:
+    """Parse an integer token at i (after spaces), advance i past it."""
+    cdef Py_ssize_t j = skip_spaces(buf, i[0], end)
+    cdef long sign = 1, val = 0
+    cdef Py_ssize_t start
+    if j < end and buf[j] == '-':
+        sign = -1
+        j += 1
+    start = j
+    while j < end and c'0' <= buf[j] <= c'9':
+        val = val * 10 + (buf[j] - c'0')
+        j += 1
+    if j == start or (j < end and not is_space(buf[j])):
+        raise ValueError("Expecting an integer at offset %d." % start)
+    i[0] = j
+    return sign * val
+
+
+def scan_record(const unsigned char[:] buf not None, Py_ssize_t pos):
+    """
+    Scan the five lines of a LA4Ice record which start at pos in buf, e.g.,
+        000000003 000000002 -327 72.23 0 158 472 472 0 0 327 461 overlap
+        <blank line>
+         158 ctatgagtaaat-atacta-gtata--a-atacga
+             |*|*||||***|*||||*|*|*|*|**|*||**||
+           0 c-a-gagt-ggtgatacaacgcagagtacatggg  25.1%
+    without copying any alignment string.
+
+    Return None if the record is the EOF signature '+ +', otherwise
+    (header, spans, next_pos), where
+        header = (qID, sID, score, identity, qStrand, qStart, qEnd, qLength,
+                  sStrand, sStart, sEnd, sLength, _qStart, _sStart),
+        IDs are 0-based, _qStart and _sStart are the positions printed in
+        front of the aligned query and subject
+        spans = ((start, end) of qAln, alnStr, sAln in buf)
+        next_pos = offset of the next record in buf
+    """
+    cdef Py_ssize_t n = buf.shape[0]
+    cdef Py_ssize_t end = line_end(buf, pos), i = pos, j
+    cdef long q_id, s_id, score, q_strand, q_start, q_end, q_len
+    cdef long s_strand, s_start, s_end, s_len, q_pos, s_pos
+    cdef double identity
+    cdef char *stop
+
+    i = skip_spaces(buf, i, end)
+    if i < end and buf[i] == '+':  # FALCON-added EOF signature
+        return None
+    q_id = parse_long(buf, &i, end)
+    s_id = parse_long(buf, &i, end)
+    score = parse_long(buf, &i, end)
+    i = skip_spaces(buf, i, end)
+    j = skip_token(buf, i, end)
+    if j == i:
+        raise ValueError("Expecting identity at offset %d." % i)
+    identity = strtod(<const char *>&buf[i], &stop)
+    if <const unsigned char *>stop != &buf[j]:
+        raise ValueError("Expecting identity at offset %d." % i)
+    i = j
+    q_strand = parse_long(buf, &i, end)
+    q_start = parse_long(buf, &i, end)
+    q_end = parse_long(buf, &i, end)
+    q_len = parse_long(buf, &i, end)
+    s_strand = parse_long(buf, &i, end)
+    s_start = parse_long(buf, &i, end)
+    s_end = parse_long(buf, &i, end)
+    s_len = parse_long(buf, &i, end)
+
+    # blank line
+    if end >= n:
+        raise ValueError("Unexpected end of file.")
+    end = line_end(buf, end + 1)
+
+    # aligned query
+    if end >= n:
+        raise ValueError("Unexpected end of file.")
+    i = end + 1
+    end = line_end(buf, i)
+    q_pos = parse_long(buf, &i, end)
+    i = skip_spaces(buf, i, end)
+    j = skip_token(buf, i, end)
+    q_span = (i, j)
+
+    # alignment string
+    if end >= n:
+        raise ValueError("Unexpected end of file.")
+    i = skip_spaces(buf, end + 1, n)
+    end = line_end(buf, i)
+    j = skip_token(buf, i, end)
+    a_span = (i, j)
+
+    # aligned subject, followed by percentage of differences
+    if end >= n:
+        raise ValueError("Unexpected end of file.")
+    i = end + 1
+    end = line_end(buf, i)
+    s_pos = parse_long(buf, &i, end)
+    i = skip_spaces(buf, i, end)
+    j = skip_token(buf, i, end)
+    s_span = (i, j)
+
+    header = (q_id, s_id, score, identity, q_strand, q_start, q_end, q_len,
+              s_strand, s_start, s_end, s_len, q_pos, s_pos)
+    return header, (q_span, a_span, s_span), end + 1
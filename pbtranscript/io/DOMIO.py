@@ -40,6 +40,16 @@ class DOMRecord(object):
             self.sStart == other.sStart and self.sEnd == other.sEnd and \
             self.sLen == other.sLen
 
+    def toString(self):
+        """Return a DOM line (as in phmmer --domtblout) of this record,
+        which can be parsed by fromString. Fields which are not modeled
+        in DOMRecord are written as '-'."""
+        fields = [self.pid, '-', self.pLen, self.sid, '-', self.sLen,
+                  '-', self.score, '-', 1, 1, '-', '-', self.score, '-',
+                  self.sStart + 1, self.sEnd, self.pStart + 1, self.pEnd,
+                  self.pStart + 1, self.pEnd, '-', '-']
+        return " ".join(str(x) for x in fields)
+
     @classmethod
     def fromString(cls, line):
         """Construct and return a DOMRecord object given a DOM line."""
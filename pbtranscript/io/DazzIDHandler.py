@@ -6,8 +6,13 @@ class DazzIDHandler, which
 (2) maintain mapping between read ids in daligner-compatible fasta file
     and its original name in input file.
 (3) makes a dazz database so that input fasta file can run daligner later
+(4) reuses the dazz database made earlier if content of input file and
+    DBsplit parameters are not changed, which is recorded by a content
+    hash in *.dazz.fasta.sha1
 """
 
+import os
+import hashlib
 import logging
 import os.path as op
 from cPickle import load, dump
@@ -19,6 +24,24 @@ __author__ = 'etseng@pacificbiosciences.com'
 
 log = logging.getLogger(__name__)
 
+
+def reads_hash_and_size(input_filename):
+    """Return (sha1 of names and sequences of reads, number of reads,
+    number of bases) of a FASTA/FASTQ/ContigSet file, reading it once,
+    so that callers which need both (e.g., DalignerRunner) do not read
+    input twice."""
+    h = hashlib.sha1()
+    n_reads, n_bases = 0, 0
+    reader = ContigSetReaderWrapper(input_filename)
+    for r in reader:
+        seq = r.sequence[:]
+        h.update(">{n}\n{s}\n".format(n=r.name, s=seq))
+        n_reads += 1
+        n_bases += len(seq)
+    reader.close()
+    return h.hexdigest(), n_reads, n_bases
+
+
 class DazzIDHandler(object):
 
     """
@@ -50,18 +73,28 @@ class DazzIDHandler(object):
     """
     dazz_movie_name = 'prolog'
 
-    def __init__(self, input_filename, converted=False, dazz_dir=None):
+    def __init__(self, input_filename, converted=False, dazz_dir=None,
+                 split_size=200, reads_hash=None):
         """
         input_filename - input FASTA/FASTQ/ContigSet file
         converted - whether or not input file has been converted to
                     daligner compatible FASTA file.
+                    If False, but a dazz database of the same content
+                    hash has been made, reuse it instead of converting.
         dazz_dir - if None, save all dazz.fasta, dazz.pickle, db files
                   in the same directory as inputfile.
                   if a valid path, save all output files to dazz_dir.
+        split_size - split dazz database into blocks of split_size Mbp
+                     (i.e., DBsplit -s{split_size})
+        reads_hash - sha1 of names and sequences of reads in input file,
+                     as returned by reads_hash_and_size, if None, read
+                     input file to compute it when needed.
         """
         self.dazz_dir = dazz_dir
         self.input_filename = realpath(input_filename)
         self.validate_file_type(self.input_filename)
+        self.split_size = int(split_size)
+        self.reads_hash = reads_hash
 
         # index --> original sequence ID ex: 1 --> movie/zmw/start_end_CCS
         self.dazz_mapping = {}
@@ -72,9 +105,19 @@ class DazzIDHandler(object):
                         " format, but in fact it is not. Converting ...")
             converted = False
 
+        content_hash = None
+        if not converted:
+            content_hash = self.content_hash()
+            if self.cached_hash() == content_hash:
+                log.debug("Reusing DAZZ database %s of %s, content hash %s.",
+                          self.db_filename, self.input_filename, content_hash)
+                converted = True
+
         if not converted:
             self.convert_to_dazz_fasta()
             self.make_db()
+            with open(self.hash_filename, 'w') as writer:
+                writer.write(content_hash + '\n')
         else:
             self.read_dazz_pickle()
 
@@ -117,6 +160,30 @@ class DazzIDHandler(object):
         """
         return self.dazz_filename + '.db'
 
+    @property
+    def hash_filename(self):
+        """Return file name which saves content hash of input file, of
+        which the dazz database has been made, e.g., *.dazz.fasta.sha1
+        """
+        return self.dazz_filename + '.sha1'
+
+    def content_hash(self):
+        """Return sha1 of names and sequences of reads in input file,
+        and DBsplit parameters."""
+        if self.reads_hash is None:
+            self.reads_hash = reads_hash_and_size(self.input_filename)[0]
+        return hashlib.sha1("DBsplit -s{s}\nreads={h}\n".format(
+            s=self.split_size, h=self.reads_hash)).hexdigest()
+
+    def cached_hash(self):
+        """Return content hash of input file, of which the dazz database
+        has been made, or None if the database is incomplete."""
+        if not all(nfs_exists(fn) for fn in
+                   (self.hash_filename, self.pickle_filename, self.db_filename)):
+            return None
+        with open(self.hash_filename, 'r') as reader:
+            return reader.read().strip()
+
     def convert_to_dazz_fasta(self):
         """
         Convert input fasta/fastq file to daligner-compatibe fasta with ids:
@@ -126,6 +193,8 @@ class DazzIDHandler(object):
         """
         log.debug("Converting %s to daligner compatible fasta %s.",
                   self.input_filename, self.dazz_filename)
+        if op.exists(self.hash_filename): # the database will be changed
+            os.remove(self.hash_filename)
         reader = ContigSetReaderWrapper(self.input_filename)
 
         with FastaWriter(self.dazz_filename) as f:
@@ -172,7 +241,7 @@ class DazzIDHandler(object):
                                    real_upath(self.dazz_filename))
         execute(cmd=cmd)
 
-        cmd = "DBsplit -s200 %s" % real_upath(self.dazz_filename)
+        cmd = "DBsplit -s%d %s" % (self.split_size, real_upath(self.dazz_filename))
         execute(cmd)
 
     def keys(self):
@@ -0,0 +1,397 @@
+"""
+Define FastaIndex, a persistent index of a FASTA file, which is
+used by FastaRandomReader and SubreadFastaReader.
+
+An index is built by a single scan of the FASTA file, and is written
+to two files next to it:
+    $fasta.fai      --- a samtools faidx compatible index, written only
+                        if it does not exist or is out of date, and all
+                        records have fixed line widths.
+    $fasta.fai.hash --- offsets, lengths and line widths of records,
+                        plus open addressing hash tables of read names
+                        and zmw names, in one binary file which is
+                        mmap'd, so that later processes open the index
+                        instantly, without reading it into memory.
+
+The FASTA file is mmap'd as well, so fetching a sequence is a slice
+of the mmap, newlines are only removed for multi-line records.
+"""
+
+import os
+import os.path as op
+import mmap
+import json
+import zlib
+import logging
+import numpy as np
+
+__all__ = ["FastaIndex",
+           "zmw_of_read_name"]
+
+FASTA_INDEX_MAGIC = "PBTRANSCRIPT_FASTA_INDEX"
+FASTA_INDEX_VERSION = 1
+
+_HEADER_SIZE = 4096
+_ALIGN = 8
+_NO_RECORD = -1
+
+
+def zmw_of_read_name(name):
+    """Return zmw of a PacBio read name, e.g., movie/zmw/s_e --> movie/zmw."""
+    return name[:name.rfind('/')]
+
+
+def _hash(key):
+    """Return a deterministic hash of key (not randomized per process)."""
+    return zlib.crc32(key) & 0xffffffff
+
+
+def _build_hash_table(keys):
+    """
+    keys --- a dict, key --> record index
+    Return an open addressing (linear probing) hash table of keys, as an
+    int64 array whose size is a power of 2, where each slot contains a
+    record index or -1.
+    """
+    size = 8
+    while size < 2 * len(keys):
+        size *= 2
+    mask = size - 1
+    slots = np.empty(size, dtype=np.int64)
+    slots.fill(_NO_RECORD)
+    for key, index in keys.iteritems():
+        i = _hash(key) & mask
+        while slots[i] != _NO_RECORD:
+            i = (i + 1) & mask
+        slots[i] = index
+    return slots
+
+
+def _open_mmap(filename):
+    """mmap a file read-only, return '' if the file is empty."""
+    with open(filename, 'rb') as f:
+        if op.getsize(filename) == 0:
+            return ''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def _fasta_signature(fasta_filename):
+    """Return (size, mtime) of a FASTA file."""
+    st = os.stat(fasta_filename)
+    return [st.st_size, repr(st.st_mtime)]
+
+
+def _scan_fasta(buf):
+    """
+    Scan a FASTA file in buffer buf, return a list of
+    (name, offset, end, length, linebases, linewidth) of records,
+    where buf[offset:end] contains sequence lines of a record,
+    linebases and linewidth are the number of bases and bytes of
+    every sequence line but the last, or both 0 if line widths of
+    the record are not fixed.
+    """
+    records = []
+    size = len(buf)
+    pos = 0 if size > 0 and buf[0] == '>' else buf.find('\n>')
+    if pos > 0:
+        pos += 1
+    while 0 <= pos < size:
+        header_end = buf.find('\n', pos)
+        if header_end < 0:
+            header_end = size
+        fields = buf[pos + 1:header_end].split(None, 1)
+        # the header MUST be just 1 line
+        name = fields[0] if len(fields) > 0 else ''
+        offset = min(header_end + 1, size)
+        next_pos = buf.find('\n>', header_end)
+        end = size if next_pos < 0 else next_pos + 1
+
+        lines = buf[offset:end].split('\n')
+        if len(lines) > 0 and len(lines[-1]) == 0:
+            lines.pop()
+        bases = [len(line.rstrip()) for line in lines]
+        length = sum(bases)
+        linebases, linewidth = 0, 0
+        if length > 0:
+            # line widths are fixed if all lines but the last have the
+            # same number of bases, and all lines end with '\n' or '\r\n'.
+            pad = len(lines[0]) - bases[0]
+            if pad in (0, 1) and \
+               all(b == bases[0] for b in bases[:-1]) and \
+               0 < bases[-1] <= bases[0] and \
+               all(len(line) - b == pad for line, b in zip(lines, bases)) and \
+               (pad == 0 or all(line.endswith('\r') for line in lines)):
+                linebases, linewidth = bases[0], bases[0] + pad + 1
+        records.append((name, offset, end, length, linebases, linewidth))
+        pos = -1 if next_pos < 0 else next_pos + 1
+    return records
+
+
+class FastaIndex(object):
+
+    """
+    A persistent index of a FASTA file, see module docstring.
+
+    Example:
+        index = FastaIndex.open('subreads.fasta', with_zmws=True)
+        index['movie/1/0_100'] ==> sequence of movie/1/0_100
+        [index.name(i) for i in index.records_of_zmw('movie/1')]
+            ==> ['movie/1/0_100', 'movie/1/150_300']
+
+    Read ids are the first word of headers. If a read id occurs more
+    than once, the last occurrence is returned.
+    """
+
+    def __init__(self, fasta_filename, buf, header):
+        self.fasta_filename = fasta_filename
+        self._buf = buf
+        self._header = header
+        self._fasta = _open_mmap(fasta_filename)
+        for name, (offset, dtype, count) in header['arrays'].iteritems():
+            setattr(self, "_" + name,
+                    np.frombuffer(buf, dtype=dtype, count=count, offset=offset))
+        self._name_mask = len(self._name_slots) - 1
+        self._zmw_mask = len(self._zmw_slots) - 1 if self.has_zmws else 0
+        self._names_offset = header['arrays']['names'][0]
+
+    @classmethod
+    def open(cls, fasta_filename, with_zmws=False):
+        """
+        Open index of fasta_filename, which is reused if it is up to
+        date, and contains zmws when with_zmws is True, otherwise,
+        build an index and try to write it next to the FASTA file.
+        """
+        index_filename = cls.hash_filename(fasta_filename)
+        signature = _fasta_signature(fasta_filename)
+        if op.exists(index_filename):
+            try:
+                buf = _open_mmap(index_filename)
+                header = cls._read_header(buf)
+                if header['fasta'] == signature and \
+                   (header['has_zmws'] or not with_zmws):
+                    return cls(fasta_filename, buf, header)
+                logging.info("Rebuilding out of date index %s.", index_filename)
+            except (IOError, OSError, ValueError) as e:
+                logging.info("Rebuilding index %s: %s", index_filename, str(e))
+        return cls.build(fasta_filename, with_zmws=with_zmws)
+
+    @staticmethod
+    def hash_filename(fasta_filename):
+        """Return $fasta.fai.hash"""
+        return fasta_filename + ".fai.hash"
+
+    @staticmethod
+    def fai_filename(fasta_filename):
+        """Return $fasta.fai"""
+        return fasta_filename + ".fai"
+
+    @classmethod
+    def build(cls, fasta_filename, with_zmws=False):
+        """Build an index of fasta_filename by scanning it, write
+        $fasta.fai and $fasta.fai.hash if possible."""
+        signature = _fasta_signature(fasta_filename)
+        records = _scan_fasta(_open_mmap(fasta_filename))
+
+        names = [r[0] for r in records]
+        arrays = [('offsets', np.array([r[1] for r in records], dtype=np.int64)),
+                  ('ends', np.array([r[2] for r in records], dtype=np.int64)),
+                  ('lengths', np.array([r[3] for r in records], dtype=np.int64)),
+                  ('linebases', np.array([r[4] for r in records], dtype=np.int64)),
+                  ('linewidths', np.array([r[5] for r in records], dtype=np.int64))]
+        # names are separated by '\n', name of record i is
+        # names[name_starts[i]:name_starts[i+1]-1]
+        name_starts = np.zeros(len(names) + 1, dtype=np.int64)
+        name_starts[1:] = np.cumsum([len(name) + 1 for name in names])
+        arrays.append(('name_starts', name_starts))
+        arrays.append(('names', np.frombuffer(
+            ''.join(name + '\n' for name in names), dtype=np.uint8)))
+        last_of_name = dict((name, i) for i, name in enumerate(names))
+        arrays.append(('name_slots', _build_hash_table(last_of_name)))
+        if with_zmws:
+            # zmw --> first read; next_in_zmw: read --> next read of its zmw
+            first_of_zmw, last_of_zmw = {}, {}
+            next_in_zmw = np.empty(len(names), dtype=np.int64)
+            next_in_zmw.fill(_NO_RECORD)
+            for i, name in enumerate(names):
+                zmw = zmw_of_read_name(name)
+                if zmw in last_of_zmw:
+                    next_in_zmw[last_of_zmw[zmw]] = i
+                else:
+                    first_of_zmw[zmw] = i
+                last_of_zmw[zmw] = i
+            arrays.append(('zmw_slots', _build_hash_table(first_of_zmw)))
+            arrays.append(('next_in_zmw', next_in_zmw))
+
+        header = {'magic': FASTA_INDEX_MAGIC, 'version': FASTA_INDEX_VERSION,
+                  'fasta': signature, 'has_zmws': with_zmws,
+                  'num_records': len(names), 'num_names': len(last_of_name),
+                  'num_zmws': len(first_of_zmw) if with_zmws else 0,
+                  'arrays': {}}
+        offset = _HEADER_SIZE
+        for name, arr in arrays:
+            header['arrays'][name] = (offset, arr.dtype.str, len(arr))
+            offset += (arr.nbytes + _ALIGN - 1) // _ALIGN * _ALIGN
+        header_str = json.dumps(header)
+        if len(header_str) >= _HEADER_SIZE:
+            raise ValueError("FASTA index header is too long.")
+
+        buf = bytearray(offset)
+        buf[0:len(header_str)] = header_str
+        for name, arr in arrays:
+            start = header['arrays'][name][0]
+            buf[start:start + arr.nbytes] = arr.tostring()
+        buf = str(buf)
+
+        cls._write_fai(fasta_filename, records)
+        index_filename = cls.hash_filename(fasta_filename)
+        tmp_filename = index_filename + ".{pid}.tmp".format(pid=os.getpid())
+        try:
+            with open(tmp_filename, 'wb') as f:
+                f.write(buf)
+            os.rename(tmp_filename, index_filename)
+            buf = _open_mmap(index_filename)
+        except (IOError, OSError) as e:
+            logging.warning("Unable to write index %s, keep it in memory: %s",
+                            index_filename, str(e))
+            if op.exists(tmp_filename):
+                os.remove(tmp_filename)
+        return cls(fasta_filename, buf, header)
+
+    @classmethod
+    def _write_fai(cls, fasta_filename, records):
+        """Write a samtools faidx compatible $fasta.fai if it does not exist
+        or is older than fasta_filename, and every record has fixed line
+        width."""
+        fai_filename = cls.fai_filename(fasta_filename)
+        if (op.exists(fai_filename) and
+                op.getmtime(fai_filename) >= op.getmtime(fasta_filename)) or \
+           any(r[3] > 0 and r[4] == 0 for r in records):
+            return
+        tmp_filename = fai_filename + ".{pid}.tmp".format(pid=os.getpid())
+        try:
+            with open(tmp_filename, 'w') as f:
+                for name, offset, dummy_end, length, linebases, linewidth in records:
+                    f.write("{0}\t{1}\t{2}\t{3}\t{4}\n".format(
+                        name, length, offset, linebases, linewidth))
+            os.rename(tmp_filename, fai_filename)
+        except (IOError, OSError) as e:
+            logging.warning("Unable to write %s: %s", fai_filename, str(e))
+            if op.exists(tmp_filename):
+                os.remove(tmp_filename)
+
+    @staticmethod
+    def _read_header(buf):
+        """Read and validate header of an index in buffer buf."""
+        try:
+            header = json.loads(buf[0:_HEADER_SIZE].rstrip('\x00'))
+        except ValueError:
+            raise ValueError("Invalid FASTA index header.")
+        if header.get('magic', None) != FASTA_INDEX_MAGIC or \
+           header.get('version', None) != FASTA_INDEX_VERSION:
+            raise ValueError("Unknown FASTA index format.")
+        end = max([offset + np.dtype(dtype).itemsize * count
+                   for offset, dtype, count in header['arrays'].itervalues()])
+        if end > len(buf):
+            raise ValueError("Truncated FASTA index.")
+        return header
+
+    @property
+    def has_zmws(self):
+        """Whether or not zmws are indexed."""
+        return self._header['has_zmws']
+
+    @property
+    def num_records(self):
+        """Return number of records, including duplicated ones."""
+        return self._header['num_records']
+
+    def __len__(self):
+        """Return number of distinct read names."""
+        return self._header['num_names']
+
+    @property
+    def num_zmws(self):
+        """Return number of distinct zmws."""
+        return self._header['num_zmws']
+
+    def name(self, i):
+        """Return name of the i-th record."""
+        start = self._names_offset + int(self._name_starts[i])
+        end = self._names_offset + int(self._name_starts[i + 1]) - 1
+        return self._buf[start:end]
+
+    def names(self):
+        """Return names of all records in file order."""
+        offset, dummy_dtype, nbytes = self._header['arrays']['names']
+        names = self._buf[offset:offset + nbytes].split('\n')
+        names.pop()
+        return names
+
+    def _find(self, key, slots, mask, key_of_record):
+        """Probe hash table slots for key, return record index or -1."""
+        i = _hash(key) & mask
+        while True:
+            index = int(slots[i])
+            if index == _NO_RECORD or key_of_record(index) == key:
+                return index
+            i = (i + 1) & mask
+
+    def find(self, name):
+        """Return index of the record of read name, or -1 if not found."""
+        return self._find(name, self._name_slots, self._name_mask, self.name)
+
+    def __contains__(self, name):
+        return self.find(name) != _NO_RECORD
+
+    def sequence(self, i):
+        """Return sequence of the i-th record."""
+        offset, length = int(self._offsets[i]), int(self._lengths[i])
+        linebases, linewidth = int(self._linebases[i]), int(self._linewidths[i])
+        if length == 0:
+            return ''
+        if linebases == 0:  # irregular line widths
+            lines = self._fasta[offset:int(self._ends[i])].split('\n')
+            return ''.join(line.rstrip() for line in lines)
+        nbytes = length + (length - 1) // linebases * (linewidth - linebases)
+        seq = self._fasta[offset:offset + nbytes]
+        if length <= linebases:  # single line
+            return seq
+        return seq.replace('\r\n' if linewidth - linebases == 2 else '\n', '')
+
+    def length(self, i):
+        """Return sequence length of the i-th record."""
+        return int(self._lengths[i])
+
+    def __getitem__(self, name):
+        """Return sequence of read name, raise KeyError if not found."""
+        i = self.find(name)
+        if i == _NO_RECORD:
+            raise KeyError(name)
+        return self.sequence(i)
+
+    def find_zmw(self, zmw):
+        """Return index of the first record of zmw, or -1 if not found."""
+        if not self.has_zmws:
+            raise ValueError("Zmws of %s are not indexed." % self.fasta_filename)
+        return self._find(zmw, self._zmw_slots, self._zmw_mask,
+                          lambda i: zmw_of_read_name(self.name(i)))
+
+    def records_of_zmw(self, zmw):
+        """Return indices of all records of zmw in file order, or an empty
+        list if zmw is not found."""
+        ret = []
+        i = self.find_zmw(zmw)
+        while i != _NO_RECORD:
+            ret.append(i)
+            i = int(self._next_in_zmw[i])
+        return ret
+
+    def close(self):
+        """Close mmaps."""
+        for buf in (self._fasta, self._buf):
+            if isinstance(buf, mmap.mmap):
+                buf.close()
+
+    def __repr__(self):
+        return "<FastaIndex of {f}: {n} reads>".format(
+            f=self.fasta_filename, n=len(self))
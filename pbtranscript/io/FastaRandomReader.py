@@ -5,6 +5,9 @@ or ContigSet files randomly.
 Note that a ContigSet can contain multiple FASTA files,
 but can only contain FASTA files and filters in the
 ContigSet will not be respected.
+
+FASTA files are indexed by FastaIndex, which is persisted next to
+each FASTA file and reused by later readers, see FastaIndex.
 """
 
 from collections import namedtuple
@@ -14,6 +17,8 @@ import logging
 from pbcore.io.FastaIO import FastaRecord
 from pbcore.io import ContigSet
 
+from pbtranscript.io.FastaIndex import FastaIndex, zmw_of_read_name
+
 __all__ = ["FastaRandomReader",
            "MetaSubreadFastaReader",
            "SubreadFastaReader"]
@@ -45,9 +50,7 @@ class FastaRandomReader(object):
 
     def __init__(self, *args):
         self.fasta_filenames = self.get_fasta_filenames(*args)
-        self.fhandlers = self._open_files()
-        self.d = {}
-        self._init_index()
+        self.indices = [FastaIndex.open(fn) for fn in self.fasta_filenames]
 
     def get_fasta_filenames(self, *args):
         """Return all FASTA file names as a list."""
@@ -68,43 +71,30 @@ class FastaRandomReader(object):
                               % self.__class__.__name__)
         return ret
 
-    def _open_files(self):
-        return [open(fn) for fn in self.fasta_filenames]
-
-    def _init_index(self):
-        """Indexing reads in fasta_filenames"""
-        for index, f in enumerate(self.fhandlers):
-            while 1:
-                line = f.readline()
-                if len(line) == 0:
-                    break
-                if line.startswith('>'):
-                    sid = line.strip()[1:].split(None, 1)[0]
-                    # the header MUST be just 1 line
-                    # if id in self.d:
-                    #    print "duplicate id {0}!!".format(id)
-                    self.d[sid] = (index, f.tell())
+    def _find(self, k):
+        """Return (index, record number) of read k, or (None, -1).
+        If k is in multiple files, the last one wins."""
+        for index in reversed(self.indices):
+            i = index.find(k)
+            if i >= 0:
+                return index, i
+        return None, -1
+
+    def __contains__(self, k):
+        return self._find(k)[0] is not None
 
     def __getitem__(self, k):
-        if k not in self.d:
+        index, i = self._find(k)
+        if index is None:
             errMsg = "key {k} not in {f}!".format(k=k, f=",".join(self.fasta_filenames))
-            logging.error(self.d.keys())
+            logging.error(errMsg)
             raise ValueError(errMsg)
-        return self._get_record(k)
-
-    def _get_record(self, k):
-        index, tell = self.d[k]
-        f = self.fhandlers[index]
-        f.seek(tell)
-        content = ''
-        for line in f:
-            if line.startswith('>'):
-                break
-            content += line.strip()
-        return FastaRecord(header=k, sequence=content)
+        return FastaRecord(header=k, sequence=index.sequence(i))
 
     def __len__(self):
-        return len(self.d)
+        if len(self.indices) == 1:
+            return len(self.indices[0])
+        return len(self.keys())
 
     def __delitem__(self, key):
         errMsg = "%s.__delitem__ not defined." % self.__class__.__name__
@@ -115,8 +105,11 @@ class FastaRandomReader(object):
         raise NotImplementedError(errMsg)
 
     def keys(self):
-        """Return d.keys."""
-        return self.d.keys()
+        """Return distinct read ids."""
+        if len(self.indices) == 1 and \
+           len(self.indices[0]) == self.indices[0].num_records:
+            return self.indices[0].names()
+        return list(set(k for index in self.indices for k in index.names()))
 
 
 class MetaSubreadFastaReader(object):
@@ -124,27 +117,32 @@ class MetaSubreadFastaReader(object):
     """Reader for reading PabBio subreads in a list of fasta files."""
 
     def __init__(self, fasta_filenames):
-        self.meta_f = {}
-        self.meta_zmw_d = {}
-        # record just the zmw and let the subread reader handle it
-        for fn in fasta_filenames:
-            self.meta_f[fn] = SubreadFastaReader(fn)
-            # combine all the keys
-            for k in self.meta_f[fn].zmw_d.keys():
-                self.meta_zmw_d[k] = fn
+        self.meta_f = [SubreadFastaReader(fn) for fn in fasta_filenames]
+
+    def _reader_of_zmw(self, zmw):
+        """Return the reader containing zmw, the last one wins."""
+        for reader in reversed(self.meta_f):
+            if reader.has_zmw(zmw):
+                return reader
+        raise KeyError(zmw)
 
     def __getitem__(self, k):
         """
         k -- could be zmw or subread id
         """
         if k.count('/') == 2:
-            zmw = k[:k.rfind('/')]
+            zmw = zmw_of_read_name(k)
         else:
             zmw = k
-        return self.meta_f[self.meta_zmw_d[zmw]][k]
+        return self._reader_of_zmw(zmw)[k]
 
     def __len__(self):
-        return len(sum([len(d) for d in self.meta_zmw_d]))
+        """Return number of zmws."""
+        return sum(reader.num_zmws for reader in self.meta_f)
+
+    def num_subreads_of_zmw(self, zmw):
+        """Return number of subreads of zmw, without reading sequences."""
+        return len(self._reader_of_zmw(zmw).index.records_of_zmw(zmw))
 
     def __delitem__(self, key):
         errMsg = "%s.__delitem__ not defined." % self.__class__.__name__
@@ -160,22 +158,16 @@ class SubreadFastaReader(object):
     """Reader for reading PabBio subreads in a fasta file."""
 
     def __init__(self, fasta_filename):
-        self.f = open(fasta_filename)
-        self.d = {}
-        self.zmw_d = {}
-        while 1:
-            line = self.f.readline()
-            if len(line) == 0:
-                break
-            if line.startswith('>'):
-                # ex: m140..._s1_p0/155/0_1673 RQ=0.845
-                rid = line.strip()[1:].split(None, 1)[0]
-                # the header MUST be just 1 line
-                zmw = rid[:rid.rfind('/')]
-                self.d[rid] = (rid, self.f.tell())
-                if zmw not in self.zmw_d:
-                    self.zmw_d[zmw] = []
-                self.zmw_d[zmw].append((rid, self.f.tell()))
+        self.index = FastaIndex.open(fasta_filename, with_zmws=True)
+
+    def has_zmw(self, zmw):
+        """Return True if zmw has any subread in this file."""
+        return self.index.find_zmw(zmw) >= 0
+
+    @property
+    def num_zmws(self):
+        """Return number of zmws."""
+        return self.index.num_zmws
 
     def __getitem__(self, k):
         """
@@ -184,30 +176,26 @@ class SubreadFastaReader(object):
         If latter, return just that record but still in a list
         """
         if k.count('/') == 2:  # is a subread
-            if k not in self.d:
+            i = self.index.find(k)
+            if i < 0:
                 raise ValueError("key {0} not in dictionary!".format(k))
-            locations = [self.d[k]]
+            locations = [i]
         else:  # is a ZMW
-            if k not in self.zmw_d:
+            locations = self.index.records_of_zmw(k)
+            if len(locations) == 0:
                 raise ValueError("key {0} not in dictionary!".format(k))
-            locations = self.zmw_d[k]
-        output = []
-        for seqid, loc in locations:
-            self.f.seek(loc)
-            content = ''
-            for line in self.f:
-                if line.startswith('>'):
-                    break
-                content += line.strip()
-            output.append(FastaRecord(header=seqid, sequence=content))
-        return output
+        return [FastaRecord(header=self.index.name(i),
+                            sequence=self.index.sequence(i))
+                for i in locations]
 
     def keys(self):
-        """return keys (subreads)."""
-        return self.d.keys()
+        """Return distinct keys (subreads)."""
+        if len(self.index) == self.index.num_records:
+            return self.index.names()
+        return list(set(self.index.names()))
 
     def __len__(self):
-        return len(self.d)
+        return len(self.index)
 
     def __delitem__(self, key):
         errMsg = "%s.__delitem__ not defined." % self.__class__.__name__
@@ -4,10 +4,58 @@
 Define LA4IceReader which reads output of 'LA4Ice' as BLASRRecord.
 """
 
+import os
+import mmap
+import numpy as np
 from pbtranscript.io.BLASRRecord import BLASRRecord
+from pbtranscript.io.c_LA4Ice import scan_record
 
 __author__ = 'etseng@pacificbiosciences.com'
 
+__all__ = ["LA4IceRecord", "LA4IceReader"]
+
+_ALN_FIELDS = ('qAln', 'alnStr', 'sAln')
+
+
+def _record_fields(record):
+    """Return a dict of public fields of a BLASRRecord, including
+    alignment strings."""
+    d = dict((k, v) for (k, v) in vars(record).iteritems()
+             if not k.startswith('_'))
+    for name in _ALN_FIELDS:
+        d[name] = getattr(record, name)
+    return d
+
+
+class LA4IceRecord(BLASRRecord):
+
+    """
+    A BLASRRecord read by LA4IceReader, of which alignment strings
+    (qAln, alnStr, sAln) are only sliced out of the reader's buffer
+    when they are first accessed. Access them before the reader is closed.
+    """
+
+    def __init__(self, buf, aln_spans, **kwargs):
+        super(LA4IceRecord, self).__init__(**kwargs)
+        self._buf = buf
+        # (start, end) of qAln, alnStr, sAln in buf
+        self._aln_spans = dict(zip(_ALN_FIELDS, aln_spans))
+        for name in _ALN_FIELDS:
+            del self.__dict__[name]
+
+    def __getattr__(self, name):
+        """Materialize an alignment string when it is first accessed."""
+        try:
+            start, end = self.__dict__['_aln_spans'][name]
+        except KeyError:
+            raise AttributeError(name)
+        value = self._buf[start:end]
+        setattr(self, name, value)
+        return value
+
+    def __eq__(self, another):
+        return _record_fields(self) == _record_fields(another)
+
 
 class LA4IceReader(object):
 
@@ -15,13 +63,28 @@ class LA4IceReader(object):
     Reader for reading alignments produced by
         'LA4Ice -m -i0 -w100000 -b0 -a {db} {las}'
 
+    The file is memory mapped and scanned by c_LA4Ice.scan_record,
+    alignment strings of records are materialized lazily (see LA4IceRecord).
+
+    prefilter --- if not None, a function which takes a record and returns
+        False if the record should be skipped. It is called before any
+        alignment string is materialized, hence it should only look at
+        header fields (e.g., strand, identity, qStart, qEnd, ...)
+
     Example
         [r for r in LA4IceReader('*.las.out')][0] ==> this shows a BLASRRecord
     """
 
-    def __init__(self, las_out_filename):
+    def __init__(self, las_out_filename, prefilter=None):
         self.file_name = las_out_filename
+        self.prefilter = prefilter
         self.f = self._open_file(las_out_filename)
+        if os.fstat(self.f.fileno()).st_size > 0:
+            self.buf = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self.buf = ''
+        self._arr = np.frombuffer(self.buf, dtype=np.uint8)
+        self._pos = 0
         self._lineno = 0
 
     def _open_file(self, file_name):
@@ -38,6 +101,9 @@ class LA4IceReader(object):
 
     def close(self):
         """Close *.las.out file."""
+        self._arr = None  # drop the view before unmapping
+        if isinstance(self.buf, mmap.mmap):
+            self.buf.close()
         self.f.close()
 
     def next(self):
@@ -45,48 +111,38 @@ class LA4IceReader(object):
         Should be the printed out of running:
         LA4Ice -m -i0 -w100000 -b0 -a:{db} {las}
         """
+        while True:
+            r = self._next_record()
+            if self.prefilter is None or self.prefilter(r):
+                return r
+
+    def _next_record(self):
+        """Read the next record, without materializing alignment strings."""
         # first line is BLASR-like output
         # ex: 000000002 000002845 -1192 85.12 0 1855 3082 3082 0 2324 3516 3517 overlap
         # if is - strand, then strand=1, start=S, end=E means the sequence is
         # seq[S:E].reverse_complement()
         try:
-            raw = self.f.readline().strip().split()
-            self._lineno += 1
-            if raw[0] == '+' and raw[1] == '+':  # FALCON-added EOF signature
+            ret = scan_record(self._arr, self._pos)
+            if ret is None:  # FALCON-added EOF signature
                 raise StopIteration
-            qID = int(raw[0]) + 1  # convert to 1-based
-            sID = int(raw[1]) + 1  # convert to 1-based
-            score = int(raw[2])
-            iden = float(raw[3])
-            qStrand = int(raw[4])
-            qStart = int(raw[5])  # 0-based
-            qEnd = int(raw[6])
-            qLen = int(raw[7])
-            sStrand = int(raw[8])
-            sStart = int(raw[9])
-            sEnd = int(raw[10])
-            sLen = int(raw[11])
-
-            self.f.readline()  # blank line
-            _qStart, qAln = self.f.readline().strip().split()
-            self._lineno += 2
-            # Liz: changed becuz new daligner has _qStart and _sStart both at 0-based
-            assert ((qStrand == 0 and int(_qStart)  == qStart) or
-                    (qStrand == 1 and int(_qStart)  == qEnd))
-            alnStr = self.f.readline().strip()
-            _sStart, sAln = self.f.readline().strip().split()[:2]
-            self._lineno += 2
+            header, aln_spans, self._pos = ret
+            (qID, sID, score, iden, qStrand, qStart, qEnd, qLen,
+             sStrand, sStart, sEnd, sLen, _qStart, _sStart) = header
             # Liz: changed becuz new daligner has _qStart and _sStart both at 0-based
-            assert ((sStrand == 0 and int(_sStart)  == sStart) or
-                    (sStrand == 1 and int(_sStart)  == sEnd))
-            return BLASRRecord(qID=qID, qLength=qLen,
-                               qStart=qStart, qEnd=qEnd, qStrand=qStrand,
-                               sID=sID, sLength=sLen,
-                               sStart=sStart, sEnd=sEnd, sStrand=sStrand,
-                               score=score, mapQV=None,
-                               qAln=qAln, alnStr=alnStr, sAln=sAln,
-                               identity=iden,
-                               strand='+' if qStrand == sStrand else '-')
+            assert ((qStrand == 0 and _qStart == qStart) or
+                    (qStrand == 1 and _qStart == qEnd))
+            assert ((sStrand == 0 and _sStart == sStart) or
+                    (sStrand == 1 and _sStart == sEnd))
+            self._lineno += 5
+            return LA4IceRecord(buf=self.buf, aln_spans=aln_spans,
+                                qID=qID + 1, qLength=qLen,  # convert to 1-based
+                                qStart=qStart, qEnd=qEnd, qStrand=qStrand,
+                                sID=sID + 1, sLength=sLen,  # convert to 1-based
+                                sStart=sStart, sEnd=sEnd, sStrand=sStrand,
+                                score=score, mapQV=None,
+                                identity=iden,
+                                strand='+' if qStrand == sStrand else '-')
         except (IndexError, IOError, ValueError, AssertionError) as exc:
             raise ValueError("Unable to read %s line %d as LA4Ice output: %r." %
-                             (self.file_name, self._lineno, exc))
+                             (self.file_name, self._lineno + 1, exc))
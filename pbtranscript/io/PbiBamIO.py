@@ -4,7 +4,9 @@ Defines classes for fetching data from a collection of original SMRTCell bam
 files, and for writing bam files.
 """
 
+import os
 import os.path as op
+import hashlib
 import numpy as np
 
 from ..libs import AlignmentFile, AlignedSegment, array_to_qualitystring
@@ -14,6 +16,7 @@ from pbcore.io import (SubreadSet, ConsensusReadSet,
 from pbcore.io import BamAlignment
 
 from pbtranscript.Utils import get_files_from_file_or_fofn
+from pbtranscript.io.ZmwIndex import ZMW_INDEX_VERSION, ZmwIndex
 
 
 __all__ = ["BamCollection",
@@ -327,9 +330,15 @@ class BamCollection(object):
     ccs dataset.
 
     Note that ALL bam files MUST have pbi index generated.
+
+    Zmws are looked up in a ZmwIndex, which is built from pbi once
+    and persisted in a sidecar file next to the input, see
+    zmwIndexFilename.
     """
 
     def __init__(self, *args):
+        self._zmwIndexFilename = self._getZmwIndexFilename(args)
+        self._zmwIndex = None
         if len(args) == 1:
             args = get_files_from_file_or_fofn(args[0])
         self._dataset = openDataFile(*args)
@@ -396,11 +405,11 @@ class BamCollection(object):
             return ds2
 
         _hn = int(indices[1])
-        # for efficiency: first select on hn, then movie name.
-        _reads = self._dataset[self._dataset.index.holeNumber == _hn]
-        _reads = [_read for _read in _reads if _read.movieName == _movie]
-        if len(_reads) == 0:
+        try:
+            _rows = self.zmwIndex[(self._dataset.movieIds[_movie], _hn)]
+        except KeyError:
             raise KeyError("Could not find %s in %s" % (key, str(self._dataset)))
+        _reads = self._dataset[_rows]
 
         _zmw = BamZmw(bamRecords=_reads, isCCS=self.isCCS)
         if len(indices) == 2:
@@ -418,17 +427,84 @@ class BamCollection(object):
     def __iter__(self):
         """Iterators over Zmw, ZmwRead objects.
         """
-        _qid_hns = np.unique(self._dataset.index[['qId', 'holeNumber']])
         for _movie in self.movieNames:
-            ds2 = self._dataset.copy()
-            ds2.filters.addRequirement(movie=[('==', _movie)])
             _movie_id = self._dataset.movieIds[_movie]
-            for (__movie_id, _hn) in _qid_hns:
-                if __movie_id == _movie_id:
-                    _reads = ds2[ds2.index.holeNumber == _hn]
-                    assert all([_read.movieName == _movie for _read in _reads])
-                    if len(_reads) > 0:
-                        yield BamZmw(bamRecords=_reads, isCCS=self.isCCS)
+            for _rows in self.zmwIndex.iter_rows(_movie_id):
+                yield BamZmw(bamRecords=self._dataset[_rows], isCCS=self.isCCS)
+
+    def __contains__(self, key):
+        """Return True if movie or zmw of key, e.g., movie/holeNumber or
+        movie/holeNumber/start_end, is in this collection."""
+        if not isinstance(key, str):
+            return False
+        indices = key.rstrip("/").split("/")
+        if indices[0] not in self._dataset.movieIds:
+            return False
+        if len(indices) == 1:
+            return True
+        try:
+            _hn = int(indices[1])
+        except ValueError:
+            return False
+        return (self._dataset.movieIds[indices[0]], _hn) in self.zmwIndex
+
+    def numReadsOfZmw(self, key):
+        """Return number of reads (e.g., subreads) of a zmw, where key is
+        movie/holeNumber, without reading any record from bam files."""
+        indices = key.rstrip("/").split("/")
+        try:
+            return self.zmwIndex.num_records((self._dataset.movieIds[indices[0]],
+                                              int(indices[1])))
+        except (KeyError, IndexError, ValueError):
+            raise KeyError("Could not find %s in %s" % (key, str(self._dataset)))
+
+    @staticmethod
+    def _getZmwIndexFilename(args):
+        """Return sidecar file of zmw index of input files, which is
+        $input.zmwindex.npz if there is only one input bam, fofn or
+        dataset xml, otherwise $first_bam.$sha1_of_all_inputs.zmwindex.npz.
+        """
+        fns = [op.abspath(op.expanduser(fn)) for fn in args]
+        if len(fns) == 0:
+            return None
+        if len(fns) == 1:
+            return fns[0] + ".zmwindex.npz"
+        return "%s.%s.zmwindex.npz" % (
+            fns[0], hashlib.sha1("\n".join(fns)).hexdigest()[:12])
+
+    @property
+    def zmwIndexFilename(self):
+        """Return sidecar file of zmw index."""
+        return self._zmwIndexFilename
+
+    def _zmwIndexSignature(self):
+        """Return a signature of bam and pbi files and filters, which
+        identifies records in pbi of this collection."""
+        resources = []
+        for bam in self._dataset.resourceReaders():
+            for fn in (bam.filename, bam.filename + ".pbi"):
+                if op.exists(fn):
+                    st = os.stat(fn)
+                    resources.append([op.abspath(fn), st.st_size, int(st.st_mtime)])
+        return {'version': ZMW_INDEX_VERSION,
+                'resources': resources,
+                'filters': str(self._dataset.filters),
+                'num_records': len(self._dataset.index)}
+
+    @property
+    def zmwIndex(self):
+        """Return ZmwIndex of this collection, which is read from
+        sidecar file if it is up to date, otherwise built from pbi."""
+        if self._zmwIndex is None:
+            def _columns():
+                """Return pbi columns qId and holeNumber."""
+                index = self._dataset.index
+                return index.qId, index.holeNumber
+            self._zmwIndex = ZmwIndex.read_or_build(
+                filename=self.zmwIndexFilename,
+                signature=self._zmwIndexSignature(),
+                pbi_columns_func=_columns)
+        return self._zmwIndex
 
     def reads(self):
         """Iterate over all reads"""
@@ -461,7 +537,7 @@ class BamCollection(object):
 
     def __len__(self):
         """Return total number of zmws in all movies."""
-        return len(np.unique(self._dataset.index[['qId', 'holeNumber']]))
+        return len(self.zmwIndex)
 
     def close(self):
         """Close all readers."""
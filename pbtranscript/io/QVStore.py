@@ -0,0 +1,435 @@
+#!/usr/bin/env python
+
+"""
+Define QVStore, a columnar, array-backed store of per-read quality
+value probabilities used by basQVcacher and fastqQVcacher.
+
+A QVStore can be saved to a binary QV cache file and opened again
+with numpy memory maps, so that QVs of reads are extracted from
+ccs.h5/ccs.bam files once and then shared by every process which
+needs them, without parsing or copying them into memory.
+"""
+
+import os
+import json
+import numpy as np
+
+__all__ = ["QVStore", "qvs_to_probs"]
+
+
+def qvs_to_probs(qvs):
+    """Convert an array of phred QVs to error probabilities (float32)."""
+    qvs = np.asarray(qvs, dtype=np.float32)
+    return np.power(np.float32(10.), -qvs / np.float32(10.))
+
+
+class QVStore(object):
+
+    """
+    Columnar store of QV probabilities.
+
+    Every QV track (e.g., 'DeletionQV', 'DeletionQV_smoothed' or
+    'unsmoothed') is kept in one contiguous float32 buffer shared by
+    all reads. A read is addressed by a row, which records the offset
+    and length of the read within every track buffer, and the per-read
+    mean of every track for which means have been computed.
+
+    Example:
+        store = QVStore()
+        store.add('movie/1/0_3_CCS', {'unsmoothed': [0.1, 0.01, 0.001]})
+        store.get('movie/1/0_3_CCS', 'unsmoothed') ==> array view
+        store.write('reads.qvcache')
+        QVStore.open('reads.qvcache') ==> store memory mapping the cache
+
+    Reads of a QV cache file opened by QVStore.open() stay memory mapped
+    and read-only. Reads added afterwards go into an in-memory segment
+    on top of the mapped cache, so adding reads never copies the cache.
+    Call detach(seqids) to copy mapped reads into the in-memory segment
+    before modifying them, e.g., smoothing them with another window.
+    """
+
+    dtype = np.float32
+    min_capacity = 1024
+    magic = 'PBQVSTORE1\n'
+
+    def __init__(self):
+        self._rows = {}  # seqid --> row index
+        self._offsets = np.zeros(0, dtype=np.int64)
+        self._lengths = np.zeros(0, dtype=np.int64)
+        self._num_rows = 0  # number of rows allocated, including deleted
+        self._size = 0  # number of bases allocated, including deleted
+        self._dead = 0  # number of bases occupied by deleted reads
+        self._buffers = {}  # track name --> float32 buffer
+        self._means = {}  # track name --> float32 array of per-row means
+        # json serializable attributes saved with the store in a QV cache
+        self.attrs = {}
+        # read-only store memory mapped from a QV cache file, see open()
+        self._base = None
+
+    def __len__(self):
+        return len(self._rows) + (len(self._base) if self._base is not None else 0)
+
+    def __contains__(self, seqid):
+        return seqid in self._rows or self.mapped(seqid)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        """Return ids of all reads in store."""
+        return self._rows.keys() + \
+            (self._base.keys() if self._base is not None else [])
+
+    def mapped(self, seqid):
+        """Return True if seqid is a read-only read memory mapped from
+        a QV cache file."""
+        return self._base is not None and seqid in self._base._rows
+
+    @property
+    def track_names(self):
+        """Return names of all QV tracks in store."""
+        names = set(self._buffers.keys())
+        if self._base is not None:
+            names.update(self._base.track_names)
+        return sorted(names)
+
+    @property
+    def nbytes(self):
+        """Return number of bytes used by in-memory track buffers and means,
+        excluding memory mapped reads."""
+        return (sum(b.nbytes for b in self._buffers.itervalues()) +
+                sum(m.nbytes for m in self._means.itervalues()) +
+                self._offsets.nbytes + self._lengths.nbytes)
+
+    def detach(self, seqids=None):
+        """Copy memory mapped reads in seqids (or all memory mapped reads
+        if seqids is None) into memory, so that they can be modified."""
+        if self._base is None:
+            return
+        if seqids is None:
+            seqids = self._base.keys()
+        base = self._base
+        seqids = sorted((seqid for seqid in seqids if self.mapped(seqid)),
+                        key=lambda seqid: base._rows[seqid])
+        if len(seqids) == 0:
+            return
+        rows = np.fromiter((base._rows[seqid] for seqid in seqids),
+                           dtype=np.int64, count=len(seqids))
+        positions = base._positions(rows)
+        means = dict((name, base._means[name][rows]) for name in base._means)
+        # extend() hides detached reads in base
+        self.extend(seqids, base._lengths[rows],
+                    dict((name, base._buffers[name][positions])
+                         for name in base._buffers))
+        rows = np.fromiter((self._rows[seqid] for seqid in seqids),
+                           dtype=np.int64, count=len(seqids))
+        for name, values in means.iteritems():
+            self._mean_array(name)[rows] = values
+
+    def _row(self, seqid):
+        """Return row of seqid, raise KeyError if seqid is not in store."""
+        try:
+            return self._rows[seqid]
+        except KeyError:
+            raise KeyError("QVs of {seqid} must be precached.".format(seqid=seqid))
+
+    def _mean_array(self, name):
+        """Return array of per-row means of track name, create it if
+        it does not exist."""
+        if name not in self._means:
+            self._means[name] = np.empty(max(self._num_rows, self.min_capacity),
+                                         dtype=self.dtype)
+            self._means[name][:] = np.nan
+        return self._means[name]
+
+    @staticmethod
+    def _grow(arr, n, fill=0):
+        """Return arr if it can hold n elements, otherwise a copy of arr
+        resized (at least doubled) to hold n elements."""
+        if len(arr) >= n:
+            return arr
+        new_arr = np.empty(max(n, 2 * len(arr), QVStore.min_capacity),
+                           dtype=arr.dtype)
+        new_arr[:len(arr)] = arr
+        new_arr[len(arr):] = fill
+        return new_arr
+
+    def track(self, name):
+        """Return buffer of track name, create it if it does not exist.
+        Reads are addressed within the buffer by segments()."""
+        if name not in self._buffers:
+            self._buffers[name] = np.empty(max(self._size, self.min_capacity),
+                                           dtype=self.dtype)
+            self._buffers[name][:] = np.nan
+        return self._buffers[name]
+
+    def extend(self, seqids, lengths, tracks):
+        """
+        Add a batch of reads to store.
+            seqids --- ids of reads to add
+            lengths --- lengths of reads, in the same order as seqids
+            tracks --- dict of track name --> flat array of QV probabilities
+                       of all reads concatenated in the same order as seqids
+        """
+        lengths = np.asarray(lengths, dtype=np.int64)
+        if len(seqids) != len(lengths):
+            raise ValueError("Number of seqids and lengths must agree.")
+        total = int(lengths.sum())
+        for name, values in tracks.iteritems():
+            if len(values) != total:
+                raise ValueError("Track {name} should contain {n} values.".
+                                 format(name=name, n=total))
+
+        # re-adding an existing read replaces its QVs
+        for seqid in seqids:
+            if seqid in self:
+                del self[seqid]
+
+        first_row, start = self._num_rows, self._size
+        self._num_rows += len(seqids)
+        self._size += total
+        self._offsets = self._grow(self._offsets, self._num_rows)
+        self._lengths = self._grow(self._lengths, self._num_rows)
+        self._offsets[first_row:self._num_rows] = \
+            start + np.cumsum(lengths) - lengths
+        self._lengths[first_row:self._num_rows] = lengths
+        for name in self._buffers.keys():
+            self._buffers[name] = self._grow(self._buffers[name], self._size, np.nan)
+        for name in self._means.keys():
+            self._means[name] = self._grow(self._means[name], self._num_rows, np.nan)
+
+        for name, values in tracks.iteritems():
+            buf = self.track(name)
+            buf[start:self._size] = values
+
+        for i, seqid in enumerate(seqids):
+            self._rows[seqid] = first_row + i
+
+    def add(self, seqid, tracks):
+        """Add a read to store, tracks is a dict of track name --> QVs."""
+        lengths = set(len(v) for v in tracks.itervalues())
+        if len(lengths) != 1:
+            raise ValueError("All QV tracks of {s} must have the same length.".
+                             format(s=seqid))
+        self.extend([seqid], [lengths.pop()], tracks)
+
+    def __delitem__(self, seqid):
+        if self.mapped(seqid):
+            # hide the mapped read, the cache file is not changed
+            del self._base._rows[seqid]
+            return
+        row = self._row(seqid)
+        del self._rows[seqid]
+        self._dead += int(self._lengths[row])
+        # reclaim space once more than half of all bases are dead.
+        if self._dead > self.min_capacity and 2 * self._dead > self._size:
+            self.compact()
+
+    def remove_track(self, name):
+        """Remove a QV track and its means from store."""
+        self._buffers.pop(name, None)
+        self._means.pop(name, None)
+        if self._base is not None:
+            self._base.remove_track(name)
+
+    def get(self, seqid, name, position=None):
+        """Return QVs of track name of read seqid as an array view,
+        or QV at position if position is not None."""
+        if self.mapped(seqid):
+            return self._base.get(seqid, name, position)
+        row = self._row(seqid)
+        offset, length = self._offsets[row], self._lengths[row]
+        buf = self._buffers[name]
+        if position is None:
+            return buf[offset:offset + length]
+        if position < 0:
+            position += length
+        if not 0 <= position < length:
+            raise IndexError("Position {p} out of range of {s}.".
+                             format(p=position, s=seqid))
+        return buf[offset + position]
+
+    def get_mean(self, seqid, name):
+        """Return mean QV of track name of read seqid."""
+        if self.mapped(seqid):
+            return self._base.get_mean(seqid, name)
+        return self._means[name][self._row(seqid)]
+
+    def _select_rows(self, seqids):
+        """Return sorted rows of reads in seqids, or of all reads if
+        seqids is None."""
+        if seqids is None:
+            rows = np.fromiter(self._rows.itervalues(), dtype=np.int64,
+                               count=len(self._rows))
+        else:
+            rows = np.fromiter((self._row(s) for s in seqids), dtype=np.int64)
+        rows.sort()
+        return rows
+
+    def _positions(self, rows):
+        """Return positions of all bases of reads in rows within track
+        buffers, read by read."""
+        lengths = self._lengths[rows]
+        starts = np.cumsum(lengths) - lengths
+        pos_in_read = np.arange(int(lengths.sum()), dtype=np.int64) - \
+            np.repeat(starts, lengths)
+        return np.repeat(self._offsets[rows], lengths) + pos_in_read
+
+    def segments(self, seqids=None):
+        """Return (offsets, lengths) of in-memory reads in seqids (or all
+        in-memory reads if seqids is None) within track buffers, ordered
+        by offset. Memory mapped reads must be detached first."""
+        rows = self._select_rows(seqids)
+        return self._offsets[rows], self._lengths[rows]
+
+    def compute_means(self, names, seqids=None):
+        """Compute mean QVs of tracks in names for in-memory reads in
+        seqids in bulk, or for all in-memory reads if seqids is None."""
+        rows = self._select_rows(seqids)
+        rows = rows[self._lengths[rows] > 0]
+        if len(rows) == 0:
+            return
+        positions = self._positions(rows)
+        lengths = self._lengths[rows]
+        starts = np.cumsum(lengths) - lengths
+        for name in names:
+            values = self._buffers[name][positions].astype(np.float64)
+            self._mean_array(name)[rows] = np.add.reduceat(values, starts) / lengths
+
+    def compact(self):
+        """Drop bases of deleted in-memory reads and renumber rows."""
+        items = sorted(self._rows.iteritems(), key=lambda x: x[1])
+        seqids = [seqid for seqid, dummy_row in items]
+        rows = np.array([row for dummy_seqid, row in items], dtype=np.int64)
+        positions = self._positions(rows)
+        lengths = self._lengths[rows]
+        self._offsets = np.cumsum(lengths) - lengths
+        self._lengths = lengths.copy()
+        for name in self._buffers.keys():
+            self._buffers[name] = self._buffers[name][positions]
+        for name in self._means.keys():
+            self._means[name] = self._means[name][rows]
+        self._rows = dict((seqid, i) for i, seqid in enumerate(seqids))
+        self._num_rows = len(seqids)
+        self._size = len(positions)
+        self._dead = 0
+
+    def _live(self):
+        """Return (seqids, rows, positions of bases) of live reads, ordered
+        by row."""
+        items = sorted(self._rows.iteritems(), key=lambda x: x[1])
+        rows = np.array([row for dummy_seqid, row in items], dtype=np.int64)
+        return [seqid for seqid, dummy_row in items], rows, self._positions(rows)
+
+    @staticmethod
+    def _pad(f):
+        """Pad f with zeros so that the next section is 8-byte aligned."""
+        f.write('\0' * (-f.tell() % 8))
+
+    def write(self, filename):
+        """
+        Save all live reads of store, including memory mapped reads, to
+        a QV cache file, which can be opened with QVStore.open(). The file
+        is written to a temporary file first and then renamed, so that
+        readers never see a partially written cache.
+        """
+        # memory mapped reads first, then in-memory reads
+        stores = [self] if self._base is None else [self._base, self]
+        lives = [store._live() for store in stores]
+        names = '\n'.join(seqid for seqids, dummy_rows, dummy_pos in lives
+                          for seqid in seqids)
+        lengths = np.concatenate([store._lengths[live[1]]
+                                  for store, live in zip(stores, lives)])
+        offsets = np.cumsum(lengths) - lengths
+        tracks = sorted(set(n for store in stores for n in store._buffers))
+        means = sorted(set(n for store in stores for n in store._means))
+
+        def _section(arrs, name, select):
+            """Return values of arrs[name] ('_buffers' or '_means') of each
+            store, selected by positions of bases (select=2) or rows
+            (select=1) of live reads, NaN if a store lacks name."""
+            ret = []
+            for store, live in zip(stores, lives):
+                index = live[select]
+                if name in getattr(store, arrs):
+                    ret.append(getattr(store, arrs)[name][index])
+                else:
+                    ret.append(np.empty(len(index), dtype=self.dtype))
+                    ret[-1][:] = np.nan
+            return np.concatenate(ret)
+
+        tmp_filename = filename + '.tmp'
+        with open(tmp_filename, 'wb') as f:
+            header = json.dumps({'num_rows': len(lengths),
+                                 'size': int(lengths.sum()),
+                                 'tracks': tracks,
+                                 'means': means,
+                                 'names_nbytes': len(names),
+                                 'attrs': self.attrs})
+            f.write(self.magic)
+            np.array([len(header)], dtype=np.uint64).tofile(f)
+            f.write(header)
+            self._pad(f)
+            for arr in [offsets, lengths]:
+                arr.tofile(f)
+                self._pad(f)
+            # one track at a time, so that memory mapped tracks are not
+            # all read into memory at once
+            for name in tracks:
+                _section('_buffers', name, 2).tofile(f)
+                self._pad(f)
+            for name in means:
+                _section('_means', name, 1).tofile(f)
+                self._pad(f)
+            f.write(names)
+        os.rename(tmp_filename, filename)
+
+    @staticmethod
+    def _memmap(filename, dtype, offset, count):
+        """Return a read-only memory map of count elements of dtype
+        at offset of filename."""
+        if count == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(filename, dtype=dtype, mode='r',
+                         offset=offset, shape=(count,))
+
+    @classmethod
+    def open(cls, filename):
+        """Open a QV cache file written by write(), return a QVStore
+        whose reads are memory mapped read-only from filename, and
+        reads added later are kept in memory."""
+        with open(filename, 'rb') as f:
+            if f.read(len(cls.magic)) != cls.magic:
+                raise IOError("{f} is not a QV cache file.".format(f=filename))
+            header_len = int(np.fromfile(f, dtype=np.uint64, count=1)[0])
+            header = json.loads(f.read(header_len))
+            offset = f.tell() + (-f.tell() % 8)
+
+        num_rows, size = header['num_rows'], header['size']
+        tracks = [str(name) for name in header['tracks']]
+        means = [str(name) for name in header['means']]
+        sections = [(np.int64, num_rows), (np.int64, num_rows)] + \
+            [(cls.dtype, size)] * len(tracks) + \
+            [(cls.dtype, num_rows)] * len(means) + \
+            [(np.uint8, header['names_nbytes'])]
+        arrs = []
+        for dtype, count in sections:
+            arrs.append(cls._memmap(filename, dtype, offset, count))
+            offset += count * np.dtype(dtype).itemsize
+            offset += -offset % 8
+
+        store = cls()
+        store._offsets, store._lengths = arrs[0], arrs[1]
+        store._buffers = dict(zip(tracks, arrs[2:2 + len(tracks)]))
+        store._means = dict(zip(means, arrs[2 + len(tracks):-1]))
+        if num_rows > 0:
+            store._rows = dict((seqid, i) for i, seqid in
+                               enumerate(arrs[-1].tostring().split('\n')))
+        store._num_rows = num_rows
+        store._size = size
+
+        store.attrs = dict(header['attrs'])
+        ret = cls()
+        ret._base = store
+        ret.attrs = header['attrs']
+        return ret
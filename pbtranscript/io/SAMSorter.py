@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+"""
+Sort SAM records by (reference name, position) using a chunked external
+merge sort, which reads SAM lines from a stream (e.g., stdout of gmap),
+so that sorting runs while the stream is still being written, and uses
+at most a given amount of memory, spilling sorted runs to a tmp dir.
+
+Records are ordered the same as `LC_ALL=C sort -k 3,3 -k 4,4n`, i.e.,
+bytewise by reference name, then numerically by position, then bytewise
+by the whole line, so that the output is deterministic.
+
+Optionally write an offset index of the sorted SAM file, each line of which
+has tab-separated reference name, byte offset of the first record mapped to
+the reference, and number of records mapped to the reference, so that
+readers (e.g., collapse) can seek to records of a reference directly.
+"""
+
+import os
+import heapq
+import shutil
+import logging
+import tempfile
+import os.path as op
+from collections import OrderedDict
+
+__all__ = ["sort_sam_stream",
+           "sam_offset_index_fn",
+           "read_sam_offset_index",
+           "SORT_SAM_MAX_MEM"]
+
+# Default memory budget in bytes of sorting SAM records.
+SORT_SAM_MAX_MEM = 512 * 1024 * 1024
+
+
+def _sort_key(line):
+    """Return (reference name, position, line) of a SAM record line."""
+    fields = line.split('\t', 4)
+    try:
+        return (fields[2], int(fields[3]), line)
+    except (IndexError, ValueError):
+        raise ValueError("Could not parse SAM record %s" % line)
+
+
+def _write_run(keys, tmp_dir, n_runs):
+    """Write lines of sorted keys to a run file in tmp_dir, return its path."""
+    fn = op.join(tmp_dir, "run_%d.sam" % n_runs)
+    with open(fn, 'w') as writer:
+        writer.writelines(k[2] for k in keys)
+    return fn
+
+
+def _iter_run(fn):
+    """Yield sort keys of lines in a sorted run file."""
+    with open(fn, 'r') as reader:
+        for line in reader:
+            yield _sort_key(line)
+
+
+def sam_offset_index_fn(sam_filename):
+    """Return offset index file of a sorted SAM file."""
+    return sam_filename + ".idx"
+
+
+def read_sam_offset_index(index_fn):
+    """Return an OrderedDict {reference name: (offset, number of records)}
+    read from an offset index written by sort_sam_stream."""
+    ret = OrderedDict()
+    with open(index_fn, 'r') as reader:
+        for line in reader:
+            rname, offset, n = line.rstrip('\n').split('\t')
+            ret[rname] = (int(offset), int(n))
+    return ret
+
+
+def sort_sam_stream(in_stream, out_sam, max_mem=SORT_SAM_MAX_MEM,
+                    tmp_dir=None, index_fn=None):
+    """
+    Read SAM lines from in_stream, write SAM headers followed by records
+    sorted by (reference name, position) to out_sam, and return number of
+    records. Records are sorted in memory in chunks of at most max_mem
+    bytes, chunks are spilled to sorted runs in a sub-directory of tmp_dir
+    and merged in the end. out_sam is written to a tmp file first and
+    renamed when all records are written, so that no partial out_sam is
+    left if reading in_stream fails. If index_fn is not None, write an
+    offset index of out_sam to index_fn.
+    """
+    headers, keys, run_fns = [], [], []
+    n_bytes, n_records = 0, 0
+    run_dir = None
+    tmp_out_sam = out_sam + ".tmp"
+    if index_fn is not None and op.exists(index_fn): # index of an old out_sam
+        os.remove(index_fn)
+    try:
+        for line in in_stream:
+            if line.startswith('@'):
+                headers.append(line)
+                continue
+            if len(line.strip()) == 0:
+                continue
+            if not line.endswith('\n'):
+                line += '\n'
+            keys.append(_sort_key(line))
+            n_bytes += len(line)
+            n_records += 1
+            if n_bytes >= max_mem:
+                if run_dir is None:
+                    run_dir = tempfile.mkdtemp(prefix="sort_sam_", dir=tmp_dir)
+                keys.sort()
+                run_fns.append(_write_run(keys, run_dir, len(run_fns)))
+                keys, n_bytes = [], 0
+
+        keys.sort()
+        if len(run_fns) == 0:
+            sorted_keys = keys
+        else:
+            logging.debug("Merging %d sorted runs of SAM records to %s",
+                          len(run_fns) + 1, out_sam)
+            sorted_keys = heapq.merge(keys, *[_iter_run(fn) for fn in run_fns])
+
+        index = OrderedDict()
+        with open(tmp_out_sam, 'w') as writer:
+            writer.writelines(headers)
+            offset = sum(len(h) for h in headers)
+            for rname, dummy_pos, line in sorted_keys:
+                if rname not in index:
+                    index[rname] = [offset, 0]
+                index[rname][1] += 1
+                writer.write(line)
+                offset += len(line)
+        os.rename(tmp_out_sam, out_sam)
+    finally:
+        if run_dir is not None:
+            shutil.rmtree(run_dir, ignore_errors=True)
+        if op.exists(tmp_out_sam):
+            os.remove(tmp_out_sam)
+
+    if index_fn is not None:
+        with open(index_fn + ".tmp", 'w') as writer:
+            for rname, (offset, n) in index.iteritems():
+                writer.write("%s\t%d\t%d\n" % (rname, offset, n))
+        os.rename(index_fn + ".tmp", index_fn)
+    return n_records
@@ -0,0 +1,189 @@
+"""
+Define ZmwIndex, an index of zmws in PacBio BAM files,
+(movie id, hole number) --> rows of records in the pbi index,
+which is built once from pbi columns in a vectorized pass and can
+be persisted as a sidecar file next to the input BAM/dataset,
+so that looking up subreads of a zmw no longer scans the pbi.
+"""
+import os
+import json
+import logging
+import zipfile
+import numpy as np
+
+__all__ = ["ZMW_INDEX_VERSION",
+           "ZmwIndex"]
+
+ZMW_INDEX_MAGIC = "ZMW_INDEX"
+ZMW_INDEX_VERSION = 1
+
+_HN_BITS = np.uint64(32)
+
+
+def _zmw_key(movie_id, hole_number):
+    """Return a unique integer key of zmw (movie_id, hole_number), where
+    movie_id is the (signed 32-bit) qId of the read group in pbi."""
+    return ((int(movie_id) & 0xffffffff) << 32) | int(hole_number)
+
+
+def _zmw_keys(movie_ids, hole_numbers):
+    """Vectorized _zmw_key, return keys as an uint64 array."""
+    movie_ids = np.asarray(movie_ids).astype(np.int64) & 0xffffffff
+    return (movie_ids.astype(np.uint64) << _HN_BITS) | \
+        np.asarray(hole_numbers).astype(np.uint64)
+
+
+class ZmwIndex(object):
+
+    """
+    An index of zmws, (movie id, hole number) --> row indices of
+    records of the zmw in pbi, in pbi order.
+
+    Keys are stored as a sorted array of unique zmw keys; records of
+    the i-th zmw are rows[indptr[i]:indptr[i+1]]. Looking up a zmw is
+    a binary search of keys, which needs no further setup after the
+    arrays are loaded from a sidecar file (building a dict of millions
+    of zmws would cost seconds per process).
+
+    signature is a json serializable object which identifies the
+    input (e.g., pbi files, their sizes and mtimes, and filters),
+    a sidecar file is only reused if signatures match.
+    """
+
+    def __init__(self, keys, indptr, rows, signature=None):
+        assert len(indptr) == len(keys) + 1
+        assert indptr[-1] == len(rows)
+        self.keys = np.asarray(keys, dtype=np.uint64)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.rows = np.asarray(rows, dtype=np.int64)
+        self.signature = signature
+
+    @classmethod
+    def from_pbi(cls, movie_ids, hole_numbers, signature=None):
+        """Build a ZmwIndex from pbi columns qId and holeNumber."""
+        keys = _zmw_keys(movie_ids, hole_numbers)
+        # stable sort, so that records of a zmw are kept in pbi order.
+        rows = np.argsort(keys, kind='mergesort')
+        sorted_keys = keys[rows]
+        is_first = np.ones(len(sorted_keys), dtype=np.bool_)
+        is_first[1:] = sorted_keys[1:] != sorted_keys[:-1]
+        starts = np.flatnonzero(is_first)
+        indptr = np.append(starts, len(sorted_keys))
+        return cls(keys=sorted_keys[starts], indptr=indptr, rows=rows,
+                   signature=signature)
+
+    def __len__(self):
+        """Return number of zmws."""
+        return len(self.keys)
+
+    def _slot(self, movie_id, hole_number):
+        """Return slot of a zmw, raise KeyError if not found."""
+        key = np.uint64(_zmw_key(movie_id, hole_number))
+        i = int(np.searchsorted(self.keys, key))
+        if i == len(self.keys) or self.keys[i] != key:
+            raise KeyError((movie_id, hole_number))
+        return i
+
+    def __contains__(self, zmw):
+        """zmw --- (movie id, hole number)"""
+        try:
+            self._slot(*zmw)
+            return True
+        except KeyError:
+            return False
+
+    def __getitem__(self, zmw):
+        """zmw --- (movie id, hole number), return a list of row indices
+        of records of the zmw, raise KeyError if not found."""
+        i = self._slot(*zmw)
+        return self.rows[self.indptr[i]:self.indptr[i + 1]].tolist()
+
+    def num_records(self, zmw):
+        """zmw --- (movie id, hole number), return number of records
+        of the zmw, raise KeyError if not found."""
+        i = self._slot(*zmw)
+        return int(self.indptr[i + 1] - self.indptr[i])
+
+    def hole_numbers(self, movie_id):
+        """Return hole numbers of all zmws of a movie, ascending."""
+        lo, hi = self._movie_range(movie_id)
+        mask = np.uint64(0xffffffff)
+        return (self.keys[lo:hi] & mask).astype(np.int64).tolist()
+
+    def iter_rows(self, movie_id):
+        """Iterate over row indices of zmws of a movie, in hole number order."""
+        lo, hi = self._movie_range(movie_id)
+        indptr = self.indptr.tolist()
+        for i in xrange(lo, hi):
+            yield self.rows[indptr[i]:indptr[i + 1]].tolist()
+
+    def _movie_range(self, movie_id):
+        """Return [lo, hi) slots of zmws of a movie."""
+        start = np.uint64(_zmw_key(movie_id, 0))
+        end = np.uint64(_zmw_key(movie_id, 0xffffffff))
+        return (int(np.searchsorted(self.keys, start, side='left')),
+                int(np.searchsorted(self.keys, end, side='right')))
+
+    def write(self, filename):
+        """Write this index to filename atomically, i.e., it is first
+        written to a temporary file, which is then renamed to filename."""
+        header = {'magic': ZMW_INDEX_MAGIC, 'version': ZMW_INDEX_VERSION,
+                  'signature': self.signature}
+        tmp_filename = filename + ".{pid}.tmp".format(pid=os.getpid())
+        try:
+            with open(tmp_filename, 'wb') as f:
+                np.savez(f, header=np.frombuffer(json.dumps(header),
+                                                 dtype=np.uint8),
+                         keys=self.keys, indptr=self.indptr, rows=self.rows)
+            os.rename(tmp_filename, filename)
+        finally:
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+
+    @classmethod
+    def read(cls, filename, signature=None):
+        """Read an index from filename, raise ValueError if filename is
+        not a valid index, or its signature does not match signature."""
+        try:
+            with np.load(filename) as a:
+                header = json.loads(a['header'].tostring())
+                if header.get('magic', None) != ZMW_INDEX_MAGIC or \
+                   header.get('version', None) != ZMW_INDEX_VERSION:
+                    raise ValueError("Unknown zmw index format.")
+                # compare json forms, tuples are loaded as lists.
+                if signature is not None and \
+                   json.dumps(header['signature'], sort_keys=True) != \
+                   json.dumps(signature, sort_keys=True):
+                    raise ValueError("Zmw index is out of date.")
+                return cls(keys=a['keys'], indptr=a['indptr'], rows=a['rows'],
+                           signature=header['signature'])
+        except (IOError, OSError, KeyError, TypeError, AssertionError,
+                zipfile.BadZipfile) as e:
+            raise ValueError("Unable to read zmw index %s: %r" % (filename, e))
+
+    @classmethod
+    def read_or_build(cls, filename, signature, pbi_columns_func):
+        """
+        Return the index in sidecar file filename if its signature matches,
+        otherwise, build an index from pbi columns (movie_ids, hole_numbers)
+        returned by pbi_columns_func(), and try to write it to filename.
+        """
+        if filename is not None and os.path.exists(filename):
+            try:
+                return cls.read(filename, signature)
+            except ValueError as e:
+                logging.info("Rebuilding zmw index %s: %s", filename, str(e))
+
+        movie_ids, hole_numbers = pbi_columns_func()
+        index = cls.from_pbi(movie_ids, hole_numbers, signature=signature)
+        if filename is not None:
+            try:
+                index.write(filename)
+            except (IOError, OSError) as e:
+                logging.warning("Unable to write zmw index %s: %s",
+                                filename, str(e))
+        return index
+
+    def __repr__(self):
+        return "<ZmwIndex of {n} zmws, {r} records>".format(
+            n=len(self), r=len(self.rows))
@@ -8,13 +8,16 @@ from .BLASRRecord import *
 from .ReadAnnotation import *
 from .PbiBamIO import *
 from .LA4IceReader import *
-from .DazzIDHandler import DazzIDHandler
+from .DazzIDHandler import DazzIDHandler, reads_hash_and_size
 from .ContigSetReaderWrapper import ContigSetReaderWrapper
 from .SAMReaders import GMAPSAMReader, GMAPSAMRecord, iter_gmap_sam
+from .SAMSorter import *
+from .BamConcat import *
 from .GroupIO import *
 from .GffIO import *
 from .ReadStatIO import *
 from .AbundanceIO import *
+from .QVStore import *
 from .common import *
 from .ChainIO import *
 from .MergeGroupIO import *
@@ -132,9 +132,18 @@ def pickup_icec_job(pickle_filename, ccs_fofn, flnc_filename, fasta_files_to_add
 
     log.info("Loading prob QV information....")
     probqv = None
+    qv_cache_fn = icec_obj.get('qv_cache_filename', None)
+    if qv_cache_fn is not None and not op.exists(qv_cache_fn):
+        log.warning("QV cache %s does not exist. Ignore.", qv_cache_fn)
+        qv_cache_fn = None
+
     if ccs_fofn is None:
         logging.info("Loading probability from model (0.01,0.07,0.06)")
         probqv = ProbFromModel(.01, .07, .06)
+    elif qv_cache_fn is not None:
+        logging.info("Loading prob QVs of %s from %s", c_fa, qv_cache_fn)
+        probqv = ProbFromFastq(qv_cache_filename=qv_cache_fn)
+        probqv.add_seqs_from_fasta(c_fa)
     else:
         #if use_finer_qv:
         #    probqv = ProbFromQV(input_fofn=ccs_fofn, fasta_filename=input_fasta)
@@ -153,6 +162,7 @@ def pickup_icec_job(pickle_filename, ccs_fofn, flnc_filename, fasta_files_to_add
     icec.changes = set()
     icec.refs = {}
     icec.ccs_fofn = ccs_fofn
+    icec.qv_cache_filename = qv_cache_fn if ccs_fofn is not None else None
     icec.all_fasta_filename = flnc_filename
     todo = icec.uc.keys()
     log.info("Re-run gcon for proper refs....")
@@ -110,6 +110,18 @@ class PartialChunkTask(ChunkTask):
         """Return output nfl pickle of the i-th chunk."""
         return IceFiles(prog_name="", root_dir=self.cluster_out_dir, no_log_f=True).nfl_pickle_i(self.nfl_index)
 
+    @property
+    def combined_consensus_isoforms_file(self):
+        """Return consensus isoforms of all cluster bins, which are combined
+        as reference of the i-th nfl chunk, e.g., nfl.0.all_bins.consensus.fasta"""
+        return op.splitext(self.nfl_file)[0] + ".all_bins.consensus.fasta"
+
+    @property
+    def combined_nfl_pickle(self):
+        """Return output nfl pickle of the i-th chunk against consensus isoforms
+        of all cluster bins, e.g., nfl.0.all_bins.partial_uc.pickle"""
+        return op.splitext(self.nfl_file)[0] + ".all_bins.partial_uc.pickle"
+
 
 class PolishChunkTask(ChunkTask):
     """Class represents an ice_poish (quiver|arrow) chunk task."""
@@ -224,6 +236,22 @@ class ChunkTasksPickle(object):
         groups = [g for g in groups if len(g) > 0]
         return groups
 
+    def group_tasks_by_nfl_index(self, max_nchunks):
+        """
+        Group chunk tasks (PartialChunkTask objects) into no greater than
+        {max_nchunks} groups, so that tasks of the same nfl chunk are always
+        in the same group, return groups where groups[i] contains indices
+        of tasks in the i-th group.
+        """
+        assert all([hasattr(task, 'nfl_index') for task in self.chunk_tasks])
+        nfl_indices = sorted(set([task.nfl_index for task in self.chunk_tasks]))
+        groups = [[] for dummy_i in range(max_nchunks)]
+        for i, task in enumerate(self.chunk_tasks):
+            groups[nfl_indices.index(task.nfl_index) % max_nchunks].append(i)
+        # Remove empty groups
+        groups = [g for g in groups if len(g) > 0]
+        return groups
+
     def spawn_pickles(self, out_pickle_fns):
         """Create n pickles each containing exactly one ChunkTask obj in list"""
         if len(out_pickle_fns) != len(self):
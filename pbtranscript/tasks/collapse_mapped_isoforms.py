@@ -59,6 +59,9 @@ class Constants(object):
 
     SKIP_5_EXON_ALT_DEFAULT = False
 
+    CPUS_DEFAULT = 1
+    CPUS_DESC = "Number of processes collapsing blocks of the SAM file in parallel (default: %s)" % CPUS_DEFAULT
+
 
 def add_collapse_mapped_isoforms_io_arguments(arg_parser):
     """Add arguments for collapse isoforms."""
@@ -104,6 +107,9 @@ def add_collapse_mapped_isoforms_arguments(arg_parser):
     coll_group.add_argument("--skip_5_exon_alt", dest="skip_5_exon_alt",
                             default=Constants.SKIP_5_EXON_ALT_DEFAULT,
                             action="store_true", help=argparse.SUPPRESS)
+
+    coll_group.add_argument("--cpus", dest="cpus", type=int,
+                            default=Constants.CPUS_DEFAULT, help=Constants.CPUS_DESC)
     return arg_parser
 
 
@@ -117,7 +123,8 @@ def args_runner(args):
                                min_flnc_coverage=args.min_flnc_coverage,
                                max_fuzzy_junction=args.max_fuzzy_junction,
                                allow_extra_5exon=args.allow_extra_5exon,
-                               skip_5_exon_alt=args.skip_5_exon_alt)
+                               skip_5_exon_alt=args.skip_5_exon_alt,
+                               cpus=args.cpus)
     c.run()
 
     if args.collapsed_isoforms is not None:
@@ -4,6 +4,7 @@ this task merges ice_partial chunked output nfl pickles.
 """
 
 import logging
+import os.path as op
 import sys
 from itertools import groupby
 
@@ -11,8 +12,10 @@ from pbcommand.models import FileTypes, get_pbparser
 from pbcommand.cli import pbparser_runner
 from pbcommand.utils import setup_log
 
+from pbtranscript.PBTranscriptOptions import BaseConstants
 from pbtranscript.ice.IceUtils import combine_nfl_pickles
 from pbtranscript.ice.IceFiles import IceFiles
+from pbtranscript.ice.IcePartial import split_combined_nfl_pickle
 from pbtranscript.tasks.TPickles import ChunkTasksPickle, PartialChunkTask
 
 
@@ -49,6 +52,10 @@ def get_contract_parser():
                            name="Gather nfl pickles Done Txt file",
                            description="Gather nfl pickles Done Txt file.",
                            default_name="gather_ice_partial_pickles_done")
+    p.add_boolean(BaseConstants.PARTIAL_COMBINE_BINS_ID, "partial_combine_bins",
+                  default=BaseConstants.PARTIAL_COMBINE_BINS_DEFAULT,
+                  name="Combine cluster bins in ice_partial",
+                  description=BaseConstants.PARTIAL_COMBINE_BINS_DESC)
     return p
 
 
@@ -60,9 +67,27 @@ def args_runner(args):
 def resolved_tool_contract_runner(rtc):
     """Given resolved tool contract, run"""
     p = ChunkTasksPickle.read(rtc.task.input_files[0])
-    p.sorted_by_attr(attr='cluster_bin_index')
     assert all([isinstance(task, PartialChunkTask) for task in p])
 
+    # ice_partial_cluster_bins in partial_combine_bins mode assigns each nfl
+    # chunk to consensus isoforms of all bins at once, split its output first.
+    # Combined pickles left by an earlier run in another mode are ignored.
+    combine_bins = rtc.task.options.get(BaseConstants.PARTIAL_COMBINE_BINS_ID,
+                                        BaseConstants.PARTIAL_COMBINE_BINS_DEFAULT)
+    p.sorted_by_attr(attr='nfl_index')
+    for dummy_nfl_index, group in groupby(p, lambda x: x.nfl_index):
+        gs = [g for g in group]
+        if combine_bins:
+            if not op.exists(gs[0].combined_nfl_pickle):
+                raise IOError("Combined nfl pickle %s does not exist." %
+                              gs[0].combined_nfl_pickle)
+            log.info("Splitting %s to cluster bins.", gs[0].combined_nfl_pickle)
+            split_combined_nfl_pickle(combined_pickle=gs[0].combined_nfl_pickle,
+                                      combined_fasta=gs[0].combined_consensus_isoforms_file,
+                                      bin_indices=[g.cluster_bin_index for g in gs],
+                                      out_pickles=[g.nfl_pickle for g in gs])
+    p.sorted_by_attr(attr='cluster_bin_index')
+
     with open(rtc.task.output_files[0], 'w') as writer:
         for i, group in groupby(p, lambda x: x.cluster_bin_index):
             gs = [g for g in group]
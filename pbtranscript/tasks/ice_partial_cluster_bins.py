@@ -7,13 +7,14 @@ PartialChunkTask objects in input pickle.
 import os.path as op
 import logging
 import sys
+from itertools import groupby
 
 from pbcore.io import ConsensusReadSet
 from pbcommand.cli import pbparser_runner
 from pbcommand.utils import setup_log
 from pbcommand.models import FileTypes
 
-from pbtranscript.ice.IcePartial import IcePartialOne
+from pbtranscript.ice.IcePartial import IcePartialOne, combine_consensus_of_bins
 from pbtranscript.PBTranscriptOptions import (BaseConstants,
                                               get_base_contract_parser)
 from pbtranscript.tasks.TPickles import PartialChunkTask, ChunkTasksPickle
@@ -50,6 +51,10 @@ def get_contract_parser():
                            name="Partial Done Txt file",
                            description="Partial Done Txt file.",
                            default_name="partial_chunks_done")
+    p.add_boolean(BaseConstants.PARTIAL_COMBINE_BINS_ID, "partial_combine_bins",
+                  default=BaseConstants.PARTIAL_COMBINE_BINS_DEFAULT,
+                  name="Combine cluster bins in ice_partial",
+                  description=BaseConstants.PARTIAL_COMBINE_BINS_DESC)
     return p
 
 
@@ -69,6 +74,30 @@ def task_runner(task, ccs_file, nproc, tmp_dir):
                          tmp_dir=tmp_dir).run()
 
 
+def combined_task_runner(tasks, ccs_file, nproc, tmp_dir):
+    """Given PartialChunkTask objects of the same nfl chunk, assign nfl reads
+    to consensus isoforms of all cluster bins of these tasks at once, and
+    save the output to tasks[0].combined_nfl_pickle, which will be split
+    to nfl pickles of cluster bins by gather_ice_partial_cluster_bins_pickle.
+    The combined consensus isoforms are rewritten in every run, so its dazz
+    database is only reused if its content hash agrees.
+    """
+    assert all([isinstance(task, PartialChunkTask) for task in tasks])
+    assert len(set([task.nfl_file for task in tasks])) == 1
+    for task in tasks:
+        assert op.exists("%s.sensitive.config" % task.consensus_isoforms_file)
+    combine_consensus_of_bins(ref_fastas=[task.consensus_isoforms_file for task in tasks],
+                              bin_indices=[task.cluster_bin_index for task in tasks],
+                              out_fasta=tasks[0].combined_consensus_isoforms_file)
+    return IcePartialOne(input_fasta=tasks[0].nfl_file,
+                         ref_fasta=tasks[0].combined_consensus_isoforms_file,
+                         ccs_fofn=ccs_file,
+                         out_pickle=tasks[0].combined_nfl_pickle,
+                         blasr_nproc=nproc,
+                         tmp_dir=tmp_dir,
+                         target_converted=False).run()
+
+
 def resolved_tool_contract_runner(rtc):
     """Given resolved tool contract, run"""
     p = ChunkTasksPickle.read(rtc.task.input_files[0])
@@ -89,7 +118,22 @@ def resolved_tool_contract_runner(rtc):
                 ccs_file = None
                 break
 
+    combine_bins = rtc.task.options.get(Constants.PARTIAL_COMBINE_BINS_ID,
+                                        Constants.PARTIAL_COMBINE_BINS_DEFAULT)
     with open(rtc.task.output_files[0], 'w') as writer:
+        if combine_bins:
+            p.sorted_by_attr(attr='nfl_index')
+            for nfl_index, group in groupby(p, lambda x: x.nfl_index):
+                tasks = [task for task in group]
+                log.info("Running ice_partial on cluster bins %s, nfl chunk %s/%s",
+                         ",".join([str(task.cluster_bin_index) for task in tasks]),
+                         str(nfl_index), str(tasks[0].n_nfl_chunks))
+                combined_task_runner(tasks=tasks, ccs_file=ccs_file,
+                                     nproc=nproc, tmp_dir=tmp_dir)
+                writer.write("ice_partial of all cluster bins, nfl chunk %s/%s is DONE: %s\n" %
+                             (nfl_index, tasks[0].n_nfl_chunks, tasks[0].combined_nfl_pickle))
+            return
+
         for task in p:
             log.info("Running ice_partial on cluster bin %s, nfl chunk %s/%s",
                      str(task.cluster_bin_index),
@@ -47,6 +47,10 @@ def get_contract_parser():
                            name="Polish Done Txt file",
                            description="Polish Done Txt file.",
                            default_name="polish_chunks_done")
+    p.add_boolean(BaseConstants.BATCH_BLASR_PER_BIN_ID, "batch_blasr_per_bin",
+                  default=BaseConstants.BATCH_BLASR_PER_BIN_DEFAULT,
+                  name="Batch blasr per polish bin",
+                  description=BaseConstants.BATCH_BLASR_PER_BIN_DESC)
     return p
 
 
@@ -54,7 +58,7 @@ class IceQuiverRTC(IceQuiver):
 
     """IceQuiver Resolved tool contract runner."""
 
-    def __init__(self, root_dir, subread_set, nproc):
+    def __init__(self, root_dir, subread_set, nproc, batch_blasr_per_bin=False):
         tmp_dir = op.join(root_dir, "tmp")
         mkdir(tmp_dir)
         super(IceQuiverRTC, self).__init__(
@@ -67,7 +71,8 @@ class IceQuiverRTC(IceQuiver):
                 max_sge_jobs=0,
                 blasr_nproc=nproc,
                 quiver_nproc=nproc),
-            prog_name="IceQuiver")
+            prog_name="IceQuiver",
+            batch_blasr_per_bin=batch_blasr_per_bin)
 
     def cluster_dir(self, cid):
         """"overwrite IceQuiver.cluster_dir"""
@@ -91,6 +96,8 @@ def resolved_tool_contract_runner(rtc):
     nproc = rtc.task.nproc
     tmp_dir = rtc.task.tmpdir_resources[0].path \
             if len(rtc.task.tmpdir_resources) > 0 else None
+    batch_blasr_per_bin = rtc.task.options.get(Constants.BATCH_BLASR_PER_BIN_ID,
+                                               Constants.BATCH_BLASR_PER_BIN_DEFAULT)
 
     with open(rtc.task.output_files[0], 'w') as writer:
         for task in p:
@@ -100,12 +107,13 @@ def resolved_tool_contract_runner(rtc):
             log.debug("ice_quiver root_dir is %s", task.cluster_out_dir)
             log.debug("consensus_isoforms is %s", task.consensus_isoforms_file)
 
-            task_runner(task=task, subread_set=subread_set, nproc=nproc, tmp_dir=tmp_dir)
+            task_runner(task=task, subread_set=subread_set, nproc=nproc, tmp_dir=tmp_dir,
+                        batch_blasr_per_bin=batch_blasr_per_bin)
             writer.write("ice_polish of cluster bin %s, polish chunk %s/%s in %s is DONE.\n" %
                          (task.cluster_bin_index, task.polish_index, task.n_polish_chunks,
                           task.cluster_out_dir))
 
-def task_runner(task, subread_set, nproc, tmp_dir):
+def task_runner(task, subread_set, nproc, tmp_dir, batch_blasr_per_bin=False):
     """
     Given a PolishChunkTask object, run
     """
@@ -119,7 +127,8 @@ def task_runner(task, subread_set, nproc, tmp_dir):
 
     iceq = IceQuiverRTC(root_dir=task.cluster_out_dir,
                         subread_set=subread_set,
-                        nproc=nproc)
+                        nproc=nproc,
+                        batch_blasr_per_bin=batch_blasr_per_bin)
     iceq.validate_inputs()
     iceq.process_chunk_i(i=task.polish_index,
                          num_chunks=task.n_polish_chunks)
@@ -34,7 +34,7 @@ class Constants(BaseConstants):
 
 class IceQuiverRTC(IceQuiver):
 
-    def __init__(self, root_dir, subread_set, nproc):
+    def __init__(self, root_dir, subread_set, nproc, batch_blasr_per_bin=False):
         tmp_dir = op.join(root_dir, "tmp")
         if not op.isdir(tmp_dir):
             os.makedirs(tmp_dir)
@@ -48,7 +48,8 @@ class IceQuiverRTC(IceQuiver):
                 max_sge_jobs=0,
                 blasr_nproc=nproc,
                 quiver_nproc=nproc),
-            prog_name="IceQuiver")
+            prog_name="IceQuiver",
+            batch_blasr_per_bin=batch_blasr_per_bin)
 
     def cluster_dir(self, cid):
         dir_name = IceQuiver.cluster_dir(self, cid)
@@ -81,7 +82,9 @@ def resolved_tool_contract_runner(rtc):
     iceq = IceQuiverRTC(
         root_dir=output_dir,
         subread_set=rtc.task.input_files[0],
-        nproc=rtc.task.nproc)
+        nproc=rtc.task.nproc,
+        batch_blasr_per_bin=opts.get(Constants.BATCH_BLASR_PER_BIN_ID,
+                                     Constants.BATCH_BLASR_PER_BIN_DEFAULT))
     iceq.validate_inputs()
     iceq.process_chunk_i(i=i_chunk, num_chunks=n_chunks)
     with open(rtc.task.output_files[0], 'w') as f:
@@ -111,6 +114,10 @@ def get_contract_parser():
     # ice_quiver_postprocess in pbsmrtpipe
     tcp.add_output_file_type(FileTypes.JSON, "json_out", "JSON file",
                              "JSON sentinel file", default_name="quiver_out")
+    p.add_boolean(BaseConstants.BATCH_BLASR_PER_BIN_ID, "batch_blasr_per_bin",
+                  default=BaseConstants.BATCH_BLASR_PER_BIN_DEFAULT,
+                  name="Batch blasr per polish bin",
+                  description=BaseConstants.BATCH_BLASR_PER_BIN_DESC)
     return p
 
 
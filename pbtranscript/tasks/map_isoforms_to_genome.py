@@ -14,6 +14,7 @@ from pbcommand.models import FileTypes
 from pbcommand.utils import setup_log
 
 from pbtranscript.PBTranscriptOptions import get_base_contract_parser
+from pbtranscript.io import sam_offset_index_fn, SORT_SAM_MAX_MEM
 from pbtranscript.collapsing.CollapsingUtils import map_isoforms_and_sort
 
 log = logging.getLogger(__name__)
@@ -33,6 +34,9 @@ class Constants(object):
     GMAP_NPROC_ID = "pbtranscript.task_options.gmap_nproc"
     GMAP_NPROC_DEFAULT = 24
 
+    SORT_MAX_MEM_ID = "pbtranscript.task_options.sort_max_mem"
+    SORT_MAX_MEM_DEFAULT = SORT_SAM_MAX_MEM / (1024 * 1024) # in MB
+
 
 def add_map_isoforms_io_arguments(arg_parser):
     """Add io arguments"""
@@ -66,6 +70,20 @@ def add_gmap_arguments(arg_parser):
     gmap_group.add_argument("--gmap_nproc", type=int,
                             default=Constants.GMAP_NPROC_DEFAULT, help=helpstr)
 
+    helpstr = "Memory budget in MB of sorting GMAP SAM records (default: %s)" % \
+              Constants.SORT_MAX_MEM_DEFAULT
+    gmap_group.add_argument("--sort_max_mem", type=int,
+                            default=Constants.SORT_MAX_MEM_DEFAULT, help=helpstr)
+
+    helpstr = "Directory to save temporary sorted runs of GMAP SAM records (default: system tmp)"
+    gmap_group.add_argument("--sort_tmp_dir", type=str, default=None, help=helpstr)
+
+    helpstr = "Write offset index of each reference of the sorted GMAP SAM file " + \
+              "to <sam_filename>.idx, which collapse uses to seek to records " + \
+              "of each reference (default: False)"
+    gmap_group.add_argument("--sam_offset_index", default=False,
+                            action="store_true", help=helpstr)
+
     return arg_parser
 
 
@@ -93,7 +111,11 @@ def args_runner(args):
                           sam_filename=args.sam_filename,
                           gmap_db_dir=gmap_db_dir,
                           gmap_db_name=gmap_db_name,
-                          gmap_nproc=args.gmap_nproc)
+                          gmap_nproc=args.gmap_nproc,
+                          sort_max_mem=args.sort_max_mem * 1024 * 1024,
+                          tmp_dir=args.sort_tmp_dir,
+                          index_fn=sam_offset_index_fn(args.sam_filename)
+                          if args.sam_offset_index else None)
     return 0
 
 
@@ -104,7 +126,12 @@ def resolved_tool_contract_runner(rtc):
                           sam_filename=rtc.task.output_files[0],
                           gmap_db_dir=gmap_db_dir,
                           gmap_db_name=gmap_db_name,
-                          gmap_nproc=rtc.task.options[Constants.GMAP_NPROC_ID])
+                          gmap_nproc=rtc.task.options[Constants.GMAP_NPROC_ID],
+                          sort_max_mem=rtc.task.options.get(
+                              Constants.SORT_MAX_MEM_ID,
+                              Constants.SORT_MAX_MEM_DEFAULT) * 1024 * 1024,
+                          tmp_dir=rtc.task.tmpdir_resources[0].path
+                          if len(rtc.task.tmpdir_resources) > 0 else None)
     return 0
 
 
@@ -136,6 +163,10 @@ def get_contract_parser():
     tcp.add_int(option_id=Constants.GMAP_NPROC_ID, option_str="gmap_nproc",
                 default=Constants.GMAP_NPROC_DEFAULT,
                 name="GMAP nproc", description="GMAP nproc")
+    tcp.add_int(option_id=Constants.SORT_MAX_MEM_ID, option_str="sort_max_mem",
+                default=Constants.SORT_MAX_MEM_DEFAULT,
+                name="Sort memory in MB",
+                description="Memory budget in MB of sorting GMAP SAM records")
     return p
 
 
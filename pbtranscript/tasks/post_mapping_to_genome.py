@@ -102,7 +102,8 @@ def post_mapping_to_genome_runner(in_isoforms, in_sam, in_pickle,
                                   allow_extra_5exon=cmi.Constants.ALLOW_EXTRA_5EXON_DEFAULT,
                                   skip_5_exon_alt=cmi.Constants.SKIP_5_EXON_ALT_DEFAULT,
                                   min_count=fci.Constants.MIN_COUNT_DEFAULT,
-                                  to_filter_out_subsets=True):
+                                  to_filter_out_subsets=True,
+                                  cpus=cmi.Constants.CPUS_DEFAULT):
     """
     (1) Collapse isoforms and merge fuzzy junctions if needed.
     (2) Generate read stat file and abundance file
@@ -129,7 +130,8 @@ def post_mapping_to_genome_runner(in_isoforms, in_sam, in_pickle,
                                  min_flnc_coverage=min_flnc_coverage,
                                  max_fuzzy_junction=max_fuzzy_junction,
                                  allow_extra_5exon=allow_extra_5exon,
-                                 skip_5_exon_alt=skip_5_exon_alt)
+                                 skip_5_exon_alt=skip_5_exon_alt,
+                                 cpus=cpus)
     cir.run()
 
     # (2) Generate read stat file and abundance file
@@ -198,7 +200,7 @@ def args_runner(args):
         min_aln_coverage=args.min_aln_coverage, min_aln_identity=args.min_aln_identity,
         min_flnc_coverage=args.min_flnc_coverage, max_fuzzy_junction=args.max_fuzzy_junction,
         allow_extra_5exon=args.allow_extra_5exon,
-        min_count=args.min_count)
+        min_count=args.min_count, cpus=args.cpus)
     return 0
 
 
@@ -214,7 +216,8 @@ def resolved_tool_contract_runner(rtc):
         max_fuzzy_junction=rtc.task.options[cmi.Constants.MAX_FUZZY_JUNCTION_ID],
         allow_extra_5exon=rtc.task.options[cmi.Constants.ALLOW_EXTRA_5EXON_ID],
         min_count=rtc.task.options[fci.Constants.MIN_COUNT_ID],
-        to_filter_out_subsets=fci.Constants.FILTER_OUT_SUBSETS_DEFAULT)
+        to_filter_out_subsets=fci.Constants.FILTER_OUT_SUBSETS_DEFAULT,
+        cpus=rtc.task.nproc)
     return 0
 
 
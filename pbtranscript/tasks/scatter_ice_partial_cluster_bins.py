@@ -12,6 +12,7 @@ from pbcommand.cli import pbparser_runner
 from pbcommand.models import get_scatter_pbparser, FileTypes, PipelineChunk
 from pbcommand.pb_io import write_pipeline_chunks
 
+from pbtranscript.PBTranscriptOptions import BaseConstants
 from pbtranscript.tasks.TPickles import ChunkTasksPickle, PartialChunkTask
 
 
@@ -57,11 +58,15 @@ def get_contract_parser():
     p.add_int("pbsmrtpipe.task_options.dev_scatter_max_nchunks", "max_nchunks",
               Constants.DEFAULT_NCHUNKS,
               "Max NChunks", "Maximum number of Chunks")
+    p.add_boolean(BaseConstants.PARTIAL_COMBINE_BINS_ID, "partial_combine_bins",
+                  default=BaseConstants.PARTIAL_COMBINE_BINS_DEFAULT,
+                  name="Combine cluster bins in ice_partial",
+                  description=BaseConstants.PARTIAL_COMBINE_BINS_DESC)
     return p
 
 
 def run_main(partial_chunks_pickle_file, sentinel_file,
-             ccs_file, output_json_file, max_nchunks):
+             ccs_file, output_json_file, max_nchunks, combine_bins=False):
     """
     Spawn partial Chunk Tasks in pickle.
     Parameters:
@@ -69,13 +74,18 @@ def run_main(partial_chunks_pickle_file, sentinel_file,
       ccs_file -- ccs dataset
       sentinel_file -- sentinel file to connect pbsmrtpipe tasks
       output_json -- chunk.json
+      combine_bins -- if True, put tasks of the same nfl chunk in one group,
+                      so that they can be run against all cluster bins at once
     """
     p = ChunkTasksPickle.read(partial_chunks_pickle_file)
     assert all([isinstance(r, PartialChunkTask) for r in p])
     out_dir = op.dirname(output_json_file)
 
     # sort and group tasks
-    groups = p.sort_and_group_tasks(max_nchunks=max_nchunks)
+    if combine_bins:
+        groups = p.group_tasks_by_nfl_index(max_nchunks=max_nchunks)
+    else:
+        groups = p.sort_and_group_tasks(max_nchunks=max_nchunks)
 
     # Writing chunk.json
     base_name = "spawned_partial_chunk"
@@ -112,7 +122,10 @@ def rtc_runner(rtc):
                     sentinel_file=rtc.task.input_files[1],
                     ccs_file=rtc.task.input_files[2],
                     output_json_file=rtc.task.output_files[0],
-                    max_nchunks=rtc.task.max_nchunks)
+                    max_nchunks=rtc.task.max_nchunks,
+                    combine_bins=rtc.task.options.get(
+                        BaseConstants.PARTIAL_COMBINE_BINS_ID,
+                        BaseConstants.PARTIAL_COMBINE_BINS_DEFAULT))
 
 
 def main():
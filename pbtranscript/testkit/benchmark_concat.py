@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+"""
+Benchmark concatenating sam|bam files of clusters in a polish bin
+(IceUtils.concat_sam and IceUtils.concat_bam), compared with decoding
+and re-encoding every bam record by pysam.
+
+Synthetic data consist of num_clusters sam and bam files, each of which
+has one reference sequence and reads_per_cluster subread alignments,
+like sam|bam_of_cluster files concatenated in IceQuiver.
+
+Usage:
+    python -m pbtranscript.testkit.benchmark_concat out_dir \
+        --num_clusters 100 --reads_per_cluster 20000
+"""
+
+import argparse
+import hashlib
+import random
+import time
+import os
+import os.path as op
+
+from pbtranscript.libs import AlignmentFile, AlignedSegment
+from pbtranscript.io import BamHeader
+from pbtranscript.ice.IceUtils import concat_sam, concat_bam
+
+__all__ = ["make_synthetic_bins", "concat_bam_by_pysam", "benchmark"]
+
+
+def make_synthetic_bins(out_dir, num_clusters, reads_per_cluster,
+                        read_len=1000, seed=0):
+    """Write sam and bam files of num_clusters clusters to out_dir,
+    return (sam files, bam files)."""
+    rng = random.Random(seed)
+    qual = "".join(chr(rng.randint(0, 40)) for dummy_i in xrange(read_len))
+    sam_fns, bam_fns = [], []
+    for k in xrange(num_clusters):
+        ref = "c{k}/f{n}p0/{l}".format(k=k, n=reads_per_cluster, l=read_len + 100)
+        seq = "".join(rng.choice("ACGT") for dummy_i in xrange(read_len))
+        m5 = hashlib.md5(seq).hexdigest()
+        header = {'HD': {'VN': '1.5', 'SO': 'unknown'},
+                  'SQ': [{'SN': ref, 'LN': read_len + 100, 'M5': m5}],
+                  'RG': [{'ID': 'rg0', 'PL': 'PACBIO', 'PU': 'm0'}],
+                  'PG': [{'ID': 'BLASR', 'PN': 'blasr'}]}
+        sam_fns.append(op.join(out_dir, "c{k}.sam".format(k=k)))
+        bam_fns.append(op.join(out_dir, "c{k}.bam".format(k=k)))
+        with open(sam_fns[-1], 'w') as sam_writer, \
+             AlignmentFile(bam_fns[-1], "wb", header=header) as bam_writer:
+            sam_writer.write("@HD\tVN:1.5\tSO:unknown\n" +
+                             "@SQ\tSN:{r}\tLN:{l}\tM5:{m}\n".format(
+                                 r=ref, l=read_len + 100, m=m5) +
+                             "@RG\tID:rg0\tPL:PACBIO\tPU:m0\n" +
+                             "@PG\tID:BLASR\tPN:blasr\n")
+            for i in xrange(reads_per_cluster):
+                qname = "m0/{z}/0_{l}".format(z=k * reads_per_cluster + i, l=read_len)
+                sam_writer.write("\t".join([qname, "0", ref, "51", "254",
+                                            "{l}M".format(l=read_len), "*", "0",
+                                            "0", seq, "*", "RG:Z:rg0"]) + "\n")
+                r = AlignedSegment()
+                r.query_name = qname
+                r.query_sequence = seq
+                r.flag = 0
+                r.reference_id = 0
+                r.reference_start = 50
+                r.mapping_quality = 254
+                r.cigarstring = "{l}M".format(l=read_len)
+                r.query_qualities = [ord(c) for c in qual]
+                r.set_tag("RG", "rg0")
+                bam_writer.write(r)
+    return sam_fns, bam_fns
+
+
+def concat_bam_by_pysam(in_fns, out_fn):
+    """Concat bam files by decoding and re-encoding every record,
+    rewriting tid, as a baseline."""
+    h = BamHeader(ignore_pg=True)
+    for in_fn in in_fns:
+        with AlignmentFile(in_fn, 'rb') as s:
+            h.add(s.header)
+    with AlignmentFile(out_fn, "wb", header=h.header) as o:
+        for index, in_fn in enumerate(in_fns):
+            with AlignmentFile(in_fn, 'rb') as s:
+                for r in s:
+                    r.tid = index
+                    o.write(r)
+
+
+def _time(func, *args):
+    """Return seconds of calling func(*args)."""
+    start_t = time.time()
+    func(*args)
+    return time.time() - start_t
+
+
+def benchmark(sam_fns, bam_fns, out_dir):
+    """Return [(name, seconds)] of concatenating sam_fns and bam_fns."""
+    ret = [("concat_sam", _time(concat_sam, sam_fns, op.join(out_dir, "all.sam"))),
+           ("concat_bam", _time(concat_bam, bam_fns, op.join(out_dir, "all.bam"))),
+           ("concat_bam_by_pysam", _time(concat_bam_by_pysam, bam_fns,
+                                         op.join(out_dir, "all.pysam.bam")))]
+    for name, seconds in ret:
+        print "{n}\t{t:.1f} sec".format(n=name, t=seconds)
+    return ret
+
+
+def get_parser():
+    """Return argument parser."""
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("out_dir", type=str, help="Output directory")
+    parser.add_argument("--num_clusters", type=int, default=100)
+    parser.add_argument("--reads_per_cluster", type=int, default=20000)
+    parser.add_argument("--read_len", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    return parser
+
+
+def run(args):
+    """Make synthetic bins, benchmark and write report.csv to out_dir."""
+    if not op.exists(args.out_dir):
+        os.makedirs(args.out_dir)
+    sam_fns, bam_fns = make_synthetic_bins(out_dir=args.out_dir,
+                                           num_clusters=args.num_clusters,
+                                           reads_per_cluster=args.reads_per_cluster,
+                                           read_len=args.read_len, seed=args.seed)
+    results = benchmark(sam_fns, bam_fns, args.out_dir)
+
+    report_fn = op.join(args.out_dir, "report.csv")
+    with open(report_fn, 'w') as writer:
+        writer.write("name,num_clusters,reads_per_cluster,seconds\n")
+        for name, seconds in results:
+            writer.write("{n},{c},{r},{t:.1f}\n".format(
+                n=name, c=args.num_clusters, r=args.reads_per_cluster, t=seconds))
+    print "Benchmark report written to %s" % report_fn
+
+
+if __name__ == "__main__":
+    import sys
+    run(get_parser().parse_args(sys.argv[1:]))
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+"""
+Benchmark DalignerRunner on synthetic isoforms, sweeping block sizes and
+numbers of parallel daligner and LA4Ice jobs, and compare them with the
+plan picked by DalignerTuner.
+
+Synthetic data consist of random transcripts (targets) and reads which
+are copies of transcripts with substitutions and indels (queries), so
+that alignments look like aligning flnc reads to consensus isoforms in
+ICE. Requires daligner, LA4Ice, fasta2DB and DBsplit in $PATH.
+
+Usage:
+    python -m pbtranscript.testkit.benchmark_daligner out_dir \
+        --num_transcripts 2000 --reads_per_transcript 20 --cpus 32
+"""
+
+import argparse
+import random
+import shutil
+import time
+import os
+import os.path as op
+
+from pbtranscript.ice_daligner import DalignerRunner
+from pbtranscript.DalignerTuner import DalignerPlan, DALIGNER_NUM_THREADS, \
+    db_size, default_max_mem, tune_daligner
+
+__all__ = ["mutate", "make_synthetic_isoforms", "sweep_plans", "benchmark"]
+
+
+def mutate(rng, seq, error_rate):
+    """Return a copy of seq with substitutions, insertions and deletions
+    at total error_rate."""
+    out = []
+    for c in seq:
+        x = rng.random()
+        if x < error_rate / 3:
+            out.append(rng.choice("ACGT"))
+        elif x < error_rate * 2 / 3:
+            out.append(c + rng.choice("ACGT"))
+        elif x >= error_rate:
+            out.append(c)
+    return "".join(out)
+
+
+def make_synthetic_isoforms(query_fa, target_fa, num_transcripts,
+                            reads_per_transcript, min_len=1000, max_len=4000,
+                            error_rate=0.02, seed=0):
+    """Write num_transcripts random transcripts to target_fa, and
+    reads_per_transcript mutated copies of each to query_fa."""
+    rng = random.Random(seed)
+    with open(query_fa, 'w') as q_writer, open(target_fa, 'w') as t_writer:
+        for i in xrange(num_transcripts):
+            seq = "".join(rng.choice("ACGT")
+                          for dummy_j in xrange(rng.randint(min_len, max_len)))
+            t_writer.write(">c{i}\n{s}\n".format(i=i, s=seq))
+            for j in xrange(reads_per_transcript):
+                read = mutate(rng, seq, error_rate)
+                q_writer.write(">m0/{z}/0_{l}_CCS\n{s}\n".format(
+                    z=i * reads_per_transcript + j, l=len(read), s=read))
+
+
+def sweep_plans(cpus, split_sizes=(25, 50, 100, 200)):
+    """Yield (name, DalignerPlan) of configurations to benchmark."""
+    for split_size in split_sizes:
+        for daligner_jobs in sorted(set([1, max(1, cpus / DALIGNER_NUM_THREADS)])):
+            for la4ice_jobs in sorted(set([min(cpus, 4), cpus])):
+                yield ("s{s}_d{d}_l{l}".format(s=split_size, d=daligner_jobs,
+                                               l=la4ice_jobs),
+                       DalignerPlan(query_split_size=split_size,
+                                    target_split_size=split_size,
+                                    daligner_jobs=daligner_jobs,
+                                    threads_per_job=DALIGNER_NUM_THREADS,
+                                    la4ice_jobs=la4ice_jobs))
+
+
+def benchmark(query_fa, target_fa, out_dir, cpus, max_mem, plans):
+    """Run DalignerRunner of each (name, plan) in plans, return a list of
+    (name, plan, query_blocks, target_blocks, seconds)."""
+    ret = []
+    for name, plan in plans:
+        run_dir = op.join(out_dir, name)
+        if op.exists(run_dir):
+            shutil.rmtree(run_dir)
+        os.makedirs(run_dir)
+        start_t = time.time()
+        runner = DalignerRunner(query_filename=query_fa, target_filename=target_fa,
+                                is_FL=True, same_strand_only=True,
+                                dazz_dir=run_dir,
+                                script_dir=op.join(run_dir, "scripts"),
+                                use_sge=False, sge_opts=None, cpus=cpus,
+                                max_mem=max_mem, plan=plan)
+        runner.run(output_dir=run_dir, min_match_len=300)
+        ret.append((name, runner.plan, runner.query_blocks, runner.target_blocks,
+                    time.time() - start_t))
+        print "{n}\t{t:.1f} sec\t{p}".format(n=name, t=ret[-1][-1], p=runner.plan)
+    return ret
+
+
+def get_parser():
+    """Return argument parser."""
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("out_dir", type=str, help="Output directory")
+    parser.add_argument("--num_transcripts", type=int, default=2000)
+    parser.add_argument("--reads_per_transcript", type=int, default=20)
+    parser.add_argument("--cpus", type=int, default=4)
+    parser.add_argument("--max_mem", type=int, default=None,
+                        help="Memory budget in MB (default: half of physical memory)")
+    parser.add_argument("--seed", type=int, default=0)
+    return parser
+
+
+def run(args):
+    """Make synthetic data, benchmark plans and write report.csv to out_dir."""
+    if not op.exists(args.out_dir):
+        os.makedirs(args.out_dir)
+    query_fa = op.join(args.out_dir, "query.fasta")
+    target_fa = op.join(args.out_dir, "target.fasta")
+    make_synthetic_isoforms(query_fa, target_fa,
+                            num_transcripts=args.num_transcripts,
+                            reads_per_transcript=args.reads_per_transcript,
+                            seed=args.seed)
+    max_mem = default_max_mem() if args.max_mem is None else args.max_mem * 1024 * 1024
+    tuned = tune_daligner(query_size=db_size(query_fa), target_size=db_size(target_fa),
+                          cpus=args.cpus, max_mem=max_mem, same_strand_only=True)
+    plans = [("tuned", tuned)] + list(sweep_plans(args.cpus))
+    results = benchmark(query_fa, target_fa, args.out_dir, args.cpus, max_mem, plans)
+
+    report_fn = op.join(args.out_dir, "report.csv")
+    with open(report_fn, 'w') as writer:
+        writer.write("name,query_split_size,target_split_size,query_blocks," +
+                     "target_blocks,daligner_jobs,la4ice_jobs,seconds\n")
+        for name, plan, query_blocks, target_blocks, seconds in results:
+            writer.write("{n},{qs},{ts},{qb},{tb},{d},{l},{t:.1f}\n".format(
+                n=name, qs=plan.query_split_size, ts=plan.target_split_size,
+                qb=query_blocks, tb=target_blocks, d=plan.daligner_jobs,
+                l=plan.la4ice_jobs, t=seconds))
+    print "Benchmark report written to %s" % report_fn
+
+
+if __name__ == "__main__":
+    import sys
+    run(get_parser().parse_args(sys.argv[1:]))
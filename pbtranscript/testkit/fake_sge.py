@@ -0,0 +1,148 @@
+#!/usr/bin/env python
+
+"""
+A tiny fake SGE, which provides qsub, qstat and qdel commands that run
+jobs as local background processes, for testing code which submits
+jobs to SGE (e.g., JobScheduler.SgeBackend) without a real cluster.
+
+Usage:
+    install_fake_sge(bin_dir, state_dir)
+    os.environ["PATH"] = bin_dir + os.pathsep + os.environ["PATH"]
+    os.environ[STATE_DIR_ENV] = state_dir
+
+qsub understands options written by SgeOptions.qsub_cmd, and ignores
+-pe, -q, -V, -S, -cwd and -hold_jid. qstat only lists job ids, names and
+states ('r') of running jobs.
+"""
+
+import os
+import os.path as op
+import sys
+import errno
+import signal
+import subprocess
+
+__all__ = ["install_fake_sge", "STATE_DIR_ENV"]
+
+# Environment variable of the directory where fake SGE saves job states.
+STATE_DIR_ENV = "FAKE_SGE_DIR"
+
+# qsub options which take one value, or two values.
+_QSUB_OPTS_1 = ("-q", "-e", "-o", "-N", "-S", "-hold_jid", "-sync", "-b")
+_QSUB_OPTS_2 = ("-pe", )
+
+
+def install_fake_sge(bin_dir, state_dir):
+    """Write qsub, qstat and qdel wrapper scripts to bin_dir, which save
+    job states to state_dir."""
+    for d in (bin_dir, state_dir):
+        if not op.exists(d):
+            os.makedirs(d)
+    for cmd in ("qsub", "qstat", "qdel"):
+        fn = op.join(bin_dir, cmd)
+        with open(fn, 'w') as writer:
+            writer.write("#!/bin/bash\n" +
+                         "export {e}=${{{e}:-{d}}}\n".format(e=STATE_DIR_ENV, d=state_dir) +
+                         "exec {p} {m} {c} \"$@\"\n".format(
+                             p=sys.executable, m=op.abspath(__file__).replace(".pyc", ".py"),
+                             c=cmd))
+        os.chmod(fn, 0755)
+
+
+def _state_dir():
+    """Return directory of job states."""
+    return os.environ[STATE_DIR_ENV]
+
+
+def _next_jid():
+    """Return a new job id."""
+    jid = len(os.listdir(_state_dir())) + 1
+    while True:
+        try:
+            fd = os.open(op.join(_state_dir(), "%d.job" % jid),
+                         os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            os.close(fd)
+            return jid
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+            jid += 1
+
+
+def _is_alive(pid):
+    """Return True if process pid is running (and not a zombie)."""
+    try:
+        os.kill(pid, 0)
+    except OSError:
+        return False
+    try:
+        with open("/proc/%d/stat" % pid, 'r') as reader:
+            return reader.read().split(')')[-1].split()[0] != 'Z'
+    except IOError:
+        return True
+
+
+def _jobs():
+    """Yield (jid, pid, name) of submitted jobs."""
+    for fn in sorted(os.listdir(_state_dir())):
+        if fn.endswith(".job"):
+            with open(op.join(_state_dir(), fn), 'r') as reader:
+                fields = reader.read().split()
+            if len(fields) == 2:
+                yield fn[:-4], int(fields[0]), fields[1]
+
+
+def qsub(args):
+    """Run a script in background, print its job id."""
+    opts = {}
+    i = 0
+    while i < len(args) and args[i].startswith("-"):
+        if args[i] in _QSUB_OPTS_1:
+            opts[args[i]] = args[i + 1]
+            i += 2
+        elif args[i] in _QSUB_OPTS_2:
+            i += 3
+        else:
+            i += 1
+    cmd = args[i:]
+    if opts.get("-b") != "y":
+        cmd = ["/bin/bash"] + cmd
+    name = opts.get("-N", op.basename(args[i]))
+    jid = _next_jid()
+    with open(opts.get("-o", os.devnull), 'a') as olog, \
+            open(opts.get("-e", os.devnull), 'a') as elog:
+        p = subprocess.Popen(cmd, stdout=olog, stderr=elog,
+                             preexec_fn=os.setsid, close_fds=True)
+    with open(op.join(_state_dir(), "%d.job" % jid), 'w') as writer:
+        writer.write("%d %s\n" % (p.pid, name))
+    if opts.get("-sync") == "y":
+        return p.wait()
+    print "Your job %d (\"%s\") has been submitted" % (jid, name)
+    return 0
+
+
+def qstat(dummy_args):
+    """Print running jobs."""
+    print "job-ID  prior   name       user         state submit/start at     queue                          slots ja-task-ID"
+    print "-" * 110
+    for jid, pid, name in _jobs():
+        if _is_alive(pid):
+            print "%s 0.50000 %s fake r 01/01/2016 00:00:00 fake.q 1" % (jid, name)
+    return 0
+
+
+def qdel(args):
+    """Kill jobs."""
+    jobs = dict((jid, pid) for jid, pid, dummy_name in _jobs())
+    for jid in args:
+        if jid in jobs and _is_alive(jobs[jid]):
+            try:
+                os.killpg(jobs[jid], signal.SIGKILL)
+            except OSError:
+                pass
+            print "fake has deleted job %s" % jid
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit({"qsub": qsub, "qstat": qstat, "qdel": qdel}[sys.argv[1]](sys.argv[2:]))
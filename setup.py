@@ -17,12 +17,20 @@ if 'setuptools.extension' in sys.modules:
 
 ext_modules = [Extension("pbtranscript.findECE",
                          ["pbtranscript/ice/C/findECE.pyx"]),
+               Extension("pbtranscript.c_PrimerSearch",
+                         ["pbtranscript/ice/C/c_PrimerSearch.pyx"]),
                Extension("pbtranscript.ice.ProbModel",
                          ["pbtranscript/ice/C/ProbModel.pyx"], language="c++"),
+               Extension("pbtranscript.ice.c_Clique",
+                         ["pbtranscript/ice/C/c_Clique.pyx"]),
+               Extension("pbtranscript.ice.c_IceUtils",
+                         ["pbtranscript/ice/C/c_IceUtils.pyx"], language="c++"),
                Extension("pbtranscript.io.c_basQV",
                          ["pbtranscript/ice/C/c_basQV.pyx"], language="c++"),
                Extension("pbtranscript.io.SAMReaders",
                          ["pbtranscript/io/C/SAMReaders.pyx"], language="c++"),
+               Extension("pbtranscript.io.c_LA4Ice",
+                         ["pbtranscript/io/C/c_LA4Ice.pyx"], language="c++"),
                Extension("pbtranscript.collapsing.intersection_unique",
                          ["pbtranscript/collapsing/C/intersection_unique.pyx"], language="c++"),
                Extension("pbtranscript.collapsing.intersection",
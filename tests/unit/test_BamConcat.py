@@ -0,0 +1,95 @@
+"""Test pbtranscript.io.BamConcat."""
+
+import unittest
+import gzip
+import random
+import os.path as op
+from pbtranscript.Utils import mknewdir
+from pbtranscript.libs import AlignmentFile, AlignedSegment
+from pbtranscript.io.BamConcat import BgzfReader, BgzfWriter, \
+    BGZF_BLOCK_SIZE, parse_bam_header_text, bam_header_text, concat_bam_files
+from test_setpath import OUT_DIR
+
+
+def _write_bam(out_fn, refs, records):
+    """Write a bam file of references refs [(name, length)] and records
+    [(query name, reference name or None)]."""
+    header = {'HD': {'VN': '1.5', 'SO': 'unknown'},
+              'SQ': [{'SN': name, 'LN': length} for name, length in refs],
+              'RG': [{'ID': 'rg0', 'PL': 'PACBIO'}]}
+    tids = dict((name, tid) for tid, (name, dummy_len) in enumerate(refs))
+    rng = random.Random(len(records))
+    with AlignmentFile(out_fn, "wb", header=header) as writer:
+        for qname, rname in records:
+            r = AlignedSegment()
+            r.query_name = qname
+            r.query_sequence = "".join(rng.choice("ACGT") for dummy_i in range(200))
+            r.flag = 0 if rname is not None else 4
+            r.reference_id = tids[rname] if rname is not None else -1
+            r.reference_start = 10 if rname is not None else -1
+            r.mapping_quality = 254
+            if rname is not None:
+                r.cigarstring = "200M"
+            r.set_tag("RG", "rg0")
+            writer.write(r)
+
+
+class Test_BamConcat(unittest.TestCase):
+    """Test BamConcat."""
+    def setUp(self):
+        """Define output dir."""
+        self.out_dir = op.join(OUT_DIR, "test_BamConcat")
+        mknewdir(self.out_dir)
+
+    def test_bgzf(self):
+        """Data written by BgzfWriter can be read by gzip and BgzfReader."""
+        rng = random.Random(0)
+        data = "".join(rng.choice("ACGT") for dummy_i in range(3 * BGZF_BLOCK_SIZE + 7))
+        fn = op.join(self.out_dir, "test.gz")
+        with BgzfWriter(fn) as writer:
+            writer.write(data[:100])
+            writer.write(data[100:])
+        self.assertEqual(gzip.open(fn).read(), data)
+        with BgzfReader(fn) as reader:
+            self.assertEqual(reader.read(100), data[:100])
+            self.assertEqual(reader.read(BGZF_BLOCK_SIZE), data[100:BGZF_BLOCK_SIZE + 100])
+
+    def test_header_text(self):
+        """Test parse_bam_header_text and bam_header_text."""
+        text = "@HD\tVN:1.5\tSO:unknown\n@SQ\tSN:c0\tLN:10\tM5:abc\n" + \
+               "@RG\tID:rg0\tPL:PACBIO\n@CO\tsome comment\n"
+        header = parse_bam_header_text(text)
+        self.assertEqual(header['SQ'], [{'SN': 'c0', 'LN': 10, 'M5': 'abc'}])
+        self.assertEqual(bam_header_text(header), text)
+        header = parse_bam_header_text("@HD\tVN:1.5\n", refs=[("c1", 20)])
+        self.assertEqual(header['SQ'], [{'SN': 'c1', 'LN': 20}])
+
+    def test_concat_bam_files(self):
+        """Concatenated records are the same as records of inputs, tids
+        are remapped to references in merged header."""
+        inputs = [([("c0", 1000)], [("m/%d/0_200" % i, "c0") for i in range(1000)]),
+                  ([("c1", 1000)], [("m/%d/0_200" % i, "c1") for i in range(1000, 1500)] +
+                   [("m/1500/0_200", None)]),
+                  ([("c0", 1000), ("c2", 1000)],
+                   [("m/%d/0_200" % i, "c2" if i % 2 else "c0") for i in range(2000, 3000)])]
+        in_fns = []
+        for i, (refs, records) in enumerate(inputs):
+            in_fns.append(op.join(self.out_dir, "in.%d.bam" % i))
+            _write_bam(in_fns[-1], refs, records)
+
+        out_fn = op.join(self.out_dir, "out.bam")
+        self.assertEqual(concat_bam_files(in_fns, out_fn), 1)
+
+        reader = AlignmentFile(out_fn, "rb", check_sq=False)
+        self.assertEqual(list(reader.references), ["c0", "c1", "c2"])
+        records = [(r.query_name, r.reference_name if r.reference_id >= 0 else None)
+                   for r in reader]
+        reader.close()
+        self.assertEqual(records, [rec for dummy_refs, recs in inputs for rec in recs])
+
+        with self.assertRaises(ValueError):
+            concat_bam_files([], out_fn)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -6,7 +6,10 @@ import filecmp
 import numpy as np
 from pbcore.io.GffIO import Gff3Record
 from pbtranscript.Utils import rmpath, mkdir
-from pbtranscript.io import ContigSetReaderWrapper, iter_gmap_sam, GroupWriter, CollapseGffWriter
+from pbtranscript.io import ContigSetReaderWrapper, iter_gmap_sam, GroupWriter, CollapseGffWriter, \
+        GroupRecord, CollapseGffRecord
+from pbtranscript.io.SAMSorter import sort_sam_stream, sam_offset_index_fn
+from pbtranscript.collapsing.CollapseIsoforms import split_sorted_gmap_sam, renumber_locus
 from pbtranscript.collapsing import Branch, ContiVec, transfrag_to_contig, \
         exons_match_sam_record, compare_exon_matrix, get_fl_from_id, collapse_sam_records
 from test_setpath import DATA_DIR, OUT_DIR, SIV_DATA_DIR, SIV_STD_DIR
@@ -26,6 +29,13 @@ def _get_sam_groups(ignored_ids_writer=None):
     return groups
 
 
+def _sam_line(qname, rname, pos, cigar):
+    """Return a SAM record line, which is unmapped if rname is '*'."""
+    flag = 4 if rname == '*' else 0
+    return "\t".join([qname, str(flag), rname, str(pos), "0", cigar,
+                      "*", "0", "0", "ACGT", "*"]) + "\n"
+
+
 def _get_contiVec_and_offset():
     """Returns contiVec and offset of groups[0]["+"]."""
     contivec_pickle_fn = op.join(SIV_DATA_DIR, 'test_branch', 'contiVec.pickle')
@@ -237,3 +247,119 @@ class TEST_Branch(unittest.TestCase):
         self.assertTrue(filecmp.cmp(good_gff_fn, std_good_gff_fn))
         self.assertTrue(filecmp.cmp(bad_gff_fn, std_bad_gff_fn))
         self.assertTrue(filecmp.cmp(group_fn, std_group_fn))
+
+    def test_Branch_parallel(self):
+        """Test Branch.run collapsing blocks of SAM in parallel, outputs
+        must be the same as collapsing in one process."""
+        test_name = "test_branch_parallel"
+        good_gff_fn = op.join(_OUT_DIR_, test_name + ".good.gff.unfuzzy")
+        bad_gff_fn = op.join(_OUT_DIR_, test_name + ".bad.gff.unfuzzy")
+        group_fn = op.join(_OUT_DIR_, test_name + ".group.txt.unfuzzy")
+
+        b = Branch(isoform_filename=READS_DS, sam_filename=SORTED_GMAP_SAM,
+                   cov_threshold=2, min_aln_coverage=0.99, min_aln_identity=0.95)
+
+        b.run(allow_extra_5exon=True, skip_5_exon_alt=False,
+              ignored_ids_fn=None,
+              good_gff_fn=good_gff_fn,
+              bad_gff_fn=bad_gff_fn,
+              group_fn=group_fn,
+              cpus=4)
+
+        std_dir = op.join(SIV_STD_DIR, "test_branch")
+        self.assertTrue(filecmp.cmp(good_gff_fn, op.join(std_dir, "test_branch.good.gff.unfuzzy")))
+        self.assertTrue(filecmp.cmp(bad_gff_fn, op.join(std_dir, "test_branch.bad.gff.unfuzzy")))
+        self.assertTrue(filecmp.cmp(group_fn, op.join(std_dir, "test_branch.group.txt.unfuzzy")))
+
+    def test_split_sorted_gmap_sam(self):
+        """Test split_sorted_gmap_sam, blocks must not split overlapping records."""
+        out_dir = op.join(_OUT_DIR_, "test_split_sorted_gmap_sam")
+        rmpath(out_dir)
+        mkdir(out_dir)
+        blocks = split_sorted_gmap_sam(SORTED_GMAP_SAM, out_dir, block_size=1)
+        self.assertTrue(len(blocks) > 1)
+
+        lines = [l for l in open(SORTED_GMAP_SAM) if not l.startswith('@')]
+        block_lines = [[l for l in open(fn) if not l.startswith('@')] for fn in blocks]
+        self.assertEqual(sum(block_lines, []), lines)
+        self.assertEqual(len(_get_sam_groups()),
+                         sum(len([g for g in iter_gmap_sam(
+                             sam_filename=fn,
+                             query_len_dict=ContigSetReaderWrapper.name_to_len_dict(READS_DS),
+                             min_aln_coverage=0.99, min_aln_identity=0.85,
+                             ignored_ids_writer=None)]) for fn in blocks))
+
+    def test_split_sorted_gmap_sam_blocks(self):
+        """Test split_sorted_gmap_sam on a small SAM file, blocks start only at
+        records which do not overlap previous records, and unmapped records
+        stay with their previous records."""
+        out_dir = op.join(_OUT_DIR_, "test_split_sorted_gmap_sam_blocks")
+        rmpath(out_dir)
+        mkdir(out_dir)
+        header = "@HD\tVN:1.5\tSO:coordinate\n@SQ\tSN:chr1\tLN:1000\n@SQ\tSN:chr2\tLN:1000\n"
+        records = [[_sam_line("r1", "chr1", 100, "50M"),
+                    # overlaps r1, spans [119, 639) by its intron.
+                    _sam_line("r2", "chr1", 120, "10M500N10M"),
+                    _sam_line("u1", "*", 0, "*"),
+                    # overlaps the intron of r2.
+                    _sam_line("r3", "chr1", 600, "10M")],
+                   [_sam_line("r4", "chr1", 700, "10M"),
+                    _sam_line("u2", "*", 0, "*")],
+                   [_sam_line("r5", "chr2", 1, "10M")]]
+        sam_fn = op.join(out_dir, "in.sam")
+        with open(sam_fn, 'w') as writer:
+            writer.write(header + "".join(sum(records, [])))
+
+        blocks = split_sorted_gmap_sam(sam_fn, out_dir, block_size=1)
+        self.assertEqual([open(fn).read() for fn in blocks],
+                         [header + "".join(lines) for lines in records])
+
+        blocks = split_sorted_gmap_sam(sam_fn, out_dir, block_size=10000)
+        self.assertEqual([open(fn).read() for fn in blocks], [open(sam_fn).read()])
+
+        with open(sam_fn, 'w') as writer:
+            writer.write(header + records[1][0] + records[0][0])
+        with self.assertRaises(ValueError):
+            split_sorted_gmap_sam(sam_fn, out_dir, block_size=1)
+
+    def test_split_sorted_gmap_sam_index(self):
+        """Test split_sorted_gmap_sam with an offset index, blocks must be the
+        same as blocks split without the index."""
+        out_dir = op.join(_OUT_DIR_, "test_split_sorted_gmap_sam_index")
+        rmpath(out_dir)
+        mkdir(out_dir)
+        header = "@HD\tVN:1.5\tSO:coordinate\n@SQ\tSN:chr1\tLN:1000\n@SQ\tSN:chr2\tLN:1000\n"
+        records = [_sam_line("r%d" % i, "chr%d" % (i % 2 + 1), 50 * (i % 7) + 1, "30M")
+                   for i in range(30)] + [_sam_line("u%d" % i, "*", 0, "*") for i in range(3)]
+        sam_fn = op.join(out_dir, "in.sam")
+        index_fn = sam_offset_index_fn(sam_fn)
+        sort_sam_stream(in_stream=iter(header.splitlines(True) + records),
+                        out_sam=sam_fn, index_fn=index_fn)
+
+        for block_size in (1, 200, 1000, 10000):
+            blocks = split_sorted_gmap_sam(sam_fn, out_dir, block_size=block_size)
+            expected = [open(fn).read() for fn in blocks]
+            blocks = split_sorted_gmap_sam(sam_fn, out_dir, block_size=block_size,
+                                           index_fn=index_fn)
+            self.assertEqual([open(fn).read() for fn in blocks], expected)
+
+        # A stale index is ignored.
+        with open(index_fn, 'w') as writer:
+            writer.write("chr1\t1\t1\n")
+        blocks = split_sorted_gmap_sam(sam_fn, out_dir, block_size=10000, index_fn=index_fn)
+        self.assertEqual([open(fn).read() for fn in blocks], [open(sam_fn).read()])
+
+    def test_renumber_locus(self):
+        """Test renumber_locus, which shifts locus index of PB ids."""
+        group = GroupRecord(name="PB.3.2", members=["i0", "i1"])
+        self.assertEqual(renumber_locus(group, 5),
+                         GroupRecord(name="PB.8.2", members=["i0", "i1"]))
+        self.assertTrue(renumber_locus(group, 0) is group)
+
+        gff = CollapseGffRecord(seqid="chr1", start=100, end=200, feature="exon",
+                                strand="+", gene_id="PB.3", transcript_id="PB.3.2")
+        r = renumber_locus(gff, 12)
+        self.assertEqual((r.seqid, r.start, r.end, r.feature, r.strand),
+                         ("chr1", 100, 200, "exon", "+"))
+        self.assertEqual((r.gene_id, r.transcript_id), ("PB.15", "PB.15.2"))
+        self.assertEqual((gff.gene_id, gff.transcript_id), ("PB.3", "PB.3.2"))
@@ -3,7 +3,8 @@
 import unittest
 import os
 import os.path as op
-from pbtranscript.Classifier import Classifier, PBRead
+from pbtranscript.Classifier import Classifier, PBRead, \
+    ChimeraDetectionOptions
 from pbtranscript.io.DOMIO import DOMRecord
 from collections import namedtuple
 from test_setpath import DATA_DIR, OUT_DIR, STD_DIR
@@ -140,6 +141,44 @@ class Test_Classifier(unittest.TestCase):
         self.assertTrue(res[2] is None)
         self.assertTrue(str(res[3]) == str(rc))
 
+    def test_runStreamingClassifier(self):
+        """Test runStreamingClassifier, which should classify reads the
+        same way as runPrimerTrimmer + runChimeraDetector."""
+        readsFN = op.join(self.dataDir, "reads_of_insert.fasta")
+        opts = ChimeraDetectionOptions(50, 10, 100, 50, 100, True)
+
+        def classify(name, streaming, cpus):
+            """Classify reads, return classifier and its out dir."""
+            d = op.join(self.outDir, "test_runStreamingClassifier_" + name)
+            if not op.exists(d):
+                os.makedirs(d)
+            obj = Classifier(reads_fn=readsFN, out_dir=d,
+                             out_reads_fn=op.join(d, "isoseq_draft.fasta"),
+                             cpus=cpus, opts=opts, primer_search="native")
+            if streaming:
+                obj.runStreamingClassifier()
+            else:
+                obj.runPrimerTrimmer()
+                obj.runChimeraDetector()
+            return obj, d
+
+        expected, expected_dir = classify("files", False, 1)
+        for cpus in (1, 3):
+            obj, d = classify("streaming_%d" % cpus, True, cpus)
+            for attr in ["num_reads", "num_5_seen", "num_3_seen",
+                         "num_polya_seen", "num_filtered_short_reads",
+                         "num_fl", "num_flnc", "num_flc", "num_flnc_bases",
+                         "num_nfl", "num_nflnc", "num_nflc"]:
+                self.assertEqual(getattr(obj.summary, attr),
+                                 getattr(expected.summary, attr))
+            for fn in ["isoseq_draft.fasta", "isoseq_draft.primer_info.csv",
+                       "flnc.fasta", "flc.fasta", "nfl.fasta",
+                       "nflnc.fasta", "nflc.fasta"]:
+                self.assertTrue(filecmp.cmp(op.join(d, fn),
+                                            op.join(expected_dir, fn)))
+            self.assertFalse(op.exists(op.join(d, "fl.trimmed.fasta")))
+            self.assertFalse(op.exists(op.join(d, "hmmer.front_end.dom")))
+
     def test_PBRead(self):
         """Test class PBRead."""
         A = namedtuple('A', 'name sequence')
@@ -0,0 +1,73 @@
+"""Test pbtranscript.DalignerTuner."""
+
+import unittest
+from pbtranscript.DalignerTuner import DBSize, DALIGNER_NUM_THREADS, \
+    DEFAULT_SPLIT_SIZE, MIN_SPLIT_SIZE, num_blocks, daligner_job_mem, \
+    tune_split_sizes, tune_parallelism, tune_daligner
+
+GB = 1024 ** 3
+
+
+class Test_DalignerTuner(unittest.TestCase):
+    """Test DalignerTuner."""
+    def setUp(self):
+        """Define sizes of flnc reads and consensus isoforms."""
+        self.flnc = DBSize(n_reads=200000, n_bases=400 * 1000 * 1000)
+        self.refs = DBSize(n_reads=20000, n_bases=40 * 1000 * 1000)
+
+    def test_num_blocks(self):
+        """Test num_blocks."""
+        self.assertEqual(num_blocks(self.flnc, 200), 2)
+        self.assertEqual(num_blocks(self.flnc, 50), 8)
+        self.assertEqual(num_blocks(DBSize(1, 10), 200), 1)
+
+    def test_tune_split_sizes(self):
+        """Enough query blocks to use all cores, bounded by memory."""
+        # 4 cpus, one daligner job at a time, default block size.
+        self.assertEqual(tune_split_sizes(self.flnc, self.refs, cpus=4, max_mem=64 * GB),
+                         (DEFAULT_SPLIT_SIZE, DEFAULT_SPLIT_SIZE))
+        # 32 cpus, 8 daligner jobs at a time, 8 query blocks.
+        q_split, t_split = tune_split_sizes(self.flnc, self.refs, cpus=32, max_mem=64 * GB)
+        self.assertEqual((q_split, t_split), (50, DEFAULT_SPLIT_SIZE))
+        # Small memory budget, smaller blocks.
+        q_split, t_split = tune_split_sizes(self.flnc, self.refs, cpus=4, max_mem=4 * GB)
+        self.assertTrue(q_split < DEFAULT_SPLIT_SIZE)
+        self.assertTrue(daligner_job_mem(
+            DBSize(0, q_split * 1000000),
+            DBSize(0, min(self.refs.n_bases, t_split * 1000000))) < 4 * GB)
+        # Tiny data is never split smaller than MIN_SPLIT_SIZE.
+        tiny = DBSize(n_reads=10, n_bases=20000)
+        self.assertEqual(tune_split_sizes(tiny, tiny, cpus=64, max_mem=GB, same_db=True),
+                         (MIN_SPLIT_SIZE, MIN_SPLIT_SIZE))
+
+    def test_tune_parallelism(self):
+        """Number of jobs is bounded by cores, block pairs and memory."""
+        self.assertEqual(tune_parallelism(self.flnc, self.refs, query_blocks=8,
+                                          target_blocks=1, cpus=32, max_mem=64 * GB),
+                         (8, 32))
+        self.assertEqual(tune_parallelism(self.flnc, self.refs, query_blocks=2,
+                                          target_blocks=1, cpus=32, max_mem=64 * GB),
+                         (2, 16))
+        self.assertEqual(tune_parallelism(self.flnc, self.refs, query_blocks=2,
+                                          target_blocks=1, cpus=32, max_mem=64 * GB,
+                                          same_strand_only=True),
+                         (2, 8))
+        # self alignment of 3 blocks has 6 block pairs.
+        self.assertEqual(tune_parallelism(self.refs, self.refs, query_blocks=3,
+                                          target_blocks=3, cpus=32, max_mem=64 * GB,
+                                          same_db=True)[0], 6)
+        # at least one job, even if memory budget is too small.
+        self.assertEqual(tune_parallelism(self.flnc, self.refs, query_blocks=8,
+                                          target_blocks=1, cpus=32, max_mem=1), (1, 1))
+
+    def test_tune_daligner(self):
+        """Test tune_daligner."""
+        plan = tune_daligner(self.flnc, self.refs, cpus=32, max_mem=64 * GB)
+        self.assertEqual(plan.threads_per_job, DALIGNER_NUM_THREADS)
+        self.assertEqual(plan.daligner_jobs, 8)
+        self.assertTrue(plan.daligner_jobs * plan.threads_per_job <= 32)
+        self.assertEqual(plan.la4ice_jobs, 32)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,7 +2,7 @@ import unittest
 import os.path as op
 import filecmp
 from cPickle import load
-from pbtranscript.io import DazzIDHandler
+from pbtranscript.io import DazzIDHandler, reads_hash_and_size
 from pbtranscript.Utils import mknewdir, execute
 #from pbtranscript.io import *
 from test_setpath import OUT_DIR, DATA_DIR, STD_DIR
@@ -76,6 +76,29 @@ class Test_DazzIDHandler(unittest.TestCase):
         print "Testing DazzIDHandler.num_blocks"
         self.assertTrue(handler.num_blocks, 1)
 
+    def test_reuse_dazz_db(self):
+        """Reuse dazz db of the same content hash, rebuild it otherwise."""
+        fn = op.join(self.outDir, self.fastaFileName)
+        handler = DazzIDHandler(fn, converted=False)
+        self.assertTrue(op.exists(handler.hash_filename))
+        self.assertEqual(handler.cached_hash(), handler.content_hash())
+        db_mtime = op.getmtime(handler.db_filename)
+
+        # The same content, dazz db is reused.
+        handler = DazzIDHandler(fn, converted=False)
+        self.assertEqual(op.getmtime(handler.db_filename), db_mtime)
+        self.assertEqual(len(handler.keys()), 12)
+
+        # Sizes and hash of reads computed in one pass by the caller.
+        reads_hash, n_reads, dummy_n_bases = reads_hash_and_size(fn)
+        self.assertEqual(n_reads, 12)
+        handler = DazzIDHandler(fn, converted=False, reads_hash=reads_hash)
+        self.assertEqual(op.getmtime(handler.db_filename), db_mtime)
+
+        # Different DBsplit parameters, content hash changes.
+        another = DazzIDHandler(fn, converted=True, split_size=100)
+        self.assertNotEqual(another.content_hash(), handler.content_hash())
+
 
 class Test_DazzIDHandler_DataSet(unittest.TestCase):
     """Test DazzIDHandler while input is dataset."""
@@ -0,0 +1,83 @@
+"""Test pbtranscript.io.FastaIndex."""
+import unittest
+import os.path as op
+from pbtranscript.Utils import rmpath
+from pbtranscript.io.FastaIndex import FastaIndex, zmw_of_read_name
+from test_setpath import OUT_DIR
+
+
+class Test_FastaIndex(unittest.TestCase):
+    """Test FastaIndex."""
+    def setUp(self):
+        """Write a FASTA file with single-line, multi-line, irregular,
+        CRLF, empty and duplicated records."""
+        self.fasta_filename = op.join(OUT_DIR, "test_FastaIndex.fasta")
+        for fn in (self.fasta_filename, FastaIndex.fai_filename(self.fasta_filename),
+                   FastaIndex.hash_filename(self.fasta_filename)):
+            rmpath(fn)
+        self.records = [("m/1/0_10", "ACGTACGTAA\n"),
+                        ("m/1/20_33 RQ=0.8", "ACGTA\nCGTAC\nGGG\n"),
+                        ("m/2/0_7", "ACG\nTACG\n"),  # irregular
+                        ("m/3/0_4", "AC\r\nGT\r\n"),
+                        ("m/4/0_0", ""),
+                        ("m/1/40_45", "TTTTT")]
+        with open(self.fasta_filename, 'w') as f:
+            f.write("".join(">%s\n%s" % r for r in self.records))
+        self.seqs = {"m/1/0_10": "ACGTACGTAA", "m/1/20_33": "ACGTACGTACGGG",
+                     "m/2/0_7": "ACGTACG", "m/3/0_4": "ACGT", "m/4/0_0": "",
+                     "m/1/40_45": "TTTTT"}
+
+    def _check(self, index):
+        """Check sequences and zmws in index."""
+        self.assertEqual(len(index), 6)
+        self.assertEqual(index.names(), [r[0].split()[0] for r in self.records])
+        for name, seq in self.seqs.iteritems():
+            self.assertEqual(index[name], seq)
+            self.assertTrue(name in index)
+        self.assertFalse("m/1" in index)
+        self.assertRaises(KeyError, index.__getitem__, "m/5/0_1")
+        self.assertEqual([index.name(i) for i in index.records_of_zmw("m/1")],
+                         ["m/1/0_10", "m/1/20_33", "m/1/40_45"])
+        self.assertEqual(index.records_of_zmw("m/5"), [])
+        self.assertEqual(index.num_zmws, 4)
+
+    def test_build_and_reuse(self):
+        """Test building, reusing and rebuilding an index."""
+        index = FastaIndex.open(self.fasta_filename, with_zmws=True)
+        self._check(index)
+        # no .fai because of the irregular record
+        self.assertFalse(op.exists(FastaIndex.fai_filename(self.fasta_filename)))
+        self.assertTrue(op.exists(FastaIndex.hash_filename(self.fasta_filename)))
+
+        index2 = FastaIndex.open(self.fasta_filename)
+        self.assertTrue(index2.has_zmws)
+        self._check(index2)
+        index.close()
+        index2.close()
+
+        # rebuild if the FASTA file has changed.
+        self.records = self.records[0:2] + [("m/1/0_10", "CC\n")]
+        with open(self.fasta_filename, 'w') as f:
+            f.write("".join(">%s\n%s" % r for r in self.records))
+        index3 = FastaIndex.open(self.fasta_filename, with_zmws=True)
+        self.assertEqual(len(index3), 2)
+        self.assertEqual(index3.num_records, 3)
+        self.assertEqual(index3["m/1/0_10"], "CC")  # the last one wins
+        self.assertEqual([index3.name(i) for i in index3.records_of_zmw("m/1")],
+                         ["m/1/0_10", "m/1/20_33", "m/1/0_10"])
+        index3.close()
+
+        # samtools faidx compatible .fai
+        with open(FastaIndex.fai_filename(self.fasta_filename)) as f:
+            self.assertEqual(f.read(), "m/1/0_10\t10\t10\t10\t11\n" +
+                             "m/1/20_33\t13\t39\t5\t6\n" +
+                             "m/1/0_10\t2\t65\t2\t3\n")
+
+    def test_zmw_of_read_name(self):
+        """Test zmw_of_read_name."""
+        self.assertEqual(zmw_of_read_name("movie/1/0_100"), "movie/1")
+        self.assertEqual(zmw_of_read_name("movie/1/ccs"), "movie/1")
+
+
+if __name__ == "__main__":
+    unittest.main()
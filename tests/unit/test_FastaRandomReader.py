@@ -4,7 +4,7 @@ import unittest
 import os.path as op
 from pbcore.io import FastaReader, ContigSet
 from pbtranscript.io.FastaRandomReader import FastaRandomReader, \
-        MetaSubreadFastaReader
+        MetaSubreadFastaReader, SubreadFastaReader
 from pbtranscript.Utils import write_files_to_fofn
 from test_setpath import DATA_DIR, OUT_DIR, STD_DIR
 import hashlib
@@ -123,3 +123,15 @@ class TestMetaSubreadFastaReader(unittest.TestCase):
         self.assertEqual(r5.name, "m130812_random_random_s1_p0/249/0_1339")
         self.assertEqual(hashlib.md5(r5.sequence).hexdigest(), "b20d3723a136aedc2f96f6f498ad3da0")
 
+
+class TestSubreadFastaReader(unittest.TestCase):
+    """Class for testing SubreadFastaReader."""
+    def test_keys(self):
+        """Test SubreadFastaReader.keys() of reads with duplicated names."""
+        fa = op.join(OUT_DIR, "test_subread_fasta_reader_keys.fasta")
+        with open(fa, 'w') as writer:
+            writer.write(">m/1/0_4\nACGT\n>m/1/5_9\nAACC\n" +
+                         ">m/2/0_4\nGGTT\n>m/1/0_4\nTTTT\n")
+        reader = SubreadFastaReader(fa)
+        self.assertEqual(sorted(reader.keys()), ["m/1/0_4", "m/1/5_9", "m/2/0_4"])
+        self.assertEqual(len(reader), 3)
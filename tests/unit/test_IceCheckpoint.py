@@ -0,0 +1,78 @@
+"""Test pbtranscript.ice.IceCheckpoint."""
+import unittest
+import os
+import os.path as op
+import random
+from pbtranscript.Utils import mknewdir
+from pbtranscript.ice.MembershipMatrix import MembershipMatrix
+from pbtranscript.ice.IceCheckpoint import checkpoint_filename, \
+    list_checkpoints, write_checkpoint, read_checkpoint, \
+    latest_checkpoint, remove_checkpoints
+from test_setpath import OUT_DIR
+
+
+class Test_IceCheckpoint(unittest.TestCase):
+    """Test IceCheckpoint."""
+    def setUp(self):
+        """Initialize."""
+        self.checkpoint_dir = op.join(OUT_DIR, "test_IceCheckpoint")
+        mknewdir(self.checkpoint_dir)
+        random.seed(0)
+        self.uc = {0: ['r1', 'r2', 'r3'], 2: ['r4'], 5: ['r5', 'r6']}
+        self.d = MembershipMatrix.from_dict(
+            {'r1': {0: 0}, 'r2': {0: -1.5, 2: -3.25}, 'r3': {},
+             'r4': {2: -0.5, 5: -10.0}, 'r5': {5: 0}, 'r6': {5: -2.0},
+             'r7': {}})
+        self.refs = {0: '/tmp/c0/g_consensus.fasta', 2: None,
+                     5: '/tmp/c5/g_consensus_ref.fasta'}
+        self.newids = set(['r2', 'r3', 'r4', 'r7'])
+        self.changes = set([2, 5])
+        self.header = {'stage': 'run_til_end', 'iterNum': 3,
+                       'fasta_filenames_to_add': ['a.fasta', 'b.fasta']}
+
+    def _write(self, index):
+        """Write a checkpoint with the given index."""
+        fn = checkpoint_filename(self.checkpoint_dir, index)
+        write_checkpoint(filename=fn, header=self.header, uc=self.uc,
+                         d=self.d, refs=self.refs, newids=self.newids,
+                         changes=self.changes)
+        return fn
+
+    def test_read_write(self):
+        """Test write_checkpoint and read_checkpoint."""
+        fn = self._write(0)
+        self.assertEqual(os.listdir(self.checkpoint_dir), [op.basename(fn)])
+        a = read_checkpoint(fn)
+        self.assertEqual(a['uc'], self.uc)
+        self.assertEqual(a['d'], self.d)
+        self.assertEqual(a['d'].best('r4'), (2, -0.5))
+        self.assertEqual(sorted(a['d'].reads_of_cluster(5)), ['r4', 'r5', 'r6'])
+        self.assertEqual(a['refs'], self.refs)
+        self.assertEqual(a['newids'], self.newids)
+        self.assertEqual(a['changes'], self.changes)
+        self.assertEqual(a['header']['stage'], 'run_til_end')
+        self.assertEqual(a['header']['iterNum'], 3)
+        self.assertEqual(a['header']['fasta_filenames_to_add'],
+                         ['a.fasta', 'b.fasta'])
+
+    def test_latest_checkpoint(self):
+        """Test latest_checkpoint skips invalid checkpoints."""
+        self.assertEqual(latest_checkpoint(self.checkpoint_dir), (None, None))
+        fns = [self._write(i) for i in range(3)]
+        self.assertEqual(list_checkpoints(self.checkpoint_dir),
+                         list(enumerate(fns)))
+        with open(fns[2], 'w') as f:  # truncated checkpoint
+            f.write("PK")
+        self.assertRaises(ValueError, read_checkpoint, fns[2])
+        fn, a = latest_checkpoint(self.checkpoint_dir)
+        self.assertEqual(fn, fns[1])
+        self.assertEqual(a['uc'], self.uc)
+
+        remove_checkpoints(self.checkpoint_dir, keep=1)
+        self.assertEqual(list_checkpoints(self.checkpoint_dir), [(2, fns[2])])
+        remove_checkpoints(self.checkpoint_dir)
+        self.assertEqual(list_checkpoints(self.checkpoint_dir), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
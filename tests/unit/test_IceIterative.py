@@ -0,0 +1,66 @@
+"""Test consensus cache of pbtranscript.ice.IceIterative."""
+
+import unittest
+import os.path as op
+from collections import namedtuple
+from pbcore.io import FastaReader
+from pbtranscript.Utils import mknewdir
+from pbtranscript.ice.IceIterative import IceIterative
+from test_setpath import OUT_DIR
+
+Read = namedtuple("Read", "sequence")
+IceOpts = namedtuple("IceOpts", "maxScore")
+
+
+def _make_ice(root_dir, seq_dict):
+    """Return an IceIterative object which only has what the consensus
+    cache needs, without running ICE."""
+    ice = IceIterative.__new__(IceIterative)
+    ice.root_dir = root_dir
+    ice._tmp_dir = None
+    ice.seq_dict = seq_dict
+    ice.ice_opts = IceOpts(maxScore=-1000)
+    ice.uc = {}
+    return ice
+
+
+class Test_IceIterative(unittest.TestCase):
+    """Test consensus cache of IceIterative."""
+    def setUp(self):
+        """Define reads."""
+        self.root_dir = op.join(OUT_DIR, "test_IceIterative")
+        mknewdir(self.root_dir)
+        self.seq_dict = {"r1": Read("ACGT"), "r2": Read("AACC"), "r3": Read("GGTT")}
+
+    def test_gcon_cache_key(self):
+        """Keys depend on ids and sequences of reads, not their order."""
+        ice = _make_ice(self.root_dir, self.seq_dict)
+        key = ice.gcon_cache_key(["r1", "r2", "r3"])
+        self.assertEqual(ice.gcon_cache_key(["r3", "r1", "r2"]), key)
+        self.assertNotEqual(ice.gcon_cache_key(["r1", "r2"]), key)
+
+        # Same ids, different input sequences.
+        other = _make_ice(self.root_dir, dict(self.seq_dict, r3=Read("GGTA")))
+        self.assertNotEqual(other.gcon_cache_key(["r1", "r2", "r3"]), key)
+
+    def test_choose_ref_file_from_cache(self):
+        """Cached consensus of a cluster is renamed after the cluster
+        which reuses it."""
+        ice = _make_ice(self.root_dir, self.seq_dict)
+        key = ice.gcon_cache_key(["r1", "r2", "r3"])
+        cons = ice.g_consensus_fa_of_cluster(5)
+        mknewdir(op.dirname(cons))
+        with open(cons, 'w') as writer:
+            writer.write(">c5\nACGTACGT\n")
+
+        self.assertEqual(ice.choose_ref_file(5, cache_key=key), cons)
+        self.assertTrue(op.exists(ice.gcon_cache_fa(key)))
+
+        ref_fa = ice.choose_ref_file(12, cache_key=key)
+        self.assertEqual(ref_fa, ice.g_consensus_fa_of_cluster(12))
+        self.assertEqual([(r.name, r.sequence) for r in FastaReader(ref_fa)],
+                         [("c12", "ACGTACGT")])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+"""Test pbtranscript.ice.IcePartial."""
+
+import unittest
+import os.path as op
+from cPickle import dump, load
+
+from pbcore.io import FastaWriter, FastaReader
+from pbtranscript.Utils import mknewdir
+from pbtranscript.ice.IcePartial import combine_consensus_of_bins, \
+        split_combined_nfl_pickle
+from test_setpath import OUT_DIR
+
+
+class Test_IcePartial(unittest.TestCase):
+    """Test IcePartial."""
+    def setUp(self):
+        """Set up test data."""
+        self.out_dir = op.join(OUT_DIR, "test_IcePartial")
+        mknewdir(self.out_dir)
+
+    def test_combine_and_split(self):
+        """Test combine_consensus_of_bins and split_combined_nfl_pickle."""
+        ref_fastas = [op.join(self.out_dir, "bin%d.consensus.fasta" % i)
+                      for i in range(2)]
+        for ref_fasta, cids in zip(ref_fastas, [(0, 1), (0, )]):
+            with FastaWriter(ref_fasta) as writer:
+                for cid in cids:
+                    writer.writeRecord("c%d/f2p0/4" % cid, "ACGT")
+
+        combined_fasta = op.join(self.out_dir, "all_bins.consensus.fasta")
+        n = combine_consensus_of_bins(ref_fastas=ref_fastas, bin_indices=[3, 7],
+                                      out_fasta=combined_fasta)
+        self.assertEqual(n, 3)
+        self.assertEqual([r.name for r in FastaReader(combined_fasta)],
+                         ["c0 b3_c0/f2p0/4", "c1 b3_c1/f2p0/4", "c2 b7_c0/f2p0/4"])
+
+        combined_pickle = op.join(self.out_dir, "all_bins.partial_uc.pickle")
+        with open(combined_pickle, 'w') as f:
+            dump({'partial_uc': {1: ['r1', 'r2'], 2: ['r2', 'r3']},
+                  'nohit': set(['r4'])}, f)
+        out_pickles = [op.join(self.out_dir, "bin%d.partial_uc.pickle" % i)
+                       for i in range(2)]
+        split_combined_nfl_pickle(combined_pickle=combined_pickle,
+                                  combined_fasta=combined_fasta,
+                                  bin_indices=[3, 7], out_pickles=out_pickles)
+        a, b = [load(open(fn)) for fn in out_pickles]
+        self.assertEqual(a['partial_uc'], {1: ['r1', 'r2']})
+        self.assertEqual(a['nohit'], set(['r3', 'r4']))
+        self.assertEqual(b['partial_uc'], {0: ['r2', 'r3']})
+        self.assertEqual(b['nohit'], set(['r1', 'r4']))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+"""Test pbtranscript.ice.IceQuiver."""
+
+import unittest
+import random
+import os.path as op
+from collections import defaultdict
+from pbtranscript.Utils import mknewdir, mkdir
+from pbtranscript.ClusterOptions import SgeOptions
+from pbtranscript.io import MetaSubreadFastaReader
+from pbtranscript.ice.IceQuiver import IceQuiver
+from pbtranscript.testkit.benchmark_daligner import mutate
+from test_setpath import OUT_DIR
+
+MOVIE = "m000000_000000_00000_c000000000000000000000000000000000_s1_p0"
+
+
+def _sam_records(sam_fn):
+    """Return sorted (query name, reference name, mapq) of alignments."""
+    ret = []
+    for line in open(sam_fn):
+        if not line.startswith('@'):
+            fields = line.split('\t')
+            ret.append((fields[0], fields[2], fields[4]))
+    return sorted(ret)
+
+
+class Test_IceQuiver(unittest.TestCase):
+    """Test IceQuiver."""
+    def setUp(self):
+        """Make subreads of two similar isoforms, c0 = A+B+C, c1 = A+C,
+        a zmw of c0, c1 each is assigned to both clusters as nfl reads."""
+        self.out_dir = op.join(OUT_DIR, "test_IceQuiver")
+        mknewdir(self.out_dir)
+        rng = random.Random(0)
+        exon = lambda n: "".join(rng.choice("ACGT") for dummy_i in range(n))
+        a, b, c = exon(600), exon(400), exon(600)
+        isoforms = {0: a + b + c, 1: a + c}
+
+        self.refs, self.uc = {}, {}
+        self.partial_uc = defaultdict(lambda: [])
+        self.subreads_fa = op.join(self.out_dir, "subreads.fasta")
+        with open(self.subreads_fa, 'w') as writer:
+            for cid, seq in isoforms.iteritems():
+                self.refs[cid] = op.join(self.out_dir, "c%d.ref.fasta" % cid)
+                with open(self.refs[cid], 'w') as ref_writer:
+                    ref_writer.write(">c%d/f5p0/%d\n%s\n" % (cid, len(seq), seq))
+                self.uc[cid] = []
+                for i in range(5):
+                    zmw = cid * 10 + i
+                    self.uc[cid].append("%s/%d/ccs" % (MOVIE, zmw))
+                    for j in range(2):
+                        read = mutate(rng, seq, error_rate=0.02)
+                        writer.write(">%s/%d/%d_%d\n%s\n" % (MOVIE, zmw, j * 10000,
+                                                             j * 10000 + len(read), read))
+            self.partial_uc[0].append("%s/%d/ccs" % (MOVIE, 10))
+            self.partial_uc[1].append("%s/%d/ccs" % (MOVIE, 0))
+
+    def _make_bin(self, name, batch):
+        """Create sam of a quiver bin of c0 and c1, return (valid cids, sam)."""
+        root_dir = op.join(self.out_dir, name)
+        iq = IceQuiver(root_dir=root_dir, bas_fofn=None, fasta_fofn=None,
+                       sge_opts=SgeOptions(unique_id=1, blasr_nproc=2),
+                       batch_blasr_per_bin=batch)
+        mkdir(iq.quivered_dir)
+        cids = [0, 1]
+        for cid in cids:
+            mkdir(iq.cluster_dir(cid))
+        d = MetaSubreadFastaReader([self.subreads_fa])
+        if batch:
+            owners = iq.create_raw_file_for_bin(cids=cids, d=d, uc=self.uc,
+                                                partial_uc=self.partial_uc)
+            valid_cids = iq.create_sam_for_bin_by_batched_blasr(
+                cids=cids, refs=self.refs, owners=owners)
+        else:
+            iq.create_raw_files_for_clusters_in_bin(cids=cids, d=d, uc=self.uc,
+                                                    partial_uc=self.partial_uc)
+            iq.create_sams_for_clusters_in_bin(cids=cids, refs=self.refs)
+            valid_cids = iq.concat_valid_sams_and_refs_for_bin(cids=cids,
+                                                               refs=self.refs)
+        return valid_cids, iq.sam_of_quivered_bin(cids[0], cids[-1])
+
+    def test_batched_blasr_per_bin(self):
+        """Batched blasr of a bin creates the same alignments as calling
+        blasr for each cluster, with mapping qualities of unique hits."""
+        valid_cids, sam = self._make_bin("per_cluster", batch=False)
+        batched_valid_cids, batched_sam = self._make_bin("batched", batch=True)
+        self.assertEqual(batched_valid_cids, valid_cids)
+        self.assertEqual(valid_cids, [0, 1])
+        records = _sam_records(sam)
+        batched_records = _sam_records(batched_sam)
+        self.assertTrue(len(records) >= 24)
+        self.assertEqual([r[0:2] for r in batched_records], [r[0:2] for r in records])
+        # Hits of subreads to their own clusters are not penalized by hits
+        # to similar isoforms, otherwise quiver|arrow would drop them.
+        self.assertEqual(set(r[2] for r in batched_records), set(["254"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
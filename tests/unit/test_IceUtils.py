@@ -92,6 +92,24 @@ class Test_ICEUtils(unittest.TestCase):
         IceUtils.ice_fa2fq(in_fa, ccs_bam_fofn, out_bam_fq)
         self.assertTrue(filecmp.cmp(out_bam_fq, stdout_fq))
 
+    def test_ice_fa2qvcache(self):
+        """Test ice_fa2qvcache, QVs in cache should be the same as in fq."""
+        in_fa = op.join(self.sivDataDir, "flnc.fasta")
+        ccs_fofn = op.join(self.sivDataDir, "ccs.fofn")
+        stdout_fq = op.join(self.sivStdoutDir, "test_ice_fa2fq.fastq")
+        out_cache = op.join(self.outDir, "test_ice_fa2qvcache.qvcache")
+        IceUtils.ice_fa2qvcache([in_fa], ccs_fofn, out_cache)
+
+        expected = ProbFromFastq(stdout_fq)
+        probqv, dummy_msg = IceUtils.set_probqv_from_qv_cache(
+            qv_cache_filename=out_cache, fasta_filename=in_fa)
+        self.assertEqual(sorted(probqv.seqids), sorted(expected.seqids))
+        for seqid in expected.seqids:
+            self.assertTrue(np.all(probqv.get_smoothed(seqid, None) ==
+                                   expected.get_smoothed(seqid, None)))
+            self.assertEqual(probqv.get_mean(seqid, None),
+                             expected.get_mean(seqid, None))
+
     def test_parsed_read_name(self):
         names = ['m/1234/CCS',
                  'm/1234/0_100_CCS',
@@ -120,15 +138,28 @@ class Test_ICEUtils(unittest.TestCase):
         s2 = sorted(['\t'.join(sorted(r.split('\t'))) for r in open(sam2)])
         self.assertTrue(s1 == s2)
 
-    def test_concat_bam_header(self):
-        """Test concat_bam_header"""
-        from pbtranscript.ice.IceUtils import concat_bam_header
-        fns = [op.join(self.moreDir, "aligned.%d.bam" % i) for i in range(1, 6)]
-        out_fn =  op.join(self.outDir, "test_concat_bam_header.sam")
-        stdout_fn =  op.join(self.sivStdoutDir, "test_concat_bam_header.sam")
-        concat_bam_header(fns, out_fn)
-        self.assertTrue(op.exists(out_fn))
-        self.cmp_sam(out_fn, stdout_fn)
+    def test_concat_sam(self):
+        """Test concat_sam, conflicting M5s are changed deterministically."""
+        fns = []
+        for i, (ref, m5) in enumerate([("c0", "a" * 32), ("c1", "b" * 32), ("c2", "a" * 32)]):
+            fns.append(op.join(self.outDir, "test_concat_sam.%d.sam" % i))
+            with open(fns[-1], 'w') as writer:
+                writer.write("@HD\tVN:1.3.1\n")
+                writer.write("@SQ\tSN:%s\tLN:100\tM5:%s\n" % (ref, m5))
+                writer.write("@RG\tID:rg%d\n@PG\tID:BLASR\n" % i)
+                writer.write("m/%d/0_10\t0\t%s\t1\t254\t4M\t*\t0\t0\tACGT\t*\n" % (i, ref))
+        out_fn = op.join(self.outDir, "test_concat_sam.sam")
+        concat_sam(fns, out_fn)
+        lines = open(out_fn).read().splitlines()
+        self.assertEqual([l.split('\t')[0] for l in lines],
+                         ["@HD", "@SQ", "@SQ", "@SQ", "@RG", "@PG",
+                          "m/0/0_10", "m/1/0_10", "m/2/0_10"])
+        self.assertEqual(lines[4], "@RG\tID:rg0")
+        m5s = [l.split('\t')[-1] for l in lines[1:4]]
+        self.assertEqual(m5s[0:2], ["M5:" + "a" * 32, "M5:" + "b" * 32])
+        self.assertTrue(m5s[2] not in m5s[0:2])
+        concat_sam(fns, out_fn + ".2")
+        self.assertEqual(open(out_fn + ".2").read().splitlines(), lines)
 
     def test_concat_bam(self):
         """Test concat_bam, unaligned and aligned."""
@@ -153,6 +184,33 @@ class Test_ICEUtils(unittest.TestCase):
         execute(cmd=cmd)
         self.cmp_sam(out_sam, stdout_sam)
 
+    def test_filter_alignments_of_clusters(self):
+        """Only keep alignments of subreads to consensus of their own clusters."""
+        in_sam = op.join(self.outDir, "test_filter_alignments_of_clusters.in.sam")
+        out_sam = op.join(self.outDir, "test_filter_alignments_of_clusters.out.sam")
+        aln = lambda q, r: "\t".join([q, "0", r, "1", "3", "4M", "*", "0", "0",
+                                      "ACGT", "*"]) + "\n"
+        with open(in_sam, 'w') as writer:
+            writer.write("@HD\tVN:1.5\tSO:unknown\n")
+            for ref in ("c0/f2p0/100", "c1/f2p0/100", "c2/f2p0/100"):
+                writer.write("@SQ\tSN:%s\tLN:100\n" % ref)
+            writer.write(aln("m/1/0_10", "c1/f2p0/100"))
+            writer.write(aln("m/1/0_10", "c0/f2p0/100"))
+            writer.write(aln("m/2/10_20", "c1/f2p0/100"))
+            writer.write(aln("m/3/0_10", "c2/f2p0/100"))
+        ref_cids = {"c0/f2p0/100": 0, "c1/f2p0/100": 1, "c2/f2p0/100": 2}
+        owners = {"m/1": set([0]), "m/2": set([0, 1])}
+
+        valid_cids = filter_alignments_of_clusters(in_fn=in_sam, out_fn=out_sam,
+                                                   ref_cids=ref_cids, owners=owners)
+        self.assertEqual(valid_cids, [0, 1])
+        lines = [l.rstrip('\n').split('\t') for l in open(out_sam)]
+        self.assertEqual([l[1] for l in lines if l[0] == "@SQ"],
+                         ["SN:c0/f2p0/100", "SN:c1/f2p0/100"])
+        self.assertEqual([(l[0], l[2], l[4]) for l in lines if not l[0].startswith('@')],
+                         [("m/1/0_10", "c0/f2p0/100", "254"),
+                          ("m/2/10_20", "c1/f2p0/100", "254")])
+
     def test_trim_subreads_and_write(self):
         """
         Test trim_subreads_and_write(reader, in_zmwids, outfile, trim_len, min_len...)
@@ -204,9 +262,6 @@ class Test_ICEUtils(unittest.TestCase):
         else:
             self.assertTrue(False)
 
-        qver_get_func = prob_model.get_smoothed
-        qvmean_get_func = prob_model.get_mean
-
         dummy_o, c, dummy_m = backticks("cp %s %s" % (op.join(copy_dir, qname), query_filename))
         self.assertTrue(c == 0)
 
@@ -229,8 +284,7 @@ class Test_ICEUtils(unittest.TestCase):
                                              target_dazz_handler=runner.target_dazz_handler,
                                              la4ice_filename=la4ice_filename,
                                              is_FL=True, sID_starts_with_c=False,
-                                             qver_get_func=qver_get_func,
-                                             qvmean_get_func=qvmean_get_func))
+                                             probqv=prob_model))
         # Num of hits may change when daligner or parameters change.
         self.assertTrue(len(hits), 706)
         self.assertEqual(str(hits[0]),
@@ -254,6 +308,32 @@ class Test_ICEUtils(unittest.TestCase):
         test_name = "test_daligner_against_ref_use_sge"
         self._test_daligner_against_ref(test_name=test_name, use_sge=True, sge_opts=SgeOptions(100))
 
+    def test_daligner_against_refs(self):
+        """Test daligner_against_refs() in worker processes agrees with
+        calling daligner_against_ref() serially."""
+        las_out = op.join(self.dataDir, "test_LA4IceReader.las.out")
+        dazz_handler = {3: "read3", 4: "read4"}
+        prob_model = ProbFromModel(0.01, 0.07, 0.06)
+        kwargs = dict(query_dazz_handler=dazz_handler, target_dazz_handler=dazz_handler,
+                      is_FL=False, sID_starts_with_c=False,
+                      ece_penalty=1, ece_min_len=1000, same_strand_only=False,
+                      probqv=prob_model)
+        fields = lambda hits: [sorted(vars(h).items()) for h in hits]
+
+        expected = fields(h for dummy_i in range(4)
+                          for h in daligner_against_ref(la4ice_filename=las_out, **kwargs))
+        self.assertEqual(len(expected), 8)
+        self.assertTrue(all(h.log_prob < 0 for h in
+                            daligner_against_ref(la4ice_filename=las_out, **kwargs)))
+        for num_processes in (1, 3):
+            hits = daligner_against_refs([las_out] * 4, num_processes=num_processes, **kwargs)
+            self.assertEqual(fields(hits), expected)
+
+        # Hits accepted without alignment checking have no log_prob.
+        kwargs['no_qv_or_aln_checking'] = True
+        hits = list(daligner_against_ref(la4ice_filename=las_out, **kwargs))
+        self.assertTrue(all(h.log_prob is None for h in hits))
+
     def test_num_reads_in_fasta(self):
         """Test num_reads_in_fasta"""
         in_fa = op.join(self.sivDataDir, "flnc.fasta")
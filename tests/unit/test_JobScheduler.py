@@ -0,0 +1,124 @@
+"""Test pbtranscript.JobScheduler."""
+
+import unittest
+import os
+import os.path as op
+import shutil
+import time
+from Queue import Queue
+from pbtranscript.JobScheduler import JobScheduler, LocalBackend, \
+    SgeBackend, Job, backoff_intervals, wait_for_files
+from pbtranscript.ClusterOptions import SgeOptions
+from pbtranscript.testkit.fake_sge import install_fake_sge, STATE_DIR_ENV
+from test_setpath import OUT_DIR
+
+
+def _mknewdir(d):
+    """Remove and create directory d."""
+    if op.exists(d):
+        shutil.rmtree(d)
+    os.makedirs(d)
+
+
+class Test_JobScheduler(unittest.TestCase):
+    """Test JobScheduler."""
+    def setUp(self):
+        """Set up test data."""
+        self.out_dir = op.join(OUT_DIR, "test_JobScheduler")
+        _mknewdir(self.out_dir)
+
+    def test_backoff_intervals(self):
+        """Test backoff_intervals."""
+        intervals = backoff_intervals(initial=1, maximum=5)
+        self.assertEqual([next(intervals) for _i in range(5)], [1, 2, 4, 5, 5])
+
+    def test_wait_for_files(self):
+        """Test wait_for_files."""
+        fn = op.join(self.out_dir, "a.txt")
+        self.assertFalse(wait_for_files([fn], timeout=0.3))
+        open(fn, 'w').close()
+        self.assertTrue(wait_for_files([fn], timeout=0.3))
+
+    def test_run_dag(self):
+        """Jobs start after jobs they depend on are done."""
+        fn = op.join(self.out_dir, "dag.txt")
+        s = JobScheduler(backend=LocalBackend(), cores=2)
+        s.add_job(Job(name="b", cmd="echo b >> %s" % fn, depends_on=["a"]))
+        s.add_job(Job(name="a", cmd="sleep 0.2; echo a >> %s" % fn))
+        s.add_job(Job(name="c", cmd="echo c >> %s" % fn, depends_on=["a", "b"]))
+        self.assertEqual(s.run(), [])
+        self.assertEqual(open(fn).read().split(), ["a", "b", "c"])
+
+    def test_run_failed(self):
+        """Failed jobs are retried, downstream jobs of failed jobs fail."""
+        flag = op.join(self.out_dir, "flag")
+        s = JobScheduler(backend=LocalBackend(), cores=1, initial_backoff=0.1)
+        a = s.add_job(Job(name="a", retries=2,
+                          cmd="test -e {f} || (touch {f}; exit 1)".format(f=flag)))
+        b = s.add_job(Job(name="b", cmd="exit 3"))
+        c = s.add_job(Job(name="c", cmd="echo c", depends_on=["b"]))
+        self.assertEqual(s.run(), [b, c])
+        self.assertEqual((a.state, a.attempts), ("DONE", 2))
+        self.assertEqual((b.returncode, c.attempts), (3, 0))
+
+    def test_run_timeout(self):
+        """Jobs are killed after time out."""
+        s = JobScheduler(backend=LocalBackend(), cores=1)
+        a = s.add_job(Job(name="a", cmd="sleep 30", timeout=0.5))
+        start_t = time.time()
+        self.assertEqual(s.run(), [a])
+        self.assertTrue(time.time() - start_t < 10)
+
+    def test_cycle(self):
+        """Jobs in a cycle are rejected."""
+        s = JobScheduler(backend=LocalBackend())
+        s.add_job(Job(name="a", cmd="echo a", depends_on=["b"]))
+        s.add_job(Job(name="b", cmd="echo b", depends_on=["a"]))
+        self.assertRaises(ValueError, s.run)
+
+    def test_sge_backend(self):
+        """Run jobs through SgeBackend on a fake SGE."""
+        bin_dir = op.join(self.out_dir, "bin")
+        state_dir = op.join(self.out_dir, "fake_sge")
+        install_fake_sge(bin_dir, state_dir)
+        old_path = os.environ["PATH"]
+        os.environ["PATH"] = bin_dir + os.pathsep + old_path
+        os.environ[STATE_DIR_ENV] = state_dir
+        try:
+            fn = op.join(self.out_dir, "sge.txt")
+            s = JobScheduler(backend=SgeBackend(SgeOptions(1), qstat_interval=1),
+                             max_jobs=2)
+            a = s.add_job(Job(name="a", cmd="echo a >> %s" % fn,
+                              script=op.join(self.out_dir, "a.sh")))
+            b = s.add_job(Job(name="b", cmd="echo b >> %s" % fn, depends_on=["a"],
+                              script=op.join(self.out_dir, "b.sh")))
+            c = s.add_job(Job(name="c", cmd="exit 2",
+                              script=op.join(self.out_dir, "c.sh")))
+            self.assertEqual(s.run(), [c])
+            self.assertEqual(open(fn).read().split(), ["a", "b"])
+            self.assertEqual(c.returncode, 2)
+        finally:
+            os.environ["PATH"] = old_path
+            del os.environ[STATE_DIR_ENV]
+
+    def test_sge_backend_killed_attempt(self):
+        """Sentinels of killed attempts do not complete retries, and posting
+        a job killed after the watcher has seen it is ignored."""
+        backend = SgeBackend(SgeOptions(1))
+        backend.events = Queue()
+        script = op.join(self.out_dir, "d.sh")
+        self.assertNotEqual(SgeBackend.sentinel_of(script, 1),
+                            SgeBackend.sentinel_of(script, 2))
+        with open(SgeBackend.sentinel_of(script, 1), 'w') as writer:
+            writer.write("0\n")
+        backend._running["d"] = (2, "2", SgeBackend.sentinel_of(script, 2))
+        self.assertEqual(backend._check_sentinels(), 0)
+        self.assertFalse(backend._post("d", 1, 0, "late write of attempt 1"))
+
+        del backend._running["d"] # killed
+        self.assertFalse(backend._post("d", 2, 0, "killed"))
+        self.assertTrue(backend.events.empty())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -61,3 +61,15 @@ class TEST_LA4ICEREADER(unittest.TestCase):
         reads = [r for r in LA4IceReader(f)]
         self.assertTrue(len(reads) == 0)
 
+    def test_prefilter(self):
+        """Test LA4IceReader with a prefilter, alignment strings are
+        materialized when accessed."""
+        with LA4IceReader(self.las_out,
+                          prefilter=lambda r: r.qStart == 0) as reader:
+            reads = [r for r in reader]
+            self.assertEqual(len(reads), 1)
+            self.assertFalse('alnStr' in vars(reads[0]))
+            self.assertEqual(reads[0].alnStr, t1_aaln)
+            self.assertTrue('alnStr' in vars(reads[0]))
+            self.assertTrue(reads[0] == self.t1)
+
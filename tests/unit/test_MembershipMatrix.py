@@ -0,0 +1,111 @@
+"""Test pbtranscript.ice.MembershipMatrix."""
+import unittest
+import random
+import cPickle
+from pbtranscript.ice.MembershipMatrix import MembershipMatrix
+
+
+class Test_MembershipMatrix(unittest.TestCase):
+    """Test MembershipMatrix."""
+    def setUp(self):
+        """Initialize."""
+        self.d = {'r1': {0: -1.0, 1: -0.5},
+                  'r2': {1: -2.0},
+                  'r3': {},
+                  'r4': {2: 0}}
+        self.m = MembershipMatrix.from_dict(self.d)
+
+    def test_dict(self):
+        """Test from_dict, to_dict and pickling."""
+        self.assertEqual(self.m.to_dict(), self.d)
+        self.assertEqual(len(self.m), 4)
+        self.assertEqual(self.m.nnz, 4)
+        self.assertTrue('r3' in self.m and 'r5' not in self.m)
+        self.assertEqual(sorted(self.m), ['r1', 'r2', 'r3', 'r4'])
+        m = cPickle.loads(cPickle.dumps(self.m))
+        self.assertEqual(m, self.m)
+
+    def test_rows(self):
+        """Test get, set, best, is_best and num_clusters."""
+        m = self.m
+        self.assertEqual(m.get('r1', 1), -0.5)
+        self.assertEqual(m.get('r1', 2, 'None'), 'None')
+        self.assertRaises(KeyError, m.get, 'r5', 1)
+        self.assertEqual(m.best('r1'), (1, -0.5))
+        self.assertEqual(m.best('r3'), None)
+        self.assertTrue(m.is_best('r1', 1))
+        self.assertFalse(m.is_best('r1', 0))
+        self.assertFalse(m.is_best('r3', 0))
+        self.assertEqual(m.num_clusters('r1'), 2)
+        self.assertEqual(m.num_clusters('r3'), 0)
+
+        m.set('r1', 0, -0.1)
+        m.set('r3', 2, -3.0)
+        m.set('r5', 2, -1.0)
+        self.assertEqual(m.sorted_items('r1'), [(0, -0.1), (1, -0.5)])
+        self.assertEqual(sorted(m.reads_of_cluster(2)), ['r3', 'r4', 'r5'])
+
+        m.reset_read('r1', [(3, -0)])
+        self.assertEqual(m.items('r1'), [(3, 0)])
+        self.assertEqual(m.reads_of_cluster(0), [])
+        m.delete_read('r2')
+        self.assertFalse('r2' in m)
+        self.assertEqual(m.reads_of_cluster(1), [])
+        m.add_read('r2')
+        self.assertEqual(m.items('r2'), [])
+
+    def test_delete_cluster(self):
+        """Test delete_cluster and invalidate_clusters."""
+        m = self.m
+        m.delete_cluster(1)
+        self.assertEqual(m.to_dict(), {'r1': {0: -1.0}, 'r2': {},
+                                       'r3': {}, 'r4': {2: 0}})
+        self.assertEqual(sorted(m.clusters()), [0, 2])
+        m.delete_cluster(100)
+
+        m = MembershipMatrix.from_dict(self.d)
+        m.invalidate_clusters([0, 1, 2], qids=['r1', 'r4', 'r100'])
+        self.assertEqual(m.to_dict(), {'r1': {}, 'r2': {1: -2.0},
+                                       'r3': {}, 'r4': {}})
+        m.invalidate_clusters([1])
+        self.assertEqual(m.nnz, 0)
+
+    def test_random(self):
+        """Compare against a dict of dicts."""
+        random.seed(0)
+        d, m = {}, MembershipMatrix()
+        for dummy_i in range(5000):
+            qid, cid = "r%d" % random.randint(0, 50), random.randint(0, 20)
+            op = random.random()
+            if op < 0.6:
+                prob = -random.randint(0, 10) / 2.
+                d.setdefault(qid, {})[cid] = prob
+                m.set(qid, cid, prob)
+            elif op < 0.7:
+                for v in d.itervalues():
+                    v.pop(cid, None)
+                m.delete_cluster(cid)
+            elif op < 0.8:
+                cids = random.sample(range(21), 5)
+                qids = set("r%d" % random.randint(0, 50) for dummy_j in range(10))
+                for qid in qids.intersection(d):
+                    for c in set(cids).intersection(d[qid]):
+                        del d[qid][c]
+                m.invalidate_clusters(cids, qids)
+            elif op < 0.9 and qid in d:
+                del d[qid]
+                m.delete_read(qid)
+            elif qid in d:
+                self.assertEqual(m.is_best(qid, cid), cid in d[qid] and
+                                 d[qid][cid] == max(d[qid].itervalues()))
+                best = m.best(qid)
+                if best is None:
+                    self.assertEqual(d[qid], {})
+                else:
+                    self.assertEqual(best[1], max(d[qid].itervalues()))
+            self.assertEqual(m.to_dict(), d)
+        self.assertEqual(m.nnz, sum(len(v) for v in d.itervalues()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+"""Test pbtranscript.ice.PolishCost."""
+
+import unittest
+import os.path as op
+from pbtranscript.Utils import mknewdir
+from pbtranscript.ice.PolishCost import cluster_polish_cost, polish_costs, \
+    balanced_bins, write_polish_cost_report
+from test_setpath import OUT_DIR
+
+
+class Test_PolishCost(unittest.TestCase):
+    """Test PolishCost."""
+    def setUp(self):
+        """Set up test data."""
+        self.out_dir = op.join(OUT_DIR, "test_PolishCost")
+        mknewdir(self.out_dir)
+        self.n_subreads = {'m/1': 10, 'm/2': 3, 'm/3': 1}
+
+    def _n_subreads_of_zmw(self, zmw):
+        """Return number of subreads of zmw."""
+        return self.n_subreads[zmw]
+
+    def test_cluster_polish_cost(self):
+        """Test cluster_polish_cost, reads of the same zmw count once."""
+        self.assertEqual(cluster_polish_cost(
+            read_ids=['m/1/ccs', 'm/1/0_100', 'm/2/ccs', 'm/4/ccs'],
+            consensus_len=100, n_subreads_of_zmw=self._n_subreads_of_zmw),
+                         (10 + 3 + 1) * 100)
+
+    def test_polish_costs(self):
+        """Test polish_costs."""
+        uc = {0: ['m/1/ccs'], 1: ['m/2/ccs']}
+        partial_uc = {0: [], 1: ['m/3/0_10']}
+        self.assertEqual(polish_costs(cids=[0, 1], uc=uc, partial_uc=partial_uc,
+                                      consensus_lens={0: 10, 1: 20},
+                                      n_subreads_of_zmw=self._n_subreads_of_zmw),
+                         {0: 110, 1: 100})
+
+    def test_balanced_bins(self):
+        """Test balanced_bins."""
+        costs = {0: 1, 1: 1, 2: 10, 3: 4, 4: 5, 5: 1}
+        self.assertEqual(balanced_bins(costs, 2), [[0, 3, 4, 5], [1, 2]])
+        self.assertEqual(balanced_bins(costs, 3), [[0, 3, 5], [1, 4], [2]])
+        self.assertEqual(balanced_bins(costs, 100), [[0], [1], [2], [3], [4], [5]])
+        self.assertEqual(balanced_bins({}, 3), [])
+
+    def test_write_polish_cost_report(self):
+        """Test write_polish_cost_report."""
+        prefixes = [op.join(self.out_dir, "c%dto%d" % (i, i)) for i in range(3)]
+        for prefix, cost, runtime in zip(prefixes, (10, 30, 20), (5, 15, None)):
+            open(prefix + ".cost", 'w').write("%d\n" % cost)
+            if runtime is not None:
+                open(prefix + ".runtime", 'w').write("%d\n" % runtime)
+        fn = op.join(self.out_dir, "polish_cost_report.csv")
+        self.assertEqual(write_polish_cost_report(prefixes, fn), 1.0)
+        self.assertEqual(open(fn).read().split(),
+                         ["bin,predicted_cost,predicted_runtime,actual_runtime",
+                          "c0to0,10,5.0,5", "c1to1,30,15.0,15", "c2to2,20,10.0,NA"])
+
+
+if __name__ == "__main__":
+    unittest.main()
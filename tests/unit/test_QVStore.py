@@ -0,0 +1,120 @@
+"""Test pbtranscript.io.QVStore."""
+import unittest
+import os.path as op
+import numpy as np
+from pbtranscript.Utils import mkdir
+from pbtranscript.io.QVStore import QVStore, qvs_to_probs
+from pbtranscript.io.c_basQV import maxval_per_window, maxval_per_window_bulk
+from test_setpath import OUT_DIR
+
+
+class TestQVStore(unittest.TestCase):
+    """Test QVStore."""
+    def setUp(self):
+        """Define a store of three reads."""
+        self.qvs = {'r1': [10, 20, 30, 5, 7],
+                    'r2': [40, 1, 1, 2, 30, 30, 3],
+                    'r3': [12, 12, 15]}
+        self.store = QVStore()
+        ids = ['r1', 'r2', 'r3']
+        self.store.extend(ids, [len(self.qvs[i]) for i in ids],
+                          {'unsmoothed': qvs_to_probs(
+                              np.concatenate([self.qvs[i] for i in ids]))})
+
+    def test_get(self):
+        """Test get, get_mean, __contains__ and __len__."""
+        self.assertEqual(len(self.store), 3)
+        self.assertTrue('r2' in self.store)
+        self.assertFalse('r4' in self.store)
+        for seqid, qvs in self.qvs.iteritems():
+            probs = [10**(-qv/10.) for qv in qvs]
+            self.assertTrue(np.allclose(self.store.get(seqid, 'unsmoothed'), probs))
+            self.assertAlmostEqual(self.store.get(seqid, 'unsmoothed', 1), probs[1], places=6)
+            self.assertAlmostEqual(self.store.get(seqid, 'unsmoothed', -1), probs[-1], places=6)
+        self.assertRaises(IndexError, self.store.get, 'r3', 'unsmoothed', 3)
+        self.assertRaises(KeyError, self.store.get, 'r4', 'unsmoothed')
+
+        self.store.compute_means(['unsmoothed'])
+        for seqid, qvs in self.qvs.iteritems():
+            probs = [10**(-qv/10.) for qv in qvs]
+            self.assertAlmostEqual(self.store.get_mean(seqid, 'unsmoothed'),
+                                   sum(probs)/len(probs), places=6)
+
+    def test_smooth(self):
+        """Test smoothing over track buffers agrees with maxval_per_window."""
+        offsets, lengths = self.store.segments()
+        self.assertEqual(list(lengths), [5, 7, 3])
+        maxval_per_window_bulk(self.store.track('unsmoothed'),
+                               self.store.track('smoothed'),
+                               offsets, lengths, 3)
+        for seqid in self.qvs:
+            arr = [float(x) for x in self.store.get(seqid, 'unsmoothed')]
+            self.assertTrue(np.allclose(self.store.get(seqid, 'smoothed'),
+                                        maxval_per_window(arr, 3)))
+
+    def test_delete_and_compact(self):
+        """Test __delitem__, extend after delete and compact."""
+        expected = self.store.get('r3', 'unsmoothed').copy()
+        del self.store['r2']
+        self.assertFalse('r2' in self.store)
+        self.store.add('r4', {'unsmoothed': [0.5, 0.25]})
+        self.store.compact()
+        self.assertEqual(sorted(self.store.keys()), ['r1', 'r3', 'r4'])
+        self.assertTrue(np.all(self.store.get('r3', 'unsmoothed') == expected))
+        self.assertEqual(list(self.store.get('r4', 'unsmoothed')), [0.5, 0.25])
+
+    def test_write_and_open(self):
+        """Test writing a store to a QV cache file and memory mapping it."""
+        mkdir(OUT_DIR)
+        fn = op.join(OUT_DIR, "test_QVStore.qvcache")
+        del self.store['r2']
+        self.store.compute_means(['unsmoothed'])
+        self.store.attrs['window_size'] = 3
+        self.store.write(fn)
+
+        store = QVStore.open(fn)
+        self.assertTrue(store.mapped('r1') and store.mapped('r3'))
+        self.assertEqual(store.nbytes, 0)
+        self.assertEqual(store.attrs['window_size'], 3)
+        self.assertEqual(sorted(store.keys()), ['r1', 'r3'])
+        for seqid in ['r1', 'r3']:
+            self.assertTrue(np.all(store.get(seqid, 'unsmoothed') ==
+                                   self.store.get(seqid, 'unsmoothed')))
+            self.assertEqual(store.get_mean(seqid, 'unsmoothed'),
+                             self.store.get_mean(seqid, 'unsmoothed'))
+
+        # adding reads does not copy mapped reads into memory
+        store.add('r4', {'unsmoothed': [0.5, 0.25]})
+        self.assertFalse(store.mapped('r4'))
+        self.assertTrue(store.mapped('r3'))
+        self.assertEqual(sorted(store.keys()), ['r1', 'r3', 'r4'])
+        self.assertEqual(list(store.get('r4', 'unsmoothed')), [0.5, 0.25])
+        self.assertTrue(np.all(store.get('r3', 'unsmoothed') ==
+                               self.store.get('r3', 'unsmoothed')))
+
+        # only detached reads are copied into memory
+        store.detach(['r1'])
+        self.assertFalse(store.mapped('r1'))
+        self.assertTrue(store.mapped('r3'))
+        self.assertTrue(np.all(store.get('r1', 'unsmoothed') ==
+                               self.store.get('r1', 'unsmoothed')))
+        self.assertEqual(store.get_mean('r1', 'unsmoothed'),
+                         self.store.get_mean('r1', 'unsmoothed'))
+        offsets, lengths = store.segments(['r1', 'r4'])
+        self.assertEqual(sorted(lengths), [2, 5])
+        self.assertRaises(KeyError, store.segments, ['r3'])
+
+        # mapped and in-memory reads are written together
+        del store['r3']
+        self.assertEqual(len(store), 2)
+        fn2 = op.join(OUT_DIR, "test_QVStore.2.qvcache")
+        store.write(fn2)
+        store2 = QVStore.open(fn2)
+        self.assertEqual(sorted(store2.keys()), ['r1', 'r4'])
+        self.assertEqual(list(store2.get('r4', 'unsmoothed')), [0.5, 0.25])
+        self.assertTrue(np.all(store2.get('r1', 'unsmoothed') ==
+                               self.store.get('r1', 'unsmoothed')))
+        self.assertTrue(np.isnan(store2.get_mean('r4', 'unsmoothed')))
+
+if __name__ == "__main__":
+    unittest.main()
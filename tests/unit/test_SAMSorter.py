@@ -0,0 +1,69 @@
+"""Test pbtranscript.io.SAMSorter."""
+import unittest
+import os
+import os.path as op
+import random
+from pbtranscript.Utils import rmpath, mkdir
+from pbtranscript.io.SAMSorter import sort_sam_stream, read_sam_offset_index
+from test_setpath import OUT_DIR
+
+_OUT_DIR_ = op.join(OUT_DIR, "test_SAMSorter")
+
+
+def _make_sam_lines(n):
+    """Return SAM header and record lines in random order."""
+    random.seed(0)
+    headers = ["@HD\tVN:1.0\n", "@SQ\tSN:chr1\tLN:10000\n", "@SQ\tSN:chr10\tLN:10000\n"]
+    records = ["r%d\t0\t%s\t%d\t60\t10M\t*\t0\t0\tAAAAAAAAAA\t*\n" %
+               (i, random.choice(["chr1", "chr10", "chr2"]), random.randint(1, 1000))
+               for i in range(n)]
+    return headers, records
+
+
+class TestSAMSorter(unittest.TestCase):
+    """Test sort_sam_stream."""
+    def setUp(self):
+        """Define output dir."""
+        rmpath(_OUT_DIR_)
+        mkdir(_OUT_DIR_)
+
+    def test_sort_sam_stream(self):
+        """Records spilled to many sorted runs are merged in order."""
+        headers, records = _make_sam_lines(500)
+        out_sam = op.join(_OUT_DIR_, "sorted.sam")
+        index_fn = out_sam + ".idx"
+        n = sort_sam_stream(in_stream=iter(headers + records), out_sam=out_sam,
+                            max_mem=1000, tmp_dir=_OUT_DIR_, index_fn=index_fn)
+        self.assertEqual(n, 500)
+
+        expected = sorted(records, key=lambda l: (l.split('\t')[2], int(l.split('\t')[3]), l))
+        lines = open(out_sam).readlines()
+        self.assertEqual(lines, headers + expected)
+
+        index = read_sam_offset_index(index_fn)
+        self.assertEqual(index.keys(), ["chr1", "chr10", "chr2"])
+        with open(out_sam) as reader:
+            for rname, (offset, num) in index.iteritems():
+                reader.seek(offset)
+                recs = [reader.readline() for dummy_i in range(num)]
+                self.assertTrue(all(r.split('\t')[2] == rname for r in recs))
+        self.assertEqual(sum(num for dummy_offset, num in index.values()), 500)
+
+    def test_sort_sam_stream_empty(self):
+        """An empty stream produces an empty SAM file."""
+        out_sam = op.join(_OUT_DIR_, "empty.sam")
+        self.assertEqual(sort_sam_stream(in_stream=iter([]), out_sam=out_sam), 0)
+        self.assertEqual(op.getsize(out_sam), 0)
+
+    def test_sort_sam_stream_error(self):
+        """No partial SAM file or sorted runs are left if a record is bad."""
+        headers, records = _make_sam_lines(100)
+        out_sam = op.join(_OUT_DIR_, "error.sam")
+        with self.assertRaises(ValueError):
+            sort_sam_stream(in_stream=iter(headers + records + ["truncated\t0\n"]),
+                            out_sam=out_sam, max_mem=1000, tmp_dir=_OUT_DIR_)
+        self.assertEqual(os.listdir(_OUT_DIR_), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
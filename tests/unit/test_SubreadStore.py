@@ -0,0 +1,101 @@
+"""Test pbtranscript.ice.SubreadStore."""
+
+import unittest
+import os
+import os.path as op
+import socket
+import subprocess
+from collections import defaultdict
+from pbcore.io import FastaReader
+from pbtranscript.Utils import mknewdir
+from pbtranscript.io import MetaSubreadFastaReader
+from pbtranscript.ice.IceUtils import trim_subreads_and_write
+from pbtranscript.ice.SubreadStore import SubreadStore, write_subread_store, \
+    subread_store_signature, acquire_subread_store_lock, \
+    subread_store_lock_is_stale
+from test_setpath import DATA_DIR, OUT_DIR
+
+
+MOVIE1 = "m130812_185809_42141_c100533960310000001823079711101380_s1_p0"
+MOVIE2 = "m130812_random_random_s1_p0"
+
+
+def _records(fasta_fn):
+    """Return [(name, sequence)] of reads in fasta_fn."""
+    return [(r.name, r.sequence) for r in FastaReader(fasta_fn)]
+
+
+class Test_SubreadStore(unittest.TestCase):
+    """Test SubreadStore."""
+    def setUp(self):
+        """Define input subreads and clusters."""
+        self.out_dir = op.join(OUT_DIR, "test_SubreadStore")
+        mknewdir(self.out_dir)
+        self.fas = [op.join(DATA_DIR, "test_meta_subreads_fasta_reader1.fasta"),
+                    op.join(DATA_DIR, "test_meta_subreads_fasta_reader2.fasta")]
+        self.uc = {3: [MOVIE1 + "/70/ccs"],
+                   1: [MOVIE2 + "/249/ccs", MOVIE1 + "/59/ccs"],
+                   2: [MOVIE2 + "/no_such_zmw/ccs"]}
+        self.partial_uc = defaultdict(lambda: [])
+        self.partial_uc[3] = [MOVIE2 + "/440/13280_16126"]
+
+    def test_write_and_read(self):
+        """Subreads of clusters read from the store are the same as
+        subreads extracted from input subreads zmw by zmw."""
+        reader = MetaSubreadFastaReader(self.fas)
+        store_fn = op.join(self.out_dir, "subreads_by_cluster.fasta")
+        signature = subread_store_signature(self.fas, trim_len=100, min_len=50)
+        n = write_subread_store(reader=reader, cids=self.uc.keys(), uc=self.uc,
+                                partial_uc=self.partial_uc, out_file=store_fn,
+                                trim_len=100, min_len=50, signature=signature)
+
+        store = SubreadStore.open(store_fn, signature)
+        self.assertEqual(store.cids, [1, 2, 3])
+        self.assertEqual(store.num_subreads(2), 0)
+        self.assertEqual(sum(store.num_subreads(k) for k in store.cids), n)
+        self.assertTrue(3 in store)
+        self.assertTrue(4 not in store)
+
+        out_fn = lambda k: op.join(self.out_dir, "store.c%s.fasta" % k)
+        store.write_clusters(cids=[3, 1, 2], out_file_func=out_fn)
+        for k in self.uc:
+            expected_fn = op.join(self.out_dir, "expected.c%s.fasta" % k)
+            trim_subreads_and_write(reader=reader,
+                                    in_seqids=self.uc[k] + self.partial_uc[k],
+                                    out_file=expected_fn, trim_len=100,
+                                    min_len=50, ignore_keyerror=True)
+            self.assertEqual(_records(out_fn(k)), _records(expected_fn))
+            self.assertEqual(len(_records(out_fn(k))), store.num_subreads(k))
+
+        # Out of date
+        self.assertIsNone(SubreadStore.open(store_fn, signature="another"))
+        self.assertIsNone(SubreadStore.open(op.join(self.out_dir, "nonexist.fasta")))
+
+    def test_lock(self):
+        """A lock held by a live process is respected, a lock whose holder
+        is gone or which is too old is taken over."""
+        lock_fn = op.join(self.out_dir, "store.fasta.lock")
+        self.assertTrue(acquire_subread_store_lock(lock_fn))
+        self.assertEqual(open(lock_fn).read().split(),
+                         [socket.gethostname(), str(os.getpid())])
+        self.assertFalse(subread_store_lock_is_stale(lock_fn))
+        self.assertFalse(acquire_subread_store_lock(lock_fn))
+        # Too old
+        self.assertTrue(subread_store_lock_is_stale(lock_fn, max_age=0))
+        self.assertTrue(acquire_subread_store_lock(lock_fn, max_age=0))
+        os.remove(lock_fn)
+
+        # Holder is gone.
+        p = subprocess.Popen(["true"])
+        p.wait()
+        with open(lock_fn, 'w') as writer:
+            writer.write("%s\t%d\n" % (socket.gethostname(), p.pid))
+        self.assertTrue(subread_store_lock_is_stale(lock_fn))
+        self.assertTrue(acquire_subread_store_lock(lock_fn))
+        self.assertEqual(open(lock_fn).read().split()[1], str(os.getpid()))
+        os.remove(lock_fn)
+        self.assertFalse(subread_store_lock_is_stale(lock_fn))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -67,6 +67,18 @@ class Test_ChunkTasksPickle(unittest.TestCase):
         p.sorted_by_attr(attr='cluster_bin_index')
         self.assertEqual(p.chunk_tasks, sorted_chunk_tasks)
 
+    def test_group_tasks_by_nfl_index(self):
+        """Test group_tasks_by_nfl_index"""
+        p = ChunkTasksPickle([PartialChunkTask(i, 'flnc_%s.fasta' % i, 'out_dir_%s' % i,
+                                               'nfl.%s.contigset.xml' % j, j, 3)
+                              for i in range(0, 2) for j in range(0, 3)])
+        self.assertEqual(p.group_tasks_by_nfl_index(max_nchunks=10),
+                         [[0, 3], [1, 4], [2, 5]])
+        self.assertEqual(p.group_tasks_by_nfl_index(max_nchunks=2),
+                         [[0, 2, 3, 5], [1, 4]])
+        self.assertEqual(p[4].combined_nfl_pickle,
+                         'nfl.1.contigset.all_bins.partial_uc.pickle')
+
     def test_sort_and_group_tasks(self):
         """Test sort_and_group_tasks"""
         d = op.join(SIV_DATA_DIR, "test_tool_contract_chunks")
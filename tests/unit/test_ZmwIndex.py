@@ -0,0 +1,66 @@
+"""Test pbtranscript.io.ZmwIndex."""
+import unittest
+import os.path as op
+import numpy as np
+from pbtranscript.Utils import rmpath
+from pbtranscript.io.ZmwIndex import ZmwIndex
+from test_setpath import OUT_DIR
+
+
+class Test_ZmwIndex(unittest.TestCase):
+    """Test ZmwIndex."""
+    def setUp(self):
+        """Initialize pbi columns of two movies, subreads of a zmw
+        are not necessarily adjacent, e.g., from multiple bam files."""
+        self.movie_ids = np.array([-5, -5, -5, 7, 7, -5, 7], dtype=np.int32)
+        self.hole_numbers = np.array([10, 10, 3, 10, 0, 10, 0], dtype=np.int32)
+        self.index = ZmwIndex.from_pbi(self.movie_ids, self.hole_numbers,
+                                       signature={'num_records': 7})
+
+    def test_lookup(self):
+        """Test __getitem__, __contains__, hole_numbers, iter_rows and num_records."""
+        index = self.index
+        self.assertEqual(len(index), 4)
+        self.assertEqual(index[(-5, 10)], [0, 1, 5])
+        self.assertEqual(index[(-5, 3)], [2])
+        self.assertEqual(index[(7, 0)], [4, 6])
+        self.assertTrue((7, 10) in index)
+        self.assertFalse((7, 3) in index)
+        self.assertFalse((8, 10) in index)
+        self.assertRaises(KeyError, index.__getitem__, (7, 3))
+        self.assertEqual(index.hole_numbers(-5), [3, 10])
+        self.assertEqual(list(index.iter_rows(7)), [[4, 6], [3]])
+        self.assertEqual(list(index.iter_rows(8)), [])
+        self.assertEqual(index.num_records((-5, 10)), 3)
+        self.assertRaises(KeyError, index.num_records, (7, 3))
+
+    def test_read_write(self):
+        """Test sidecar files are reused only if signatures match."""
+        fn = op.join(OUT_DIR, "test_ZmwIndex.zmwindex.npz")
+        rmpath(fn)
+        calls = []
+
+        def columns():
+            """Return pbi columns."""
+            calls.append(1)
+            return self.movie_ids, self.hole_numbers
+
+        a = ZmwIndex.read_or_build(fn, {'num_records': 7}, columns)
+        self.assertTrue(op.exists(fn))
+        b = ZmwIndex.read_or_build(fn, {'num_records': 7}, columns)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(b.signature, {'num_records': 7})
+        self.assertEqual(b[(-5, 10)], a[(-5, 10)])
+        self.assertRaises(ValueError, ZmwIndex.read, fn, {'num_records': 8})
+        ZmwIndex.read_or_build(fn, {'num_records': 8}, columns)
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(ZmwIndex.read(fn).signature, {'num_records': 8})
+
+        with open(fn, 'w') as f:  # corrupted sidecar
+            f.write("PK")
+        self.assertRaises(ValueError, ZmwIndex.read, fn)
+        rmpath(fn)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+"""Test pbtranscript.ice.c_Clique."""
+import unittest
+import random
+from pbtranscript.ice.c_Clique import AlignGraph
+
+
+def _graph(edges):
+    """Return an AlignGraph of edges."""
+    g = AlignGraph()
+    for a, b in edges:
+        g.add_edge(a, b)
+    return g
+
+
+class Test_AlignGraph(unittest.TestCase):
+    """Test AlignGraph."""
+    def setUp(self):
+        """A clique of 'a, b, c, d, e' and some other edges."""
+        self.edges = [('b', 'c'), ('b', 'd'), ('b', 'e'), ('b', 'f'), ('b', 'a'),
+                      ('a', 'c'), ('a', 'd'), ('a', 'e'), ('c', 'd'), ('c', 'e'),
+                      ('c', 'f'), ('c', 'g'), ('d', 'e'), ('d', 'g'), ('e', 'g'),
+                      ('f', 'g')]
+
+    def test_csr(self):
+        """Self loops and duplicated edges are ignored."""
+        g = _graph(self.edges + [('a', 'a'), ('a', 'b'), ('b', 'a')])
+        self.assertEqual(g.nodes(), ['b', 'c', 'd', 'e', 'f', 'a', 'g'])
+        self.assertEqual(g.number_of_nodes(), 7)
+        self.assertEqual(g.neighbors('a'), ['b', 'c', 'd', 'e'])
+        self.assertEqual(g.degree('c'), 6)
+        self.assertTrue('g' in g)
+        self.assertFalse('h' in g)
+
+    def test_find_cliques(self):
+        """Test find_cliques."""
+        g = _graph(self.edges)
+        cliques = g.find_cliques(gamma=1, maxitr=5)
+        self.assertEqual(set(cliques[0]), set(['a', 'b', 'c', 'd', 'e']))
+        self.assertEqual(set(cliques[1]), set(['f', 'g']))
+        self.assertEqual(_graph([('a', 'b')]).find_cliques(), [['a', 'b']])
+        self.assertEqual(AlignGraph().find_cliques(), [])
+
+    def test_find_cliques_planted(self):
+        """Cliques are mutually exclusive quasi-cliques, and the same
+        graph and seed always give the same cliques."""
+        rng = random.Random(0)
+        groups = [["r%d_%d" % (i, j) for j in range(rng.randint(1, 30))]
+                  for i in range(50)]
+        g = AlignGraph()
+        for group in groups:
+            for i, a in enumerate(group):
+                for b in group[i+1:]:
+                    if rng.random() < 0.95:
+                        g.add_edge(a, b)
+        nodes = sum(groups, [])
+        for dummy_i in range(200):
+            g.add_edge(rng.choice(nodes), rng.choice(nodes))
+
+        cliques = g.find_cliques(gamma=0.8, maxitr=5)
+        self.assertEqual(cliques, g.find_cliques(gamma=0.8, maxitr=5))
+        members = sum(cliques, [])
+        self.assertEqual(len(members), len(set(members)))
+        for c in cliques:
+            for a in c:
+                n = len(set(g.neighbors(a)).intersection(c))
+                self.assertTrue(n >= 0.8 * len(c) - 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
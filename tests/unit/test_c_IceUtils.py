@@ -0,0 +1,133 @@
+"""Test pbtranscript.ice.c_IceUtils."""
+import unittest
+import random
+from math import log
+import numpy as np
+from pbtranscript.findECE import findECE
+from pbtranscript.ice.c_IceUtils import eval_alignment, eval_hit, \
+    large_nonmatch
+
+
+def _random_alignment(n):
+    """Return a random (qAln, alnStr, sAln) of n columns."""
+    q_aln, aln_str, s_aln = [], [], []
+    for dummy_i in range(n):
+        event = random.choice('MMMMSIIDD')
+        nt = random.choice('AACGT')
+        if event == 'M':
+            q_aln.append(nt)
+            aln_str.append('|')
+            s_aln.append(nt)
+        elif event == 'S':
+            q_aln.append(nt)
+            aln_str.append('*')
+            s_aln.append(random.choice('ACGT'))
+        elif event == 'I':
+            q_aln.append(nt)
+            aln_str.append('*')
+            s_aln.append('-')
+        else:
+            q_aln.append('-')
+            aln_str.append('*')
+            s_aln.append(nt)
+    return ''.join(q_aln), ''.join(aln_str), ''.join(s_aln)
+
+
+def _py_log_prob(cigar, q_start, prob_sub, prob_ins, prob_del, err_only):
+    """Reference implementation, calc_aln_log_prob(2) in python."""
+    score, pos = 0., q_start
+    for x in cigar:
+        if x == 'M':
+            tmp = 1 - prob_sub[pos] if err_only else \
+                  1 - prob_sub[pos] - prob_ins[pos] - prob_del[pos]
+            score += log(max(tmp, 0.001))
+            pos += 1
+        elif x == 'S':
+            score += log(prob_sub[pos]) + log(1 / 3.)
+            pos += 1
+        elif x == 'I':
+            score += log(prob_ins[pos]) + log(1 / 3.)
+            pos += 1
+        else:
+            score += log(prob_del[pos])
+    return score
+
+
+class TestEvalAlignment(unittest.TestCase):
+    """Test eval_alignment."""
+    def test_without_qvs(self):
+        """Without QVs, every non-match is a penalty."""
+        cigar, ece = eval_alignment('AC-GTA', '|**|*|', 'ATTG-A')
+        self.assertEqual(cigar, 'MSDMIM')
+        self.assertEqual(list(ece), [0, 1, 1, 0, 1, 0])
+        self.assertEqual(ece.dtype, np.uint8)
+        self.assertRaises(ValueError, eval_alignment, 'AC', '||', 'A')
+
+    def test_random(self):
+        """Compare cigar and ECE array against the alignment string."""
+        random.seed(0)
+        for dummy_i in range(200):
+            q_aln, aln_str, s_aln = _random_alignment(random.randint(1, 60))
+            cigar, ece = eval_alignment(q_aln, aln_str, s_aln)
+            self.assertEqual(cigar, ''.join(
+                'M' if a == '|' else 'D' if q == '-' else 'I' if s == '-' else 'S'
+                for q, a, s in zip(q_aln, aln_str, s_aln)))
+            self.assertEqual(list(ece), [int(a != '|') for a in aln_str])
+
+
+class TestEvalHit(unittest.TestCase):
+    """Test large_nonmatch and eval_hit."""
+    def test_large_nonmatch(self):
+        """Compare against findECE."""
+        random.seed(0)
+        for dummy_i in range(2000):
+            n, q = random.randint(0, 80), random.random()
+            penalty, min_len = random.randint(1, 4), random.randint(1, 20)
+            ece = np.array([random.random() < q for dummy_j in range(n)],
+                           dtype=np.uint8)
+            s = [0] + list(ece.astype(int) * (penalty + 1) - penalty)
+            expected = len(findECE(s, len(s), min_len, True)) > 0
+            self.assertEqual(large_nonmatch(ece, penalty, min_len), expected)
+
+    def test_eval_hit(self):
+        """Compare against eval_alignment, large_nonmatch and python
+        implementations of calc_prob_from_aln."""
+        random.seed(1)
+        np.random.seed(1)
+        num_rejected = 0
+        for dummy_i in range(500):
+            q_aln, aln_str, s_aln = _random_alignment(random.randint(1, 100))
+            q_start = random.randint(0, 5)
+            q_end = q_start + len(q_aln) - q_aln.count('-')
+            probs = [(np.random.rand(q_end + 3) / 4).astype(np.float32)
+                     for dummy_k in range(3)]
+            cigar, ece = eval_alignment(q_aln, aln_str, s_aln)
+            penalty, min_len = random.randint(1, 4), random.randint(5, 30)
+            if large_nonmatch(ece, penalty, min_len):
+                num_rejected += 1
+                self.assertEqual(eval_hit(q_aln, aln_str, s_aln,
+                                          penalty, min_len), None)
+                continue
+
+            self.assertEqual(eval_hit(q_aln, aln_str, s_aln,
+                                      penalty, min_len), 0.)
+            self.assertAlmostEqual(
+                eval_hit(q_aln, aln_str, s_aln, penalty, min_len,
+                         q_start, q_end, prob_qvs=probs),
+                _py_log_prob(cigar, q_start, *probs, err_only=False), places=5)
+            self.assertAlmostEqual(
+                eval_hit(q_aln, aln_str, s_aln, penalty, min_len,
+                         q_start, q_end, prob_err=probs[0]),
+                _py_log_prob(cigar, q_start, *([probs[0]] * 3), err_only=True),
+                places=5)
+            rates = (0.01, 0.07, 0.06)
+            expected = sum(log({'M': 0.86, 'S': 0.01, 'I': 0.07,
+                                'D': 0.06}[x]) for x in cigar)
+            self.assertAlmostEqual(
+                eval_hit(q_aln, aln_str, s_aln, penalty, min_len,
+                         rates=rates), expected)
+        self.assertTrue(0 < num_rejected < 500)
+
+
+if __name__ == "__main__":
+    unittest.main()
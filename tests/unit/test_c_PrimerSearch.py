@@ -0,0 +1,67 @@
+"""Test pbtranscript.c_PrimerSearch."""
+import unittest
+import os.path as op
+from pbcore.io import FastaReader
+from pbtranscript.c_PrimerSearch import PrimerSearcher
+from pbtranscript.io.DOMIO import DOMReader, DOMRecord
+from test_setpath import DATA_DIR
+
+# Primers with which test_parseHmmDom.dom was created by phmmer,
+# reverse primers are reverse complemented, as in Classifier.
+PRIMERS = [("F1", "AAGCAGTGGTATCAACGCAGAGTACATGGGG"),
+           ("R1", "AAGCAGTGGTATCAACGCAGAGTAC")]
+
+
+class Test_c_PrimerSearch(unittest.TestCase):
+    """Test PrimerSearcher."""
+    def setUp(self):
+        """Set up test data."""
+        self.reads = dict((r.name, r.sequence) for r in
+                          FastaReader(op.join(DATA_DIR, "test_phmmer.fasta")))
+        self.searcher = PrimerSearcher(PRIMERS)
+
+    def test_search(self):
+        """Test search on a few exact and approximate matches."""
+        f1 = PRIMERS[0][1]
+        seq = "ACGT" * 5 + f1 + "TTGCA" * 5
+        hits = [h for h in self.searcher.search(seq) if h[0] == 0]
+        self.assertEqual(len(hits), 1)
+        pi, score, pStart, pEnd, sStart, sEnd = hits[0]
+        self.assertEqual(pi, 0)
+        self.assertEqual((pStart, pEnd, sStart, sEnd), (0, 31, 20, 51))
+        self.assertAlmostEqual(score, round(31 * 1.1, 1))
+
+        # A mismatch and a deletion are tolerated.
+        seq = "ACGT" * 5 + f1[:10] + "C" + f1[11:20] + f1[21:] + "TTGCA" * 5
+        hits = self.searcher.search(seq)
+        self.assertEqual([h[0] for h in hits], [0, 1])
+        self.assertTrue(hits[0][1] > 15)
+
+        self.assertEqual(self.searcher.search("ACGT" * 30), [])
+        self.assertEqual(self.searcher.search(""), [])
+
+    def test_compare_with_phmmer(self):
+        """Test native hits are consistent with phmmer hits."""
+        expected = {}
+        for r in DOMReader(op.join(DATA_DIR, "test_parseHmmDom.dom")):
+            if r.sid in self.reads and r.score >= 10:
+                expected[(r.sid, r.pid)] = r
+
+        self.assertTrue(len(expected) > 0)
+        for (sid, pid), e in expected.iteritems():
+            hits = [DOMRecord(pid=PRIMERS[h[0]][0], sid=sid, score=h[1],
+                              pStart=h[2], pEnd=h[3], pLen=len(PRIMERS[h[0]][1]),
+                              sStart=h[4], sEnd=h[5], sLen=len(self.reads[sid]))
+                    for h in self.searcher.search(self.reads[sid])]
+            hits = [h for h in hits if h.pid == pid]
+            self.assertEqual(len(hits), 1)
+            h = hits[0]
+            self.assertTrue(abs(h.score - e.score) <= 1.5)
+            self.assertTrue(abs(h.sStart - e.sStart) <= 3)
+            self.assertTrue(abs(h.sEnd - e.sEnd) <= 3)
+            # DOM lines written by toString are parsed back.
+            self.assertEqual(str(DOMRecord.fromString(h.toString())), str(h))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+"""Test pbtranscript.ice_pbdagcon."""
+import unittest
+import os.path as op
+from pbcore.util.Process import backticks
+from pbtranscript.io import FastaRandomReader
+from pbtranscript.ice.IceUtils import GCON_IN_FA
+from pbtranscript.ice_pbdagcon import choose_template_from_m5, \
+    choose_template_by_blasr, align_all_vs_all_by_blasr, \
+    write_aln_input_to_ref_from_m5, AlignGraphUtilError
+from test_setpath import OUT_DIR
+
+
+def _m5(qname, tname, q_strand, t_strand, n_match, n_mismatch, n_ins, n_del):
+    """Return split fields of a fake blasr -m 5 line."""
+    return [qname, '100', '0', '100', q_strand, tname, '100', '0', '100',
+            t_strand, '-300', str(n_match), str(n_mismatch), str(n_ins),
+            str(n_del), '254', 'A', '|', 'A']
+
+
+class Test_ice_pbdagcon(unittest.TestCase):
+    """Test ice_pbdagcon."""
+    def setUp(self):
+        """Initialize."""
+        self.fasta_filename = op.join(OUT_DIR, "test_ice_pbdagcon.fasta")
+        with open(self.fasta_filename, 'w') as f:
+            f.write(">r1\nAAAA\n>r2\nAAAAAA\n>r3\nAAAAA\n>r4\nAA\n")
+        self.m5_fields = [
+            _m5('r1/0_4', 'r1', '0', '0', 100, 0, 0, 0),  # self hit
+            _m5('r1/0_4', 'r2', '0', '0', 90, 10, 0, 0),
+            _m5('r1/0_4', 'r3', '0', '0', 80, 10, 10, 0),
+            _m5('r2/0_6', 'r1', '0', '0', 90, 10, 0, 0),
+            _m5('r2/0_6', 'r3', '0', '0', 80, 20, 0, 0),
+            _m5('r3/0_5', 'r2', '0', '1', 80, 20, 0, 0),  # opp strand
+            _m5('r3/0_5', 'r1', '0', '0', 90, 10, 0, 0),
+            _m5('r3/0_5', 'r2', '0', '0', 80, 20, 0, 0)]
+
+    def test_choose_template_from_m5(self):
+        """Pick the read with the highest mean similarity, the longest one
+        if there is a tie."""
+        fd = FastaRandomReader(self.fasta_filename)
+        # r1: ceil(mean(90, 84.21)) = 88, r2: 85, r3: 85
+        self.assertEqual(choose_template_from_m5(self.m5_fields, fd), 'r1')
+        self.assertEqual(choose_template_from_m5(self.m5_fields[3:], fd), 'r2')
+        self.assertRaises(AlignGraphUtilError, choose_template_from_m5,
+                          self.m5_fields, fd, min_number_reads=4)
+
+    @unittest.skipUnless(backticks('blasr --version')[1] == 0, "blasr not installed")
+    def test_choose_template_from_m5_vs_m1(self):
+        """Choose the same template from real all vs all blasr -m 5
+        alignments as choose_template_by_blasr does from blasr -m 1."""
+        fd = FastaRandomReader(GCON_IN_FA)
+        m1_ref = choose_template_by_blasr(
+            fasta_filename=GCON_IN_FA,
+            out_filename=op.join(OUT_DIR, "test_ice_pbdagcon.m1"))
+        m5_fields = align_all_vs_all_by_blasr(
+            fasta_filename=GCON_IN_FA,
+            out_filename=op.join(OUT_DIR, "test_ice_pbdagcon.m5"))
+        self.assertTrue(len(m5_fields) > 0)
+        self.assertEqual(choose_template_from_m5(m5_fields, fd), m1_ref.name)
+
+    def test_write_aln_input_to_ref_from_m5(self):
+        """Reuse hits to the template, report reads without a hit."""
+        out_filename = op.join(OUT_DIR, "test_ice_pbdagcon.saln")
+        unaligned = write_aln_input_to_ref_from_m5(
+            self.m5_fields, ref_id='r2', consensus_name='c1',
+            out_filename=out_filename, read_ids=['r1', 'r2', 'r3', 'r4'])
+        self.assertEqual(unaligned, ['r2', 'r4'])
+        # r3's best hit to r2 is on the opposite strand, drop it
+        lines = [line.split() for line in open(out_filename)]
+        self.assertEqual(len(lines), 1)
+        self.assertEqual(lines[0][0], 'r1/0_4')
+        self.assertEqual(lines[0][5], 'c1')
+        self.assertEqual(lines[0][6:], self.m5_fields[1][6:])
+
+
+if __name__ == "__main__":
+    unittest.main()